@@ -0,0 +1,130 @@
+import json
+import os
+import random
+import subprocess
+import sys
+
+# 関数ごとにデプロイした場合と router で1つの関数にまとめた場合のコールドスタート回数を比較する
+#   1. 各モジュールの初期化時間（import にかかる時間）を別プロセスで測る
+#   2. エンドポイントごとの呼び出し頻度からリクエスト列を作り、アイドル時間でコンテナが破棄されるモデルで
+#      コールドスタートの回数と初期化時間の合計をシミュレーションする
+# 使い方: python backend/benchmarks/cold_start_benchmark.py [時間数]
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+LAYER_DIR = os.path.join(BACKEND_DIR, 'layer', 'common', 'python')
+
+# 1時間あたりの呼び出し回数（user-register は登録時だけ、organization-id-get はログイン時に呼ばれる）
+REQUESTS_PER_HOUR = {
+    'components-crud': 120,
+    'organization-id-get': 6,
+    'user-register': 0.5,
+}
+DURATION_SECONDS = 0.2
+# Lambda はアイドルなコンテナをおおむね5〜15分で破棄する
+IDLE_TIMEOUT_SECONDS = 600
+
+ENV = {
+    'REGION_NAME': 'ap-northeast-1',
+    'COGNITO_USER_POOL_ID': 'dummy_pool_id',
+    'COGNITO_APP_CLIENT_ID': 'dummy_app_client_id',
+    'TABLE_NAME': 'components',
+    'PK_NAME': 'pk',
+    'SK_NAME': 'sk',
+    'SK_PREFIX': 'category',
+    'SK_SUFFIX': 'id',
+    'SK_DELIMITER': '#',
+    'FIELD_TYPES': json.dumps({'pk': 'S', 'sk': 'S', 'category': 'S', 'id': 'S', 'name': 'S'}),
+    'TABLE1_NAME': 'users',
+    'TABLE1_PK_NAME': 'user_id',
+    'TABLE1_FIELD_TYPES': json.dumps({'user_id': 'S', 'organization_id': 'S', 'username': 'S'}),
+    'TABLE2_NAME': 'organizations',
+    'TABLE2_PK_NAME': 'organization_id',
+    'TABLE2_FIELD_TYPES': json.dumps({'organization_id': 'S', 'organization_name': 'S'}),
+}
+
+INIT_SCRIPT = '''
+import sys, time
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import lambda_function
+for name in sys.argv[2:]:
+    lambda_function.load_function(name)
+print((time.perf_counter() - started) * 1000)
+'''
+
+
+def measure_init_ms(function_dir, load=(), repeat=3):
+    env = dict(os.environ, **ENV, PYTHONPATH=LAYER_DIR, AWS_DEFAULT_REGION='ap-northeast-1')
+    samples = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', INIT_SCRIPT, function_dir, *load],
+            env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        samples.append(float(output.strip().splitlines()[-1]))
+    return sorted(samples)[len(samples) // 2]
+
+
+def make_trace(hours, seed=0):
+    rng = random.Random(seed)
+    trace = []
+    for name, per_hour in REQUESTS_PER_HOUR.items():
+        t = 0.0
+        while True:
+            t += rng.expovariate(per_hour / 3600)
+            if t >= hours * 3600:
+                break
+            trace.append((t, name))
+    trace.sort()
+    return trace
+
+
+# pool_of(name) が同じ値になる関数はコンテナを共有する
+# 空いているウォームなコンテナが無ければ新しいコンテナ（コールドスタート）で処理する
+def simulate(trace, pool_of):
+    pools = {}
+    cold_starts = {}
+    for t, name in trace:
+        containers = pools.setdefault(pool_of(name), [])
+        containers[:] = [c for c in containers if t - c['last_used'] <= IDLE_TIMEOUT_SECONDS]
+        container = next((c for c in containers if c['busy_until'] <= t), None)
+        if container is None:
+            container = {'loaded': set()}
+            containers.append(container)
+            cold_starts[name] = cold_starts.get(name, 0) + 1
+        container['loaded'].add(name)
+        container['busy_until'] = t + DURATION_SECONDS
+        container['last_used'] = t + DURATION_SECONDS
+    return cold_starts
+
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 24 * 7
+    names = list(REQUESTS_PER_HOUR)
+
+    separate_init = {name: measure_init_ms(os.path.join(BACKEND_DIR, name)) for name in names}
+    router_dir = os.path.join(BACKEND_DIR, 'router')
+    router_init = {name: measure_init_ms(router_dir, [name]) for name in names}
+
+    trace = make_trace(hours)
+    separate = simulate(trace, lambda name: name)
+    combined = simulate(trace, lambda name: 'router')
+
+    rows = []
+    for label, cold_starts, init_ms in (('separate', separate, separate_init), ('router', combined, router_init)):
+        total = sum(cold_starts.values())
+        init_total = sum(count * init_ms[name] for name, count in cold_starts.items())
+        rows.append({
+            'mode': label,
+            'requests': len(trace),
+            'cold_starts': total,
+            'cold_start_rate': round(total / len(trace), 4) if trace else 0,
+            'by_function': cold_starts,
+            'init_ms': {name: round(ms, 1) for name, ms in init_ms.items()},
+            'total_init_seconds': round(init_total / 1000, 2),
+        })
+    print(json.dumps({'hours': hours, 'idle_timeout_seconds': IDLE_TIMEOUT_SECONDS, 'results': rows}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
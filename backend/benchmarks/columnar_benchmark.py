@@ -0,0 +1,89 @@
+import gzip
+import json
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'layer', 'common', 'python'))
+
+from columnar import ColumnarEncoder  # noqa: E402
+
+# components-crud の query レスポンスを、従来のアイテムのリストと columnar 形式で比較する
+# 使い方: python backend/benchmarks/columnar_benchmark.py [件数]
+
+FIELDS = [
+    'organization_id', 'category_item_id', 'item_id', 'category', 'manufacturer', 'name', 'type',
+    'model_number', 'year', 'qty', 'storage_area', 'assign', 'note', 'created_at', 'updated_at',
+]
+CATEGORIES = ['ic', 'capacitor', 'resistor', 'connector', 'sensor', 'module', 'cable', 'tool']
+MANUFACTURERS = ['TI', 'ADI', 'Murata', 'TDK', 'Rohm', 'Omron', 'Panasonic', 'Microchip', 'ST', 'NXP']
+STORAGE_AREAS = [f'shelf-{c}{n}' for c in 'ABCD' for n in range(1, 6)]
+
+
+class StringDecimalEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, Decimal):
+            return str(obj)
+        return super().default(obj)
+
+
+def make_items(count, seed=0):
+    rng = random.Random(seed)
+    items = []
+    for i in range(count):
+        item_id = f'{rng.getrandbits(128):032x}'
+        category = rng.choice(CATEGORIES)
+        item = {
+            'organization_id': '4f9d2c1e-7a3b-4e8f-9c6d-2b1a0e5f7d3c',
+            'category_item_id': f'{category}#{item_id}',
+            'item_id': item_id,
+            'category': category,
+            'manufacturer': rng.choice(MANUFACTURERS),
+            'name': f'part-{i:05d}',
+            'type': rng.choice(['SMD', 'DIP', 'module']),
+            'model_number': f'MN-{rng.randint(1000, 99999)}',
+            'year': str(rng.randint(2010, 2025)),
+            'qty': Decimal(rng.randint(0, 500)),
+            'storage_area': rng.choice(STORAGE_AREAS),
+            'created_at': f'2025/0{rng.randint(1, 9)}/1{rng.randint(0, 9)} 12:00:00',
+            'updated_at': f'2025/0{rng.randint(1, 9)}/1{rng.randint(0, 9)} 12:00:00',
+        }
+        if rng.random() < 0.3:
+            item['assign'] = rng.choice(['alice', 'bob', 'carol'])
+        if rng.random() < 0.2:
+            item['note'] = f'note {i}'
+        items.append(item)
+    return items
+
+
+def measure(fn, repeat=5):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return result, best * 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    items = make_items(count)
+
+    rows, rows_ms = measure(lambda: json.dumps({'components': items}, cls=StringDecimalEncoder))
+    columnar, columnar_ms = measure(lambda: ColumnarEncoder(FIELDS).add(items).encode())
+
+    report = {
+        'items': count,
+        'rows': {'bytes': len(rows.encode()), 'gzip_bytes': len(gzip.compress(rows.encode())), 'ms': round(rows_ms, 1)},
+        'columnar': {'bytes': len(columnar.encode()), 'gzip_bytes': len(gzip.compress(columnar.encode())), 'ms': round(columnar_ms, 1)},
+    }
+    report['bytes_ratio'] = round(report['columnar']['bytes'] / report['rows']['bytes'], 3)
+    report['gzip_bytes_ratio'] = round(report['columnar']['gzip_bytes'] / report['rows']['gzip_bytes'], 3)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
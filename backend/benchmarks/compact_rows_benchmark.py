@@ -0,0 +1,62 @@
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'layer', 'common', 'python'))
+
+from columnar_benchmark import FIELDS, make_items  # noqa: E402
+from rows import dumps_rows  # noqa: E402
+from schema import Schema  # noqa: E402
+from serialization import deserialize_item  # noqa: E402
+
+# query_with_pagination の結果を dict で持つ場合と rows.CompactRow で持つ場合のメモリ使用量を比較する
+# 使い方: python backend/benchmarks/compact_rows_benchmark.py [件数]
+
+FIELD_TYPES = {field: 'N' if field == 'qty' else 'S' for field in FIELDS}
+
+
+def to_dynamodb(item):
+    return {key: {'N': str(value)} if key == 'qty' else {'S': value} for key, value in item.items()}
+
+
+def measure(convert, raw_items):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = [convert(item) for item in raw_items]
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {'retained_bytes': retained, 'peak_bytes': peak, 'build_ms': round(elapsed_ms, 1)}
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    raw_items = [to_dynamodb(item) for item in make_items(count)]
+    row_type = Schema(FIELD_TYPES).row_type(['organization_id', 'category_item_id', 'item_id', 'category'])
+
+    dicts, dict_report = measure(deserialize_item, raw_items)
+    started = time.perf_counter()
+    json.dumps(dicts, default=str)
+    dict_report['serialize_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    del dicts
+
+    rows, row_report = measure(row_type.from_dynamodb, raw_items)
+    started = time.perf_counter()
+    dumps_rows(rows)
+    row_report['serialize_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+    report = {
+        'items': count,
+        'dict': dict_report,
+        'compact_row': row_report,
+        'retained_ratio': round(row_report['retained_bytes'] / dict_report['retained_bytes'], 3),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,388 @@
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'layer', 'common', 'python'))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'local'))
+
+from columnar_benchmark import make_items  # noqa: E402
+from local_auth import bearer  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+# 同時ユーザー数を変えて Function URL のイベントを送り、スループット・レイテンシ・エラー率・DynamoDB の呼び出し回数を測る
+#   - 送り先: 既定はプロセス内のローカルランタイム（local/server.py の LocalRuntime、DynamoDB はメモリ上）
+#             --url で起動済みのローカルサーバー（python backend/local/server.py）に HTTP で送る
+#   - 負荷: 合成（query / query_category / put / update / delete の比率と organization ごとの件数を指定）
+#           または --replay で server.py --record が保存したイベントを再生する
+#   - 仮想ユーザーごとに1スレッドで、トークンを持って順にリクエストを送る
+# 結果は JSON で標準出力に書く（--users 50,200,1000 のように複数指定すると同じランタイムで順に測る）
+#
+# 使い方: python backend/benchmarks/load_harness.py --users 50,200 --requests-per-user 20 --items-per-org 500
+
+DEFAULT_MIX = {'query': 60, 'query_category': 10, 'put': 10, 'update': 15, 'delete': 5}
+EDITOR_GROUPS = ['editor']
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        action, _, weight = part.partition('=')
+        if action not in DEFAULT_MIX:
+            raise ValueError(f'Unknown action in mix: {action}')
+        mix[action] = float(weight)
+    return mix
+
+
+# 最近接順位法のパーセンタイル（values はソート済み）
+def percentile(values, p):
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(-(-len(values) * p // 100)) - 1))
+    return values[index]
+
+
+def summarize(latencies_ms):
+    values = sorted(latencies_ms)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean': round(sum(values) / len(values), 3),
+        'p50': round(percentile(values, 50), 3),
+        'p95': round(percentile(values, 95), 3),
+        'p99': round(percentile(values, 99), 3),
+        'max': round(values[-1], 3),
+    }
+
+
+def _json_item(item):
+    return {key: str(value) if key == 'qty' else value for key, value in item.items()}
+
+
+# ----- 送り先 -----
+
+class InProcessTarget:
+    # リクエストはハンドラーを直接呼ぶ。JWKS の取得先としてだけローカルサーバーを起動する
+    def __init__(self, dynamodb_latency_ms=0, concurrency=None):
+        from server import LocalRuntime, LocalServer
+        self.runtime = LocalRuntime(concurrency=concurrency, log_level=logging.WARNING,
+                                    dynamodb_latency_ms=dynamodb_latency_ms)
+        self.server = LocalServer(self.runtime, port=0).start()
+        self.name = 'in-process'
+
+    def token(self, sub, groups):
+        return self.runtime.signer.issue_token(sub, sub, groups)
+
+    def send(self, method, path, headers, body):
+        status, _, response_body = self.runtime.handle(method, path, headers, body)
+        return status, response_body
+
+    def dynamodb_calls(self):
+        return self.runtime.stats()['dynamodb_calls']
+
+    # 初期データはハンドラーを通さずにテーブルへ直接書き込む
+    def seed(self, organization_id, items):
+        from dynamodb_handler import DynamoDBHandler
+        from schema import load_schema
+        handler = DynamoDBHandler(
+            os.environ['REGION_NAME'], os.environ['TABLE_NAME'], os.environ['PK_NAME'], os.environ['SK_NAME'],
+            os.environ['SK_PREFIX'], os.environ['SK_SUFFIX'], os.environ['SK_DELIMITER'], load_schema('FIELD_TYPES'),
+            client=self.runtime.dynamodb,
+        )
+        for start in range(0, len(items), 25):
+            requests = [{'PutRequest': {'Item': handler.build_item(dict(item), item['item_id'])}}
+                        for item in items[start:start + 25]]
+            handler.batch_write_with_retry({os.environ['TABLE_NAME']: requests})
+
+    def close(self):
+        self.server.stop()
+
+
+class HttpTarget:
+    # スレッドごとに接続を持ち、keep-alive で送る
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.name = url
+        self.local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        return connection
+
+    def _request(self, method, path, headers, body):
+        connection = self._connection()
+        try:
+            connection.request(method, path, body=body.encode() if body is not None else None, headers=headers)
+            response = connection.getresponse()
+            return response.status, response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            self.local.connection = None
+            raise
+
+    def token(self, sub, groups):
+        status, body = self._request('POST', '/local/token', {}, json.dumps({'sub': sub, 'username': sub, 'groups': groups}))
+        if status != 200:
+            raise RuntimeError(f'Failed to issue a token for {sub}: {status}')
+        return json.loads(body)['id_token']
+
+    def send(self, method, path, headers, body):
+        return self._request(method, path, headers, body)
+
+    def dynamodb_calls(self):
+        status, body = self._request('GET', '/local/stats', {}, None)
+        return json.loads(body)['dynamodb_calls'] if status == 200 else None
+
+    # サーバーのテーブルには直接書けないので put リクエストで入れる
+    def seed(self, organization_id, items):
+        token = self.token('load-seeder', EDITOR_GROUPS)
+        for item in items:
+            value = _json_item({key: value for key, value in item.items() if key not in ('category_item_id', 'item_id')})
+            self.send('POST', '/components', {'Authorization': bearer(token)}, json.dumps({'action': 'put', 'value': value}))
+
+    def close(self):
+        pass
+
+
+# ----- 負荷 -----
+
+class SyntheticWorkload:
+    def __init__(self, organizations, items_per_org, mix, seed=0):
+        self.organization_ids = [f'load-org-{i:04d}' for i in range(organizations)]
+        self.items_per_org = items_per_org
+        self.mix = mix
+        self.seed = seed
+        self.keys = {organization_id: [] for organization_id in self.organization_ids}
+        self.lock = threading.Lock()
+
+    def prepare(self, target):
+        for n, organization_id in enumerate(self.organization_ids):
+            items = make_items(self.items_per_org, seed=self.seed + n)
+            for item in items:
+                item['organization_id'] = organization_id
+            target.seed(organization_id, items)
+        # 計測の前に1回ずつ query して、関数の読み込み・JWKS の取得を済ませ、update / delete に使うキーを集める
+        token = target.token('load-seeder', EDITOR_GROUPS)
+        for organization_id in self.organization_ids:
+            body = json.dumps({'action': 'query', 'value': {'organization_id': organization_id}})
+            status, response_body = target.send('POST', '/components', {'Authorization': bearer(token)}, body)
+            self.observe('query', organization_id, status, response_body)
+
+    def organization_for(self, user_index):
+        return self.organization_ids[user_index % len(self.organization_ids)]
+
+    def next_request(self, rng, organization_id):
+        action = rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        with self.lock:
+            keys = self.keys[organization_id]
+            key = rng.choice(keys) if keys else None
+            if action == 'delete' and key is not None:
+                keys.remove(key)
+        if action in ('update', 'delete') and key is None:
+            action = 'query'
+
+        if action == 'query':
+            body = {'action': 'query', 'value': {'organization_id': organization_id}}
+        elif action == 'query_category':
+            body = {'action': 'query', 'value': {'organization_id': organization_id, 'category': 'ic'}}
+        elif action == 'put':
+            item = make_items(1, seed=rng.getrandbits(32))[0]
+            value = {k: v for k, v in item.items() if k not in ('category_item_id', 'item_id', 'created_at', 'updated_at')}
+            value['organization_id'] = organization_id
+            body = {'action': 'put', 'value': _json_item(value)}
+        elif action == 'update':
+            body = {'action': 'update', 'value': {'organization_id': organization_id, 'category_item_id': key, 'qty': str(rng.randint(0, 500))}}
+        else:
+            body = {'action': 'delete', 'value': [{'organization_id': organization_id, 'category_item_id': key}]}
+        return action, 'POST', '/components', json.dumps(body)
+
+    # put・query の結果から、以降の update / delete で使うキーを覚える
+    def observe(self, action, organization_id, status, response_body):
+        if status != 200 or action not in ('put', 'query'):
+            return
+        components = json.loads(response_body).get('components') or []
+        if not isinstance(components, list):
+            return
+        keys = [c['category_item_id'] for c in components if isinstance(c, dict) and 'category_item_id' in c]
+        with self.lock:
+            if action == 'put':
+                self.keys[organization_id].extend(keys)
+            elif not self.keys[organization_id]:
+                self.keys[organization_id] = keys
+
+
+class ReplayWorkload:
+    # 記録したイベントを順に（ユーザーごとにずらして）送る。Authorization は仮想ユーザーのトークンに置き換える
+    def __init__(self, path):
+        with open(path) as f:
+            self.events = [json.loads(line) for line in f if line.strip()]
+        if not self.events:
+            raise ValueError(f'No events in {path}')
+        self.organization_ids = ['replay']
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def prepare(self, target):
+        pass
+
+    def organization_for(self, user_index):
+        return 'replay'
+
+    def next_request(self, rng, organization_id):
+        with self.lock:
+            event = self.events[self.counter % len(self.events)]
+            self.counter += 1
+        method = event.get('requestContext', {}).get('http', {}).get('method', 'POST')
+        path = event.get('rawPath') or '/'
+        try:
+            action = json.loads(event.get('body') or '{}').get('action', path.strip('/') or 'request')
+        except (json.JSONDecodeError, AttributeError):
+            action = 'request'
+        return action, method, path, event.get('body')
+
+    def observe(self, action, organization_id, status, response_body):
+        pass
+
+
+# ----- 実行 -----
+
+def run_users(target, workload, users, requests_per_user=None, duration_seconds=None, think_time_ms=0, seed=0):
+    results = []
+    results_lock = threading.Lock()
+    tokens = [target.token(f'load-user-{i:04d}', EDITOR_GROUPS) for i in range(users)]
+    start_barrier = threading.Barrier(users + 1)
+    deadline = [None]
+
+    def user(index):
+        rng = random.Random(seed * 100003 + index)
+        organization_id = workload.organization_for(index)
+        headers = {'Authorization': bearer(tokens[index]), 'Content-Type': 'application/json'}
+        local_results = []
+        start_barrier.wait()
+        sent = 0
+        while True:
+            if requests_per_user is not None and sent >= requests_per_user:
+                break
+            if duration_seconds is not None and time.perf_counter() >= deadline[0]:
+                break
+            action, method, path, body = workload.next_request(rng, organization_id)
+            started = time.perf_counter()
+            try:
+                status, response_body = target.send(method, path, headers, body)
+            except Exception as e:
+                logger.debug(f'{action} failed: {e}')
+                status, response_body = 'exception', b''
+            local_results.append((action, status, (time.perf_counter() - started) * 1000))
+            workload.observe(action, organization_id, status, response_body)
+            sent += 1
+            if think_time_ms:
+                time.sleep(think_time_ms / 1000)
+        with results_lock:
+            results.extend(local_results)
+
+    threads = [threading.Thread(target=user, args=(i,), daemon=True) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    calls_before = target.dynamodb_calls()
+    started = time.perf_counter()
+    if duration_seconds is not None:
+        deadline[0] = started + duration_seconds
+    start_barrier.wait()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    calls_after = target.dynamodb_calls()
+    return build_report(users, results, elapsed, calls_before, calls_after)
+
+
+def build_report(users, results, elapsed, calls_before, calls_after):
+    requests = len(results)
+    status_counts = Counter(str(status) for _, status, _ in results)
+    errors = sum(1 for _, status, _ in results if status == 'exception' or status >= 500)
+    by_action = {}
+    for action in sorted({action for action, _, _ in results}):
+        action_results = [r for r in results if r[0] == action]
+        by_action[action] = dict(
+            summarize([latency for _, _, latency in action_results]),
+            errors=sum(1 for _, status, _ in action_results if status == 'exception' or status >= 500),
+        )
+    report = {
+        'users': users,
+        'requests': requests,
+        'duration_seconds': round(elapsed, 3),
+        'throughput_rps': round(requests / elapsed, 2) if elapsed > 0 else None,
+        'latency_ms': summarize([latency for _, _, latency in results]),
+        'by_action': by_action,
+        'status_counts': dict(status_counts),
+        'error_rate': round(errors / requests, 4) if requests else 0,
+        'rejected_rate': round(status_counts.get('429', 0) / requests, 4) if requests else 0,
+        'dynamodb': None,
+    }
+    if calls_before is not None and calls_after is not None:
+        delta = {op: calls_after.get(op, 0) - calls_before.get(op, 0) for op in calls_after}
+        delta = {op: count for op, count in delta.items() if count > 0}
+        total = sum(delta.values())
+        report['dynamodb'] = {
+            'calls': total,
+            'calls_per_request': round(total / requests, 3) if requests else None,
+            'by_operation': {op: round(count / requests, 3) for op, count in sorted(delta.items())} if requests else {},
+        }
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay Function URL events against the handlers and report latency percentiles.')
+    parser.add_argument('--url', default=None, help='local server URL (default: run the handlers in this process)')
+    parser.add_argument('--users', default='50', help='comma separated concurrent users, e.g. 50,200,1000')
+    parser.add_argument('--requests-per-user', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=None, help='seconds per run (overrides --requests-per-user)')
+    parser.add_argument('--organizations', type=int, default=10)
+    parser.add_argument('--items-per-org', type=int, default=200)
+    parser.add_argument('--mix', default=None, help='e.g. query=60,query_category=10,put=10,update=15,delete=5')
+    parser.add_argument('--replay', default=None, help='JSON Lines file recorded with server.py --record')
+    parser.add_argument('--think-time-ms', type=float, default=0)
+    parser.add_argument('--dynamodb-latency-ms', type=float, default=0, help='in-process only: latency added per DynamoDB call')
+    parser.add_argument('--concurrency', type=int, default=None, help='in-process only: max concurrent handler invocations')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    target = HttpTarget(args.url) if args.url else InProcessTarget(args.dynamodb_latency_ms, args.concurrency)
+    if args.replay:
+        workload = ReplayWorkload(args.replay)
+    else:
+        workload = SyntheticWorkload(args.organizations, args.items_per_org, parse_mix(args.mix) if args.mix else DEFAULT_MIX, args.seed)
+    try:
+        workload.prepare(target)
+        runs = []
+        for users in [int(n) for n in args.users.split(',')]:
+            requests_per_user = None if args.duration is not None else args.requests_per_user
+            runs.append(run_users(target, workload, users, requests_per_user, args.duration, args.think_time_ms, args.seed))
+    finally:
+        target.close()
+
+    print(json.dumps({
+        'target': target.name,
+        'workload': 'replay' if args.replay else 'synthetic',
+        'organizations': len(workload.organization_ids),
+        'items_per_org': None if args.replay else args.items_per_org,
+        'mix': None if args.replay else workload.mix,
+        'runs': runs,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
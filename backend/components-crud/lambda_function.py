@@ -1,8 +1,32 @@
 from dynamodb_handler import DynamoDBHandler
+from schema import load_schema
 from cognito_auth import CognitoAuthenticator, STATUS_CODE_UNAUTHORIZED
+import tracing
+from resilience import ResilientCaller, Deadline, ThrottlingError, service_unavailable_response
+import capacity
+from capacity import CapacityMeter
+from sharding import ShardingPolicy
+import object_store
+import background
+from export_job import ExportJob, FORMAT_CSV, export_columns, get_export_status, run_export
+from background import STATUS_PENDING
+from import_job import ImportJob, get_import_status, run_import
+from columnar import ColumnarEncoder, FORMAT_COLUMNAR
+from rows import CompactRow, dumps_rows
+import query_cache
+import warmup
+from rate_limiter import RateLimitExceeded, too_many_requests_response
+import rate_limiter
+import idempotency
+import low_stock
+import snapshot
+import compression
+import profiling
+from idempotency import IdempotencyInProgressError, conflict_response
 import json
 import os
 import logging
+import uuid
 from decimal import Decimal
 
 REGION_NAME = os.environ['REGION_NAME']
@@ -14,11 +38,102 @@ SK_NAME = os.environ['SK_NAME']
 SK_PREFIX = os.environ['SK_PREFIX']
 SK_SUFFIX = os.environ['SK_SUFFIX']
 SK_DELIMITER = os.environ['SK_DELIMITER']
-FIELD_TYPES = json.loads(os.environ['FIELD_TYPES'])
+FIELD_TYPES = load_schema('FIELD_TYPES')
+# 大きな organization は SHARD_OVERRIDES でシャード数を指定する（未設定ならシャーディングしない）
+SHARDING_POLICY = ShardingPolicy.from_env()
+COMPONENT_COLUMNS = export_columns(FIELD_TYPES, [PK_NAME, SK_NAME, SK_SUFFIX, SK_PREFIX])
+# adjust_qty で増減する数量の属性（数値で保存する。文字列のまま残っているアイテムは増減時に変換する）
+QTY_NAME = os.environ.get('QTY_NAME', 'qty')
+# LOW_STOCK_INDEX_NAME を設定すると、qty が発注点（reorder_threshold）以下のアイテムをスパースな GSI に載せ、low_stock で取得できる
+LOW_STOCK = low_stock.from_env(QTY_NAME)
+# 大量のアイテムを返すときのメモリ使用量を抑えるため、クエリ結果を dict ではなくコンパクトな行で持つ
+COMPACT_ROWS = os.environ.get('COMPACT_ROWS', '').lower() in ('1', 'true', 'yes')
+# QUERY_CACHE=memory / redis://host:port でクエリ結果をキャッシュする（書き込みで organization ごとに無効化）
+# memory は他のコンテナの書き込みでは無効化されない（QUERY_CACHE_TTL の間は古い結果を返しうる）
+QUERY_CACHE = query_cache.from_env()
+# SNAPSHOTS=true で organization 全体の query を圧縮したスナップショットと書き込みの差分から返す（古くなったら非同期で作り直す）
+SNAPSHOTS = snapshot.from_env()
+# COMPRESS_MIN_BYTES を設定すると、それより大きな文字列属性（note など）を圧縮して書く（COMPRESS_FIELDS で属性を絞れる）
+COMPRESSOR = compression.from_env(FIELD_TYPES, [PK_NAME, SK_NAME, SK_PREFIX, SK_SUFFIX, low_stock.FLAG_NAME])
+# 書き込むアイテムが MAX_ITEM_BYTES（既定 380KB）を超えたら DynamoDB を呼ばずに 400 を返す
+MAX_ITEM_BYTES = compression.max_item_bytes_from_env()
+# ウォームアップイベントとプロビジョニングされた同時実行・SnapStart の初期化で、クライアント・JWKS・接続を準備する
+WARMER = warmup.Warmer().jwks(REGION_NAME, COGNITO_USER_POOL_ID).describe_tables(REGION_NAME, [TABLE_NAME])
+if QUERY_CACHE is not None:
+    WARMER.step('query_cache', QUERY_CACHE.prime)
+WARMER.init_hook()
+# RATE_LIMIT_PER_SECOND / RATE_LIMIT_BURST で organization ごとにレート制限する（バケットは同じテーブルの ratelimit#<organization_id> に置く）
+RATE_LIMITER = rate_limiter.from_env(TABLE_NAME, PK_NAME, SK_NAME, REGION_NAME)
+# IDEMPOTENCY_TABLE_NAME を設定すると、書き込みの Idempotency-Key ヘッダーでリトライ時に最初の結果を返す
+IDEMPOTENCY = idempotency.from_env(REGION_NAME)
+IDEMPOTENT_ACTIONS = ['put', 'update', 'adjust_qty', 'delete', 'import']
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+_export_store = None
+
+
+# エクスポート・インポートの保存先（EXPORT_BUCKET または OBJECT_STORE_DIR）は export / import を使うときだけ必要
+def get_export_store():
+    global _export_store
+    if _export_store is None:
+        _export_store = object_store.from_env(REGION_NAME)
+    return _export_store
+
+
+def create_dynamodb_handler(context, capacity_meter=None):
+    return DynamoDBHandler(
+        REGION_NAME, TABLE_NAME, PK_NAME, SK_NAME, SK_PREFIX, SK_SUFFIX, SK_DELIMITER, FIELD_TYPES,
+        capacity_meter=capacity_meter,
+        resilience=ResilientCaller.for_table(TABLE_NAME, deadline=Deadline.from_context(context)),
+        sharding_policy=SHARDING_POLICY,
+        compact_rows=COMPACT_ROWS,
+        query_cache=QUERY_CACHE,
+        low_stock=LOW_STOCK,
+        snapshots=SNAPSHOTS,
+        compressor=COMPRESSOR,
+        max_item_bytes=MAX_ITEM_BYTES
+    )
+
+
+# export アクションから非同期で呼び出されたときの処理
+def run_export_job(job_event, context):
+    job = ExportJob.load(get_export_store(), job_event['organization_id'], job_event['job_id'])
+    try:
+        document = run_export(job, create_dynamodb_handler(context), COMPONENT_COLUMNS)
+    except Exception:
+        # 失敗はステータスに記録済み。非同期呼び出しの自動リトライはさせない
+        return {'status': job.document['status']}
+    return {'status': document['status']}
+
+
+# import アクションから非同期で呼び出されたときの処理。時間切れ前に中断したら続きを再度非同期で呼び出す
+def run_import_job(job_event, context):
+    job = ImportJob.load(get_export_store(), job_event['organization_id'], job_event['job_id'])
+    try:
+        document = run_import(job, create_dynamodb_handler(context), deadline=Deadline.from_context(context))
+    except Exception:
+        return {'status': job.document['status']}
+    if document['status'] == STATUS_PENDING:
+        background.invoke_async(context.invoked_function_arn, {'import_job': job.to_event()})
+    return {'status': document['status']}
+
+
+# query で古くなっていたスナップショットを非同期呼び出しで作り直す
+def run_snapshot_job(job_event, context):
+    meta = SNAPSHOTS.build(create_dynamodb_handler(context), job_event['organization_id'])
+    return {'status': 'built' if meta is not None else 'skipped'}
+
+
+# 作り直しは依頼できなくてもクエリ自体は返せるので、失敗してもエラーにしない
+def request_snapshot_builds(dynamodb_handler, context):
+    for organization_id in dynamodb_handler.stale_snapshots:
+        try:
+            background.invoke_async(context.invoked_function_arn, {'snapshot_job': {'organization_id': organization_id}})
+        except Exception as e:
+            logger.warning(f'Failed to request snapshot build for {organization_id}: {e}')
+
 
 class StringDecimalEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -27,10 +142,149 @@ class StringDecimalEncoder(json.JSONEncoder):
         return super().default(obj)
 
 
+# 消費キャパシティ集計・レート制限用にリクエストから organization_id を取り出す
+def get_organization_id(value):
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            return ''
+    if isinstance(value, list):
+        value = value[0] if len(value) > 0 else {}
+    if isinstance(value, dict):
+        return value.get(PK_NAME, '')
+    return ''
+
+
+# format: "columnar" のときは components を列形式にする（それ以外は従来通りアイテムのリスト）
+# COMPACT_ROWS のときは行ごとにオブジェクトとして書き出す
+def dump_response_body(response_body):
+    components = response_body['components']
+    if isinstance(components, ColumnarEncoder):
+        dumped_components = components.encode()
+    elif isinstance(components, list) and len(components) > 0 and isinstance(components[0], CompactRow):
+        dumped_components = dumps_rows(components)
+    else:
+        return json.dumps(response_body, cls=StringDecimalEncoder)
+    head = json.dumps({key: value for key, value in response_body.items() if key != 'components'})
+    return f'{head[:-1]}, "components": {dumped_components}}}'
+
+
+# 冪等性キーから put するアイテムの ID を決める（冪等性テーブルのレコードが消えた後のリトライでも重複させない）
+def item_id_for(organization_id, idempotency_key):
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f'{organization_id}#{idempotency_key}'))
+
+
+# 削除したアイテムのキーだけを返してクライアント側で反映できるようにする
+def get_deleted_keys(value):
+    if isinstance(value, str):
+        value = json.loads(value)
+    return [{PK_NAME: item[PK_NAME], SK_NAME: item[SK_NAME]} for item in value]
+
+
+# 操作を実行して Lambda の戻り値を返す（冪等性キーがあるときは Idempotency.run の中で呼ぶ）
+# item_id を渡すと put でその ID を使う（リトライで同じアイテムになるようにするため）
+def execute_action(action_type, value, response_format, message, context, item_id=None):
+    result = False
+    response_value = [] # 辞書のリスト
+
+    if message == '':
+        capacity_meter = None
+        if capacity.is_enabled():
+            capacity_meter = CapacityMeter(organization_id=get_organization_id(value), action=action_type)
+        dynamodb_handler = create_dynamodb_handler(context, capacity_meter)
+
+        # 例外で抜けた場合も消費したキャパシティを記録する
+        try:
+            if action_type == 'query':
+                if 'category' in value:
+                    response_value = dynamodb_handler.query_by_sk_prefix(value)
+                else:
+                    response_value = dynamodb_handler.query_by_PK(value)
+                    request_snapshot_builds(dynamodb_handler, context)
+                if response_format == FORMAT_COLUMNAR:
+                    response_value = ColumnarEncoder(COMPONENT_COLUMNS).add(response_value)
+                result = True
+            elif action_type == 'low_stock':
+                response_value = dynamodb_handler.query_low_stock(value)
+                if response_format == FORMAT_COLUMNAR:
+                    response_value = ColumnarEncoder(COMPONENT_COLUMNS).add(response_value)
+                result = True
+            elif action_type == 'put':
+                response_value = dynamodb_handler.put_item(value, item_id)
+                if len(response_value) > 0:
+                    result = True
+            elif action_type == 'update':
+                response_value = dynamodb_handler.update_item(value)
+                if len(response_value) > 0:
+                    result = True
+            elif action_type == 'adjust_qty':
+                response_value = dynamodb_handler.adjust_quantities(value, QTY_NAME)
+                result = all(r['status'] == 'ok' for r in response_value)
+            elif action_type == 'delete':
+                result = dynamodb_handler.batch_delete_items(value)
+                if result:
+                    response_value = get_deleted_keys(value)
+            elif action_type == 'export':
+                # ジョブを登録して自分自身を非同期で呼び出し、すぐにジョブIDを返す
+                job = ExportJob.create(get_export_store(), value[PK_NAME], value.get('format', FORMAT_CSV))
+                background.invoke_async(context.invoked_function_arn, {'export_job': job.to_event()})
+                response_value = [job.document]
+                result = True
+            elif action_type == 'export_status':
+                response_value = [get_export_status(get_export_store(), value[PK_NAME], value['job_id'])]
+                result = True
+            elif action_type == 'import':
+                # job_id を指定した場合は失敗したジョブを続きから再開する
+                if 'job_id' in value:
+                    job = ImportJob.load(get_export_store(), value[PK_NAME], value['job_id'])
+                else:
+                    job = ImportJob.create(get_export_store(), value[PK_NAME], value['csv'])
+                background.invoke_async(context.invoked_function_arn, {'import_job': job.to_event()})
+                response_value = [job.document]
+                result = True
+            elif action_type == 'import_status':
+                response_value = [get_import_status(get_export_store(), value[PK_NAME], value['job_id'])]
+                result = True
+            else:
+                logger.info(f'Not support action: {action_type}')
+        finally:
+            if capacity_meter is not None:
+                capacity_meter.emit()
+
+
+    response_body = {
+        'result': 'success' if result else 'failure',
+        'message': message,
+        'components': response_value
+    }
+    with tracing.span('serialize'):
+        dumped_body = dump_response_body(response_body)
+    tracing.current().add_bytes('response.bytes', len(dumped_body))
+    logger.info(f'Returning response: {dumped_body}')
+    
+    return {
+        'statusCode': 200,
+        'body': dumped_body
+    }
+
+
+@tracing.traced('components-crud')
+@profiling.profiled('components-crud')
 def lambda_handler(event, context):
     logger.info('Lambda function invoked from Lambda Function URLs.')
 
+    if warmup.is_warmup_event(event):
+        return warmup.warmup_response(WARMER.prime())
+
     logger.info(f'Received raw event: {json.dumps(event, indent=2)}')
+    if 'export_job' in event:
+        return run_export_job(event['export_job'], context)
+    if 'import_job' in event:
+        return run_import_job(event['import_job'], context)
+    if 'snapshot_job' in event:
+        return run_snapshot_job(event['snapshot_job'], context)
+
     if ('httpMethod' in event) and (event['httpMethod'] == 'OPTIONS'):
         logger.info('OPTIONS request received for CORS preflight check.')
         return {
@@ -49,59 +303,50 @@ def lambda_handler(event, context):
         request_body = json.loads(event['body'])
         action_type = request_body['action']
         value = request_body['value']
-        result = False
+        response_format = request_body.get('format', '')
+        tracing.current().set_property('action', action_type)
         message = ''
-        response_value = [] # 辞書のリスト
 
         claims = cognitoAuthenticator.get_claims()
         groups = claims.get('cognito:groups', [])
         logger.info(f'User groups: {groups}')
 
+        # admin は x-profile ヘッダーでこのリクエストをプロファイルできる（PROFILING が未設定でも）
+        if 'admin' in groups:
+            profiling.try_start(profiling.requested_mode(event))
+
         allowed_groups = ['editor', 'admin']
         is_editable = True
         if not any(g in groups for g in allowed_groups):
             is_editable = False
 
-        if action_type in ['put', 'update', 'delete']:
+        if action_type in ['put', 'update', 'adjust_qty', 'delete', 'import']:
             if not is_editable:
                 message = '編集権限がありません'
 
-        if message == '':
-            dynamodb_handler = DynamoDBHandler(
-                REGION_NAME, TABLE_NAME, PK_NAME, SK_NAME, SK_PREFIX, SK_SUFFIX, SK_DELIMITER, FIELD_TYPES
-            )
-
-            if action_type == 'query':
-                if 'category' in value:
-                    response_value = dynamodb_handler.query_by_sk_prefix(value)
-                else:
-                    response_value = dynamodb_handler.query_by_PK(value)
-                result = True
-            elif action_type == 'put':
-                response_value = dynamodb_handler.put_item(value)
-                if len(response_value) > 0:
-                    result = True
-            elif action_type == 'update':
-                result = dynamodb_handler.update_item(value)
-            elif action_type == 'delete':
-                result = dynamodb_handler.batch_delete_items(value)
-            else:
-                logger.info(f'Not support action: {action_type}')
-
+        if message == '' and RATE_LIMITER is not None:
+            RATE_LIMITER.check(get_organization_id(value), action_type)
 
-        response_body = {
-            'result': 'success' if result else 'failure',
-            'message': message,
-            'components': response_value
-        }
-        dumped_body = json.dumps(response_body, cls=StringDecimalEncoder)
-        logger.info(f'Returning response: {dumped_body}')
-        
-        return {
-            'statusCode': 200,
-            'body': dumped_body
-        }
+        idempotency_key = idempotency.get_idempotency_key(event, request_body)
+        if message == '' and IDEMPOTENCY is not None and idempotency_key != '' and action_type in IDEMPOTENT_ACTIONS:
+            organization_id = get_organization_id(value)
+            return IDEMPOTENCY.run(
+                f'{organization_id}#{action_type}#{idempotency_key}',
+                {'action': action_type, 'value': value, 'format': response_format},
+                lambda: execute_action(action_type, value, response_format, message, context,
+                                       item_id_for(organization_id, idempotency_key)),
+            )
+        return execute_action(action_type, value, response_format, message, context)
 
+    except RateLimitExceeded as rle:
+        logger.warning(rle)
+        return too_many_requests_response(rle)
+    except IdempotencyInProgressError as ipe:
+        logger.warning(ipe)
+        return conflict_response()
+    except ThrottlingError as te:
+        logger.error(f'DynamoDB is throttling: {te}')
+        return service_unavailable_response(te)
     except ValueError as ve:
         logger.error(ve)
         return {
@@ -1,6 +1,7 @@
 import os
 import json
 import pytest
+from decimal import Decimal
 from unittest.mock import patch, MagicMock
 
 os.environ['REGION_NAME'] = 'ap-northeast-1'
@@ -126,6 +127,30 @@ def test_lambda_handler_delete_success(mock_dynamodb_cls, mock_cognito_cls, base
 
     assert response['statusCode'] == 200
     assert body['result'] == 'success'
+    assert body['components'] == [{'pk': 'user1', 'sk': 'pk#id'}]
+
+
+@patch('lambda_function.CognitoAuthenticator')
+@patch('lambda_function.DynamoDBHandler')
+def test_lambda_handler_update_returns_item(mock_dynamodb_cls, mock_cognito_cls, base_event):
+    event = base_event.copy()
+    event['body'] = json.dumps({'action': 'update', 'value': {'pk': 'user1', 'sk': 'pk#id', 'name': 'new'}})
+
+    mock_cognito = MagicMock()
+    mock_cognito.jwt_decode.return_value = True
+    mock_cognito.get_claims.return_value = {'cognito:groups': ['editor']}
+    mock_cognito_cls.return_value = mock_cognito
+
+    mock_dynamodb = MagicMock()
+    mock_dynamodb.update_item.return_value = [{'pk': 'user1', 'sk': 'pk#id', 'name': 'new', 'qty': Decimal('3')}]
+    mock_dynamodb_cls.return_value = mock_dynamodb
+
+    response = lambda_handler(event, None)
+    body = json.loads(response['body'])
+
+    assert response['statusCode'] == 200
+    assert body['result'] == 'success'
+    assert body['components'] == [{'pk': 'user1', 'sk': 'pk#id', 'name': 'new', 'qty': '3'}]
 
 
 @patch('lambda_function.CognitoAuthenticator')
@@ -178,3 +203,332 @@ def test_lambda_handler_internal_error(mock_dynamodb_cls, mock_cognito_cls, base
 
     response = lambda_handler(event, None)
     assert response['statusCode'] == 500
+
+
+@patch('lambda_function.CognitoAuthenticator')
+@patch('lambda_function.DynamoDBHandler')
+def test_lambda_handler_capacity_accounting(mock_dynamodb_cls, mock_cognito_cls, base_event, monkeypatch):
+    monkeypatch.setenv('CAPACITY_ACCOUNTING_ENABLED', 'true')
+
+    mock_cognito = MagicMock()
+    mock_cognito.jwt_decode.return_value = True
+    mock_cognito.get_claims.return_value = {'cognito:groups': ['admin']}
+    mock_cognito_cls.return_value = mock_cognito
+
+    mock_dynamodb = MagicMock()
+    mock_dynamodb.query_by_PK.return_value = []
+    mock_dynamodb_cls.return_value = mock_dynamodb
+
+    response = lambda_handler(base_event, None)
+
+    assert response['statusCode'] == 200
+    capacity_meter = mock_dynamodb_cls.call_args.kwargs['capacity_meter']
+    assert capacity_meter.summary()['organization_id'] == 'user1'
+    assert capacity_meter.summary()['action'] == 'query'
+
+
+@patch('lambda_function.CapacityMeter.emit')
+@patch('lambda_function.CognitoAuthenticator')
+@patch('lambda_function.DynamoDBHandler')
+def test_lambda_handler_capacity_emitted_on_error(mock_dynamodb_cls, mock_cognito_cls, mock_emit, base_event, monkeypatch):
+    monkeypatch.setenv('CAPACITY_ACCOUNTING_ENABLED', 'true')
+
+    mock_cognito = MagicMock()
+    mock_cognito.jwt_decode.return_value = True
+    mock_cognito.get_claims.return_value = {'cognito:groups': ['admin']}
+    mock_cognito_cls.return_value = mock_cognito
+
+    mock_dynamodb = MagicMock()
+    mock_dynamodb.query_by_PK.side_effect = Exception('Some internal error')
+    mock_dynamodb_cls.return_value = mock_dynamodb
+
+    response = lambda_handler(base_event, None)
+
+    assert response['statusCode'] == 500
+    mock_emit.assert_called_once()
+
+
+@patch('lambda_function.CognitoAuthenticator')
+@patch('lambda_function.DynamoDBHandler')
+def test_lambda_handler_throttled(mock_dynamodb_cls, mock_cognito_cls, base_event):
+    from resilience import CircuitOpenError
+
+    mock_cognito = MagicMock()
+    mock_cognito.jwt_decode.return_value = True
+    mock_cognito.get_claims.return_value = {'cognito:groups': ['admin']}
+    mock_cognito_cls.return_value = mock_cognito
+
+    error = CircuitOpenError('Circuit breaker is open')
+    error.retry_after = 4.2
+    mock_dynamodb = MagicMock()
+    mock_dynamodb.query_by_PK.side_effect = error
+    mock_dynamodb_cls.return_value = mock_dynamodb
+
+    response = lambda_handler(base_event, None)
+    assert response['statusCode'] == 503
+    assert response['headers']['Retry-After'] == '5'
+
+
+@patch('lambda_function.background.invoke_async')
+@patch('lambda_function.CognitoAuthenticator')
+def test_lambda_handler_export_job(mock_cognito_cls, mock_invoke_async, base_event, tmp_path, monkeypatch):
+    import gzip
+    import lambda_function
+    from dynamodb_fake import FakeDynamoDBClient
+    from dynamodb_handler import DynamoDBHandler
+    from object_store import LocalObjectStore
+
+    mock_cognito = MagicMock()
+    mock_cognito.jwt_decode.return_value = True
+    mock_cognito.get_claims.return_value = {'cognito:groups': ['viewer']}
+    mock_cognito_cls.return_value = mock_cognito
+    monkeypatch.setattr(lambda_function, '_export_store', LocalObjectStore(str(tmp_path)))
+
+    fake_client = FakeDynamoDBClient()
+    fake_client.add_table('test_table', 'pk', 'sk')
+    handler = DynamoDBHandler('ap-northeast-1', 'test_table', 'pk', 'sk', 'pk', 'id', '#',
+                              lambda_function.FIELD_TYPES, client=fake_client)
+    for i in range(3):
+        handler.put_item({'pk': 'org1', 'name': f'part{i}'})
+
+    context = MagicMock()
+    context.invoked_function_arn = 'arn:aws:lambda:ap-northeast-1:123456789012:function:components-crud'
+    context.get_remaining_time_in_millis.return_value = 60000
+
+    # ジョブの登録
+    base_event['body'] = json.dumps({'action': 'export', 'value': {'pk': 'org1', 'format': 'csv'}})
+    response = lambda_handler(base_event, context)
+    job = json.loads(response['body'])['components'][0]
+    assert job['status'] == 'pending'
+    function_name, job_event = mock_invoke_async.call_args[0]
+    assert function_name == context.invoked_function_arn
+
+    # 非同期呼び出しで実行される処理
+    with patch('lambda_function.DynamoDBHandler', side_effect=lambda *args, **kwargs: handler):
+        assert lambda_handler(job_event, context) == {'status': 'succeeded'}
+
+    base_event['body'] = json.dumps({'action': 'export_status', 'value': {'pk': 'org1', 'job_id': job['job_id']}})
+    status = json.loads(lambda_handler(base_event, context)['body'])['components'][0]
+    assert status['status'] == 'succeeded'
+    assert status['item_count'] == 3
+    with open(status['url'][len('file://'):], 'rb') as f:
+        lines = gzip.decompress(f.read()).decode().splitlines()
+    assert lines[0].split(',')[:2] == ['pk', 'sk']
+    assert len(lines) == 4
+
+
+@patch('lambda_function.CognitoAuthenticator')
+@patch('lambda_function.DynamoDBHandler')
+def test_lambda_handler_query_columnar(mock_dynamodb_cls, mock_cognito_cls, base_event):
+    from columnar import decode_columnar
+
+    mock_cognito = MagicMock()
+    mock_cognito.jwt_decode.return_value = True
+    mock_cognito.get_claims.return_value = {'cognito:groups': ['viewer']}
+    mock_cognito_cls.return_value = mock_cognito
+
+    items = [{'pk': 'user1', 'sk': f'a#{i}', 'name': f'test{i}', 'qty': Decimal(i)} for i in range(3)]
+    mock_dynamodb = MagicMock()
+    mock_dynamodb.query_by_PK.return_value = items
+    mock_dynamodb_cls.return_value = mock_dynamodb
+
+    base_event['body'] = json.dumps({'action': 'query', 'format': 'columnar', 'value': {'pk': 'user1'}})
+    response = lambda_handler(base_event, None)
+    body = json.loads(response['body'])
+
+    assert response['statusCode'] == 200
+    assert body['result'] == 'success'
+    assert body['components']['format'] == 'columnar'
+    assert body['components']['fields'][:2] == ['pk', 'sk']
+    assert decode_columnar(body['components']) == [{**item, 'qty': str(item['qty'])} for item in items]
+
+
+@patch('lambda_function.CognitoAuthenticator')
+@patch('lambda_function.DynamoDBHandler')
+def test_lambda_handler_query_compact_rows(mock_dynamodb_cls, mock_cognito_cls, base_event):
+    from rows import make_row_type
+
+    mock_cognito = MagicMock()
+    mock_cognito.jwt_decode.return_value = True
+    mock_cognito.get_claims.return_value = {'cognito:groups': ['viewer']}
+    mock_cognito_cls.return_value = mock_cognito
+
+    Row = make_row_type(['pk', 'sk', 'name'])
+    mock_dynamodb = MagicMock()
+    mock_dynamodb.query_by_PK.return_value = [Row.from_dict({'pk': 'user1', 'sk': 'a#1', 'name': 'test'})]
+    mock_dynamodb_cls.return_value = mock_dynamodb
+
+    response = lambda_handler(base_event, None)
+    body = json.loads(response['body'])
+
+    assert response['statusCode'] == 200
+    assert body['result'] == 'success'
+    assert body['components'] == [{'pk': 'user1', 'sk': 'a#1', 'name': 'test'}]
+
+
+@patch('lambda_function.CognitoAuthenticator')
+@patch('lambda_function.DynamoDBHandler')
+def test_lambda_handler_rate_limited(mock_dynamodb_cls, mock_cognito_cls, base_event):
+    from dynamodb_fake import FakeDynamoDBClient
+    from rate_limiter import DynamoDBBucketStore, RateLimiter
+
+    mock_cognito = MagicMock()
+    mock_cognito.jwt_decode.return_value = True
+    mock_cognito.get_claims.return_value = {'cognito:groups': ['admin']}
+    mock_cognito_cls.return_value = mock_cognito
+    mock_dynamodb_cls.return_value.query_by_PK.return_value = []
+
+    client = FakeDynamoDBClient()
+    client.add_table('test_table', 'pk', 'sk')
+    limiter = RateLimiter(DynamoDBBucketStore('test_table', 'pk', 'sk', client=client), rate=1, burst=2, costs={'read': 1})
+    with patch('lambda_function.RATE_LIMITER', limiter):
+        assert lambda_handler(base_event, None)['statusCode'] == 200
+        assert lambda_handler(base_event, None)['statusCode'] == 200
+        response = lambda_handler(base_event, None)
+
+    assert response['statusCode'] == 429
+    assert response['headers']['Retry-After'] == '1'
+    assert mock_dynamodb_cls.return_value.query_by_PK.call_count == 2
+
+
+@patch('lambda_function.CognitoAuthenticator')
+@patch('lambda_function.DynamoDBHandler')
+def test_lambda_handler_put_with_idempotency_key(mock_dynamodb_cls, mock_cognito_cls, base_event):
+    from dynamodb_fake import FakeDynamoDBClient
+    from idempotency import DynamoDBIdempotencyStore, Idempotency
+
+    mock_cognito = MagicMock()
+    mock_cognito.jwt_decode.return_value = True
+    mock_cognito.get_claims.return_value = {'cognito:groups': ['editor']}
+    mock_cognito_cls.return_value = mock_cognito
+    mock_dynamodb = MagicMock()
+    mock_dynamodb.put_item.side_effect = lambda value, item_id: [dict(value, id=item_id)]
+    mock_dynamodb_cls.return_value = mock_dynamodb
+
+    client = FakeDynamoDBClient()
+    client.add_table('idempotency', 'idempotency_key')
+    event = dict(base_event, headers={'authorization': 'Bearer dummy_token', 'idempotency-key': 'retry-1'})
+    event['body'] = json.dumps({'action': 'put', 'value': {'pk': 'user1', 'name': 'test'}})
+    with patch('lambda_function.IDEMPOTENCY', Idempotency(DynamoDBIdempotencyStore('idempotency', client=client))):
+        first = lambda_handler(event, None)
+        second = lambda_handler(event, None)
+        # 同じキーで中身が違うリクエストは 400
+        event['body'] = json.dumps({'action': 'put', 'value': {'pk': 'user1', 'name': 'other'}})
+        mismatch = lambda_handler(event, None)
+
+    assert first['statusCode'] == 200
+    assert second['body'] == first['body']
+    assert second['headers']['Idempotency-Replayed'] == 'true'
+    assert mismatch['statusCode'] == 400
+    assert mock_dynamodb.put_item.call_count == 1
+    # item_id は冪等性キーから決まる
+    assert json.loads(first['body'])['components'][0]['id'] == mock_dynamodb.put_item.call_args[0][1]
+
+
+@patch('lambda_function.CognitoAuthenticator')
+@patch('lambda_function.DynamoDBHandler')
+def test_lambda_handler_adjust_qty(mock_dynamodb_cls, mock_cognito_cls, base_event):
+    mock_cognito = MagicMock()
+    mock_cognito.jwt_decode.return_value = True
+    mock_cognito.get_claims.return_value = {'cognito:groups': ['editor']}
+    mock_cognito_cls.return_value = mock_cognito
+    mock_dynamodb = MagicMock()
+    mock_dynamodb.adjust_quantities.return_value = [
+        {'pk': 'user1', 'sk': 'a#1', 'status': 'ok', 'qty': Decimal(4)},
+        {'pk': 'user1', 'sk': 'a#2', 'status': 'insufficient', 'qty': Decimal(0)},
+    ]
+    mock_dynamodb_cls.return_value = mock_dynamodb
+
+    adjustments = [{'pk': 'user1', 'sk': 'a#1', 'delta': -1, 'floor': 0}, {'pk': 'user1', 'sk': 'a#2', 'delta': -1, 'floor': 0}]
+    base_event['body'] = json.dumps({'action': 'adjust_qty', 'value': adjustments})
+    response = lambda_handler(base_event, None)
+    body = json.loads(response['body'])
+
+    assert response['statusCode'] == 200
+    # 1つでも増減できなければ failure。アイテムごとの結果を返す
+    assert body['result'] == 'failure'
+    assert [(c['status'], c['qty']) for c in body['components']] == [('ok', '4'), ('insufficient', '0')]
+    mock_dynamodb.adjust_quantities.assert_called_once_with(adjustments, 'qty')
+
+    mock_cognito.get_claims.return_value = {'cognito:groups': ['viewer']}
+    body = json.loads(lambda_handler(base_event, None)['body'])
+    assert body['message'] == '編集権限がありません'
+
+
+@patch('lambda_function.CognitoAuthenticator')
+@patch('lambda_function.DynamoDBHandler')
+def test_lambda_handler_low_stock(mock_dynamodb_cls, mock_cognito_cls, base_event):
+    mock_cognito = MagicMock()
+    mock_cognito.jwt_decode.return_value = True
+    mock_cognito.get_claims.return_value = {'cognito:groups': ['viewer']}
+    mock_cognito_cls.return_value = mock_cognito
+    mock_dynamodb = MagicMock()
+    mock_dynamodb.query_low_stock.return_value = [{'pk': 'user1', 'sk': 'a#1', 'qty': Decimal(1), 'reorder_threshold': Decimal(2)}]
+    mock_dynamodb_cls.return_value = mock_dynamodb
+
+    base_event['body'] = json.dumps({'action': 'low_stock', 'value': {'pk': 'user1'}})
+    body = json.loads(lambda_handler(base_event, None)['body'])
+    assert body['result'] == 'success'
+    assert body['components'] == [{'pk': 'user1', 'sk': 'a#1', 'qty': '1', 'reorder_threshold': '2'}]
+    mock_dynamodb.query_low_stock.assert_called_once_with({'pk': 'user1'})
+
+
+@patch('lambda_function.background.invoke_async')
+@patch('lambda_function.CognitoAuthenticator')
+@patch('lambda_function.DynamoDBHandler')
+def test_lambda_handler_requests_snapshot_build(mock_dynamodb_cls, mock_cognito_cls, mock_invoke_async, base_event, monkeypatch):
+    import lambda_function
+    mock_cognito = MagicMock()
+    mock_cognito.jwt_decode.return_value = True
+    mock_cognito.get_claims.return_value = {'cognito:groups': ['viewer']}
+    mock_cognito_cls.return_value = mock_cognito
+    mock_dynamodb = MagicMock()
+    mock_dynamodb.query_by_PK.return_value = [{'pk': 'user1', 'name': 'test'}]
+    mock_dynamodb.stale_snapshots = {'user1'}
+    mock_dynamodb_cls.return_value = mock_dynamodb
+    context = MagicMock()
+    context.invoked_function_arn = 'arn:aws:lambda:ap-northeast-1:123456789012:function:components-crud'
+    context.get_remaining_time_in_millis.return_value = 60000
+
+    # 作り直しを依頼できなくてもクエリの結果は返す
+    mock_invoke_async.side_effect = RuntimeError('throttled')
+    assert json.loads(lambda_handler(base_event, context)['body'])['result'] == 'success'
+    mock_invoke_async.assert_called_once_with(context.invoked_function_arn, {'snapshot_job': {'organization_id': 'user1'}})
+
+    snapshots = MagicMock()
+    snapshots.build.return_value = {'version': 1}
+    monkeypatch.setattr(lambda_function, 'SNAPSHOTS', snapshots)
+    assert lambda_handler({'snapshot_job': {'organization_id': 'user1'}}, context) == {'status': 'built'}
+    snapshots.build.assert_called_once_with(mock_dynamodb, 'user1')
+
+
+@patch('lambda_function.profiling.try_start')
+@patch('lambda_function.CognitoAuthenticator')
+@patch('lambda_function.DynamoDBHandler')
+def test_lambda_handler_profile_header_is_admin_only(mock_dynamodb_cls, mock_cognito_cls, mock_start, base_event):
+    mock_cognito = MagicMock()
+    mock_cognito.jwt_decode.return_value = True
+    mock_cognito.get_claims.return_value = {'cognito:groups': ['viewer']}
+    mock_cognito_cls.return_value = mock_cognito
+    mock_dynamodb_cls.return_value.query_by_PK.return_value = []
+
+    base_event['headers']['x-profile'] = 'cpu'
+    lambda_handler(base_event, None)
+    mock_start.assert_not_called()
+
+    mock_cognito.get_claims.return_value = {'cognito:groups': ['admin']}
+    lambda_handler(base_event, None)
+    mock_start.assert_called_once_with('cpu')
+
+
+@patch('lambda_function.CognitoAuthenticator')
+@patch('lambda_function.DynamoDBHandler')
+def test_lambda_handler_invalid_profile_header_is_ignored(mock_dynamodb_cls, mock_cognito_cls, base_event):
+    mock_cognito = MagicMock()
+    mock_cognito.jwt_decode.return_value = True
+    mock_cognito.get_claims.return_value = {'cognito:groups': ['admin']}
+    mock_cognito_cls.return_value = mock_cognito
+    mock_dynamodb_cls.return_value.query_by_PK.return_value = []
+
+    base_event['headers']['x-profile'] = 'everything'
+    assert lambda_handler(base_event, None)['statusCode'] == 200
@@ -0,0 +1,87 @@
+import datetime
+import json
+import logging
+import uuid
+from zoneinfo import ZoneInfo
+
+import clients
+from object_store import ObjectNotFoundError
+
+logger = logging.getLogger(__name__)
+
+# 時間のかかる処理（エクスポートなど）を同じ関数の非同期呼び出し（InvocationType=Event）で実行する
+# Function URL 経由のイベントには body が入るので、ジョブのイベントとは区別できる
+
+def get_lambda_client(region_name=None):
+    return clients.get_client('lambda', region_name)
+
+
+def invoke_async(function_name, event, client=None):
+    client = client if client is not None else get_lambda_client()
+    logger.info(f'Invoking {function_name} asynchronously')
+    client.invoke(FunctionName=function_name, InvocationType='Event', Payload=json.dumps(event).encode())
+
+
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_SUCCEEDED = 'succeeded'
+STATUS_FAILED = 'failed'
+
+
+def _now():
+    return datetime.datetime.now(ZoneInfo('Asia/Tokyo')).strftime('%Y/%m/%d %H:%M:%S')
+
+
+# ジョブの状態は <KIND>s/<organization_id>/<job_id>/status.json に JSON で保存し、クライアントはそれをポーリングする
+class Job:
+    KIND = 'job'
+
+    def __init__(self, store, organization_id, job_id, document):
+        self.store = store
+        self.organization_id = organization_id
+        self.job_id = job_id
+        self.document = document
+
+    @classmethod
+    def create(cls, store, organization_id, **fields):
+        if not organization_id:
+            raise ValueError('organization_id is required')
+        job_id = uuid.uuid4().hex
+        document = {
+            'job_id': job_id,
+            'organization_id': organization_id,
+            'status': STATUS_PENDING,
+            'created_at': _now(),
+        }
+        document.update(fields)
+        job = cls(store, organization_id, job_id, document)
+        job.save_status(STATUS_PENDING)
+        return job
+
+    @classmethod
+    def load(cls, store, organization_id, job_id):
+        try:
+            document = json.loads(store.get_object(cls.key_for(organization_id, job_id, 'status.json')))
+        except ObjectNotFoundError:
+            raise ValueError(f'{cls.KIND.capitalize()} job not found: {job_id}')
+        return cls(store, organization_id, job_id, document)
+
+    @classmethod
+    def key_for(cls, organization_id, job_id, name):
+        return f'{cls.KIND}s/{organization_id}/{job_id}/{name}'
+
+    def key(self, name):
+        return self.key_for(self.organization_id, self.job_id, name)
+
+    @property
+    def status(self):
+        return self.document['status']
+
+    def to_event(self):
+        return {'organization_id': self.organization_id, 'job_id': self.job_id}
+
+    def save_status(self, status, **fields):
+        self.document.update(fields)
+        self.document['status'] = status
+        self.document['updated_at'] = _now()
+        self.store.put_object(self.key('status.json'), json.dumps(self.document).encode(), 'application/json')
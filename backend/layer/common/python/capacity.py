@@ -0,0 +1,96 @@
+import json
+import logging
+import os
+import threading
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# DynamoDB の ReturnConsumedCapacity を集計し、organization_id と action ごとに
+# 1回の呼び出しでどれだけ RCU/WCU を消費したかをログに出力する
+
+ENABLED_ENV_NAME = 'CAPACITY_ACCOUNTING_ENABLED'
+
+READ_OPERATIONS = {'get_item', 'query', 'scan', 'batch_get_item', 'transact_get_items'}
+
+
+def is_enabled():
+    return os.environ.get(ENABLED_ENV_NAME, '').lower() in ('1', 'true', 'yes')
+
+
+class CapacityMeter:
+    def __init__(self, organization_id='', action=''):
+        self.tags = {'organization_id': organization_id, 'action': action}
+        self.operations = {}
+        self.query_pages = []
+        self.lock = threading.Lock()
+
+    def set_tags(self, **tags):
+        with self.lock:
+            self.tags.update(tags)
+
+    def record(self, operation, response, item_count=None):
+        consumed = response.get('ConsumedCapacity') if isinstance(response, dict) else None
+        if consumed is None:
+            consumed = []
+        elif isinstance(consumed, dict):
+            consumed = [consumed]
+
+        rcu = 0.0
+        wcu = 0.0
+        for entry in consumed:
+            # オンデマンドテーブルでは CapacityUnits のみ返る場合があるので操作種別で振り分ける
+            if 'ReadCapacityUnits' in entry or 'WriteCapacityUnits' in entry:
+                rcu += entry.get('ReadCapacityUnits', 0.0)
+                wcu += entry.get('WriteCapacityUnits', 0.0)
+            elif operation in READ_OPERATIONS:
+                rcu += entry.get('CapacityUnits', 0.0)
+            else:
+                wcu += entry.get('CapacityUnits', 0.0)
+
+        if item_count is None and isinstance(response, dict):
+            if 'Count' in response:
+                item_count = response['Count']
+            elif 'Item' in response:
+                item_count = 1
+            elif 'Responses' in response:
+                item_count = sum(len(items) for items in response['Responses'].values())
+            else:
+                item_count = 0
+
+        with self.lock:
+            stats = self.operations.setdefault(operation, {'calls': 0, 'rcu': 0.0, 'wcu': 0.0, 'items': 0})
+            stats['calls'] += 1
+            stats['rcu'] += rcu
+            stats['wcu'] += wcu
+            stats['items'] += item_count or 0
+            if operation == 'query':
+                self.query_pages.append(item_count or 0)
+
+    def total_rcu(self):
+        return sum(stats['rcu'] for stats in self.operations.values())
+
+    def total_wcu(self):
+        return sum(stats['wcu'] for stats in self.operations.values())
+
+    def summary(self):
+        with self.lock:
+            return {
+                **self.tags,
+                'rcu': round(self.total_rcu(), 3),
+                'wcu': round(self.total_wcu(), 3),
+                'operations': {op: dict(stats) for op, stats in self.operations.items()},
+                'query_page_items': list(self.query_pages),
+            }
+
+    def emit(self):
+        summary = self.summary()
+        logger.info(f'consumed capacity: {json.dumps(summary)}')
+
+        tracer = tracing.current()
+        tracer.add_count('ddb.rcu', summary['rcu'])
+        tracer.add_count('ddb.wcu', summary['wcu'])
+        tracer.set_property('organization_id', summary['organization_id'])
+        tracer.set_property('action', summary['action'])
+        return summary
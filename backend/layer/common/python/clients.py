@@ -0,0 +1,43 @@
+import threading
+
+import boto3
+
+# boto3 クライアントをコンテナ内で使い回す
+# クライアントの作成（エンドポイント解決・認証情報の読み込み）は数十ミリ秒かかり、
+# 接続プールもクライアントごとなので、リクエストのたびに作ると TLS 接続からやり直しになる
+
+_clients = {}
+_overrides = {}
+_lock = threading.Lock()
+
+
+def get_client(service_name, region_name=None, endpoint_url=None, config=None):
+    override = _overrides.get(service_name)
+    if override is not None:
+        return override
+    key = (service_name, region_name, endpoint_url, id(config) if config is not None else None)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = boto3.client(service_name, region_name=region_name, endpoint_url=endpoint_url, config=config)
+                _clients[key] = client
+    return client
+
+
+# スナップショットからの復元後など、接続を張り直したいときに使う
+def reset_clients():
+    with _lock:
+        _clients.clear()
+
+
+# ローカル実行・テスト用。リージョンや設定にかかわらず、このサービスには指定したクライアントを返す
+def override_client(service_name, client):
+    with _lock:
+        _overrides[service_name] = client
+
+
+def clear_overrides():
+    with _lock:
+        _overrides.clear()
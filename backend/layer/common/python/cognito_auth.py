@@ -1,9 +1,67 @@
 import json
+import os
+import threading
+import time
 import urllib
 from jose import jwt
+import tracing
 
 STATUS_CODE_UNAUTHORIZED = 401
 
+# JWKS はコンテナ内でキャッシュする（鍵のローテーションに備えて期限を付け、未知の kid が来たら取り直す）
+# 未知の kid での取り直しは JWKS_MIN_REFETCH_SECONDS に1回まで（でたらめな kid のトークンで JWKS を取得させ続けられないように）
+# その間に来た未知の kid のトークンは、キャッシュした JWKS で検証して拒否する
+JWKS_TTL_SECONDS = 3600
+JWKS_MIN_REFETCH_SECONDS = 60
+_jwks_cache = {}
+_jwks_lock = threading.Lock()
+
+
+# COGNITO_JWKS_URL を設定すると Cognito の代わりにその JWKS で検証する（ローカル実行用）
+JWKS_URL_ENV = 'COGNITO_JWKS_URL'
+
+
+def jwks_url(region, user_pool_id):
+    return os.environ.get(JWKS_URL_ENV) or f"https://cognito-idp.{region}.amazonaws.com/{user_pool_id}/.well-known/jwks.json"
+
+
+def fetch_jwks(url, kid=None, ttl_seconds=JWKS_TTL_SECONDS, min_refetch_seconds=JWKS_MIN_REFETCH_SECONDS,
+               clock=time.monotonic):
+    with _jwks_lock:
+        cached = _jwks_cache.get(url)
+    if cached is not None:
+        jwks, fetched_at = cached
+        age = clock() - fetched_at
+        if age < ttl_seconds:
+            known_kids = {key.get('kid') for key in jwks.get('keys', [])}
+            if kid is None or kid in known_kids:
+                return jwks
+            if age < min_refetch_seconds:
+                tracing.current().add_count('auth.jwks_refetch_skipped')
+                return jwks
+    with urllib.request.urlopen(url) as response:
+        jwks = json.loads(response.read())
+    with _jwks_lock:
+        _jwks_cache[url] = (jwks, clock())
+    return jwks
+
+
+# ウォームアップやスナップショット作成前に呼んで、最初のリクエストで取得しなくて済むようにする
+def prefetch_jwks(region, user_pool_id):
+    return fetch_jwks(jwks_url(region, user_pool_id))
+
+
+def clear_jwks_cache():
+    with _jwks_lock:
+        _jwks_cache.clear()
+
+
+def _token_kid(token):
+    try:
+        return jwt.get_unverified_header(token).get('kid')
+    except Exception:
+        return None
+
 class CognitoAuthenticator:
     def __init__(self, region, user_pool_id, app_client_id):
         self.claims = None
@@ -14,35 +72,33 @@ class CognitoAuthenticator:
     def get_claims(self):
         return self.claims
     
-    def get_cognito_jwks(self):
-        url = f"https://cognito-idp.{self.region}.amazonaws.com/{self.user_pool_id}/.well-known/jwks.json"
-        with urllib.request.urlopen(url) as response:
-            return json.loads(response.read())
+    def get_cognito_jwks(self, kid=None):
+        return fetch_jwks(jwks_url(self.region, self.user_pool_id), kid)
 
     def jwt_decode(self, event):
-        jwks = self.get_cognito_jwks()
-
+        tracer = tracing.current()
         # Decode the JWT token
         token = event['headers']['authorization'].split(' ')[1]
+        with tracer.span('auth.jwks'):
+            jwks = self.get_cognito_jwks(_token_kid(token))
+
         decode_success = False
         try:
-            self.claims = jwt.decode(
-                token,
-                jwks,
-                algorithms=['RS256'],
-                audience=self.app_client_id
-            )
+            with tracer.span('auth.verify'):
+                self.claims = jwt.decode(
+                    token,
+                    jwks,
+                    algorithms=['RS256'],
+                    audience=self.app_client_id
+                )
 
             decode_success = True
         except jwt.ExpiredSignatureError:
             print("トークンの有効期限が切れています")
-        except jwt.InvalidAudienceError:
+        except jwt.JWTClaimsError:
             print("クレームが想定と違います")
-        except jwt.InvalidSignatureError:
-            print("署名の検証に失敗しました")
-        except jwt.DecodeError:
-            print("トークンの構造が不正です")
-        except jwt.PyJWTError as e:
-            print(f"その他のJWTエラー: {str(e)}")
+        except jwt.JWTError as e:
+            # python-jose では署名の検証失敗・構造の不正はどちらも JWTError になる
+            print(f"トークンの検証に失敗しました: {str(e)}")
         
         return decode_success
\ No newline at end of file
@@ -0,0 +1,97 @@
+import json
+from decimal import Decimal
+
+# アイテムのリストを列ごとの配列にまとめた JSON（columnar 形式）に変換する
+# フィールド名は1回だけ出力し、値の種類が少ない列（category, storage_area など）は辞書エンコードする
+#
+# {"format": "columnar", "count": 3, "fields": ["category", "name"],
+#  "columns": {"category": {"dictionary": ["ic", "cap"], "codes": [0, 1, 0]},
+#              "name": ["opamp", "10uF", null]}}
+#
+# 値が無いセルは null（辞書エンコードした列では -1）
+
+FORMAT_COLUMNAR = 'columnar'
+# 異なる値の数が件数のこの割合以下なら辞書エンコードする
+DICTIONARY_RATIO = 0.5
+MISSING_CODE = -1
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=_default)
+
+
+class ColumnarEncoder:
+    # ページごとに add() で追加し、iter_chunks() で JSON を少しずつ取り出す
+    # アイテムの dict は保持せず、列ごとの配列だけを持つ
+    def __init__(self, fields=(), dictionary_ratio=DICTIONARY_RATIO):
+        self.fields = list(fields)
+        self.columns = {name: [] for name in self.fields}
+        self.dictionary_ratio = dictionary_ratio
+        self.count = 0
+
+    def add(self, items):
+        if not isinstance(items, list):
+            items = list(items)
+        columns = self.columns
+        # 途中で初めて出てきたフィールドはそれまでの行を欠損として埋める
+        # items は dict でも rows.CompactRow でもよい（どちらも keys() / get() を持つ）
+        for name in sorted(set().union(*(item.keys() for item in items)) - columns.keys()):
+            self.fields.append(name)
+            columns[name] = [None] * self.count
+        for name, values in columns.items():
+            values.extend([item.get(name) for item in items])
+        self.count += len(items)
+        return self
+
+    def _encode_column(self, values):
+        try:
+            distinct = dict.fromkeys(values)
+        except TypeError:
+            return _dumps(values)
+        distinct.pop(None, None)
+        if len(distinct) > self.count * self.dictionary_ratio or not all(isinstance(v, str) for v in distinct):
+            return _dumps(values)
+        index = {value: i for i, value in enumerate(distinct)}
+        codes = [index.get(value, MISSING_CODE) for value in values]
+        return f'{{"dictionary":{_dumps(list(distinct))},"codes":{_dumps(codes)}}}'
+
+    def iter_chunks(self):
+        yield f'{{"format":"{FORMAT_COLUMNAR}","count":{self.count},"fields":{_dumps(self.fields)},"columns":{{'
+        for i, name in enumerate(self.fields):
+            separator = ',' if i > 0 else ''
+            yield f'{separator}{_dumps(name)}:{self._encode_column(self.columns[name])}'
+        yield '}}'
+
+    def encode(self):
+        return ''.join(self.iter_chunks())
+
+
+def encode_columnar(items, fields=(), dictionary_ratio=DICTIONARY_RATIO):
+    return ColumnarEncoder(fields, dictionary_ratio).add(items).encode()
+
+
+# テストやバッチ処理用にアイテムのリストへ戻す
+def decode_columnar(document):
+    if isinstance(document, str):
+        document = json.loads(document)
+    count = document['count']
+    items = [{} for _ in range(count)]
+    for name in document['fields']:
+        column = document['columns'][name]
+        if isinstance(column, dict):
+            dictionary = column['dictionary']
+            values = [None if code == MISSING_CODE else dictionary[code] for code in column['codes']]
+        else:
+            values = column
+        for item, value in zip(items, values):
+            if value is not None:
+                item[name] = value
+    return items
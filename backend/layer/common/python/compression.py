@@ -0,0 +1,156 @@
+import logging
+import os
+import zlib
+
+import tracing
+from schema import Schema
+
+logger = logging.getLogger(__name__)
+
+# 大きな文字列属性（note など）を zlib で圧縮して Binary（B）で保存する
+#
+# スキーマで S の属性のうち、UTF-8 で COMPRESS_MIN_BYTES 以上あり、圧縮して小さくなるものだけを圧縮する
+# 属性名は変えないので、ProjectionExpression はそのまま使える（射影しなかった属性は読まないので展開もしない）
+# 読み取りは DynamoDB 形式のアイテムを dict / CompactRow に変換するときに展開する
+# クエリキャッシュ・スナップショットには圧縮したまま入る（展開は返すときだけ）
+# 短い値で更新すると S に戻る。圧縮する前に書いたアイテムはそのまま読める
+# キー（PK・SK とその構成要素）や GSI のキーは圧縮しない（exclude で渡す）
+#
+# DynamoDB のアイテムの上限は 400KB。書き込む前にサイズを数え、max_item_bytes（既定 380KB）を超えたら
+# ネットワーク呼び出しの前に ValueError にする（圧縮した後のサイズで判定する）
+
+MIN_BYTES_ENV_NAME = 'COMPRESS_MIN_BYTES'
+FIELDS_ENV_NAME = 'COMPRESS_FIELDS'
+MAX_ITEM_BYTES_ENV_NAME = 'MAX_ITEM_BYTES'
+DEFAULT_MIN_BYTES = 1024
+DYNAMODB_MAX_ITEM_BYTES = 400 * 1024
+DEFAULT_MAX_ITEM_BYTES = 380 * 1024
+# 圧縮した値の先頭に付ける（圧縮していない Binary と区別する）
+MAGIC = b'\x00z1'
+
+
+def attribute_size(attr):
+    for attr_type, value in attr.items():
+        if attr_type == 'S':
+            return len(value.encode('utf-8'))
+        if attr_type == 'N':
+            # 有効桁2桁ごとに1バイト + 1バイト（多めに数える）
+            return len(value) // 2 + 2
+        if attr_type == 'B':
+            return len(value)
+        if attr_type in ('BOOL', 'NULL'):
+            return 1
+        if attr_type == 'SS':
+            return sum(len(v.encode('utf-8')) for v in value)
+        if attr_type == 'NS':
+            return sum(len(v) // 2 + 2 for v in value)
+        if attr_type == 'BS':
+            return sum(len(v) for v in value)
+        if attr_type == 'L':
+            return 3 + sum(1 + attribute_size(v) for v in value)
+        if attr_type == 'M':
+            return 3 + sum(1 + len(name.encode('utf-8')) + attribute_size(v) for name, v in value.items())
+    return 0
+
+
+# DynamoDB 形式のアイテムのサイズ（属性名 + 値）
+def item_size(item):
+    return sum(len(name.encode('utf-8')) + attribute_size(attr) for name, attr in item.items())
+
+
+def _check_size(size, max_item_bytes):
+    if size > max_item_bytes:
+        tracing.current().add_count('item_size.rejected')
+        raise ValueError(f'Item too large: {size} bytes (limit {max_item_bytes} bytes)')
+    return size
+
+
+def check_item_size(item, max_item_bytes=DEFAULT_MAX_ITEM_BYTES):
+    return _check_size(item_size(item), max_item_bytes)
+
+
+# UpdateItem は更新後のアイテム全体のサイズが分からないので、キーと書き込む属性（名前 + 値）だけで数える
+def check_update_size(key_item, names, values, max_item_bytes=DEFAULT_MAX_ITEM_BYTES):
+    size = item_size(key_item)
+    size += sum(len(name.encode('utf-8')) for name in names.values())
+    size += sum(attribute_size(attr) for attr in values.values())
+    return _check_size(size, max_item_bytes)
+
+
+def compress_text(value, level=6):
+    return MAGIC + zlib.compress(value.encode('utf-8'), level)
+
+
+def is_compressed(value):
+    return isinstance(value, (bytes, bytearray)) and value[:len(MAGIC)] == MAGIC
+
+
+def decompress_text(value):
+    return zlib.decompress(value[len(MAGIC):]).decode('utf-8')
+
+
+class TextCompressor:
+    def __init__(self, fields, min_bytes=DEFAULT_MIN_BYTES, level=6):
+        self.fields = tuple(fields)
+        self.field_set = frozenset(self.fields)
+        self.min_bytes = min_bytes
+        self.level = level
+
+    # スキーマの S の属性のうち、exclude（キーなど）以外を対象にする。only を渡すとその属性だけにする
+    @classmethod
+    def for_schema(cls, field_types, exclude=(), only=None, **kwargs):
+        fields = [name for name, field_type in Schema.of(field_types).field_types.items()
+                  if field_type == 'S' and name not in exclude and (only is None or name in only)]
+        return cls(fields, **kwargs)
+
+    # 書き込む属性（DynamoDB 形式）を必要なら圧縮して返す
+    def compress_attribute(self, name, attr):
+        value = attr.get('S') if name in self.field_set else None
+        if value is None or len(value) * 4 < self.min_bytes:
+            return attr
+        size = len(value.encode('utf-8'))
+        if size < self.min_bytes:
+            return attr
+        compressed = compress_text(value, self.level)
+        if len(compressed) >= size:
+            return attr
+        tracer = tracing.current()
+        tracer.add_count('compression.compressed')
+        tracer.add_count('compression.saved_bytes', size - len(compressed))
+        return {'B': compressed}
+
+    # 書き込むアイテム（DynamoDB 形式）の属性をその場で圧縮する
+    def compress_item(self, item):
+        for name in self.fields:
+            attr = item.get(name)
+            if attr is not None:
+                item[name] = self.compress_attribute(name, attr)
+        return item
+
+    # 読んだアイテム（DynamoDB 形式）の圧縮された属性を S に戻す
+    # 元のアイテム（キャッシュ・スナップショットのものかもしれない）は変えず、圧縮された属性があるときだけコピーを返す
+    def expand(self, item):
+        expanded = None
+        for name in self.fields:
+            attr = item.get(name)
+            if attr is None or 'B' not in attr or not is_compressed(attr['B']):
+                continue
+            if expanded is None:
+                expanded = dict(item)
+            expanded[name] = {'S': decompress_text(attr['B'])}
+        return item if expanded is None else expanded
+
+
+# COMPRESS_MIN_BYTES を設定すると有効（COMPRESS_FIELDS=note,assign で属性を絞れる）
+def from_env(field_types, exclude=()):
+    min_bytes = os.environ.get(MIN_BYTES_ENV_NAME, '')
+    if min_bytes == '':
+        return None
+    only = [name.strip() for name in os.environ.get(FIELDS_ENV_NAME, '').split(',') if name.strip()] or None
+    compressor = TextCompressor.for_schema(field_types, exclude, only, min_bytes=int(min_bytes))
+    logger.info(f'Compressing text attributes over {compressor.min_bytes} bytes: {list(compressor.fields)}')
+    return compressor
+
+
+def max_item_bytes_from_env():
+    return min(int(os.environ.get(MAX_ITEM_BYTES_ENV_NAME) or DEFAULT_MAX_ITEM_BYTES), DYNAMODB_MAX_ITEM_BYTES)
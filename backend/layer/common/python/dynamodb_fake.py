@@ -0,0 +1,982 @@
+import bisect
+import copy
+import math
+import random
+import re
+import threading
+from collections import Counter
+from decimal import Decimal
+
+from botocore.exceptions import ClientError
+
+# DynamoDB Local を使わずにテスト・ベンチマークするためのインメモリ実装
+# DynamoDBHandler が使う低レベルクライアント API のサブセットのみを実装する
+
+MAX_BATCH_WRITE_ITEMS = 25
+MAX_BATCH_GET_KEYS = 100
+MAX_TRANSACT_ITEMS = 100
+MAX_PAGE_BYTES = 1024 * 1024
+
+THROTTLING_ERROR_CODE = 'ProvisionedThroughputExceededException'
+
+
+def make_client_error(code, message, operation_name, **extra):
+    error_response = {'Error': {'Code': code, 'Message': message}}
+    error_response.update(extra)
+    return ClientError(error_response, operation_name)
+
+
+def _validation_error(message, operation_name):
+    return make_client_error('ValidationException', message, operation_name)
+
+
+# ===== 型付き属性値のユーティリティ =====
+
+def _attr_type(attr):
+    return next(iter(attr))
+
+
+def _comparable(attr):
+    attr_type = _attr_type(attr)
+    value = attr[attr_type]
+    if attr_type == 'N':
+        return Decimal(value)
+    if attr_type == 'B' and isinstance(value, str):
+        return value.encode()
+    return value
+
+
+def _copy_attr(attr):
+    attr_type = _attr_type(attr)
+    if attr_type in ('S', 'N', 'B', 'BOOL', 'NULL'):
+        return {attr_type: attr[attr_type]}
+    return copy.deepcopy(attr)
+
+
+def copy_item(item):
+    return {k: _copy_attr(v) for k, v in item.items()}
+
+
+def _attr_size(attr):
+    attr_type = _attr_type(attr)
+    value = attr[attr_type]
+    if attr_type == 'S':
+        return len(value.encode())
+    if attr_type == 'N':
+        return len(value) // 2 + 2
+    if attr_type == 'B':
+        return len(value)
+    if attr_type in ('BOOL', 'NULL'):
+        return 1
+    if attr_type in ('SS', 'BS'):
+        return sum(len(v.encode() if isinstance(v, str) else v) for v in value)
+    if attr_type == 'NS':
+        return sum(len(v) // 2 + 2 for v in value)
+    if attr_type == 'L':
+        return 3 + sum(_attr_size(v) + 1 for v in value)
+    if attr_type == 'M':
+        return 3 + sum(len(k.encode()) + _attr_size(v) + 1 for k, v in value.items())
+    return 0
+
+
+def item_size(item):
+    return sum(len(k.encode()) + _attr_size(v) for k, v in item.items())
+
+
+def read_units(size, consistent=False):
+    units = max(1, math.ceil(size / 4096))
+    return float(units) if consistent else units / 2
+
+
+def write_units(size):
+    return float(max(1, math.ceil(size / 1024)))
+
+
+# ===== 式パーサ =====
+
+_TOKEN_RE = re.compile(r'\s*(<>|<=|>=|[=<>(),+\-]|[#:]?[A-Za-z0-9_]+)')
+_KEYWORDS = {'AND', 'OR', 'NOT', 'BETWEEN', 'IN', 'SET', 'ADD', 'REMOVE', 'DELETE'}
+_COMPARATORS = {'=', '<>', '<', '<=', '>', '>='}
+
+
+def _tokenize(expression):
+    tokens = []
+    pos = 0
+    expression = expression.strip()
+    while pos < len(expression):
+        match = _TOKEN_RE.match(expression, pos)
+        if not match:
+            raise ValueError(f'Invalid expression near: {expression[pos:]}')
+        tokens.append(match.group(1))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    def __init__(self, expression, names, values):
+        self.tokens = _tokenize(expression)
+        self.pos = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def peek_keyword(self):
+        token = self.peek()
+        return token.upper() if token and token.upper() in _KEYWORDS else None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise ValueError('Unexpected end of expression')
+        self.pos += 1
+        return token
+
+    def expect(self, expected):
+        token = self.next()
+        if token.upper() != expected:
+            raise ValueError(f'Expected {expected} but got {token}')
+
+    def at_end(self):
+        return self.pos >= len(self.tokens)
+
+    def path(self):
+        token = self.next()
+        if token.startswith('#'):
+            if token not in self.names:
+                raise ValueError(f'Undefined attribute name placeholder: {token}')
+            return self.names[token]
+        if token.startswith(':') or token in '(),=<>+-':
+            raise ValueError(f'Expected attribute path but got {token}')
+        return token
+
+    def operand(self):
+        token = self.peek()
+        if token is None:
+            raise ValueError('Unexpected end of expression')
+        if token.startswith(':'):
+            self.next()
+            if token not in self.values:
+                raise ValueError(f'Undefined attribute value placeholder: {token}')
+            return ('value', self.values[token])
+        if token.lower() in ('if_not_exists', 'list_append', 'size'):
+            func = self.next().lower()
+            self.expect('(')
+            args = [self.operand()]
+            while self.peek() == ',':
+                self.next()
+                args.append(self.operand())
+            self.expect(')')
+            return ('func', func, args)
+        return ('path', self.path())
+
+    # ----- 条件式 -----
+
+    def condition(self):
+        node = self.and_condition()
+        while self.peek_keyword() == 'OR':
+            self.next()
+            node = ('or', node, self.and_condition())
+        return node
+
+    def and_condition(self):
+        node = self.not_condition()
+        while self.peek_keyword() == 'AND':
+            self.next()
+            node = ('and', node, self.not_condition())
+        return node
+
+    def not_condition(self):
+        if self.peek_keyword() == 'NOT':
+            self.next()
+            return ('not', self.not_condition())
+        return self.primary_condition()
+
+    def primary_condition(self):
+        token = self.peek()
+        if token == '(':
+            self.next()
+            node = self.condition()
+            self.expect(')')
+            return node
+        if token and token.lower() in ('attribute_exists', 'attribute_not_exists', 'begins_with', 'contains', 'attribute_type'):
+            func = self.next().lower()
+            self.expect('(')
+            args = [self.operand()]
+            while self.peek() == ',':
+                self.next()
+                args.append(self.operand())
+            self.expect(')')
+            return ('call', func, args)
+
+        left = self.operand()
+        keyword = self.peek_keyword()
+        if keyword == 'BETWEEN':
+            self.next()
+            low = self.operand()
+            self.expect('AND')
+            high = self.operand()
+            return ('between', left, low, high)
+        if keyword == 'IN':
+            self.next()
+            self.expect('(')
+            candidates = [self.operand()]
+            while self.peek() == ',':
+                self.next()
+                candidates.append(self.operand())
+            self.expect(')')
+            return ('in', left, candidates)
+        comparator = self.next()
+        if comparator not in _COMPARATORS:
+            raise ValueError(f'Invalid comparator: {comparator}')
+        return ('compare', comparator, left, self.operand())
+
+    def parse_condition(self):
+        node = self.condition()
+        if not self.at_end():
+            raise ValueError(f'Unexpected token: {self.peek()}')
+        return node
+
+    # ----- 更新式 -----
+
+    def parse_update(self):
+        actions = []
+        while not self.at_end():
+            clause = self.next().upper()
+            if clause not in ('SET', 'ADD', 'REMOVE', 'DELETE'):
+                raise ValueError(f'Invalid update clause: {clause}')
+            while True:
+                if clause == 'SET':
+                    path = self.path()
+                    self.expect('=')
+                    value = self.operand()
+                    if self.peek() in ('+', '-'):
+                        op = self.next()
+                        value = ('arith', op, value, self.operand())
+                    actions.append(('SET', path, value))
+                elif clause == 'REMOVE':
+                    actions.append(('REMOVE', self.path(), None))
+                else:
+                    path = self.path()
+                    actions.append((clause, path, self.operand()))
+                if self.peek() != ',':
+                    break
+                self.next()
+        return actions
+
+    def parse_projection(self):
+        paths = [self.path()]
+        while self.peek() == ',':
+            self.next()
+            paths.append(self.path())
+        return paths
+
+
+# ===== 評価 =====
+
+def _resolve(operand, item):
+    kind = operand[0]
+    if kind == 'value':
+        return operand[1]
+    if kind == 'path':
+        return item.get(operand[1])
+    _, func, args = operand
+    if func == 'if_not_exists':
+        current = _resolve(args[0], item)
+        return current if current is not None else _resolve(args[1], item)
+    if func == 'list_append':
+        left = _resolve(args[0], item) or {'L': []}
+        right = _resolve(args[1], item) or {'L': []}
+        return {'L': left['L'] + right['L']}
+    if func == 'size':
+        attr = _resolve(args[0], item)
+        if attr is None:
+            return None
+        attr_type = _attr_type(attr)
+        value = attr[attr_type]
+        size = len(value.encode()) if attr_type == 'S' else len(value)
+        return {'N': str(size)}
+    raise ValueError(f'Unsupported function: {func}')
+
+
+def _compare(comparator, left, right):
+    if left is None or right is None:
+        return False
+    if _attr_type(left) != _attr_type(right):
+        return comparator == '<>'
+    a, b = _comparable(left), _comparable(right)
+    if comparator == '=':
+        return a == b
+    if comparator == '<>':
+        return a != b
+    if comparator == '<':
+        return a < b
+    if comparator == '<=':
+        return a <= b
+    if comparator == '>':
+        return a > b
+    return a >= b
+
+
+def evaluate_condition(node, item):
+    kind = node[0]
+    if kind == 'and':
+        return evaluate_condition(node[1], item) and evaluate_condition(node[2], item)
+    if kind == 'or':
+        return evaluate_condition(node[1], item) or evaluate_condition(node[2], item)
+    if kind == 'not':
+        return not evaluate_condition(node[1], item)
+    if kind == 'compare':
+        return _compare(node[1], _resolve(node[2], item), _resolve(node[3], item))
+    if kind == 'between':
+        value = _resolve(node[1], item)
+        return _compare('>=', value, _resolve(node[2], item)) and _compare('<=', value, _resolve(node[3], item))
+    if kind == 'in':
+        value = _resolve(node[1], item)
+        return any(_compare('=', value, _resolve(c, item)) for c in node[2])
+    _, func, args = node
+    if func == 'attribute_exists':
+        return _resolve(args[0], item) is not None
+    if func == 'attribute_not_exists':
+        return _resolve(args[0], item) is None
+    if func == 'attribute_type':
+        attr = _resolve(args[0], item)
+        return attr is not None and _attr_type(attr) == _resolve(args[1], item)['S']
+    target = _resolve(args[0], item)
+    operand = _resolve(args[1], item)
+    if target is None or operand is None:
+        return False
+    if func == 'begins_with':
+        if _attr_type(target) != _attr_type(operand) or _attr_type(target) not in ('S', 'B'):
+            return False
+        return _comparable(target).startswith(_comparable(operand))
+    # contains
+    target_type = _attr_type(target)
+    if target_type == 'S':
+        return _attr_type(operand) == 'S' and operand['S'] in target['S']
+    if target_type in ('SS', 'NS', 'BS'):
+        return next(iter(operand.values())) in target[target_type]
+    if target_type == 'L':
+        return operand in target['L']
+    return False
+
+
+def _arith(op, left, right):
+    if left is None or right is None or _attr_type(left) != 'N' or _attr_type(right) != 'N':
+        raise ValueError('An operand in the update expression has an incorrect data type')
+    result = Decimal(left['N']) + Decimal(right['N']) if op == '+' else Decimal(left['N']) - Decimal(right['N'])
+    return {'N': _format_number(result)}
+
+
+def _format_number(value):
+    text = format(value.normalize(), 'f')
+    return '0' if text in ('-0', '') else text
+
+
+def apply_update(actions, item):
+    new_item = copy_item(item)
+    for action, path, operand in actions:
+        if action == 'SET':
+            if operand[0] == 'arith':
+                _, op, left, right = operand
+                new_item[path] = _arith(op, _resolve(left, item), _resolve(right, item))
+            else:
+                value = _resolve(operand, item)
+                if value is None:
+                    raise ValueError(f'The provided expression refers to an attribute that does not exist: {path}')
+                new_item[path] = _copy_attr(value)
+        elif action == 'REMOVE':
+            new_item.pop(path, None)
+        elif action == 'ADD':
+            value = _resolve(operand, item)
+            current = new_item.get(path)
+            value_type = _attr_type(value)
+            if value_type == 'N':
+                new_item[path] = _arith('+', current or {'N': '0'}, value)
+            elif value_type in ('SS', 'NS', 'BS'):
+                if current is not None and _attr_type(current) != value_type:
+                    raise ValueError('An operand in the update expression has an incorrect data type')
+                merged = list(current[value_type]) if current else []
+                merged.extend(v for v in value[value_type] if v not in merged)
+                new_item[path] = {value_type: merged}
+            else:
+                raise ValueError('Incorrect operand type for operator or function; operator: ADD')
+        else:
+            value = _resolve(operand, item)
+            current = new_item.get(path)
+            if current is not None:
+                value_type = _attr_type(value)
+                remaining = [v for v in current[value_type] if v not in value[value_type]]
+                if remaining:
+                    new_item[path] = {value_type: remaining}
+                else:
+                    new_item.pop(path)
+    return new_item
+
+
+# ===== テーブル =====
+
+class _Index:
+    def __init__(self, name, pk_name, sk_name, projection):
+        self.name = name
+        self.pk_name = pk_name
+        self.sk_name = sk_name
+        self.projection = projection
+
+    def project(self, item, table):
+        if self.projection['ProjectionType'] == 'ALL':
+            return copy_item(item)
+        keep = {table.pk_name, self.pk_name}
+        if table.sk_name:
+            keep.add(table.sk_name)
+        if self.sk_name:
+            keep.add(self.sk_name)
+        keep.update(self.projection.get('NonKeyAttributes', []))
+        return {k: _copy_attr(v) for k, v in item.items() if k in keep}
+
+
+class _Table:
+    def __init__(self, name, pk_name, sk_name='', indexes=None):
+        self.name = name
+        self.pk_name = pk_name
+        self.sk_name = sk_name
+        self.indexes = indexes or {}
+        # partition key値 -> {sort key値: item}
+        self.partitions = {}
+        self.sorted_keys = {}
+
+    def key_of(self, item, operation_name):
+        try:
+            pk = _comparable(item[self.pk_name])
+            sk = _comparable(item[self.sk_name]) if self.sk_name else None
+        except KeyError:
+            raise _validation_error('The provided key element does not match the schema', operation_name)
+        return pk, sk
+
+    def key_item(self, item):
+        key = {self.pk_name: _copy_attr(item[self.pk_name])}
+        if self.sk_name:
+            key[self.sk_name] = _copy_attr(item[self.sk_name])
+        return key
+
+    def get(self, key):
+        pk, sk = key
+        return self.partitions.get(pk, {}).get(sk)
+
+    def put(self, key, item):
+        pk, sk = key
+        partition = self.partitions.setdefault(pk, {})
+        if sk not in partition:
+            self.sorted_keys.pop(pk, None)
+        partition[sk] = item
+
+    def delete(self, key):
+        pk, sk = key
+        partition = self.partitions.get(pk)
+        if partition is not None and sk in partition:
+            del partition[sk]
+            self.sorted_keys.pop(pk, None)
+            if not partition:
+                del self.partitions[pk]
+
+    def sorted_partition(self, pk):
+        keys = self.sorted_keys.get(pk)
+        if keys is None:
+            keys = sorted(self.partitions.get(pk, {}), key=lambda k: (k is not None, k))
+            self.sorted_keys[pk] = keys
+        return keys
+
+    def item_count(self):
+        return sum(len(p) for p in self.partitions.values())
+
+
+class FakeDynamoDBClient:
+    def __init__(self, unprocessed_ratio=0.0, throttle_every=0, page_size_bytes=MAX_PAGE_BYTES, seed=0):
+        # unprocessed_ratio: batch_write_item で UnprocessedItems として返す割合
+        # throttle_every: N回に1回 batch_write_item をスロットリングさせる（0で無効）
+        self.unprocessed_ratio = unprocessed_ratio
+        self.throttle_every = throttle_every
+        self.page_size_bytes = page_size_bytes
+        self.random = random.Random(seed)
+        self.tables = {}
+        self.call_counts = Counter()
+        self.injected_errors = {}
+        self.lock = threading.RLock()
+
+    # ----- テスト用ヘルパー -----
+
+    def create_table(self, TableName, KeySchema, AttributeDefinitions=None, GlobalSecondaryIndexes=None, **kwargs):
+        pk_name, sk_name = self._parse_key_schema(KeySchema)
+        indexes = {}
+        for index in GlobalSecondaryIndexes or []:
+            index_pk, index_sk = self._parse_key_schema(index['KeySchema'])
+            indexes[index['IndexName']] = _Index(
+                index['IndexName'], index_pk, index_sk, index.get('Projection', {'ProjectionType': 'ALL'})
+            )
+        with self.lock:
+            self.tables[TableName] = _Table(TableName, pk_name, sk_name, indexes)
+        return {'TableDescription': self._describe(self.tables[TableName])}
+
+    def add_table(self, table_name, pk_name, sk_name=''):
+        key_schema = [{'AttributeName': pk_name, 'KeyType': 'HASH'}]
+        if sk_name:
+            key_schema.append({'AttributeName': sk_name, 'KeyType': 'RANGE'})
+        self.create_table(TableName=table_name, KeySchema=key_schema)
+
+    def inject_error(self, operation_name, code=THROTTLING_ERROR_CODE, times=1):
+        with self.lock:
+            self.injected_errors.setdefault(operation_name, []).extend([code] * times)
+
+    def reset_call_counts(self):
+        with self.lock:
+            self.call_counts.clear()
+
+    def _parse_key_schema(self, key_schema):
+        pk_name = next(k['AttributeName'] for k in key_schema if k['KeyType'] == 'HASH')
+        sk_name = next((k['AttributeName'] for k in key_schema if k['KeyType'] == 'RANGE'), '')
+        return pk_name, sk_name
+
+    def _describe(self, table):
+        key_schema = [{'AttributeName': table.pk_name, 'KeyType': 'HASH'}]
+        if table.sk_name:
+            key_schema.append({'AttributeName': table.sk_name, 'KeyType': 'RANGE'})
+        return {
+            'TableName': table.name,
+            'TableStatus': 'ACTIVE',
+            'KeySchema': key_schema,
+            'ItemCount': table.item_count(),
+            'GlobalSecondaryIndexes': [{'IndexName': name} for name in table.indexes],
+        }
+
+    def _begin(self, operation_name):
+        self.call_counts[operation_name] += 1
+        errors = self.injected_errors.get(operation_name)
+        if errors:
+            code = errors.pop(0)
+            raise make_client_error(code, f'Injected {code}', operation_name)
+
+    def _table(self, table_name, operation_name):
+        table = self.tables.get(table_name)
+        if table is None:
+            raise make_client_error('ResourceNotFoundException', f'Requested resource not found: {table_name}', operation_name)
+        return table
+
+    def _check_condition(self, expression, names, values, item, operation_name):
+        if not expression:
+            return True
+        try:
+            node = _Parser(expression, names, values).parse_condition()
+        except ValueError as e:
+            raise _validation_error(str(e), operation_name)
+        return evaluate_condition(node, item or {})
+
+    def _with_capacity(self, response, params, table_name, read=0.0, write=0.0):
+        if params.get('ReturnConsumedCapacity') not in ('TOTAL', 'INDEXES'):
+            return response
+        response['ConsumedCapacity'] = {
+            'TableName': table_name,
+            'CapacityUnits': read + write,
+            'ReadCapacityUnits': read,
+            'WriteCapacityUnits': write,
+        }
+        return response
+
+    def _project(self, item, projection_expression, names):
+        if not projection_expression:
+            return copy_item(item)
+        paths = _Parser(projection_expression, names, {}).parse_projection()
+        return {p: _copy_attr(item[p]) for p in paths if p in item}
+
+    # ----- 単一アイテム操作 -----
+
+    def describe_table(self, TableName, **kwargs):
+        with self.lock:
+            self._begin('DescribeTable')
+            return {'Table': self._describe(self._table(TableName, 'DescribeTable'))}
+
+    # ReturnValuesOnConditionCheckFailure='ALL_OLD' なら、条件に合わなかった既存のアイテムをエラーの Item に入れる
+    def _condition_failed(self, old_item, kwargs, operation_name):
+        extra = {}
+        if kwargs.get('ReturnValuesOnConditionCheckFailure') == 'ALL_OLD' and old_item is not None:
+            extra['Item'] = copy_item(old_item)
+        return make_client_error('ConditionalCheckFailedException', 'The conditional request failed', operation_name, **extra)
+
+    def put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, ReturnValues='NONE', **kwargs):
+        with self.lock:
+            self._begin('PutItem')
+            table = self._table(TableName, 'PutItem')
+            key = table.key_of(Item, 'PutItem')
+            old_item = table.get(key)
+            if not self._check_condition(ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues, old_item, 'PutItem'):
+                raise self._condition_failed(old_item, kwargs, 'PutItem')
+            table.put(key, copy_item(Item))
+            response = {}
+            if ReturnValues == 'ALL_OLD' and old_item is not None:
+                response['Attributes'] = copy_item(old_item)
+            size = max(item_size(Item), item_size(old_item) if old_item else 0)
+            return self._with_capacity(response, kwargs, TableName, write=write_units(size))
+
+    def get_item(self, TableName, Key, ProjectionExpression=None, ExpressionAttributeNames=None, ConsistentRead=False, **kwargs):
+        with self.lock:
+            self._begin('GetItem')
+            table = self._table(TableName, 'GetItem')
+            item = table.get(table.key_of(Key, 'GetItem'))
+            units = read_units(item_size(item) if item else 0, ConsistentRead)
+            if item is None:
+                return self._with_capacity({}, kwargs, TableName, read=units)
+            response = {'Item': self._project(item, ProjectionExpression, ExpressionAttributeNames)}
+            return self._with_capacity(response, kwargs, TableName, read=units)
+
+    def update_item(self, TableName, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues='NONE', **kwargs):
+        with self.lock:
+            self._begin('UpdateItem')
+            table = self._table(TableName, 'UpdateItem')
+            key = table.key_of(Key, 'UpdateItem')
+            old_item = table.get(key)
+            if not self._check_condition(ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues, old_item, 'UpdateItem'):
+                raise self._condition_failed(old_item, kwargs, 'UpdateItem')
+            new_item, updated_paths = self._apply_update(
+                table, Key, old_item, UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues, 'UpdateItem'
+            )
+            table.put(key, new_item)
+            response = self._return_values(ReturnValues, old_item, new_item, updated_paths)
+            size = max(item_size(new_item), item_size(old_item) if old_item else 0)
+            return self._with_capacity(response, kwargs, TableName, write=write_units(size))
+
+    def _apply_update(self, table, key, old_item, expression, names, values, operation_name):
+        try:
+            actions = _Parser(expression, names, values).parse_update()
+            for _, path, _ in actions:
+                if path in (table.pk_name, table.sk_name):
+                    raise ValueError(f'Cannot update attribute {path}. This attribute is part of the key')
+            base = old_item if old_item is not None else table.key_item(key)
+            return apply_update(actions, base), [path for _, path, _ in actions]
+        except ValueError as e:
+            raise _validation_error(str(e), operation_name)
+
+    def _return_values(self, return_values, old_item, new_item, updated_paths):
+        if return_values == 'ALL_NEW':
+            return {'Attributes': copy_item(new_item)}
+        if return_values == 'ALL_OLD':
+            return {'Attributes': copy_item(old_item)} if old_item else {}
+        if return_values in ('UPDATED_NEW', 'UPDATED_OLD'):
+            source = new_item if return_values == 'UPDATED_NEW' else (old_item or {})
+            updated = {p: _copy_attr(source[p]) for p in updated_paths if p in source}
+            return {'Attributes': updated} if updated else {}
+        return {}
+
+    def delete_item(self, TableName, Key, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues='NONE', **kwargs):
+        with self.lock:
+            self._begin('DeleteItem')
+            table = self._table(TableName, 'DeleteItem')
+            key = table.key_of(Key, 'DeleteItem')
+            old_item = table.get(key)
+            if not self._check_condition(ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues, old_item, 'DeleteItem'):
+                raise self._condition_failed(old_item, kwargs, 'DeleteItem')
+            table.delete(key)
+            response = {}
+            if ReturnValues == 'ALL_OLD' and old_item is not None:
+                response['Attributes'] = copy_item(old_item)
+            units = write_units(item_size(old_item) if old_item else 0)
+            return self._with_capacity(response, kwargs, TableName, write=units)
+
+    # ----- クエリ -----
+
+    def query(self, TableName, KeyConditionExpression, ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+              IndexName=None, Limit=None, ExclusiveStartKey=None, ScanIndexForward=True, FilterExpression=None,
+              ProjectionExpression=None, Select=None, ConsistentRead=False, **kwargs):
+        with self.lock:
+            self._begin('Query')
+            table = self._table(TableName, 'Query')
+            try:
+                parser = _Parser(KeyConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+                key_condition = parser.parse_condition()
+                filter_node = None
+                if FilterExpression:
+                    filter_node = _Parser(FilterExpression, ExpressionAttributeNames, ExpressionAttributeValues).parse_condition()
+            except ValueError as e:
+                raise _validation_error(str(e), 'Query')
+
+            if IndexName:
+                if IndexName not in table.indexes:
+                    raise _validation_error(f'The table does not have the specified index: {IndexName}', 'Query')
+                index = table.indexes[IndexName]
+                pk_name, sk_name = index.pk_name, index.sk_name
+            else:
+                index = None
+                pk_name, sk_name = table.pk_name, table.sk_name
+
+            pk_value = self._find_partition_value(key_condition, pk_name)
+            if pk_value is None:
+                raise _validation_error('Query condition missed key schema element', 'Query')
+
+            candidates = self._query_candidates(table, index, pk_value, sk_name)
+            start = 0
+            if ExclusiveStartKey:
+                # DynamoDB と同じく、ExclusiveStartKey のアイテムが消えていてもその並び位置の次から続ける
+                start_order = self._position_order(index, self._exclusive_start_position(table, index, ExclusiveStartKey, sk_name))
+                orders = [self._position_order(index, position) for position, _ in candidates]
+                if ScanIndexForward:
+                    start = bisect.bisect_right(orders, start_order)
+                else:
+                    start = len(candidates) - bisect.bisect_left(orders, start_order)
+            if not ScanIndexForward:
+                candidates.reverse()
+
+            items = []
+            scanned = 0
+            size = 0
+            last_key = None
+            remaining = candidates[start:]
+            for i, (position, item) in enumerate(remaining):
+                if not evaluate_condition(key_condition, item):
+                    continue
+                scanned += 1
+                size += item_size(item)
+                if filter_node is None or evaluate_condition(filter_node, item):
+                    projected = index.project(item, table) if index else item
+                    items.append(self._project(projected, ProjectionExpression, ExpressionAttributeNames))
+                if (Limit and scanned >= Limit) or size >= self.page_size_bytes:
+                    if i + 1 < len(remaining):
+                        last_key = self._last_evaluated_key(table, index, item)
+                    break
+
+            response = {'Count': len(items), 'ScannedCount': scanned}
+            if Select != 'COUNT':
+                response['Items'] = items
+            if last_key is not None:
+                response['LastEvaluatedKey'] = last_key
+            return self._with_capacity(response, kwargs, TableName, read=read_units(size, ConsistentRead))
+
+    def _find_partition_value(self, node, pk_name):
+        if node[0] == 'and':
+            return self._find_partition_value(node[1], pk_name) or self._find_partition_value(node[2], pk_name)
+        if node[0] == 'compare' and node[1] == '=':
+            left, right = node[2], node[3]
+            if left[0] == 'path' and left[1] == pk_name and right[0] == 'value':
+                return right[1]
+            if right[0] == 'path' and right[1] == pk_name and left[0] == 'value':
+                return left[1]
+        return None
+
+    def _query_candidates(self, table, index, pk_value, sk_name):
+        pk = _comparable(pk_value)
+        if index is None:
+            partition = table.partitions.get(pk, {})
+            return [(sk, partition[sk]) for sk in table.sorted_partition(pk)]
+        # GSI はスパースインデックス（キー属性を持たないアイテムは含まれない）
+        matches = []
+        for partition in table.partitions.values():
+            for item in partition.values():
+                index_pk = item.get(index.pk_name)
+                if index_pk is None or _comparable(index_pk) != pk:
+                    continue
+                if index.sk_name and index.sk_name not in item:
+                    continue
+                position = (
+                    _comparable(item[index.sk_name]) if index.sk_name else None,
+                    table.key_of(item, 'Query'),
+                )
+                matches.append((position, item))
+        matches.sort(key=lambda m: self._position_order(index, m[0]))
+        return matches
+
+    # _query_candidates の並び順の比較キー
+    def _position_order(self, index, position):
+        if index is None:
+            return (position is not None, position)
+        index_sk, (pk, sk) = position
+        return (index_sk is not None, index_sk, pk, sk is not None, sk)
+
+    def _exclusive_start_position(self, table, index, start_key, sk_name):
+        if index is None:
+            return _comparable(start_key[sk_name]) if sk_name else None
+        index_sk = _comparable(start_key[index.sk_name]) if index.sk_name else None
+        return (index_sk, table.key_of(start_key, 'Query'))
+
+    def _last_evaluated_key(self, table, index, item):
+        key = table.key_item(item)
+        if index is not None:
+            key[index.pk_name] = _copy_attr(item[index.pk_name])
+            if index.sk_name:
+                key[index.sk_name] = _copy_attr(item[index.sk_name])
+        return key
+
+    def scan(self, TableName, Limit=None, ExclusiveStartKey=None, FilterExpression=None, ExpressionAttributeNames=None,
+             ExpressionAttributeValues=None, ProjectionExpression=None, **kwargs):
+        with self.lock:
+            self._begin('Scan')
+            table = self._table(TableName, 'Scan')
+            filter_node = None
+            if FilterExpression:
+                try:
+                    filter_node = _Parser(FilterExpression, ExpressionAttributeNames, ExpressionAttributeValues).parse_condition()
+                except ValueError as e:
+                    raise _validation_error(str(e), 'Scan')
+
+            ordered = []
+            for pk in sorted(table.partitions):
+                for sk in table.sorted_partition(pk):
+                    ordered.append(((pk, sk), table.partitions[pk][sk]))
+
+            start = 0
+            if ExclusiveStartKey:
+                # ExclusiveStartKey のアイテムが消えていてもその並び位置の次から続ける
+                pk, sk = table.key_of(ExclusiveStartKey, 'Scan')
+                orders = [(key_pk, key_sk is not None, key_sk) for (key_pk, key_sk), _ in ordered]
+                start = bisect.bisect_right(orders, (pk, sk is not None, sk))
+
+            items = []
+            scanned = 0
+            size = 0
+            last_key = None
+            for key, item in ordered[start:]:
+                scanned += 1
+                size += item_size(item)
+                if filter_node is None or evaluate_condition(filter_node, item):
+                    items.append(self._project(item, ProjectionExpression, ExpressionAttributeNames))
+                if Limit and scanned >= Limit and start + scanned < len(ordered):
+                    last_key = table.key_item(item)
+                    break
+
+            response = {'Items': items, 'Count': len(items), 'ScannedCount': scanned}
+            if last_key is not None:
+                response['LastEvaluatedKey'] = last_key
+            return self._with_capacity(response, kwargs, TableName, read=read_units(size))
+
+    # ----- バッチ操作 -----
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        with self.lock:
+            self._begin('BatchWriteItem')
+            total = sum(len(requests) for requests in RequestItems.values())
+            if total > MAX_BATCH_WRITE_ITEMS:
+                raise _validation_error('Too many items requested for the BatchWriteItem call', 'BatchWriteItem')
+            if self.throttle_every and self.call_counts['BatchWriteItem'] % self.throttle_every == 0:
+                raise make_client_error(THROTTLING_ERROR_CODE, 'The level of configured provisioned throughput for the table was exceeded', 'BatchWriteItem')
+
+            unprocessed = {}
+            consumed = []
+            for table_name, requests in RequestItems.items():
+                table = self._table(table_name, 'BatchWriteItem')
+                units = 0.0
+                for request in requests:
+                    if self.unprocessed_ratio and self.random.random() < self.unprocessed_ratio:
+                        unprocessed.setdefault(table_name, []).append(copy.deepcopy(request))
+                        continue
+                    if 'PutRequest' in request:
+                        item = request['PutRequest']['Item']
+                        table.put(table.key_of(item, 'BatchWriteItem'), copy_item(item))
+                        units += write_units(item_size(item))
+                    elif 'DeleteRequest' in request:
+                        key = table.key_of(request['DeleteRequest']['Key'], 'BatchWriteItem')
+                        old_item = table.get(key)
+                        table.delete(key)
+                        units += write_units(item_size(old_item) if old_item else 0)
+                    else:
+                        raise _validation_error('Invalid write request', 'BatchWriteItem')
+                consumed.append({'TableName': table_name, 'CapacityUnits': units, 'WriteCapacityUnits': units})
+            response = {'UnprocessedItems': unprocessed}
+            if kwargs.get('ReturnConsumedCapacity') in ('TOTAL', 'INDEXES'):
+                response['ConsumedCapacity'] = consumed
+            return response
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        with self.lock:
+            self._begin('BatchGetItem')
+            total = sum(len(request['Keys']) for request in RequestItems.values())
+            if total > MAX_BATCH_GET_KEYS:
+                raise _validation_error('Too many items requested for the BatchGetItem call', 'BatchGetItem')
+
+            responses = {}
+            consumed = []
+            for table_name, request in RequestItems.items():
+                table = self._table(table_name, 'BatchGetItem')
+                found = responses.setdefault(table_name, [])
+                units = 0.0
+                for key in request['Keys']:
+                    item = table.get(table.key_of(key, 'BatchGetItem'))
+                    units += read_units(item_size(item) if item else 0, request.get('ConsistentRead', False))
+                    if item is not None:
+                        found.append(self._project(item, request.get('ProjectionExpression'), request.get('ExpressionAttributeNames')))
+                consumed.append({'TableName': table_name, 'CapacityUnits': units, 'ReadCapacityUnits': units})
+            response = {'Responses': responses, 'UnprocessedKeys': {}}
+            if kwargs.get('ReturnConsumedCapacity') in ('TOTAL', 'INDEXES'):
+                response['ConsumedCapacity'] = consumed
+            return response
+
+    def transact_write_items(self, TransactItems, **kwargs):
+        with self.lock:
+            self._begin('TransactWriteItems')
+            if len(TransactItems) > MAX_TRANSACT_ITEMS:
+                raise _validation_error('Member must have length less than or equal to 100', 'TransactWriteItems')
+
+            # 全ての条件を先に評価し、1つでも失敗したら何も書き込まない
+            planned = []
+            reasons = []
+            failed = False
+            seen_keys = set()
+            for transact_item in TransactItems:
+                operation, params = next(iter(transact_item.items()))
+                table = self._table(params['TableName'], 'TransactWriteItems')
+                key_source = params['Item'] if operation == 'Put' else params['Key']
+                key = table.key_of(key_source, 'TransactWriteItems')
+                if (table.name, key) in seen_keys:
+                    raise _validation_error('Transaction request cannot include multiple operations on one item', 'TransactWriteItems')
+                seen_keys.add((table.name, key))
+
+                old_item = table.get(key)
+                passed = self._check_condition(
+                    params.get('ConditionExpression'), params.get('ExpressionAttributeNames'),
+                    params.get('ExpressionAttributeValues'), old_item, 'TransactWriteItems'
+                )
+                if passed:
+                    reasons.append({'Code': 'None'})
+                    planned.append((operation, table, key, old_item, params))
+                else:
+                    failed = True
+                    reasons.append({'Code': 'ConditionalCheckFailed', 'Message': 'The conditional request failed'})
+
+            if failed:
+                codes = ', '.join(r['Code'] for r in reasons)
+                raise make_client_error(
+                    'TransactionCanceledException',
+                    f'Transaction cancelled, please refer cancellation reasons for specific reasons [{codes}]',
+                    'TransactWriteItems',
+                    CancellationReasons=reasons,
+                )
+
+            new_items = []
+            for operation, table, key, old_item, params in planned:
+                if operation == 'Update':
+                    new_item, _ = self._apply_update(
+                        table, params['Key'], old_item, params['UpdateExpression'],
+                        params.get('ExpressionAttributeNames'), params.get('ExpressionAttributeValues'), 'TransactWriteItems'
+                    )
+                    new_items.append((table, key, new_item))
+                elif operation == 'Put':
+                    new_items.append((table, key, copy_item(params['Item'])))
+                elif operation == 'Delete':
+                    new_items.append((table, key, None))
+
+            # トランザクション書き込みは通常の2倍の WCU を消費する
+            consumed = {}
+            for table, key, item in new_items:
+                old_item = table.get(key)
+                size = max(item_size(item) if item else 0, item_size(old_item) if old_item else 0)
+                consumed[table.name] = consumed.get(table.name, 0.0) + write_units(size) * 2
+                if item is None:
+                    table.delete(key)
+                else:
+                    table.put(key, item)
+            response = {}
+            if kwargs.get('ReturnConsumedCapacity') in ('TOTAL', 'INDEXES'):
+                response['ConsumedCapacity'] = [
+                    {'TableName': name, 'CapacityUnits': units, 'WriteCapacityUnits': units}
+                    for name, units in consumed.items()
+                ]
+            return response
@@ -1,16 +1,49 @@
-import boto3
-from boto3.dynamodb.types import TypeDeserializer
+from botocore.config import Config
 import datetime
+from decimal import Decimal, InvalidOperation
 import uuid
 import logging
 import json
+from concurrent.futures import ThreadPoolExecutor
 from zoneinfo import ZoneInfo
+import tracing
+import sharding
+import clients
+import compression
+from serialization import deserialize_item
+from schema import UPDATED_AT, Schema
+from rows import CompactRow
+from resilience import ResilientCaller, ThrottlingError, error_code, wrap_error
 
 logger = logging.getLogger(__name__)
 
+# リトライは ResilientCaller で行うので botocore のリトライは無効にする
+CLIENT_CONFIG = Config(retries={'total_max_attempts': 1, 'mode': 'standard'})
+
+# シャードへの並列クエリ用。ウォームなコンテナでは使い回す
+MAX_SHARD_WORKERS = 16
+_shard_executor = None
+
+
+def parse_number(value, name):
+    try:
+        number = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError(f'Invalid value for {name}: expected number')
+    if not number.is_finite():
+        raise ValueError(f'Invalid value for {name}: expected number')
+    return number
+
+
+def get_shard_executor():
+    global _shard_executor
+    if _shard_executor is None:
+        _shard_executor = ThreadPoolExecutor(max_workers=MAX_SHARD_WORKERS)
+    return _shard_executor
+
 
 class DynamoDBHandler:
-    def __init__(self, region_name, table_name, pk_name, sk_name, sk_prefix, sk_suffix, sk_delimiter, field_types, is_local=False):
+    def __init__(self, region_name, table_name, pk_name, sk_name, sk_prefix, sk_suffix, sk_delimiter, field_types, is_local=False, client=None, capacity_meter=None, resilience=None, sharding_policy=None, compact_rows=False, query_cache=None, low_stock=None, snapshots=None, compressor=None, max_item_bytes=compression.DEFAULT_MAX_ITEM_BYTES):
         self.region_name = region_name
         self.table_name = table_name
         self.pk_name = pk_name
@@ -18,12 +51,49 @@ class DynamoDBHandler:
         self.sk_prefix = sk_prefix
         self.sk_suffix = sk_suffix
         self.sk_delimiter = sk_delimiter
-        self.field_types = field_types
+        # field_types は dict でも Schema でもよい（lambda からはコンテナで共有する Schema を渡す）
+        self.schema = Schema.of(field_types)
+        self.field_types = self.schema.field_types
         self.is_local = is_local
-        if is_local:
-            self.dynamodb = boto3.client('dynamodb', endpoint_url='http://localhost:8000', region_name=self.region_name)
+        self.capacity_meter = capacity_meter
+        self.resilience = resilience if resilience is not None else ResilientCaller.for_table(table_name)
+        # シャーディングは SK が '<prefix><delimiter><item_id>' のテーブルでのみ使える
+        self.sharding_policy = sharding_policy or sharding.NO_SHARDING
+        if self.sharding_policy.shards_any() and (sk_name == '' or sk_delimiter == ''):
+            raise ValueError('Sharding requires a sort key with a delimiter')
+        # compact_rows=True のときはクエリ結果を dict ではなく rows.CompactRow で返す（読み取り専用）
+        self.row_type = None
+        if compact_rows:
+            self.row_type = self.schema.row_type([pk_name, sk_name, sk_suffix, sk_prefix])
+        # query_cache (query_cache.QueryCache) を渡すとクエリ結果をキャッシュし、書き込みのたびに PK 単位で無効化する
+        self.query_cache = query_cache
+        # low_stock (low_stock.LowStockIndex) を渡すと、発注点以下のアイテムにスパースな GSI のキーを書く
+        self.low_stock = low_stock
+        # snapshots (snapshot.InventorySnapshots) を渡すと、PK 全体のクエリをスナップショットと書き込みの差分から返す
+        # 使えなかった（作り直しが必要な）PK は stale_snapshots に入る（呼び出し元が非同期で作り直す）
+        self.snapshots = snapshots
+        self.stale_snapshots = set()
+        # compressor (compression.TextCompressor) を渡すと、大きな文字列属性を圧縮して B で書き、読むときに戻す
+        self.compressor = compressor
+        # 書き込むアイテムがこれを超えたら DynamoDB を呼ばずに ValueError にする（上限 400KB の手前）
+        self.max_item_bytes = max_item_bytes
+        # client を渡した場合はそれを使う（テスト用のFakeDynamoDBClientなど）
+        if client is not None:
+            self.dynamodb = client
+        elif is_local:
+            self.dynamodb = clients.get_client('dynamodb', self.region_name, endpoint_url='http://localhost:8000', config=CLIENT_CONFIG)
         else:
-            self.dynamodb = boto3.client('dynamodb', region_name=self.region_name)
+            self.dynamodb = clients.get_client('dynamodb', self.region_name, config=CLIENT_CONFIG)
+
+
+    # 全てのDynamoDB呼び出しはここを通す
+    def _call(self, operation, **params):
+        if self.capacity_meter is not None:
+            params['ReturnConsumedCapacity'] = 'TOTAL'
+        response = self.resilience.call(getattr(self.dynamodb, operation), **params)
+        if self.capacity_meter is not None:
+            self.capacity_meter.record(operation, response)
+        return response
 
 
     def create_sk_value(self, pk_prefix, pk_suffix):
@@ -38,13 +108,29 @@ class DynamoDBHandler:
             raise ValueError(f'Invalid SK value: {sk_value}')
 
 
+    # 論理的な PK の値とアイテムの item_id から、実際に保存する PK の値を求める
+    def physical_pk(self, pk_val, item_id):
+        shard_count = self.sharding_policy.shard_count(pk_val)
+        return sharding.physical_pk(pk_val, sharding.shard_of(item_id, shard_count), shard_count)
+
+
+    def physical_pk_for_sk(self, pk_val, sk_val):
+        if not self.sharding_policy.is_sharded(pk_val):
+            return pk_val
+        _, item_id = self.parse_sk_value(sk_val)
+        return self.physical_pk(pk_val, item_id)
+
+
     def get_current_timestamp(self):
         jst_tz = ZoneInfo('Asia/Tokyo')
         now_jst = datetime.datetime.now(jst_tz)
         return now_jst.strftime('%Y/%m/%d %H:%M:%S')
 
     
-    def put_item(self, request_item):
+    # 書き込み用のアイテム（DynamoDB 形式）を組み立てる。request_item にはキーとタイムスタンプを追記する
+    # item_id を渡すとそれを使う（インポートの再実行で同じキーになるようにするため）
+    def build_item(self, request_item, item_id=None):
+        self.schema.validate(request_item)
         try:
             timestamp = self.get_current_timestamp()
             request_item['created_at'] = timestamp
@@ -56,28 +142,45 @@ class DynamoDBHandler:
             }
             if self.sk_name != '':
                 if self.sk_delimiter != '':
-                    item_id = str(uuid.uuid4())
+                    item_id = item_id or str(uuid.uuid4())
                     sk_value = self.create_sk_value(request_item[self.sk_prefix], item_id)
                     item[self.sk_name] = {'S': sk_value}
                     item[self.sk_suffix] = {'S': item_id}
                     request_item[self.sk_name] = sk_value
                     request_item[self.sk_suffix] = item_id
                 else:
-                    item[self.sk_name] = {self.field_types[self.sk_name]: request_item[self.sk_name]}            
-
-            for key, value in self.field_types.items():
-                if key in request_item:
-                    item[key] = {value: request_item[key]}
+                    item[self.sk_name] = self.schema.serialize_value(self.sk_name, request_item[self.sk_name])
+
+            item.update(self.schema.serialize_item(request_item))
+            pk_val = request_item.get(self.pk_name)
+            if pk_val is not None and self.sharding_policy.is_sharded(pk_val):
+                item[self.pk_name] = {'S': self.physical_pk(pk_val, item_id)}
+            if self.low_stock is not None and pk_val is not None and self.low_stock.is_low(request_item):
+                item[self.low_stock.flag_name] = {'S': pk_val}
+                request_item[self.low_stock.flag_name] = pk_val
         except KeyError as e:
             raise KeyError(f'KeyError in put_item: {e}')
+        if self.compressor is not None:
+            self.compressor.compress_item(item)
+        compression.check_item_size(item, self.max_item_bytes)
+        return item
+
+
+    def put_item(self, request_item, item_id=None):
+        item = self.build_item(request_item, item_id)
+        self.record_changes(request_item.get(self.pk_name), [request_item.get(self.sk_name)])
 
         try:
             logger.info(f'putting item: {item}')
-            self.dynamodb.put_item(TableName=self.table_name, Item=item)
+            with tracing.span('ddb.put'):
+                self._call('put_item', TableName=self.table_name, Item=item)
+            self.invalidate_cache(request_item.get(self.pk_name))
+            if self.low_stock is not None and self.low_stock.flag_name in request_item:
+                self.low_stock.alert(self.pk_name, self.sk_name, request_item)
             logger.info('Successfully put item')
             return [request_item]
         except Exception as e:
-            raise Exception(f'Failed to put item: {e}')
+            raise wrap_error(e, 'Failed to put item')
 
 
     
@@ -89,25 +192,12 @@ class DynamoDBHandler:
         except KeyError:
             raise KeyError(f'KeyError in update_item: pk:{self.pk_name}, sk:{self.sk_name}')
 
+        # クライアントが読んだアイテムをそのまま送ってきた updated_at は無視する（サーバーの時刻で上書きする）
+        self.schema.validate(item, ignore=(UPDATED_AT,))
         timestamp = self.get_current_timestamp()
-
-        update_expression_parts = []
-        expression_attribute_values = {}
-        expression_attribute_names = {}
-        
-        update_expression_parts.append(f'#ua = :updated_at_val')
-        expression_attribute_names['#ua'] = 'updated_at'
-        expression_attribute_values[':updated_at_val'] = {'S': timestamp}
-
-        for key, value in item.items():
-            placeholder_name = f'#{key}'
-            placeholder_value = f':{key}_val'
-            
-            update_expression_parts.append(f'{placeholder_name} = {placeholder_value}')
-            expression_attribute_names[placeholder_name] = key
-            expression_attribute_values[placeholder_value] = {self.field_types[key]: value}
-
-        update_expression = 'SET ' + ', '.join(update_expression_parts)
+        # 更新するフィールドの組み合わせごとにキャッシュされた更新式を使う
+        encode = self.compressor.compress_attribute if self.compressor is not None else None
+        update_expression, expression_attribute_names, expression_attribute_values = self.schema.build_update(item, timestamp, encode)
 
         logger.info('Updating item...')
         key_item = {
@@ -115,20 +205,193 @@ class DynamoDBHandler:
         }
         if self.sk_name != '':
             key_item[self.sk_name] = {'S': sk_val}
+            key_item[self.pk_name] = {'S': self.physical_pk_for_sk(pk_val, sk_val)}
+        compression.check_update_size(key_item, expression_attribute_names, expression_attribute_values, self.max_item_bytes)
+        self.record_changes(pk_val, [sk_val] if self.sk_name != '' else None)
+
+        try:
+            with tracing.span('ddb.update'):
+                response = self._call(
+                    'update_item',
+                    TableName=self.table_name,
+                    Key=key_item,
+                    UpdateExpression=update_expression,
+                    ExpressionAttributeNames=expression_attribute_names,
+                    ExpressionAttributeValues=expression_attribute_values,
+                    ReturnValues='ALL_NEW' # 更新後のアイテム全体を返す
+                )
+            updated_item = deserialize_item(self.expand(response.get('Attributes', {})))
+            if self.pk_name in updated_item:
+                updated_item[self.pk_name] = pk_val
+            if self.low_stock is not None and self.low_stock.affected_by(item):
+                self.sync_low_stock(key_item, pk_val, updated_item)
+            self.invalidate_cache(pk_val)
+            logger.info(f'Successfully update item. Updated item: {updated_item}')
+            return [updated_item]
+        except Exception as e:
+            raise wrap_error(e, 'Failed to update item')
+
+
+    # 数量を UpdateItem の ADD で増減する（読まずに1回で書くので、同時に増減しても互いに上書きしない）
+    # adjustment: {PK_NAME: ..., SK_NAME: ..., 'delta': 増減量, 'floor': 下限（省略可）}
+    # floor を指定すると、増減後に floor を下回る場合は条件式（qty >= floor - delta）で弾く
+    # 存在しないアイテムは作らない。qty が文字列のまま（移行前）のアイテムは数値に変換してから再試行する
+    # 結果は {'status': 'ok' | 'insufficient' | 'not_found' | 'invalid_qty', PK, SK, qty_name: 現在の値}
+    def adjust_quantity(self, adjustment, qty_name='qty'):
+        try:
+            pk_val = adjustment[self.pk_name]
+            sk_val = adjustment[self.sk_name]
+            delta = parse_number(adjustment['delta'], 'delta')
+            floor = adjustment.get('floor')
+            floor = parse_number(floor, 'floor') if floor is not None else None
+        except KeyError as e:
+            raise ValueError(f'Missing key in adjust_qty: {e}')
+        key_item = {
+            self.pk_name: {'S': self.physical_pk_for_sk(pk_val, sk_val)},
+            self.sk_name: {'S': sk_val},
+        }
+        result = {self.pk_name: pk_val, self.sk_name: sk_val}
+
+        condition = 'attribute_exists(#pk) AND (attribute_not_exists(#qty) OR attribute_type(#qty, :number))'
+        values = {
+            ':delta': {'N': str(delta)},
+            ':number': {'S': 'N'},
+            ':updated_at': {'S': self.get_current_timestamp()},
+        }
+        if floor is not None:
+            # qty が無いアイテムは 0 として扱う
+            minimum = floor - delta
+            condition = 'attribute_exists(#pk) AND (attribute_type(#qty, :number) AND #qty >= :min)'
+            if minimum <= 0:
+                condition = 'attribute_exists(#pk) AND (attribute_not_exists(#qty) OR (attribute_type(#qty, :number) AND #qty >= :min))'
+            values[':min'] = {'N': str(minimum)}
+
+        for attempt in range(2):
+            try:
+                with tracing.span('ddb.adjust'):
+                    response = self._call(
+                        'update_item',
+                        TableName=self.table_name,
+                        Key=key_item,
+                        UpdateExpression='ADD #qty :delta SET updated_at = :updated_at',
+                        ConditionExpression=condition,
+                        ExpressionAttributeNames={'#pk': self.pk_name, '#qty': qty_name},
+                        ExpressionAttributeValues=values,
+                        # 発注点の判定に使うので low_stock があるときはアイテム全体を返す
+                        ReturnValues='UPDATED_NEW' if self.low_stock is None else 'ALL_NEW',
+                        ReturnValuesOnConditionCheckFailure='ALL_OLD',
+                    )
+                updated_item = deserialize_item(self.expand(response['Attributes']))
+                if self.low_stock is not None:
+                    updated_item[self.pk_name] = pk_val
+                    self.sync_low_stock(key_item, pk_val, updated_item)
+                return dict(result, status='ok', **{qty_name: updated_item[qty_name]})
+            except Exception as e:
+                if error_code(e) != 'ConditionalCheckFailedException':
+                    raise wrap_error(e, 'Failed to adjust quantity')
+                old_item = e.response.get('Item')
+            if old_item is None:
+                return dict(result, status='not_found')
+            current = old_item.get(qty_name)
+            if current is not None and 'S' in current and attempt == 0:
+                if not self.migrate_quantity(key_item, current['S'], qty_name):
+                    return dict(result, status='invalid_qty', **{qty_name: current['S']})
+                continue
+            return dict(result, status='insufficient', **{qty_name: deserialize_item({qty_name: current})[qty_name] if current else 0})
+
+    # 更新後のアイテム（論理 PK の dict）が発注点以下かどうかで GSI のキーを書く・消す（状態が変わったときだけ）
+    # 判定に使った qty・発注点のままのときだけ書くので、同時に更新されたら後の更新が自分で判定し直す
+    def sync_low_stock(self, key_item, pk_val, item):
+        index = self.low_stock
+        is_low = index.is_low(item)
+        if is_low == (index.flag_name in item):
+            return item
+
+        names = {'#flag': index.flag_name}
+        values = {}
+        conditions = []
+        for placeholder, name in (('qty', index.qty_name), ('threshold', index.threshold_name)):
+            names[f'#{placeholder}'] = name
+            if name in item:
+                conditions.append(f'#{placeholder} = :{placeholder}')
+                value = item[name]
+                values[f':{placeholder}'] = {'N': str(value)} if isinstance(value, (int, Decimal)) else {'S': str(value)}
+            else:
+                conditions.append(f'attribute_not_exists(#{placeholder})')
+        if is_low:
+            update_expression = 'SET #flag = :flag'
+            values[':flag'] = {'S': pk_val}
+        else:
+            update_expression = 'REMOVE #flag'
+        params = {}
+        if values:
+            params['ExpressionAttributeValues'] = values
 
         try:
-            response = self.dynamodb.update_item(
-                TableName=self.table_name,
-                Key=key_item,
-                UpdateExpression=update_expression,
-                ExpressionAttributeNames=expression_attribute_names,
-                ExpressionAttributeValues=expression_attribute_values,
-                ReturnValues='UPDATED_NEW' # 更新後の新しい属性値を返す
-            )
-            logger.info('Successfully update item. Updated attributes:', response['Attributes'])
-            return True
+            with tracing.span('ddb.low_stock'):
+                self._call(
+                    'update_item',
+                    TableName=self.table_name,
+                    Key=key_item,
+                    UpdateExpression=update_expression,
+                    ConditionExpression=' AND '.join(conditions),
+                    ExpressionAttributeNames=names,
+                    **params
+                )
         except Exception as e:
-            raise Exception(f'Failed to update item: {e}')
+            if error_code(e) != 'ConditionalCheckFailedException':
+                raise wrap_error(e, 'Failed to update low stock flag')
+            return item
+
+        if is_low:
+            item[index.flag_name] = pk_val
+            index.alert(self.pk_name, self.sk_name, item)
+        else:
+            item.pop(index.flag_name, None)
+        return item
+
+    # 複数の増減をそれぞれ独立に行い、アイテムごとの結果を返す
+    def adjust_quantities(self, adjustments, qty_name='qty'):
+        if isinstance(adjustments, dict):
+            adjustments = [adjustments]
+        results = []
+        pk_vals = list(dict.fromkeys(adjustment.get(self.pk_name) for adjustment in adjustments))
+        for pk_val in pk_vals:
+            self.record_changes(pk_val, [a.get(self.sk_name) for a in adjustments if a.get(self.pk_name) == pk_val])
+        try:
+            for adjustment in adjustments:
+                results.append(self.adjust_quantity(adjustment, qty_name))
+        finally:
+            for pk_val in pk_vals:
+                self.invalidate_cache(pk_val)
+        return results
+
+    # 文字列で保存された qty を数値に変換する（他の更新と競合しないよう、読んだ時の文字列と同じ場合だけ書く）
+    # 空文字は 0 とする。数値として読めない場合は False を返す
+    # 変換済み（他のリクエストが先に変換した）の場合も True を返す
+    def migrate_quantity(self, key_item, raw_value, qty_name='qty'):
+        try:
+            number = Decimal(raw_value.strip() or '0')
+        except InvalidOperation:
+            logger.warning(f'Cannot migrate {qty_name}={raw_value!r} of {key_item} to a number')
+            return False
+        if not number.is_finite():
+            return False
+        try:
+            with tracing.span('ddb.migrate_qty'):
+                self._call(
+                    'update_item',
+                    TableName=self.table_name,
+                    Key=key_item,
+                    UpdateExpression='SET #qty = :number',
+                    ConditionExpression='#qty = :string',
+                    ExpressionAttributeNames={'#qty': qty_name},
+                    ExpressionAttributeValues={':number': {'N': str(number)}, ':string': {'S': raw_value}},
+                )
+        except Exception as e:
+            if error_code(e) != 'ConditionalCheckFailedException':
+                raise wrap_error(e, 'Failed to migrate quantity')
+        return True
 
 
     
@@ -163,28 +426,95 @@ class DynamoDBHandler:
                 if have_sk:
                     if self.sk_delimiter != '':
                         delete_request_item['DeleteRequest']['Key'][self.sk_name] = {'S': primary_item[self.sk_name]}
+                        delete_request_item['DeleteRequest']['Key'][self.pk_name] = {
+                            'S': self.physical_pk_for_sk(primary_item[self.pk_name], primary_item[self.sk_name])
+                        }
                     else:
                         delete_request_item['DeleteRequest']['Key'][self.sk_name] = {self.field_types[self.sk_name]: primary_item[self.sk_name]}
                 
                 request_items[self.table_name].append(delete_request_item)
 
+            pk_vals = list(dict.fromkeys(primary_item[self.pk_name] for primary_item in batch))
             try:
+                for pk_val in pk_vals:
+                    self.record_changes(pk_val, [p.get(self.sk_name) for p in batch if p[self.pk_name] == pk_val])
                 logger.info(f'request_items: {request_items}')
-                response = self.dynamodb.batch_write_item(RequestItems=request_items)
-            
-                if response.get('UnprocessedItems'):
-                    logger.error(f"Unprocessed items: {response['UnprocessedItems']}")
+                unprocessed_items = self.batch_write_with_retry(request_items)
+                if unprocessed_items:
+                    logger.error(f'Unprocessed items: {unprocessed_items}')
                     return False
-                
+
+            except ThrottlingError:
+                # スロットリング継続中は 503 を返せるように呼び出し元へ投げる
+                raise
             except Exception as e:
                 logger.error(f'Failed to delete item: {e}')
                 return False
+            finally:
+                # 一部だけ削除できた場合もあるので、成否にかかわらずキャッシュを無効化する
+                for pk_val in pk_vals:
+                    self.invalidate_cache(pk_val)
 
         logger.info('Successfully delete items')
         return True
         
 
 
+    # TransactWriteItems 用の Put。must_not_exist なら同じキーのアイテムが既にあるときにトランザクションを失敗させる
+    def put_request(self, request_item, must_not_exist=False):
+        put = {'TableName': self.table_name, 'Item': self.build_item(request_item)}
+        if must_not_exist:
+            put['ConditionExpression'] = 'attribute_not_exists(#pk)'
+            put['ExpressionAttributeNames'] = {'#pk': self.pk_name}
+        return {'Put': put}
+
+
+    # TransactWriteItems 用の ConditionCheck。アイテムが存在することだけを確認する（書き込みはしない）
+    def exists_check_request(self, key_item):
+        key = {self.pk_name: {'S': key_item[self.pk_name]}}
+        if self.sk_name != '' and self.sk_delimiter != '':
+            key[self.sk_name] = {'S': key_item[self.sk_name]}
+            key[self.pk_name] = {'S': self.physical_pk_for_sk(key_item[self.pk_name], key_item[self.sk_name])}
+        elif self.sk_name != '':
+            key[self.sk_name] = self.schema.serialize_value(self.sk_name, key_item[self.sk_name])
+        return {'ConditionCheck': {
+            'TableName': self.table_name,
+            'Key': key,
+            'ConditionExpression': 'attribute_exists(#pk)',
+            'ExpressionAttributeNames': {'#pk': self.pk_name},
+        }}
+
+
+    # 複数のテーブルにまたがる書き込みをまとめて行う
+    # 条件が1つでも満たされなければ何も書き込まれず ConditionalCheckError になる
+    def transact_write(self, transact_items):
+        try:
+            logger.info(f'Writing transaction of {len(transact_items)} items')
+            with tracing.span('ddb.transact_write'):
+                self._call('transact_write_items', TransactItems=transact_items)
+        except Exception as e:
+            raise wrap_error(e, 'Failed to write transaction')
+
+
+    # UnprocessedItems をバックオフしながら再送し、最後まで処理されなかったものを返す
+    def batch_write_with_retry(self, request_items):
+        attempt = 0
+        while True:
+            try:
+                with tracing.span('ddb.batch_write'):
+                    response = self._call('batch_write_item', RequestItems=request_items)
+            except Exception as e:
+                raise wrap_error(e, 'Failed to batch write items')
+
+            unprocessed_items = response.get('UnprocessedItems')
+            if not unprocessed_items:
+                return {}
+            if not self.resilience.backoff(attempt):
+                return unprocessed_items
+            attempt += 1
+            request_items = unprocessed_items
+
+
     # PK+SK_PREFIXに一致するすべてのアイテムを取得
     def query_by_sk_prefix(self, item):
         try:
@@ -209,7 +539,35 @@ class DynamoDBHandler:
             }
         }
 
-        return self.query_with_pagination(query_params)
+        return self.query_partitions(pk_val, query_params)
+
+
+    # キーが一致するアイテムを1件取得する（無ければ None）。attribute_names を渡すとその属性だけを読む
+    def get_item(self, item, attribute_names=None):
+        try:
+            pk_val = item[self.pk_name]
+            key_item = {self.pk_name: {'S': pk_val}}
+            if self.sk_name != '':
+                key_item[self.sk_name] = {'S': item[self.sk_name]}
+                key_item[self.pk_name] = {'S': self.physical_pk_for_sk(pk_val, item[self.sk_name])}
+        except KeyError:
+            raise KeyError(f'KeyError in get_item: pk:{self.pk_name}, sk:{self.sk_name}')
+
+        params = {}
+        if attribute_names:
+            params['ProjectionExpression'] = ', '.join(f'#attr{i}' for i in range(len(attribute_names)))
+            params['ExpressionAttributeNames'] = {f'#attr{i}': name for i, name in enumerate(attribute_names)}
+        try:
+            with tracing.span('ddb.get'):
+                response = self._call('get_item', TableName=self.table_name, Key=key_item, **params)
+        except Exception as e:
+            raise wrap_error(e, 'Failed to get item')
+        if 'Item' not in response:
+            return None
+        result = deserialize_item(self.expand(response['Item']))
+        if self.pk_name in result:
+            result[self.pk_name] = pk_val
+        return result
 
 
     # PKが一致するすべてのアイテムを取得
@@ -221,6 +579,15 @@ class DynamoDBHandler:
 
         logger.info(f'Querying ({self.pk_name}: {pk_val})...')
 
+        if self.snapshots is not None:
+            raw_items, stale = self.snapshots.load(self, pk_val)
+            if stale:
+                self.stale_snapshots.add(pk_val)
+            if raw_items is not None:
+                convert = self.item_converter()
+                with tracing.span('deserialize'):
+                    return [convert(item) for item in raw_items]
+
         query_params = {
             'TableName': self.table_name,
             'KeyConditionExpression': '#pk = :pk_val',
@@ -232,37 +599,203 @@ class DynamoDBHandler:
             }
         }
 
-        return self.query_with_pagination(query_params)
+        return self.query_partitions(pk_val, query_params)
 
 
-    def query_with_pagination(self, query_params):
-        logger.info(f'Query Parameters: {query_params}')
+    # 発注点以下のアイテムだけを GSI から取得する（GSI の PK は論理 PK なのでシャードには分けない）
+    def query_low_stock(self, item):
+        if self.low_stock is None:
+            raise ValueError('Low stock index is not configured')
+        try:
+            pk_val = item[self.pk_name]
+        except KeyError:
+            raise KeyError(f'KeyError in query_low_stock: {self.pk_name}')
+
+        logger.info(f'Querying low stock items ({self.pk_name}: {pk_val})...')
+        query_params = {
+            'TableName': self.table_name,
+            'IndexName': self.low_stock.index_name,
+            'KeyConditionExpression': '#flag = :pk_val',
+            'ExpressionAttributeNames': {
+                '#flag': self.low_stock.flag_name
+            },
+            'ExpressionAttributeValues': {
+                ':pk_val': {'S': pk_val}
+            }
+        }
+        return [self.with_logical_pk(row, pk_val) for row in self.query_with_pagination(query_params)]
+
+
+    # シャーディングされた PK は全シャードに並列でクエリしてマージする（SK 順に並べ直す）
+    # query_cache があれば先にキャッシュを見て、無ければクエリした生のアイテムを保存する
+    def query_partitions(self, pk_val, query_params):
+        if self.query_cache is None or not self.is_cacheable(query_params):
+            return self.query_uncached(pk_val, query_params)
+
+        sk_prefix = query_params['ExpressionAttributeValues'].get(':sk_prefix_val', {}).get('S', '')
+        projection = query_params.get('ProjectionExpression', '')
+        version, raw_items = self.query_cache.lookup(self.table_name, pk_val, sk_prefix, projection)
+        if raw_items is None:
+            raw_items = self.query_raw_items(pk_val, query_params)
+            self.query_cache.store(self.table_name, pk_val, sk_prefix, projection, version, raw_items)
+
+        convert = self.item_converter()
+        with tracing.span('deserialize'):
+            return [convert(item) for item in raw_items]
+
+
+    # キー条件と射影だけで結果が決まるクエリだけをキャッシュする（GSI やフィルター付きはしない）
+    def is_cacheable(self, query_params):
+        return 'IndexName' not in query_params and 'FilterExpression' not in query_params
+
+
+    def query_uncached(self, pk_val, query_params):
+        shard_count = self.sharding_policy.shard_count(pk_val)
+        if shard_count <= 1:
+            return self.query_with_pagination(query_params)
+
+        shard_params = []
+        for shard_pk in sharding.physical_pks(pk_val, shard_count):
+            params = dict(query_params)
+            params['ExpressionAttributeValues'] = dict(query_params['ExpressionAttributeValues'])
+            params['ExpressionAttributeValues'][':pk_val'] = {'S': shard_pk}
+            shard_params.append(params)
+
+        with tracing.span('ddb.query.scatter'):
+            results = list(get_shard_executor().map(tracing.in_context(self.query_with_pagination), shard_params))
 
         all_items = []
+        for items in results:
+            all_items.extend(self.with_logical_pk(item, pk_val) for item in items)
+        all_items.sort(key=lambda item: item.get(self.sk_name, ''))
+        return all_items
+
+
+    # キャッシュ用に DynamoDB 形式のままアイテムを集める（PK は論理 PK に戻す）
+    def query_raw_items(self, pk_val, query_params):
+        shard_count = self.sharding_policy.shard_count(pk_val)
+        shard_params = []
+        for shard_pk in sharding.physical_pks(pk_val, shard_count):
+            params = dict(query_params)
+            params['ExpressionAttributeValues'] = dict(query_params['ExpressionAttributeValues'])
+            params['ExpressionAttributeValues'][':pk_val'] = {'S': shard_pk}
+            shard_params.append(params)
+
+        def collect(params):
+            items = []
+            for current_items in self.iter_query_pages(params):
+                items.extend(current_items)
+            return items
+
+        if shard_count <= 1:
+            return collect(shard_params[0])
+
+        with tracing.span('ddb.query.scatter'):
+            results = list(get_shard_executor().map(tracing.in_context(collect), shard_params))
+        all_items = []
+        for items in results:
+            for item in items:
+                item[self.pk_name] = {'S': pk_val}
+                all_items.append(item)
+        all_items.sort(key=lambda item: item.get(self.sk_name, {}).get('S', ''))
+        return all_items
+
+
+    # 書き込んだ PK のキャッシュを無効化する（書き込みの後に呼ぶ）
+    def invalidate_cache(self, pk_val):
+        if self.query_cache is not None and pk_val is not None:
+            self.query_cache.invalidate(self.table_name, pk_val)
+
+
+    # これから書き込む SK をスナップショットの差分に記録する（書き込みの前に呼ぶ）
+    # 記録できなければ書き込まずに失敗させるので、書き込んだのに差分が無いことはない
+    # 書き込みが失敗・中断しても差分が余分に残るだけ（マージでアイテムを読み直すので結果は変わらない）
+    # sk_vals を省略すると PK 全体が変わるものとする（インポートなど）
+    def record_changes(self, pk_val, sk_vals=None):
+        if self.snapshots is None or pk_val is None:
+            return
+        if sk_vals is not None:
+            sk_vals = [sk_val for sk_val in sk_vals if sk_val is not None]
+        self.snapshots.record(self, pk_val, sk_vals)
+
+
+    # PK が一致するアイテムを1ページずつ返す（全件をメモリに載せない。シャードは順番に読む）
+    def iter_pages_by_PK(self, pk_val):
+        for shard_pk in sharding.physical_pks(pk_val, self.sharding_policy.shard_count(pk_val)):
+            query_params = {
+                'TableName': self.table_name,
+                'KeyConditionExpression': '#pk = :pk_val',
+                'ExpressionAttributeNames': {'#pk': self.pk_name},
+                'ExpressionAttributeValues': {':pk_val': {'S': shard_pk}},
+            }
+            for current_items in self.iter_query_pages(query_params):
+                items = [deserialize_item(self.expand(item)) for item in current_items]
+                for item in items:
+                    item[self.pk_name] = pk_val
+                yield items
+
+
+    # 圧縮された属性を戻した DynamoDB 形式のアイテム（圧縮していなければそのまま）
+    def expand(self, raw_item):
+        if self.compressor is None:
+            return raw_item
+        return self.compressor.expand(raw_item)
+
+
+    # DynamoDB 形式のアイテムを返す形（dict か CompactRow）に変換する関数
+    def item_converter(self):
+        convert = self.row_type.from_dynamodb if self.row_type is not None else deserialize_item
+        if self.compressor is None:
+            return convert
+        expand = self.compressor.expand
+        return lambda item: convert(expand(item))
+
+
+    def with_logical_pk(self, item, pk_val):
+        if isinstance(item, CompactRow):
+            return item.replace(self.pk_name, pk_val)
+        item[self.pk_name] = pk_val
+        return item
+
+
+    # 1ページ分の生のアイテム（DynamoDB 形式）を順に返す
+    def iter_query_pages(self, query_params):
         last_evaluated_key = None
-        deserializer = TypeDeserializer()
-        
+        tracer = tracing.current()
+
         while True:
             try:
                 if last_evaluated_key:
                     query_params['ExclusiveStartKey'] = last_evaluated_key
                     logger.info(f'  > Requesting next page with ExclusiveStartKey...')
 
-                response = self.dynamodb.query(**query_params)
-                current_items = response.get('Items', [])
-                logger.info(f'  > Current page query records: {len(current_items)}')
-                
-                for item in current_items:
-                    plain_item = {k: deserializer.deserialize(v) for k, v in item.items()}
-                    all_items.append(plain_item)
-                
-                last_evaluated_key = response.get('LastEvaluatedKey')
-                if not last_evaluated_key:
-                    break
-                
+                with tracer.span('ddb.query.page'):
+                    response = self._call('query', **query_params)
             except Exception as e:
                 logger.error(f'Failed to query. param: {query_params}')
-                raise Exception(e)
+                raise wrap_error(e, 'Failed to query')
+
+            current_items = response.get('Items', [])
+            logger.info(f'  > Current page query records: {len(current_items)}')
+            tracer.add_count('ddb.query.items', len(current_items))
+            yield current_items
+
+            last_evaluated_key = response.get('LastEvaluatedKey')
+            if not last_evaluated_key:
+                break
+
+
+    def query_with_pagination(self, query_params):
+        logger.info(f'Query Parameters: {query_params}')
+
+        all_items = []
+        tracer = tracing.current()
+        convert = self.item_converter()
+
+        for current_items in self.iter_query_pages(query_params):
+            with tracer.span('deserialize'):
+                for item in current_items:
+                    all_items.append(convert(item))
 
         logger.info(f'query records:{len(all_items)}')
         logger.info(f'query result:{all_items}')
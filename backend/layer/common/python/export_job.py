@@ -0,0 +1,132 @@
+import csv
+import io
+import json
+import logging
+import zlib
+from decimal import Decimal
+
+import tracing
+from background import Job, STATUS_FAILED, STATUS_PENDING, STATUS_RUNNING, STATUS_SUCCEEDED
+from object_store import MIN_PART_SIZE
+
+logger = logging.getLogger(__name__)
+
+# organization の在庫を gzip 圧縮した CSV / JSONL としてオブジェクトストレージに書き出すジョブ
+# クエリ結果は1ページずつ圧縮してマルチパートアップロードに流すので、全件をメモリに持たない
+
+FORMAT_CSV = 'csv'
+FORMAT_JSONL = 'jsonl'
+FORMATS = {
+    FORMAT_CSV: 'text/csv',
+    FORMAT_JSONL: 'application/x-ndjson',
+}
+
+def _to_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, (set, frozenset)):
+        return ';'.join(sorted(str(v) for v in value))
+    if isinstance(value, bytes):
+        return value.decode(errors='replace')
+    return str(value)
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if isinstance(value, bytes):
+        return value.decode(errors='replace')
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def export_columns(schema, key_columns=()):
+    return schema.columns(key_columns)
+
+
+class RowEncoder:
+    def __init__(self, export_format, columns):
+        if export_format not in FORMATS:
+            raise ValueError(f'Unsupported export format: {export_format}')
+        self.export_format = export_format
+        self.columns = columns
+
+    def header(self):
+        if self.export_format != FORMAT_CSV:
+            return b''
+        return self._csv_rows([self.columns])
+
+    def encode(self, items):
+        if self.export_format == FORMAT_CSV:
+            columns = self.columns
+            return self._csv_rows([_to_text(item.get(name)) for name in columns] for item in items)
+        lines = [json.dumps(item, ensure_ascii=False, default=_json_default) for item in items]
+        return ''.join(f'{line}\n' for line in lines).encode()
+
+    def _csv_rows(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator='\n').writerows(rows)
+        return buffer.getvalue().encode()
+
+
+class ExportJob(Job):
+    KIND = 'export'
+
+    @classmethod
+    def create(cls, store, organization_id, export_format=FORMAT_CSV):
+        if export_format not in FORMATS:
+            raise ValueError(f'Unsupported export format: {export_format}')
+        return super().create(store, organization_id, format=export_format, item_count=0, bytes=0)
+
+    @property
+    def export_format(self):
+        return self.document['format']
+
+    @property
+    def result_key(self):
+        return self.key(f'inventory.{self.export_format}.gz')
+
+
+# handler.iter_pages_by_PK のページを順に圧縮してアップロードする
+def run_export(job, handler, columns, part_size=MIN_PART_SIZE):
+    encoder = RowEncoder(job.export_format, columns)
+    tracer = tracing.current()
+    job.save_status(STATUS_RUNNING)
+    writer = job.store.open_multipart(job.result_key, 'application/gzip', part_size)
+    # wbits=31 で gzip 形式にする
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    item_count = 0
+    try:
+        writer.write(compressor.compress(encoder.header()))
+        for items in handler.iter_pages_by_PK(job.organization_id):
+            with tracer.span('export.encode'):
+                chunk = compressor.compress(encoder.encode(items))
+            if chunk:
+                writer.write(chunk)
+            item_count += len(items)
+        writer.write(compressor.flush())
+        writer.close()
+    except Exception as e:
+        logger.error(f'Export job {job.job_id} failed: {e}', exc_info=True)
+        try:
+            writer.abort()
+        except Exception as abort_error:
+            logger.error(f'Failed to abort upload: {abort_error}')
+        job.save_status(STATUS_FAILED, error=str(e), item_count=item_count)
+        raise
+
+    tracer.add_count('export.items', item_count)
+    tracer.add_bytes('export.bytes', writer.bytes_written)
+    job.save_status(STATUS_SUCCEEDED, item_count=item_count, bytes=writer.bytes_written, key=job.result_key)
+    logger.info(f'Export job {job.job_id} finished: {item_count} items, {writer.bytes_written} bytes')
+    return job.document
+
+
+# 完了していればダウンロード用 URL を付けて返す
+def get_export_status(store, organization_id, job_id, expires_in=3600):
+    job = ExportJob.load(store, organization_id, job_id)
+    document = dict(job.document)
+    if job.status == STATUS_SUCCEEDED:
+        document['url'] = store.url_for(job.result_key, expires_in)
+    return document
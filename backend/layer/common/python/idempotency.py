@@ -0,0 +1,211 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+import clients
+import tracing
+from dynamodb_handler import CLIENT_CONFIG
+from query_cache import LRUCacheBackend
+from resilience import ResilientCaller, error_code, wrap_error
+
+logger = logging.getLogger(__name__)
+
+# 書き込み（put / update / delete / import）の冪等性キー
+#
+# クライアントは Idempotency-Key ヘッダー（または body の idempotency_key）で同じ操作のリトライであることを示す
+#   1. コンテナ内のキャッシュに完了した結果があればそれを返す（DynamoDB を呼ばない）
+#   2. 冪等性テーブルに in_progress のレコードを条件付きで書く（attribute_not_exists、または期限切れ）
+#      既にあれば: completed ならその結果を返す / in_progress なら 409 を返す
+#   3. 処理を実行して結果を completed として保存する。例外・5xx のときはレコードを消して再実行できるようにする
+# 同じキーで中身の違うリクエストが来たら（リクエストのハッシュが違えば）エラーにする
+# レコードは expires_at（DynamoDB の TTL）で消える
+
+STATUS_IN_PROGRESS = 'in_progress'
+STATUS_COMPLETED = 'completed'
+STATUS_CODE_CONFLICT = 409
+
+HEADER_NAME = 'idempotency-key'
+FIELD_NAME = 'idempotency_key'
+MAX_KEY_LENGTH = 255
+
+TABLE_ENV_NAME = 'IDEMPOTENCY_TABLE_NAME'
+TTL_ENV_NAME = 'IDEMPOTENCY_TTL_SECONDS'
+DEFAULT_TTL_SECONDS = 24 * 3600
+# in_progress のまま残ったレコード（処理中にタイムアウトしたなど）は Lambda の最大実行時間を過ぎたら取り直せる
+IN_PROGRESS_SECONDS = 900
+
+
+class IdempotencyInProgressError(Exception):
+    pass
+
+
+class IdempotencyKeyMismatchError(ValueError):
+    pass
+
+
+def request_hash(payload):
+    dumped = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(dumped.encode()).hexdigest()
+
+
+# Function URL のヘッダー名は小文字になる
+def get_idempotency_key(event, request_body):
+    key = (event.get('headers') or {}).get(HEADER_NAME) or request_body.get(FIELD_NAME) or ''
+    if len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f'Idempotency key is longer than {MAX_KEY_LENGTH} characters')
+    return key
+
+
+class DynamoDBIdempotencyStore:
+    # クライアントは botocore のリトライを無効にしているので、DynamoDBHandler と同じく ResilientCaller を通して呼ぶ
+    def __init__(self, table_name, pk_name='idempotency_key', client=None, region_name=None, resilience=None):
+        self.table_name = table_name
+        self.pk_name = pk_name
+        self.dynamodb = client if client is not None else clients.get_client('dynamodb', region_name, config=CLIENT_CONFIG)
+        self.resilience = resilience if resilience is not None else ResilientCaller.for_table(table_name)
+
+    def _call(self, operation, **params):
+        return self.resilience.call(getattr(self.dynamodb, operation), **params)
+
+    def _key(self, key):
+        return {self.pk_name: {'S': key}}
+
+    # レコードを in_progress で作る。作れたら None、既にあればそのレコードを返す
+    def claim(self, key, digest, now, expires_at, in_progress_until):
+        item = dict(self._key(key), **{
+            'status': {'S': STATUS_IN_PROGRESS},
+            'request_hash': {'S': digest},
+            'in_progress_until': {'N': str(int(in_progress_until))},
+            'expires_at': {'N': str(int(expires_at))},
+        })
+        try:
+            with tracing.span('idempotency.claim'):
+                self._call(
+                    'put_item',
+                    TableName=self.table_name,
+                    Item=item,
+                    ConditionExpression='attribute_not_exists(#pk) OR expires_at < :now OR '
+                                        '(#status = :in_progress AND in_progress_until < :now)',
+                    ExpressionAttributeNames={'#pk': self.pk_name, '#status': 'status'},
+                    ExpressionAttributeValues={':now': {'N': str(int(now))}, ':in_progress': {'S': STATUS_IN_PROGRESS}},
+                    ReturnValuesOnConditionCheckFailure='ALL_OLD',
+                )
+            return None
+        except Exception as e:
+            if error_code(e) != 'ConditionalCheckFailedException':
+                raise wrap_error(e, 'Failed to claim idempotency key')
+            existing = e.response.get('Item') or {}
+            return {
+                'status': existing.get('status', {}).get('S', STATUS_IN_PROGRESS),
+                'request_hash': existing.get('request_hash', {}).get('S', ''),
+                'response': json.loads(existing['response']['S']) if 'response' in existing else None,
+            }
+
+    def complete(self, key, response, expires_at):
+        try:
+            with tracing.span('idempotency.complete'):
+                self._call(
+                    'update_item',
+                    TableName=self.table_name,
+                    Key=self._key(key),
+                    UpdateExpression='SET #status = :completed, #response = :response, expires_at = :expires_at REMOVE in_progress_until',
+                    ExpressionAttributeNames={'#status': 'status', '#response': 'response'},
+                    ExpressionAttributeValues={
+                        ':completed': {'S': STATUS_COMPLETED},
+                        ':response': {'S': json.dumps(response)},
+                        ':expires_at': {'N': str(int(expires_at))},
+                    },
+                )
+        except Exception as e:
+            raise wrap_error(e, 'Failed to complete idempotency key')
+
+    def release(self, key):
+        try:
+            with tracing.span('idempotency.release'):
+                self._call('delete_item', TableName=self.table_name, Key=self._key(key))
+        except Exception as e:
+            raise wrap_error(e, 'Failed to release idempotency key')
+
+
+class Idempotency:
+    def __init__(self, store, ttl_seconds=DEFAULT_TTL_SECONDS, front_cache=None, in_progress_seconds=IN_PROGRESS_SECONDS,
+                 clock=time.time):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.front_cache = front_cache if front_cache is not None else LRUCacheBackend(max_entries=1000)
+        self.in_progress_seconds = in_progress_seconds
+        self.clock = clock
+
+    # execute() は Lambda の戻り値（statusCode を持つ dict）を返す関数
+    def run(self, key, payload, execute):
+        tracer = tracing.current()
+        digest = request_hash(payload)
+        cached = self.front_cache.get(key)
+        if cached is not None:
+            tracer.add_count('idempotency.cache_hits')
+            return self._replay(key, json.loads(cached), digest)
+
+        now = self.clock()
+        existing = self.store.claim(key, digest, now, now + self.ttl_seconds, now + self.in_progress_seconds)
+        if existing is not None:
+            if existing['status'] == STATUS_COMPLETED:
+                self._remember(key, existing)
+                return self._replay(key, existing, digest)
+            if existing['request_hash'] != digest:
+                raise IdempotencyKeyMismatchError(f'Idempotency key {key} was used for a different request')
+            tracer.add_count('idempotency.in_progress')
+            raise IdempotencyInProgressError(f'Request with idempotency key {key} is still in progress')
+
+        try:
+            response = execute()
+        except Exception:
+            self._release(key)
+            raise
+        if response.get('statusCode', 200) >= 500:
+            self._release(key)
+            return response
+
+        record = {'status': STATUS_COMPLETED, 'request_hash': digest, 'response': response}
+        try:
+            self.store.complete(key, response, self.clock() + self.ttl_seconds)
+        except Exception as e:
+            # 処理は終わっているので失敗にはしない（リトライは in_progress の期限が切れるまで 409 になる）
+            logger.error(f'Failed to save idempotent response for {key}: {e}')
+        self._remember(key, record)
+        return response
+
+    def _remember(self, key, record):
+        self.front_cache.set(key, json.dumps(record), self.ttl_seconds)
+
+    def _release(self, key):
+        try:
+            self.store.release(key)
+        except Exception as e:
+            logger.error(f'Failed to release idempotency key {key}: {e}')
+
+    def _replay(self, key, record, digest):
+        if record['request_hash'] != digest:
+            raise IdempotencyKeyMismatchError(f'Idempotency key {key} was used for a different request')
+        tracing.current().add_count('idempotency.replayed')
+        logger.info(f'Returning stored response for idempotency key {key}')
+        response = dict(record['response'])
+        response['headers'] = dict(response.get('headers') or {}, **{'Idempotency-Replayed': 'true'})
+        return response
+
+
+# IDEMPOTENCY_TABLE_NAME が未設定なら None（冪等性キーを使わない）
+def from_env(region_name=None):
+    table_name = os.environ.get(TABLE_ENV_NAME, '')
+    if table_name == '':
+        return None
+    ttl_seconds = int(os.environ.get(TTL_ENV_NAME, DEFAULT_TTL_SECONDS))
+    return Idempotency(DynamoDBIdempotencyStore(table_name, region_name=region_name), ttl_seconds)
+
+
+def conflict_response():
+    return {
+        'statusCode': STATUS_CODE_CONFLICT,
+        'headers': {'Retry-After': '1'},
+    }
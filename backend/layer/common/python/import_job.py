@@ -0,0 +1,166 @@
+import codecs
+import csv
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+from background import Job, STATUS_FAILED, STATUS_PENDING, STATUS_RUNNING, STATUS_SUCCEEDED
+from resilience import UNLIMITED_DEADLINE
+
+logger = logging.getLogger(__name__)
+
+# アップロードされた CSV を1行ずつ読み、FIELD_TYPES で検証して BatchWriteItem でまとめて書き込むジョブ
+# chunk_rows 行ごとに書き込みを終えてから処理済み行数をステータスに記録する（チェックポイント）
+# item_id はジョブIDと行番号から決まるので、途中から再開して同じ行を書き直しても重複しない
+
+# ステータスに残すエラーの最大件数（件数自体は error_count に全て数える）
+MAX_RECORDED_ERRORS = 100
+CHUNK_ROWS = 500
+MAX_WRITE_WORKERS = 4
+# 残り時間がこれを下回ったら中断して次の呼び出しに引き継ぐ
+MIN_REMAINING_SECONDS = 10.0
+
+IMPORT_NAMESPACE = uuid.UUID('6f1c3a52-4f5e-4c55-9a43-0b8f6c2d7e11')
+
+TRUE_VALUES = {'true', '1', 'yes'}
+FALSE_VALUES = {'false', '0', 'no'}
+
+_write_executor = None
+
+
+def get_write_executor():
+    global _write_executor
+    if _write_executor is None:
+        _write_executor = ThreadPoolExecutor(max_workers=MAX_WRITE_WORKERS)
+    return _write_executor
+
+
+class ImportJob(Job):
+    KIND = 'import'
+
+    @classmethod
+    def create(cls, store, organization_id, csv_body):
+        if not organization_id:
+            raise ValueError('organization_id is required')
+        if isinstance(csv_body, str):
+            csv_body = csv_body.encode()
+        job = super().create(store, organization_id, rows_processed=0, rows_written=0, error_count=0, errors=[])
+        store.put_object(job.source_key, csv_body, 'text/csv')
+        return job
+
+    @property
+    def source_key(self):
+        return self.key('source.csv')
+
+
+def row_item_id(job_id, row_number):
+    return str(uuid.uuid5(IMPORT_NAMESPACE, f'{job_id}:{row_number}'))
+
+
+def _convert(field_type, name, text):
+    if field_type == 'BOOL':
+        lowered = text.lower()
+        if lowered in TRUE_VALUES:
+            return True
+        if lowered in FALSE_VALUES:
+            return False
+        raise ValueError(f'Invalid value for {name}: expected boolean')
+    if field_type in ('SS', 'NS'):
+        return [v.strip() for v in text.split(';') if v.strip() != '']
+    return text
+
+
+# CSV の1行を put 用のアイテムに変換する。キー・タイムスタンプの列は無視し、空のセルは保存しない
+def parse_row(row, handler, organization_id):
+    ignored = {handler.pk_name, handler.sk_name, handler.sk_suffix, 'created_at', 'updated_at'}
+    field_types = handler.field_types
+    request_item = {}
+    for name, text in row.items():
+        if name is None:
+            raise ValueError('Too many columns')
+        if name in ignored or text is None or text.strip() == '':
+            continue
+        if name not in field_types:
+            raise ValueError(f'Unknown fields: {name}')
+        request_item[name] = _convert(field_types[name], name, text.strip())
+    if handler.sk_prefix and handler.sk_prefix not in request_item:
+        raise ValueError(f'{handler.sk_prefix} is required')
+    request_item[handler.pk_name] = organization_id
+    return request_item
+
+
+def _write_items(handler, items):
+    batches = [
+        {handler.table_name: [{'PutRequest': {'Item': item}} for item in items[i:i + 25]]}
+        for i in range(0, len(items), 25)
+    ]
+    with tracing.span('import.write'):
+        results = list(get_write_executor().map(tracing.in_context(handler.batch_write_with_retry), batches))
+    unprocessed = [r for r in results if r]
+    if unprocessed:
+        raise RuntimeError(f'Unprocessed items remain in {len(unprocessed)} batches')
+    return len(items)
+
+
+# 書き込みを終えたチャンクのエラーだけを記録する（再開時に同じ行のエラーを二重に数えない）
+def _commit_chunk(job, handler, items, errors, rows_processed):
+    handler.record_changes(job.organization_id, [item[handler.sk_name]['S'] for item in items])
+    try:
+        job.document['rows_written'] += _write_items(handler, items)
+    finally:
+        handler.invalidate_cache(job.organization_id)
+    job.document['error_count'] += len(errors)
+    room = MAX_RECORDED_ERRORS - len(job.document['errors'])
+    job.document['errors'].extend(errors[:max(0, room)])
+    job.save_status(STATUS_RUNNING, rows_processed=rows_processed)
+
+
+# 期限が近づいたら STATUS_PENDING のまま返す（呼び出し元が再度呼び出して続きから処理する）
+def run_import(job, handler, deadline=UNLIMITED_DEADLINE, chunk_rows=CHUNK_ROWS, min_remaining=MIN_REMAINING_SECONDS):
+    checkpoint = job.document['rows_processed']
+    job.document.pop('error', None)
+    job.save_status(STATUS_RUNNING)
+    logger.info(f'Import job {job.job_id} starting after row {checkpoint}')
+
+    pending_items = []
+    pending_errors = []
+    row_number = checkpoint
+    source = job.store.open_reader(job.source_key)
+    try:
+        reader = csv.DictReader(codecs.getreader('utf-8-sig')(source))
+        for row_number, row in enumerate(reader, start=1):
+            if row_number <= checkpoint:
+                continue
+            try:
+                request_item = parse_row(row, handler, job.organization_id)
+                pending_items.append(handler.build_item(request_item, item_id=row_item_id(job.job_id, row_number)))
+            except (ValueError, KeyError) as e:
+                pending_errors.append({'row': row_number, 'line': reader.line_num, 'error': str(e)})
+
+            if row_number - checkpoint >= chunk_rows:
+                _commit_chunk(job, handler, pending_items, pending_errors, row_number)
+                pending_items = []
+                pending_errors = []
+                checkpoint = row_number
+                if not deadline.allows(min_remaining):
+                    logger.info(f'Import job {job.job_id} paused at row {checkpoint}')
+                    job.save_status(STATUS_PENDING)
+                    return job.document
+
+        _commit_chunk(job, handler, pending_items, pending_errors, row_number)
+    except Exception as e:
+        logger.error(f'Import job {job.job_id} failed after row {checkpoint}: {e}', exc_info=True)
+        job.save_status(STATUS_FAILED, rows_processed=checkpoint, error=str(e))
+        raise
+    finally:
+        source.close()
+
+    tracing.current().add_count('import.rows', row_number)
+    job.save_status(STATUS_SUCCEEDED)
+    logger.info(f'Import job {job.job_id} finished: {job.document}')
+    return job.document
+
+
+def get_import_status(store, organization_id, job_id):
+    return dict(ImportJob.load(store, organization_id, job_id).document)
@@ -0,0 +1,75 @@
+import json
+import logging
+import os
+from decimal import Decimal, InvalidOperation
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# 在庫が発注点（reorder_threshold）以下のアイテムだけを載せるスパースな GSI
+#
+# qty <= reorder_threshold のアイテムにだけ low_stock_pk（論理 PK = organization_id）を書き、それ以外は属性を消す
+# GSI（パーティションキー low_stock_pk, ソートキーはテーブルの SK）には属性のあるアイテムしか入らないので、
+# low_stock クエリのコストは在庫の少ないアイテム数だけに比例する（カタログ全体は読まない）
+#   put / インポート : 書き込むアイテムから計算して一緒に書く
+#   update / adjust_qty : 更新後のアイテム（ALL_NEW）から判定し、状態が変わったときだけ条件付きでもう1回書く
+# 発注点を下回ったときは low_stock_alert を構造化ログに出す（メトリクスフィルターで通知する）
+#
+# GSI の例（CloudFormation）:
+#   IndexName: low-stock-index
+#   KeySchema: [{AttributeName: low_stock_pk, KeyType: HASH}, {AttributeName: <SK_NAME>, KeyType: RANGE}]
+
+INDEX_ENV_NAME = 'LOW_STOCK_INDEX_NAME'
+THRESHOLD_ENV_NAME = 'REORDER_THRESHOLD_NAME'
+DEFAULT_THRESHOLD_NAME = 'reorder_threshold'
+FLAG_NAME = 'low_stock_pk'
+ALERT_EVENT = 'low_stock_alert'
+
+
+def to_number(value):
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        number = Decimal(str(value).strip())
+    except InvalidOperation:
+        return None
+    return number if number.is_finite() else None
+
+
+class LowStockIndex:
+    def __init__(self, index_name, qty_name='qty', threshold_name=DEFAULT_THRESHOLD_NAME, flag_name=FLAG_NAME):
+        self.index_name = index_name
+        self.qty_name = qty_name
+        self.threshold_name = threshold_name
+        self.flag_name = flag_name
+
+    # 発注点の無いアイテムは対象外。qty の無いアイテムは 0 として扱う（adjust_qty と同じ）
+    def is_low(self, item):
+        threshold = to_number(item.get(self.threshold_name))
+        if threshold is None:
+            return False
+        qty = to_number(item.get(self.qty_name, 0))
+        return qty is not None and qty <= threshold
+
+    # update でこれらのフィールドを変えたときだけ判定し直す
+    def affected_by(self, fields):
+        return self.qty_name in fields or self.threshold_name in fields
+
+    def alert(self, pk_name, sk_name, item):
+        tracing.current().add_count('low_stock.alerts')
+        logger.warning(json.dumps({
+            'event': ALERT_EVENT,
+            pk_name: item.get(pk_name),
+            sk_name: item.get(sk_name),
+            self.qty_name: str(item.get(self.qty_name, 0)),
+            self.threshold_name: str(item.get(self.threshold_name)),
+        }, ensure_ascii=False))
+
+
+# LOW_STOCK_INDEX_NAME が未設定なら None（フラグを書かない）
+def from_env(qty_name='qty'):
+    index_name = os.environ.get(INDEX_ENV_NAME, '')
+    if index_name == '':
+        return None
+    return LowStockIndex(index_name, qty_name, os.environ.get(THRESHOLD_ENV_NAME, DEFAULT_THRESHOLD_NAME))
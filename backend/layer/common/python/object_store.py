@@ -0,0 +1,182 @@
+import logging
+import os
+from abc import ABC, abstractmethod
+
+import clients
+
+logger = logging.getLogger(__name__)
+
+# エクスポート・インポートなどで使うオブジェクトストレージ
+# 本番は S3、テストやローカル実行ではファイルシステムを使う（同じインターフェース）
+
+# S3 マルチパートアップロードの最小パートサイズ（最後のパート以外）
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class ObjectNotFoundError(Exception):
+    pass
+
+
+class MultipartWriter(ABC):
+    # write() で受け取ったバイト列を part_size ごとにまとめて upload_part() に渡す
+    # 保存先ごとのサブクラスが upload_part() / complete() / abort() を実装する
+    def __init__(self, part_size=MIN_PART_SIZE):
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.part_count = 0
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.buffer.extend(data)
+        self.bytes_written += len(data)
+        while len(self.buffer) >= self.part_size:
+            self._flush_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+
+    def _flush_part(self, data):
+        self.part_count += 1
+        self.upload_part(self.part_count, data)
+
+    def close(self):
+        if self.buffer or self.part_count == 0:
+            self._flush_part(bytes(self.buffer))
+            self.buffer.clear()
+        self.complete()
+
+    @abstractmethod
+    def upload_part(self, part_number, data):
+        pass
+
+    @abstractmethod
+    def complete(self):
+        pass
+
+    @abstractmethod
+    def abort(self):
+        pass
+
+
+class S3MultipartWriter(MultipartWriter):
+    def __init__(self, client, bucket, key, content_type, part_size=MIN_PART_SIZE):
+        super().__init__(part_size)
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        response = client.create_multipart_upload(Bucket=bucket, Key=key, ContentType=content_type)
+        self.upload_id = response['UploadId']
+        self.parts = []
+
+    def upload_part(self, part_number, data):
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=part_number, Body=data
+        )
+        self.parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+
+    def complete(self):
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={'Parts': self.parts}
+        )
+
+    def abort(self):
+        self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+
+class S3ObjectStore:
+    def __init__(self, bucket, region_name=None, client=None):
+        self.bucket = bucket
+        self.client = client if client is not None else clients.get_client('s3', region_name)
+
+    def put_object(self, key, body, content_type='application/octet-stream'):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=body, ContentType=content_type)
+
+    def get_object(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+        except self.client.exceptions.NoSuchKey:
+            raise ObjectNotFoundError(key)
+
+    # 全体を読み込まずに少しずつ読めるバイナリストリームを返す
+    def open_reader(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=key)['Body']
+        except self.client.exceptions.NoSuchKey:
+            raise ObjectNotFoundError(key)
+
+    def open_multipart(self, key, content_type='application/octet-stream', part_size=MIN_PART_SIZE):
+        return S3MultipartWriter(self.client, self.bucket, key, content_type, part_size)
+
+    def url_for(self, key, expires_in=3600):
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': key}, ExpiresIn=expires_in
+        )
+
+
+class LocalMultipartWriter(MultipartWriter):
+    def __init__(self, path, part_size=MIN_PART_SIZE):
+        super().__init__(part_size)
+        self.path = path
+        self.temp_path = f'{path}.part'
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(self.temp_path, 'wb')
+
+    def upload_part(self, part_number, data):
+        self.file.write(data)
+
+    def complete(self):
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+class LocalObjectStore:
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+
+    def _path(self, key):
+        path = os.path.abspath(os.path.join(self.root_dir, key))
+        if not path.startswith(os.path.abspath(self.root_dir) + os.sep):
+            raise ValueError(f'Invalid object key: {key}')
+        return path
+
+    def put_object(self, key, body, content_type='application/octet-stream'):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(body, str):
+            body = body.encode()
+        with open(f'{path}.part', 'wb') as f:
+            f.write(body)
+        os.replace(f'{path}.part', path)
+
+    def get_object(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            raise ObjectNotFoundError(key)
+
+    def open_reader(self, key):
+        try:
+            return open(self._path(key), 'rb')
+        except FileNotFoundError:
+            raise ObjectNotFoundError(key)
+
+    def open_multipart(self, key, content_type='application/octet-stream', part_size=MIN_PART_SIZE):
+        return LocalMultipartWriter(self._path(key), part_size)
+
+    def url_for(self, key, expires_in=3600):
+        return f'file://{self._path(key)}'
+
+
+# EXPORT_BUCKET があれば S3、無ければ OBJECT_STORE_DIR のローカルディレクトリを使う
+def from_env(region_name=None, bucket_env_name='EXPORT_BUCKET', local_dir_env_name='OBJECT_STORE_DIR'):
+    bucket = os.environ.get(bucket_env_name, '')
+    if bucket != '':
+        return S3ObjectStore(bucket, region_name=region_name)
+    local_dir = os.environ.get(local_dir_env_name, '')
+    if local_dir != '':
+        return LocalObjectStore(local_dir)
+    raise ValueError(f'{bucket_env_name} or {local_dir_env_name} must be set')
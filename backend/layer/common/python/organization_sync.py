@@ -0,0 +1,158 @@
+import logging
+import os
+
+import tracing
+from resilience import error_code, wrap_error
+from schema import Schema
+from serialization import deserialize_item
+
+logger = logging.getLogger(__name__)
+
+# organization の名前を users のアイテムにもコピーして持たせる（非正規化）
+# サインイン直後の organization-id-get が users の GetItem 1回で organization_id と organization_name を返せるようにする
+#
+# users のスキーマ（TABLE1_FIELD_TYPES）に organization_name と organization_version があるときだけ有効
+#   user-register      : 登録時に organization の名前・バージョンを user に書く（join はバージョンが変わっていないことを条件にする）
+#   rename_organization: organization の名前を変えて version を1つ上げ、所属する users のコピーを書き換える（fan_out）
+#   fan_out            : コピーの organization_version が新しいバージョンより小さいときだけ書くので、
+#                        何度実行しても・順番が入れ替わっても古い名前に戻らない
+#   organization-id-get: コピーの無い（有効にする前に登録した）user は organization を読んで、その場でコピーを書く
+# organizations の version は名前を変えたときに付く（無ければ 0）
+# users を organization_id で引く GSI（USERS_BY_ORGANIZATION_INDEX）が無ければ fan_out は users をスキャンする
+
+NAME_FIELD = 'organization_name'
+VERSION_FIELD = 'organization_version'
+ORGANIZATION_VERSION_FIELD = 'version'
+USERS_INDEX_ENV_NAME = 'USERS_BY_ORGANIZATION_INDEX'
+
+
+def is_enabled(user_field_types):
+    field_types = Schema.of(user_field_types).field_types
+    return NAME_FIELD in field_types and VERSION_FIELD in field_types
+
+
+def organization_version(organization_item):
+    return int(organization_item.get(ORGANIZATION_VERSION_FIELD, 0))
+
+
+def copy_fields(organization_item):
+    return {
+        NAME_FIELD: organization_item[NAME_FIELD],
+        VERSION_FIELD: organization_version(organization_item),
+    }
+
+
+def has_copy(user_item):
+    return NAME_FIELD in user_item and VERSION_FIELD in user_item
+
+
+# TransactWriteItems 用。join のときに読んだ organization の version のままであることを確認する
+def version_check_request(organization_handler, organization_item):
+    version = organization_version(organization_item)
+    check = {
+        'TableName': organization_handler.table_name,
+        'Key': {organization_handler.pk_name: {'S': organization_item[organization_handler.pk_name]}},
+        'ExpressionAttributeNames': {'#pk': organization_handler.pk_name, '#version': ORGANIZATION_VERSION_FIELD},
+    }
+    if version == 0:
+        check['ConditionExpression'] = 'attribute_exists(#pk) AND attribute_not_exists(#version)'
+    else:
+        check['ConditionExpression'] = 'attribute_exists(#pk) AND #version = :version'
+        check['ExpressionAttributeValues'] = {':version': {'N': str(version)}}
+    return {'ConditionCheck': check}
+
+
+# user のコピーを書く。同じか新しいバージョンのコピーが既にあれば何もしない（False を返す）
+def write_copy(user_handler, user_id, organization_item):
+    copy = copy_fields(organization_item)
+    try:
+        with tracing.span('organization_sync.write_copy'):
+            user_handler._call(
+                'update_item',
+                TableName=user_handler.table_name,
+                Key={user_handler.pk_name: {'S': user_id}},
+                UpdateExpression='SET #name = :name, #version = :version',
+                ConditionExpression='attribute_exists(#pk) AND (attribute_not_exists(#version) OR #version < :version)',
+                ExpressionAttributeNames={'#pk': user_handler.pk_name, '#name': NAME_FIELD, '#version': VERSION_FIELD},
+                ExpressionAttributeValues={':name': {'S': copy[NAME_FIELD]}, ':version': {'N': str(copy[VERSION_FIELD])}},
+            )
+        return True
+    except Exception as e:
+        if error_code(e) != 'ConditionalCheckFailedException':
+            raise wrap_error(e, 'Failed to write organization copy')
+        return False
+
+
+def iter_member_ids(user_handler, organization_field, organization_id, index_name=None):
+    params = {
+        'TableName': user_handler.table_name,
+        'ExpressionAttributeNames': {'#pk': user_handler.pk_name, '#organization_id': organization_field},
+        'ExpressionAttributeValues': {':organization_id': {'S': organization_id}},
+        'ProjectionExpression': '#pk',
+    }
+    if index_name:
+        params.update(IndexName=index_name, KeyConditionExpression='#organization_id = :organization_id')
+        pages = user_handler.iter_query_pages(params)
+    else:
+        params['FilterExpression'] = '#organization_id = :organization_id'
+        pages = iter_scan_pages(user_handler, params)
+    for items in pages:
+        for item in items:
+            yield item[user_handler.pk_name]['S']
+
+
+def iter_scan_pages(handler, params):
+    while True:
+        try:
+            response = handler._call('scan', **params)
+        except Exception as e:
+            raise wrap_error(e, 'Failed to scan')
+        yield response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+# organization に所属する users のコピーを organization_item の名前・バージョンにする
+# organization_field は users・organizations の両方で organization_id を持つ属性（TABLE2_PK_NAME）
+def fan_out(user_handler, organization_field, organization_item, index_name=None):
+    organization_id = organization_item[organization_field]
+    report = {'updated': 0, 'skipped': 0}
+    with tracing.span('organization_sync.fan_out'):
+        for user_id in iter_member_ids(user_handler, organization_field, organization_id, index_name):
+            if write_copy(user_handler, user_id, organization_item):
+                report['updated'] += 1
+            else:
+                report['skipped'] += 1
+    logger.info(f'Synced organization {organization_id} v{organization_version(organization_item)} to users: {report}')
+    return report
+
+
+# organization の名前を変えて version を上げ、更新後の organization を返す
+def rename_organization(organization_handler, organization_id, organization_name):
+    if organization_name == '':
+        raise ValueError('organization_name is required')
+    try:
+        response = organization_handler._call(
+            'update_item',
+            TableName=organization_handler.table_name,
+            Key={organization_handler.pk_name: {'S': organization_id}},
+            UpdateExpression='SET #name = :name, updated_at = :updated_at ADD #version :one',
+            ConditionExpression='attribute_exists(#pk)',
+            ExpressionAttributeNames={'#pk': organization_handler.pk_name, '#name': NAME_FIELD, '#version': ORGANIZATION_VERSION_FIELD},
+            ExpressionAttributeValues={
+                ':name': {'S': organization_name},
+                ':updated_at': {'S': organization_handler.get_current_timestamp()},
+                ':one': {'N': '1'},
+            },
+            ReturnValues='ALL_NEW',
+        )
+    except Exception as e:
+        if error_code(e) == 'ConditionalCheckFailedException':
+            raise ValueError(f'Organization not found: {organization_id}')
+        raise wrap_error(e, 'Failed to rename organization')
+    return deserialize_item(response['Attributes'])
+
+
+def users_index_from_env():
+    return os.environ.get(USERS_INDEX_ENV_NAME) or None
@@ -0,0 +1,224 @@
+import json
+import logging
+import os
+import random
+import time
+import uuid
+
+import clients
+import tracing
+from dynamodb_handler import CLIENT_CONFIG
+from resilience import ResilientCaller, RetryPolicy, error_code, wrap_error
+
+logger = logging.getLogger(__name__)
+
+# リクエストの処理（DynamoDB への書き込み）と一緒に確定させる副作用（Cognito グループへの追加など）を
+# アウトボックステーブルに書き、ワーカー（outbox-worker 関数）が取り出してリトライしながら実行する
+#
+# メッセージ: {"id": ..., "type": "add_user_to_group", "payload": {...}}
+# OutboxTable.put_request() をリクエストの TransactWriteItems に加えるので、書き込みが確定したときだけメッセージが残る
+# （確定した後にキューへ送るのと違い、送れずに副作用が失われることがない）
+#   ワーカーは DynamoDB Streams（INSERT）で新しいメッセージを受け取り、実行できたらレコードを消す
+#   失敗したら attempts を増やしてレコードを残す（ストリームのシャードは止めない）
+#   スケジュールされた sweep（{"outbox_sweep": true}）が、作られてから SWEEP_AFTER_SECONDS 経っても残っているものを再実行する
+#   attempts が max_attempts に達したものは再実行せず、エラーログを出して expires_at（TTL）まで残す
+# 副作用は少なくとも1回実行される（ストリームと sweep が重なることもある）ので、ハンドラーは冪等にすること
+
+TABLE_ENV_NAME = 'OUTBOX_TABLE_NAME'
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_MAX_ATTEMPTS = 10
+SWEEP_AFTER_SECONDS = 300
+
+ADD_USER_TO_GROUP = 'add_user_to_group'
+
+
+class UnknownMessageTypeError(ValueError):
+    pass
+
+
+def make_message(message_type, payload, message_id=None):
+    return {
+        'id': message_id or str(uuid.uuid4()),
+        'type': message_type,
+        'payload': payload,
+    }
+
+
+# テーブル・ストリームのアイテム（DynamoDB 形式）をメッセージに戻す
+def message_from_item(item, pk_name='message_id'):
+    return {
+        'id': item[pk_name]['S'],
+        'type': item['message_type']['S'],
+        'payload': json.loads(item['payload']['S']),
+        'attempts': int(item.get('attempts', {}).get('N', '0')),
+    }
+
+
+class OutboxTable:
+    # クライアントは botocore のリトライを無効にしているので、DynamoDBHandler と同じく ResilientCaller を通して呼ぶ
+    def __init__(self, table_name, pk_name='message_id', client=None, region_name=None,
+                 ttl_seconds=DEFAULT_TTL_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS, clock=time.time, resilience=None):
+        self.table_name = table_name
+        self.pk_name = pk_name
+        self.ttl_seconds = ttl_seconds
+        self.max_attempts = max_attempts
+        self.clock = clock
+        self.dynamodb = client if client is not None else clients.get_client('dynamodb', region_name, config=CLIENT_CONFIG)
+        self.resilience = resilience if resilience is not None else ResilientCaller.for_table(table_name)
+
+    def _call(self, operation, message, **params):
+        try:
+            return self.resilience.call(getattr(self.dynamodb, operation), **params)
+        except Exception as e:
+            if error_code(e) == 'ConditionalCheckFailedException':
+                raise
+            raise wrap_error(e, message)
+
+    def _key(self, message):
+        return {self.pk_name: {'S': message['id']}}
+
+    # TransactWriteItems 用の Put（呼び出し元のトランザクションに加える）
+    def put_request(self, message):
+        now = self.clock()
+        item = dict(self._key(message), **{
+            'message_type': {'S': message['type']},
+            'payload': {'S': json.dumps(message['payload'])},
+            'created_at': {'N': str(int(now))},
+            'attempts': {'N': '0'},
+            'expires_at': {'N': str(int(now + self.ttl_seconds))},
+        })
+        return {'Put': {
+            'TableName': self.table_name,
+            'Item': item,
+            'ConditionExpression': 'attribute_not_exists(#pk)',
+            'ExpressionAttributeNames': {'#pk': self.pk_name},
+        }}
+
+    def complete(self, message):
+        with tracing.span('outbox.complete'):
+            self._call('delete_item', 'Failed to complete outbox message', TableName=self.table_name, Key=self._key(message))
+
+    # 失敗した回数を増やし、増やした後の回数を返す（レコードが既に消えていれば何もしない）
+    def record_failure(self, message, error):
+        try:
+            with tracing.span('outbox.record_failure'):
+                response = self._call(
+                    'update_item', 'Failed to record outbox failure',
+                    TableName=self.table_name,
+                    Key=self._key(message),
+                    UpdateExpression='ADD attempts :one SET last_error = :error',
+                    ConditionExpression='attribute_exists(#pk)',
+                    ExpressionAttributeNames={'#pk': self.pk_name},
+                    ExpressionAttributeValues={':one': {'N': '1'}, ':error': {'S': str(error)[:1000]}},
+                    ReturnValues='UPDATED_NEW',
+                )
+        except Exception as e:
+            if error_code(e) != 'ConditionalCheckFailedException':
+                raise
+            return None
+        attempts = int(response['Attributes']['attempts']['N'])
+        if attempts >= self.max_attempts:
+            logger.error(f"Giving up side effect {message['type']} ({message['id']}) after {attempts} attempts")
+            tracing.current().add_count('outbox.dead')
+        return attempts
+
+    # 作られてから min_age 秒以上経ち、まだ諦めていないメッセージ
+    def pending(self, min_age=SWEEP_AFTER_SECONDS):
+        params = {
+            'TableName': self.table_name,
+            'FilterExpression': 'created_at <= :cutoff AND attempts < :max_attempts',
+            'ExpressionAttributeValues': {
+                ':cutoff': {'N': str(int(self.clock() - min_age))},
+                ':max_attempts': {'N': str(self.max_attempts)},
+            },
+        }
+        while True:
+            with tracing.span('outbox.scan'):
+                response = self._call('scan', 'Failed to scan outbox', **params)
+            for item in response.get('Items', []):
+                yield message_from_item(item, self.pk_name)
+            if 'LastEvaluatedKey' not in response:
+                return
+            params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+# OUTBOX_TABLE_NAME が未設定なら None（呼び出し元で副作用をその場で実行する）
+def from_env(region_name=None, env_name=TABLE_ENV_NAME):
+    table_name = os.environ.get(env_name, '')
+    if table_name == '':
+        return None
+    return OutboxTable(table_name, region_name=region_name)
+
+
+# 1つのメッセージを実行する。一時的なエラーに備えてその場で数回リトライし、それでも失敗したら例外を投げる
+def dispatch(message, handlers, policy=None, sleep=time.sleep, rng=None):
+    handler = handlers.get(message['type'])
+    if handler is None:
+        raise UnknownMessageTypeError(f"Unknown message type: {message['type']}")
+    policy = policy or RetryPolicy(max_attempts=3, base_delay=0.1, max_delay=1.0)
+    rng = rng or random.Random()
+    attempt = 0
+    while True:
+        try:
+            with tracing.span(f"outbox.{message['type']}"):
+                return handler(message['payload'])
+        except Exception as e:
+            if attempt + 1 >= policy.max_attempts:
+                raise
+            logger.warning(f"Side effect {message['type']} ({message['id']}) failed, retrying: {e}")
+            sleep(policy.delay(attempt, rng))
+            attempt += 1
+
+
+# 1つのメッセージを実行し、成功したらテーブルから消す。失敗したら attempts を増やして False を返す
+# 種類が分からないメッセージはリトライしても成功しないので、ログに残して消す
+def process_message(message, handlers, table, **dispatch_options):
+    try:
+        dispatch(message, handlers, **dispatch_options)
+        tracing.current().add_count('outbox.processed')
+    except UnknownMessageTypeError as e:
+        logger.error(f"Discarding message {message['id']}: {e}")
+    except Exception as e:
+        logger.error(f"Side effect {message['type']} ({message['id']}) failed: {e}", exc_info=True)
+        tracing.current().add_count('outbox.failed')
+        table.record_failure(message, e)
+        return False
+    table.complete(message)
+    return True
+
+
+# DynamoDB Streams のイベントの Records を処理し、失敗したメッセージの id を返す
+# 失敗したものはテーブルに残り sweep で再実行するので、ストリームには失敗を返さない
+def process_records(records, handlers, table, **dispatch_options):
+    failed = []
+    for record in records:
+        if record.get('eventName') != 'INSERT':
+            continue
+        message = message_from_item(record['dynamodb']['NewImage'], table.pk_name)
+        if not process_message(message, handlers, table, **dispatch_options):
+            failed.append(message['id'])
+    return failed
+
+
+# テーブルに残っているメッセージを再実行し、実行できた数を返す
+def sweep(table, handlers, min_age=SWEEP_AFTER_SECONDS, **dispatch_options):
+    processed = 0
+    for message in list(table.pending(min_age)):
+        if process_message(message, handlers, table, **dispatch_options):
+            processed += 1
+    return processed
+
+
+# ----- 副作用のハンドラー -----
+
+# admin_add_user_to_group は既に所属していても成功するので、再実行しても問題ない
+def cognito_handlers(user_pool_id, cognito_client):
+    def add_user_to_group(payload):
+        cognito_client.admin_add_user_to_group(
+            UserPoolId=user_pool_id,
+            Username=payload['username'],
+            GroupName=payload['group']
+        )
+        logger.info(f"Added user to group: username={payload['username']}, group={payload['group']}")
+
+    return {ADD_USER_TO_GROUP: add_user_to_group}
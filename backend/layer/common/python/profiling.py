@@ -0,0 +1,240 @@
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# 呼び出し単位の CPU（cProfile）・メモリ（tracemalloc）のプロファイリング
+#
+# 有効にする方法
+#   PROFILING=cpu / memory / all      : その関数の全ての呼び出しをプロファイルする
+#   x-profile ヘッダー（cpu / memory / all）: admin グループの（署名された Cognito トークンで認証済みの）リクエストだけ、
+#                                        認証の後に lambda_handler から start() を呼んでプロファイルを始める
+# 呼び出しの終わりに上位 PROFILING_TOP_N 件の関数（tottime 順）・メモリの確保箇所と、
+# クエリ・デシリアライズ・JSON のエンコード（FOCUS_FUNCTIONS）の集計を JSON 1行でログに出す
+# PROFILING_DIR を指定するとログの代わりにそのディレクトリにレポート（.json）と cProfile の生データ（.prof）を書く
+# 無効なときは呼び出しごとに環境変数を1回見るだけ
+# cProfile はスレッドごと（start したスレッドだけを計測する）。tracemalloc はプロセス全体で1つ
+
+MODE_ENV_NAME = 'PROFILING'
+DIR_ENV_NAME = 'PROFILING_DIR'
+TOP_N_ENV_NAME = 'PROFILING_TOP_N'
+HEADER_NAME = 'x-profile'
+DEFAULT_TOP_N = 15
+
+MODE_CPU = 'cpu'
+MODE_MEMORY = 'memory'
+MODES = {
+    MODE_CPU: (True, False),
+    MODE_MEMORY: (False, True),
+    'all': (True, True),
+}
+
+# 関数名で集計するホットスポット
+FOCUS_FUNCTIONS = {
+    'query_with_pagination': 'query',
+    'iter_query_pages': 'query',
+    'deserialize_item': 'deserialize',
+    'from_dynamodb': 'deserialize',
+    'dump_response_body': 'encode',
+    'dumps': 'encode',
+    'encode': 'encode',
+}
+
+_local = threading.local()
+_memory_lock = threading.Lock()
+_memory_sessions = 0
+_started_tracemalloc = False
+
+
+def parse_mode(mode):
+    mode = (mode or '').strip().lower()
+    if mode in ('', '0', 'false', 'off'):
+        return None
+    if mode in ('1', 'true', 'on'):
+        return 'all'
+    if mode not in MODES:
+        raise ValueError(f'Invalid profiling mode: {mode}')
+    return mode
+
+
+# x-profile ヘッダーの値（解析は start() で行う）
+def requested_mode(event):
+    return (event.get('headers') or {}).get(HEADER_NAME)
+
+
+class Session:
+    def __init__(self, service, mode, top_n=DEFAULT_TOP_N):
+        global _memory_sessions, _started_tracemalloc
+        self.service = service
+        self.mode = mode
+        self.top_n = top_n
+        self.cpu, self.memory = MODES[mode]
+        self.started = time.perf_counter()
+        self.profiler = None
+        # cProfile は他のプロファイラーが動いていると enable() で失敗するので先に始める
+        # （失敗したときに tracemalloc を始めたまま残さない）
+        if self.cpu:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            self.profiler = profiler
+        if self.memory:
+            try:
+                with _memory_lock:
+                    # 他で始めた tracemalloc は止めない
+                    if _memory_sessions == 0 and not tracemalloc.is_tracing():
+                        tracemalloc.start()
+                        _started_tracemalloc = True
+                    _memory_sessions += 1
+                tracemalloc.reset_peak()
+            except Exception:
+                if self.profiler is not None:
+                    self.profiler.disable()
+                raise
+
+    def stop(self):
+        global _memory_sessions, _started_tracemalloc
+        report = {
+            'event': 'profile',
+            'service': self.service,
+            'mode': self.mode,
+            'duration_ms': round((time.perf_counter() - self.started) * 1000, 3),
+        }
+        if self.profiler is not None:
+            self.profiler.disable()
+            report['cpu'] = cpu_report(pstats.Stats(self.profiler, stream=io.StringIO()), self.top_n)
+        if self.memory:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            with _memory_lock:
+                _memory_sessions -= 1
+                if _memory_sessions == 0 and _started_tracemalloc:
+                    tracemalloc.stop()
+                    _started_tracemalloc = False
+            report['memory'] = memory_report(snapshot, peak, self.top_n)
+        return report
+
+
+def _function_name(key):
+    filename, line, name = key
+    return f'{os.path.basename(filename)}:{line}({name})'
+
+
+def cpu_report(stats, top_n):
+    entries = stats.stats
+    top = sorted(entries.items(), key=lambda entry: entry[1][2], reverse=True)[:top_n]
+    focus = {}
+    for (filename, line, name), (_, calls, tottime, cumtime, _) in entries.items():
+        group = FOCUS_FUNCTIONS.get(name)
+        if group is None:
+            continue
+        totals = focus.setdefault(group, {'calls': 0, 'tottime_ms': 0.0, 'cumtime_ms': 0.0})
+        totals['calls'] += calls
+        totals['tottime_ms'] += tottime * 1000
+        # 再帰・入れ子の呼び出しは cumtime が重なるので、最も大きい値を使う
+        totals['cumtime_ms'] = max(totals['cumtime_ms'], cumtime * 1000)
+    for totals in focus.values():
+        totals['tottime_ms'] = round(totals['tottime_ms'], 3)
+        totals['cumtime_ms'] = round(totals['cumtime_ms'], 3)
+    return {
+        'total_ms': round(stats.total_tt * 1000, 3),
+        'top': [{
+            'function': _function_name(key),
+            'calls': calls,
+            'tottime_ms': round(tottime * 1000, 3),
+            'cumtime_ms': round(cumtime * 1000, 3),
+        } for key, (_, calls, tottime, cumtime, _) in top],
+        'focus': focus,
+    }
+
+
+def memory_report(snapshot, peak, top_n):
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)])
+    statistics = snapshot.statistics('lineno')
+    return {
+        'peak_bytes': peak,
+        'top': [{
+            'site': f'{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}',
+            'size_bytes': stat.size,
+            'count': stat.count,
+        } for stat in statistics[:top_n]],
+    }
+
+
+def current():
+    return getattr(_local, 'session', None)
+
+
+# 呼び出しの途中からプロファイルを始める（既に始まっていれば何もしない）
+def start(mode, service=None):
+    mode = parse_mode(mode)
+    if mode is None or current() is not None:
+        return current()
+    top_n = int(os.environ.get(TOP_N_ENV_NAME, DEFAULT_TOP_N))
+    _local.session = Session(service or getattr(_local, 'service', ''), mode, top_n)
+    return _local.session
+
+
+# start() と同じだが、失敗してもリクエストは止めない（ログに残してプロファイルせずに続ける）
+# 不正なモードのほか、Python 3.12 以降は別のスレッドで cProfile が動いていると enable() が ValueError になる
+def try_start(mode, service=None):
+    try:
+        return start(mode, service)
+    except Exception as e:
+        logger.error(f'Profiling not started: {e}')
+        return None
+
+
+def finish():
+    session = current()
+    if session is None:
+        return None
+    _local.session = None
+    report = session.stop()
+    write_report(report, session.profiler)
+    return report
+
+
+def write_report(report, profiler=None):
+    directory = os.environ.get(DIR_ENV_NAME, '')
+    if directory == '':
+        logger.warning(json.dumps(report))
+        return None
+    os.makedirs(directory, exist_ok=True)
+    name = f"{report['service'] or 'profile'}-{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    path = os.path.join(directory, f'{name}.json')
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    if profiler is not None:
+        profiler.dump_stats(os.path.join(directory, f'{name}.prof'))
+    logger.info(f'Wrote profile report to {path}')
+    return path
+
+
+# lambda_handler をラップする。PROFILING があれば最初から、無ければ start() が呼ばれたときだけプロファイルする
+def profiled(service):
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            _local.service = service
+            mode = os.environ.get(MODE_ENV_NAME)
+            if mode:
+                try_start(mode, service)
+            try:
+                return handler(event, context)
+            finally:
+                if current() is not None:
+                    try:
+                        finish()
+                    except Exception as e:
+                        logger.error(f'Failed to write profile report: {e}')
+        return wrapper
+    return decorator
@@ -0,0 +1,237 @@
+import logging
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+import tracing
+from serialization import dumps_raw, loads_raw
+
+logger = logging.getLogger(__name__)
+
+# DynamoDBHandler のクエリ結果（DynamoDB 形式のアイテム）を organization 単位でキャッシュする
+# キーは テーブル・PK・SK プレフィックス・射影 と organization ごとのバージョン番号から作る
+# put / update / delete のたびにバージョンを上げるので、古いエントリは参照されなくなり TTL で消える
+# バージョンはクエリの前に読むので、クエリ中に書き込みがあっても古い結果が新しいバージョンで保存されることはない
+#
+# バックエンドは get / set / incr を持つオブジェクト
+#   LRUCacheBackend   : コンテナ内のメモリ（ウォームな間だけ有効）
+#   RedisCacheBackend : Redis プロトコルのサーバー（コンテナ間で共有）
+# キャッシュの障害ではリクエストを失敗させず、キャッシュなしとして処理を続ける
+#
+# memory のバージョン番号はコンテナごとなので、書き込みで無効化されるのは書き込んだコンテナのキャッシュだけ
+# 他のコンテナは TTL が切れるまで古い結果を返しうる。既定の TTL を MEMORY_TTL_SECONDS と短くしているのはそのため
+# 書き込みをすぐに他のコンテナにも反映したいときは redis:// を使う
+
+DEFAULT_TTL_SECONDS = 30
+MEMORY_TTL_SECONDS = 2
+ENV_NAME = 'QUERY_CACHE'
+TTL_ENV_NAME = 'QUERY_CACHE_TTL'
+
+
+class LRUCacheBackend:
+    def __init__(self, max_entries=256, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= self.clock():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl_seconds=None):
+        with self.lock:
+            expires_at = self.clock() + ttl_seconds if ttl_seconds else None
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def incr(self, key):
+        with self.lock:
+            value, expires_at = self.entries.get(key, ('0', None))
+            value = str(int(value) + 1)
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            return int(value)
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisCacheBackend:
+    # RESP で GET / SET / INCR だけを使う最小限のクライアント。接続はコンテナ内で使い回す
+    def __init__(self, host='127.0.0.1', port=6379, timeout=0.2):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = None
+        self.reader = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_url(cls, url, timeout=0.2):
+        parsed = urlparse(url)
+        return cls(parsed.hostname or '127.0.0.1', parsed.port or 6379, timeout)
+
+    def _connect(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile('rb')
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.reader.close()
+                self.sock.close()
+            finally:
+                self.sock = None
+                self.reader = None
+
+    def execute(self, *args):
+        with self.lock:
+            try:
+                if self.sock is None:
+                    self._connect()
+                self.sock.sendall(encode_command(args))
+                return read_reply(self.reader)
+            except RedisError:
+                raise
+            except Exception:
+                # 壊れた接続は捨てて次の呼び出しで繋ぎ直す
+                self.close()
+                raise
+
+    def get(self, key):
+        value = self.execute('GET', key)
+        return value.decode() if value is not None else None
+
+    def set(self, key, value, ttl_seconds=None):
+        if ttl_seconds:
+            self.execute('SET', key, value, 'PX', int(ttl_seconds * 1000))
+        else:
+            self.execute('SET', key, value)
+
+    def incr(self, key):
+        return self.execute('INCR', key)
+
+
+def encode_command(args):
+    parts = [f'*{len(args)}\r\n'.encode()]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode()
+        parts.append(f'${len(data)}\r\n'.encode())
+        parts.append(data)
+        parts.append(b'\r\n')
+    return b''.join(parts)
+
+
+def read_reply(reader):
+    line = reader.readline()
+    if not line.endswith(b'\r\n'):
+        raise ConnectionError('Connection closed by server')
+    prefix, payload = line[:1], line[1:-2]
+    if prefix == b'+':
+        return payload.decode()
+    if prefix == b'-':
+        raise RedisError(payload.decode())
+    if prefix == b':':
+        return int(payload)
+    if prefix == b'$':
+        length = int(payload)
+        if length < 0:
+            return None
+        data = reader.read(length + 2)
+        return data[:-2]
+    if prefix == b'*':
+        length = int(payload)
+        if length < 0:
+            return None
+        return [read_reply(reader) for _ in range(length)]
+    raise RedisError(f'Unknown reply type: {line!r}')
+
+
+class QueryCache:
+    def __init__(self, backend, ttl_seconds=DEFAULT_TTL_SECONDS, namespace='query'):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.namespace = namespace
+
+    def _version_key(self, table_name, pk_val):
+        return f'{self.namespace}:v:{table_name}:{pk_val}'
+
+    def _entry_key(self, table_name, pk_val, version, sk_prefix, projection):
+        return f'{self.namespace}:e:{table_name}:{pk_val}:{version}:{sk_prefix}:{projection}'
+
+    # (バージョン, キャッシュされたアイテム or None) を返す。バージョンは store() にそのまま渡す
+    def lookup(self, table_name, pk_val, sk_prefix='', projection=''):
+        tracer = tracing.current()
+        try:
+            with tracer.span('cache.lookup'):
+                version = self.backend.get(self._version_key(table_name, pk_val)) or '0'
+                value = self.backend.get(self._entry_key(table_name, pk_val, version, sk_prefix, projection))
+        except Exception as e:
+            logger.warning(f'Query cache lookup failed: {e}')
+            tracer.add_count('cache.errors')
+            return None, None
+        if value is None:
+            tracer.add_count('cache.misses')
+            return version, None
+        tracer.add_count('cache.hits')
+        return version, loads_raw(value)
+
+    def store(self, table_name, pk_val, sk_prefix, projection, version, items):
+        if version is None:
+            return
+        try:
+            value = dumps_raw(items)
+        except TypeError:
+            # JSON にできない値を含むものはキャッシュしない
+            return
+        try:
+            self.backend.set(self._entry_key(table_name, pk_val, version, sk_prefix, projection), value, self.ttl_seconds)
+        except Exception as e:
+            logger.warning(f'Query cache store failed: {e}')
+            tracing.current().add_count('cache.errors')
+
+    # ウォームアップ用。Redis なら接続を張っておく
+    def prime(self):
+        self.backend.get(f'{self.namespace}:warmup')
+
+    def invalidate(self, table_name, pk_val):
+        try:
+            self.backend.incr(self._version_key(table_name, pk_val))
+        except Exception as e:
+            # 失敗しても TTL が過ぎれば最新の結果になる
+            logger.error(f'Query cache invalidation failed for {pk_val}: {e}')
+            tracing.current().add_count('cache.errors')
+
+
+# QUERY_CACHE=memory ならコンテナ内の LRU、redis://host:port なら Redis、未設定ならキャッシュしない
+# QUERY_CACHE_TTL の既定は memory なら MEMORY_TTL_SECONDS、redis なら DEFAULT_TTL_SECONDS
+def from_env(env_name=ENV_NAME, ttl_env_name=TTL_ENV_NAME):
+    setting = os.environ.get(env_name, '')
+    ttl = os.environ.get(ttl_env_name, '')
+    if setting == '':
+        return None
+    if setting == 'memory':
+        ttl_seconds = float(ttl) if ttl != '' else MEMORY_TTL_SECONDS
+        if ttl_seconds > MEMORY_TTL_SECONDS:
+            logger.warning(f'{env_name}=memory is not invalidated across containers; '
+                           f'other containers may return results up to {ttl_seconds}s old')
+        return QueryCache(LRUCacheBackend(), ttl_seconds)
+    if setting.startswith('redis://'):
+        return QueryCache(RedisCacheBackend.from_url(setting), float(ttl) if ttl != '' else DEFAULT_TTL_SECONDS)
+    raise ValueError(f'Invalid {env_name}: {setting}')
@@ -0,0 +1,235 @@
+import logging
+import math
+import os
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+import clients
+import tracing
+from dynamodb_handler import CLIENT_CONFIG
+from resilience import ResilientCaller, error_code, wrap_error
+
+logger = logging.getLogger(__name__)
+
+# organization ごとのトークンバケットによるレート制限
+#
+# 共有のバケットは DynamoDB のアイテム1つで、GCRA（Generic Cell Rate Algorithm）の理論到着時刻 tat だけを持つ
+#   n トークン使う = tat を n / rate 秒進める。tat - 現在時刻 が burst / rate 秒を超えるなら拒否
+# tat の計算（max(tat, now) + n / rate）を条件付き UpdateItem 1回で行う（読んでから書くことはしない）
+#   tat >= now のとき : SET tat = tat + :inc     条件 tat BETWEEN :now AND :max_tat
+#   tat <  now のとき : SET tat = :now + :inc    条件 attribute_not_exists(tat) OR tat < :now
+# 前回の結果から当たりそうな方を先に試し、条件が外れたらもう一方を試す
+#
+# コンテナ内のバケットには共有のバケットから lease_size トークンずつまとめて借りておき、
+# 残っている間は DynamoDB を呼ばずに処理する
+# DynamoDB のエラーではリクエストを止めない（制限しないで通す）
+
+STATUS_CODE_TOO_MANY_REQUESTS = 429
+
+READ = 'read'
+WRITE = 'write'
+JOB = 'job'
+
+# 書き込みは読み込みより WCU を多く使い、ジョブは大量のアイテムを読み書きするので重くする
+CLASS_COSTS = {READ: 1, WRITE: 5, JOB: 20}
+ACTION_CLASSES = {
+    'query': READ,
+    'low_stock': READ,
+    'export_status': READ,
+    'import_status': READ,
+    'put': WRITE,
+    'update': WRITE,
+    'adjust_qty': WRITE,
+    'delete': WRITE,
+    'export': JOB,
+    'import': JOB,
+}
+
+KEY_PREFIX = 'ratelimit#'
+BUCKET_SORT_KEY = 'bucket'
+# 使われなくなったバケットは DynamoDB の TTL で消す
+EXPIRES_AFTER_SECONDS = 3600
+
+RATE_ENV_NAME = 'RATE_LIMIT_PER_SECOND'
+BURST_ENV_NAME = 'RATE_LIMIT_BURST'
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, organization_id, retry_after):
+        super().__init__(f'Rate limit exceeded for {organization_id}, retry after {retry_after:.2f}s')
+        self.organization_id = organization_id
+        self.retry_after = retry_after
+
+
+def _number(value):
+    return {'N': f'{value:.3f}'}
+
+
+class DynamoDBBucketStore:
+    # クライアントは botocore のリトライを無効にしているので、DynamoDBHandler と同じく ResilientCaller を通して呼ぶ
+    def __init__(self, table_name, pk_name, sk_name='', client=None, region_name=None, resilience=None):
+        self.table_name = table_name
+        self.pk_name = pk_name
+        self.sk_name = sk_name
+        self.dynamodb = client if client is not None else clients.get_client('dynamodb', region_name, config=CLIENT_CONFIG)
+        self.resilience = resilience if resilience is not None else ResilientCaller.for_table(table_name)
+
+    def _key(self, organization_id):
+        key = {self.pk_name: {'S': f'{KEY_PREFIX}{organization_id}'}}
+        if self.sk_name != '':
+            key[self.sk_name] = {'S': BUCKET_SORT_KEY}
+        return key
+
+    def _update(self, organization_id, update_expression, condition, values):
+        values[':expires_at'] = {'N': str(int(time.time()) + EXPIRES_AFTER_SECONDS)}
+        try:
+            with tracing.span('ratelimit.update'):
+                response = self.resilience.call(
+                    self.dynamodb.update_item,
+                    TableName=self.table_name,
+                    Key=self._key(organization_id),
+                    UpdateExpression=f'{update_expression}, expires_at = :expires_at',
+                    ConditionExpression=condition,
+                    ExpressionAttributeValues=values,
+                    ReturnValues='UPDATED_NEW',
+                    ReturnValuesOnConditionCheckFailure='ALL_OLD',
+                )
+        except Exception as e:
+            # 条件が外れたときは lease() が ClientError の response（ALL_OLD）を使う
+            if error_code(e) == 'ConditionalCheckFailedException':
+                raise
+            raise wrap_error(e, 'Failed to update rate limit bucket')
+        return float(response['Attributes']['tat']['N'])
+
+    # increment 秒分（トークン数 / rate）を借りる。借りられたら (True, 新しい tat)、借りられなければ (False, 現在の tat)
+    def lease(self, organization_id, increment, tolerance, now, busy_hint=True):
+        attempts = [self._lease_busy, self._lease_idle]
+        if not busy_hint:
+            attempts.reverse()
+        current_tat = None
+        for attempt in attempts:
+            try:
+                return True, attempt(organization_id, increment, tolerance, now)
+            except ClientError as e:
+                if error_code(e) != 'ConditionalCheckFailedException':
+                    raise
+                item = e.response.get('Item')
+                if item is not None and 'tat' in item:
+                    current_tat = float(item['tat']['N'])
+                # バケットが満杯なことが分かったらもう一方は試さない
+                if current_tat is not None and current_tat >= now:
+                    if current_tat + increment - now > tolerance:
+                        break
+        return False, current_tat
+
+    def _lease_busy(self, organization_id, increment, tolerance, now):
+        return self._update(
+            organization_id,
+            'SET tat = tat + :inc',
+            'tat BETWEEN :now AND :max_tat',
+            {':inc': _number(increment), ':now': _number(now), ':max_tat': _number(now + tolerance - increment)},
+        )
+
+    def _lease_idle(self, organization_id, increment, tolerance, now):
+        return self._update(
+            organization_id,
+            'SET tat = :new_tat',
+            'attribute_not_exists(tat) OR tat < :now',
+            {':new_tat': _number(now + increment), ':now': _number(now)},
+        )
+
+
+class _LocalBucket:
+    def __init__(self):
+        self.tokens = 0
+        self.remote_tat = 0.0
+        self.lock = threading.Lock()
+
+
+class RateLimiter:
+    # rate: 1秒あたりのトークン数 / burst: 一度に使えるトークン数の上限
+    # burst が一番重い操作のコストより小さいと、その操作は一度も通らないので設定の誤りにする
+    def __init__(self, store, rate, burst, lease_size=10, costs=None, clock=time.time):
+        if rate <= 0 or burst <= 0:
+            raise ValueError('rate and burst must be positive')
+        self.costs = costs or CLASS_COSTS
+        if burst < max(self.costs.values()):
+            raise ValueError(f'burst must be at least {max(self.costs.values())} (the cost of the heaviest action)')
+        self.store = store
+        self.rate = rate
+        self.burst = burst
+        self.lease_size = lease_size
+        self.clock = clock
+        self.buckets = {}
+        self.buckets_lock = threading.Lock()
+
+    def cost_of(self, action):
+        return self.costs.get(ACTION_CLASSES.get(action, READ), 1)
+
+    def _bucket(self, organization_id):
+        with self.buckets_lock:
+            bucket = self.buckets.get(organization_id)
+            if bucket is None:
+                bucket = self.buckets[organization_id] = _LocalBucket()
+            return bucket
+
+    # トークンが足りなければ RateLimitExceeded を投げる
+    def check(self, organization_id, action):
+        cost = self.cost_of(action)
+        tracer = tracing.current()
+        bucket = self._bucket(organization_id)
+        with bucket.lock:
+            if bucket.tokens >= cost:
+                bucket.tokens -= cost
+                tracer.add_count('ratelimit.local_hits')
+                return
+
+            now = self.clock()
+            tolerance = self.burst / self.rate
+            # 共有のバケットに余裕がありそうならまとめて借り、無さそうなら今回の分だけ借りる
+            wanted = max(cost, min(self.lease_size, self.burst))
+            if bucket.remote_tat + wanted / self.rate - now > tolerance:
+                wanted = cost
+            try:
+                granted, tat = self.store.lease(organization_id, wanted / self.rate, tolerance, now, bucket.remote_tat >= now)
+                if not granted and wanted > cost:
+                    wanted = cost
+                    granted, tat = self.store.lease(organization_id, wanted / self.rate, tolerance, now, True)
+            except Exception as e:
+                logger.error(f'Rate limit check failed for {organization_id}, allowing request: {e}')
+                tracer.add_count('ratelimit.errors')
+                return
+            tracer.add_count('ratelimit.remote_calls')
+
+            if granted:
+                bucket.remote_tat = tat
+                bucket.tokens += wanted - cost
+                return
+            if tat is not None:
+                bucket.remote_tat = tat
+                retry_after = max(0.0, tat + cost / self.rate - tolerance - now)
+            else:
+                retry_after = cost / self.rate
+        tracer.add_count('ratelimit.rejected')
+        raise RateLimitExceeded(organization_id, retry_after)
+
+
+# RATE_LIMIT_PER_SECOND が未設定なら None（制限しない）。バケットは指定したテーブルに置く
+# RATE_LIMIT_BURST の既定は rate の10秒分（ただしジョブ1回分より小さくしない）
+def from_env(table_name, pk_name, sk_name='', region_name=None):
+    rate = os.environ.get(RATE_ENV_NAME, '')
+    if rate == '':
+        return None
+    rate = float(rate)
+    burst = float(os.environ.get(BURST_ENV_NAME) or max(rate * 10, max(CLASS_COSTS.values())))
+    store = DynamoDBBucketStore(table_name, pk_name, sk_name, region_name=region_name)
+    return RateLimiter(store, rate, burst)
+
+
+def too_many_requests_response(error):
+    return {
+        'statusCode': STATUS_CODE_TOO_MANY_REQUESTS,
+        'headers': {'Retry-After': str(max(1, math.ceil(error.retry_after)))},
+    }
@@ -0,0 +1,112 @@
+import socketserver
+import threading
+import time
+
+from query_cache import read_reply
+
+# テスト・ローカル実行用の Redis プロトコル（RESP）サーバー
+# query_cache.RedisCacheBackend が使うコマンド（GET / SET [PX|EX] / INCR）と PING / DEL / FLUSHALL だけを実装する
+#
+#   server = FakeRedisServer().start()
+#   backend = RedisCacheBackend(server.host, server.port)
+#   ...
+#   server.stop()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                args = read_reply(self.rfile)
+            except (ConnectionError, ValueError):
+                return
+            if not isinstance(args, list) or not args:
+                return
+            self.wfile.write(self.server.store.execute([a.decode() if isinstance(a, bytes) else a for a in args]))
+
+
+class _Store:
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.data = {}
+        self.lock = threading.Lock()
+        self.command_counts = {}
+
+    def _get(self, key):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= self.clock():
+            del self.data[key]
+            return None
+        return value
+
+    def execute(self, args):
+        command = args[0].upper()
+        with self.lock:
+            self.command_counts[command] = self.command_counts.get(command, 0) + 1
+            if command == 'PING':
+                return b'+PONG\r\n'
+            if command == 'GET':
+                value = self._get(args[1])
+                if value is None:
+                    return b'$-1\r\n'
+                data = value.encode()
+                return f'${len(data)}\r\n'.encode() + data + b'\r\n'
+            if command == 'SET':
+                expires_at = None
+                if len(args) >= 5 and args[3].upper() == 'PX':
+                    expires_at = self.clock() + int(args[4]) / 1000
+                elif len(args) >= 5 and args[3].upper() == 'EX':
+                    expires_at = self.clock() + int(args[4])
+                self.data[args[1]] = (args[2], expires_at)
+                return b'+OK\r\n'
+            if command == 'INCR':
+                value = self._get(args[1]) or '0'
+                try:
+                    value = int(value) + 1
+                except ValueError:
+                    return b'-ERR value is not an integer or out of range\r\n'
+                expires_at = self.data.get(args[1], (None, None))[1]
+                self.data[args[1]] = (str(value), expires_at)
+                return f':{value}\r\n'.encode()
+            if command == 'DEL':
+                deleted = sum(1 for key in args[1:] if self.data.pop(key, None) is not None)
+                return f':{deleted}\r\n'.encode()
+            if command == 'FLUSHALL':
+                self.data.clear()
+                return b'+OK\r\n'
+            return f'-ERR unknown command \'{args[0]}\'\r\n'.encode()
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, clock=time.monotonic):
+        super().__init__((host, port), _Handler)
+        self.store = _Store(clock)
+        self.thread = None
+
+    @property
+    def host(self):
+        return self.server_address[0]
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    @property
+    def command_counts(self):
+        return self.store.command_counts
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
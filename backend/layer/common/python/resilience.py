@@ -0,0 +1,364 @@
+import logging
+import math
+import random
+import threading
+import time
+from collections import deque
+
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# DynamoDB 呼び出しのエラー分類・リトライ・クライアント側レート制限・サーキットブレーカー
+# リミッターとブレーカーはテーブルごとにコンテナ内で共有し、呼び出しをまたいで状態を持つ
+
+STATUS_CODE_SERVICE_UNAVAILABLE = 503
+
+THROTTLING_ERROR_CODES = {
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+    'TooManyRequestsException',
+}
+CONDITIONAL_ERROR_CODES = {'ConditionalCheckFailedException', 'TransactionCanceledException'}
+VALIDATION_ERROR_CODES = {'ValidationException', 'SerializationException', 'ItemCollectionSizeLimitExceededException'}
+TRANSIENT_ERROR_CODES = {
+    'InternalServerError', 'ServiceUnavailable', 'TransactionConflictException', 'TransactionInProgressException', 'RequestTimeout',
+}
+# botocore のリトライを無効にしているので、接続できない・タイムアウト・切断などのネットワークエラーもここでリトライする
+NETWORK_ERRORS = (BotoConnectionError, HTTPClientError)
+
+ERROR_THROTTLE = 'throttle'
+ERROR_CONDITIONAL = 'conditional'
+ERROR_VALIDATION = 'validation'
+ERROR_TRANSIENT = 'transient'
+ERROR_UNKNOWN = 'unknown'
+
+
+class DynamoDBError(Exception):
+    pass
+
+
+class ThrottlingError(DynamoDBError):
+    pass
+
+
+class ConditionalCheckError(DynamoDBError):
+    pass
+
+
+# ValueError を継承させて lambda 側で 400 として扱えるようにする
+class DynamoDBValidationError(DynamoDBError, ValueError):
+    pass
+
+
+class CircuitOpenError(ThrottlingError):
+    pass
+
+
+def error_code(error):
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code', '')
+    return ''
+
+
+def classify_error(error):
+    if isinstance(error, NETWORK_ERRORS):
+        return ERROR_TRANSIENT
+    code = error_code(error)
+    if code == 'TransactionCanceledException':
+        # キャンセル理由にスロットリングが含まれていればスロットリングとして扱う
+        reasons = error.response.get('CancellationReasons', [])
+        if any(r.get('Code') in ('ThrottlingError', 'ProvisionedThroughputExceeded') for r in reasons):
+            return ERROR_THROTTLE
+        if any(r.get('Code') == 'TransactionConflict' for r in reasons):
+            return ERROR_TRANSIENT
+    if code in THROTTLING_ERROR_CODES:
+        return ERROR_THROTTLE
+    if code in CONDITIONAL_ERROR_CODES:
+        return ERROR_CONDITIONAL
+    if code in VALIDATION_ERROR_CODES:
+        return ERROR_VALIDATION
+    if code in TRANSIENT_ERROR_CODES:
+        return ERROR_TRANSIENT
+    # 5xx はサーバー側の一時的なエラー
+    if isinstance(error, ClientError) and error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500:
+        return ERROR_TRANSIENT
+    return ERROR_UNKNOWN
+
+
+_ERROR_CLASSES = {
+    ERROR_THROTTLE: ThrottlingError,
+    ERROR_CONDITIONAL: ConditionalCheckError,
+    ERROR_VALIDATION: DynamoDBValidationError,
+}
+
+
+# 例外を分類済みの例外に変換する（メッセージは 'Failed to ...: 元のエラー' の形式）
+def wrap_error(error, message):
+    if isinstance(error, DynamoDBError):
+        error_class = type(error)
+    else:
+        error_class = _ERROR_CLASSES.get(classify_error(error), DynamoDBError)
+    wrapped = error_class(f'{message}: {error}')
+    # ClientError の response や CircuitOpenError の retry_after を引き継ぐ
+    wrapped.__dict__.update(getattr(error, '__dict__', {}))
+    wrapped.__cause__ = error
+    return wrapped
+
+
+class Deadline:
+    def __init__(self, expires_at=None, clock=time.monotonic):
+        self.expires_at = expires_at
+        self.clock = clock
+
+    # Lambda の残り時間からレスポンスを返す余裕を引いた時刻を期限にする
+    @classmethod
+    def from_context(cls, context, safety_margin_ms=1000, clock=time.monotonic):
+        get_remaining = getattr(context, 'get_remaining_time_in_millis', None)
+        if get_remaining is None:
+            return cls(None, clock)
+        remaining_ms = max(0, get_remaining() - safety_margin_ms)
+        return cls(clock() + remaining_ms / 1000, clock)
+
+    def remaining(self):
+        if self.expires_at is None:
+            return float('inf')
+        return max(0.0, self.expires_at - self.clock())
+
+    def allows(self, seconds):
+        return self.remaining() > seconds
+
+
+UNLIMITED_DEADLINE = Deadline()
+
+
+class AdaptiveRateLimiter:
+    # スロットリングが発生するまでは制限しない。発生したら送信レートを下げ（乗算的減少）、
+    # 成功するたびに少しずつ戻す（加算的増加）
+    def __init__(self, min_rate=1.0, max_rate=1000.0, decrease_factor=0.5, increase_step=1.0, clock=time.monotonic):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.decrease_factor = decrease_factor
+        self.increase_step = increase_step
+        self.clock = clock
+        self.rate = None
+        self.tokens = 0.0
+        self.last_refill = clock()
+        self.recent_calls = deque()
+        self.lock = threading.Lock()
+
+    def is_enabled(self):
+        return self.rate is not None
+
+    # 直近1秒間の送信回数
+    def _measured_rate(self, now):
+        while self.recent_calls and now - self.recent_calls[0] >= 1.0:
+            self.recent_calls.popleft()
+        return float(len(self.recent_calls))
+
+    def _refill(self, now):
+        elapsed = now - self.last_refill
+        self.last_refill = now
+        if self.rate is not None:
+            self.tokens = min(max(self.rate, 1.0), self.tokens + elapsed * self.rate)
+
+    # 送信前に呼び、必要な待ち時間（秒）を返す。期限内に送れない場合は ThrottlingError
+    def acquire(self, deadline=UNLIMITED_DEADLINE):
+        with self.lock:
+            now = self.clock()
+            self.recent_calls.append(now)
+            self._measured_rate(now)
+            if self.rate is None:
+                return 0.0
+            self._refill(now)
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return 0.0
+            wait = (1.0 - self.tokens) / self.rate
+            if not deadline.allows(wait):
+                raise ThrottlingError('Client side rate limit exceeded before deadline')
+            self.tokens -= 1.0
+            return wait
+
+    def on_throttle(self):
+        with self.lock:
+            now = self.clock()
+            measured = self._measured_rate(now)
+            base = self.rate if self.rate is not None else max(measured, self.min_rate)
+            self._refill(now)
+            self.rate = max(self.min_rate, base * self.decrease_factor)
+            logger.info(f'Rate limiter decreased rate to {self.rate:.2f}/s')
+
+    def on_success(self):
+        with self.lock:
+            if self.rate is None:
+                return
+            self._refill(self.clock())
+            self.rate += self.increase_step
+            if self.rate >= self.max_rate:
+                self.rate = None
+
+
+# 数えるのはリトライし尽くしてもスロットリングで失敗した呼び出しの数（リトライ1回ごとではない）
+# OPEN から reset_timeout 経過後は HALF_OPEN にして1つの呼び出しだけを試し、結果が出るまで他の呼び出しは拒否する
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=10.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def _open_error(self, retry_after):
+        error = CircuitOpenError('Circuit breaker is open: table is persistently throttled')
+        error.retry_after = retry_after
+        return error
+
+    def before_call(self):
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                raise self._open_error(1.0)
+            if self.state == self.OPEN:
+                elapsed = self.clock() - self.opened_at
+                if elapsed < self.reset_timeout:
+                    raise self._open_error(self.reset_timeout - elapsed)
+                # 一定時間経過後は1回だけ試す
+                self.state = self.HALF_OPEN
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = self.clock()
+
+    # テーブルが応答した（条件チェックの失敗なども含む）
+    def on_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    # 呼び出しがスロットリングで失敗した
+    def on_throttle(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f'Circuit breaker opened after {self.failures} throttled calls')
+                self._open()
+
+    # スロットリング以外で失敗した（テーブルの状態は分からない）。試していた呼び出しなら OPEN に戻して後でまた試す
+    def on_error(self):
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self._open()
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=5, base_delay=0.05, max_delay=2.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    # full jitter: [0, min(max_delay, base * 2^attempt)] の一様乱数
+    def delay(self, attempt, rng):
+        return rng.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class ResilientCaller:
+    RETRYABLE = {ERROR_THROTTLE, ERROR_TRANSIENT}
+
+    def __init__(self, limiter=None, breaker=None, policy=None, deadline=UNLIMITED_DEADLINE,
+                 sleep=time.sleep, rng=None):
+        self.limiter = limiter or AdaptiveRateLimiter()
+        self.breaker = breaker or CircuitBreaker()
+        self.policy = policy or RetryPolicy()
+        self.deadline = deadline
+        self.sleep = sleep
+        self.rng = rng or random.Random()
+
+    @classmethod
+    def for_table(cls, table_name, deadline=UNLIMITED_DEADLINE, **kwargs):
+        limiter, breaker = get_table_guard(table_name)
+        return cls(limiter=limiter, breaker=breaker, deadline=deadline, **kwargs)
+
+    # ブレーカーは呼び出し全体（リトライを含む）の結果だけを見る
+    def call(self, fn, **params):
+        self.breaker.before_call()
+        try:
+            response = self._call_with_retry(fn, params)
+        except ClientError as e:
+            category = classify_error(e)
+            if category == ERROR_THROTTLE:
+                self.breaker.on_throttle()
+            elif category == ERROR_TRANSIENT:
+                self.breaker.on_error()
+            else:
+                self.breaker.on_success()
+            raise
+        except Exception:
+            self.breaker.on_error()
+            raise
+        self.breaker.on_success()
+        return response
+
+    def _call_with_retry(self, fn, params):
+        attempt = 0
+        while True:
+            wait = self.limiter.acquire(self.deadline)
+            if wait > 0:
+                self.sleep(wait)
+            try:
+                response = fn(**params)
+            except (ClientError,) + NETWORK_ERRORS as e:
+                category = classify_error(e)
+                if category == ERROR_THROTTLE:
+                    self.limiter.on_throttle()
+                    tracing.current().add_count('ddb.throttled')
+                if category in self.RETRYABLE and self.backoff(attempt):
+                    attempt += 1
+                    continue
+                raise
+            self.limiter.on_success()
+            return response
+
+    # リトライ前の待機。リトライ上限・期限を超える場合は False を返す
+    def backoff(self, attempt):
+        if attempt + 1 >= self.policy.max_attempts:
+            return False
+        delay = self.policy.delay(attempt, self.rng)
+        if not self.deadline.allows(delay):
+            return False
+        tracing.current().add_count('ddb.retries')
+        self.sleep(delay)
+        return True
+
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+
+def get_table_guard(table_name):
+    with _guards_lock:
+        if table_name not in _guards:
+            _guards[table_name] = (AdaptiveRateLimiter(), CircuitBreaker())
+        return _guards[table_name]
+
+
+def reset_table_guards():
+    with _guards_lock:
+        _guards.clear()
+
+
+def service_unavailable_response(error):
+    retry_after = max(1, math.ceil(getattr(error, 'retry_after', 1)))
+    return {
+        'statusCode': STATUS_CODE_SERVICE_UNAVAILABLE,
+        'headers': {'Retry-After': str(retry_after)},
+    }
@@ -0,0 +1,128 @@
+import json
+import sys
+from decimal import Decimal
+
+from serialization import deserialize_value
+
+# クエリ結果をアイテムごとの dict ではなく、スキーマから作った tuple のサブクラスで持つ
+# フィールド名はクラスで1回だけ持ち（intern 済み）、インスタンスは値の並びだけなので dict よりかなり小さい
+# 読み取り専用。値を変えるときは replace() で新しい行を作る
+
+_MISSING = object()
+
+
+class CompactRow(tuple):
+    __slots__ = ()
+    # サブクラスで設定する
+    fields = ()
+    index = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            value = self.get(key, _MISSING)
+            if value is _MISSING:
+                raise KeyError(key)
+            return value
+        return tuple.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        position = self.index.get(key)
+        if position is None:
+            extras = tuple.__getitem__(self, -1)
+            return extras.get(key, default) if extras is not None else default
+        value = tuple.__getitem__(self, position)
+        return default if value is _MISSING else value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def items(self):
+        for name, value in zip(self.fields, self):
+            if value is not _MISSING:
+                yield name, value
+        extras = tuple.__getitem__(self, -1)
+        if extras is not None:
+            yield from extras.items()
+
+    def keys(self):
+        return [name for name, _ in self.items()]
+
+    def to_dict(self):
+        item = {name: value for name, value in zip(self.fields, self) if value is not _MISSING}
+        extras = tuple.__getitem__(self, -1)
+        if extras is not None:
+            item.update(extras)
+        return item
+
+    def replace(self, key, value):
+        values = list(self)
+        position = self.index.get(key)
+        if position is None:
+            extras = dict(values[-1] or {})
+            extras[key] = value
+            values[-1] = extras
+        else:
+            values[position] = value
+        return tuple.__new__(type(self), values)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.to_dict()!r})'
+
+
+def make_row_type(fields, name='Row'):
+    fields = tuple(sys.intern(field) for field in fields)
+    index = {field: i for i, field in enumerate(fields)}
+    width = len(fields)
+
+    # DynamoDB 形式のアイテムから直接作る（途中で dict を作らない）
+    # スキーマに無い属性は最後の要素に dict でまとめる
+    def from_dynamodb(cls, item, _new=tuple.__new__, _index_get=index.get, _missing=[_MISSING] * width):
+        values = _missing.copy()
+        extras = None
+        for key, attr in item.items():
+            position = _index_get(key)
+            if position is None:
+                if extras is None:
+                    extras = {}
+                extras[key] = attr['S'] if 'S' in attr else deserialize_value(attr)
+            else:
+                values[position] = attr['S'] if 'S' in attr else deserialize_value(attr)
+        values.append(extras)
+        return _new(cls, values)
+
+    def from_dict(cls, item):
+        values = [item.get(field, _MISSING) for field in fields]
+        extras = {key: value for key, value in item.items() if key not in index}
+        values.append(extras or None)
+        return tuple.__new__(cls, values)
+
+    return type(name, (CompactRow,), {
+        '__slots__': (),
+        'fields': fields,
+        'index': index,
+        'from_dynamodb': classmethod(from_dynamodb),
+        'from_dict': classmethod(from_dict),
+    })
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, CompactRow):
+        return value.to_dict()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+DUMP_CHUNK_ROWS = 1000
+
+
+# json.dumps は tuple を配列として書き出すので、DUMP_CHUNK_ROWS 行ずつ dict に戻して書き出す
+# 一時的な dict はチャンク分だけなので全件を dict に戻すより使用メモリが少ない
+def dumps_rows(rows, default=_default):
+    chunks = []
+    for i in range(0, len(rows), DUMP_CHUNK_ROWS):
+        chunk = json.dumps([row.to_dict() for row in rows[i:i + DUMP_CHUNK_ROWS]], default=default)
+        chunks.append(chunk[1:-1])
+    return '[' + ', '.join(chunks) + ']'
@@ -0,0 +1,176 @@
+import functools
+import json
+import os
+from decimal import Decimal, InvalidOperation
+
+from rows import make_row_type
+
+# FIELD_TYPES 環境変数 ({"name": "S", "qty": "N", ...}) をコンテナ起動時に1回だけ解析し、
+# 入力チェック・書き込み用シリアライザ・更新式テンプレートをまとめて持つ
+
+
+def _serialize_string(name, value):
+    if not isinstance(value, str):
+        raise ValueError(f'Invalid value for {name}: expected string')
+    return {'S': value}
+
+
+def _serialize_number(name, value):
+    if isinstance(value, bool):
+        raise ValueError(f'Invalid value for {name}: expected number')
+    if isinstance(value, (int, Decimal)):
+        return {'N': str(value)}
+    if isinstance(value, (str, float)):
+        # フロントエンドのフォームは未入力の数値を '' で送るので 0 にする（qty_to_number の移行と同じ）
+        text = str(value).strip() or '0'
+        try:
+            number = Decimal(text)
+        except InvalidOperation:
+            raise ValueError(f'Invalid value for {name}: expected number')
+        if not number.is_finite():
+            raise ValueError(f'Invalid value for {name}: expected number')
+        return {'N': text}
+    raise ValueError(f'Invalid value for {name}: expected number')
+
+
+def _serialize_bool(name, value):
+    if not isinstance(value, bool):
+        raise ValueError(f'Invalid value for {name}: expected boolean')
+    return {'BOOL': value}
+
+
+def _serialize_binary(name, value):
+    if isinstance(value, str):
+        return {'B': value.encode()}
+    if isinstance(value, (bytes, bytearray)):
+        return {'B': bytes(value)}
+    raise ValueError(f'Invalid value for {name}: expected binary')
+
+
+def _serialize_string_set(name, value):
+    if not isinstance(value, (list, set, tuple)) or not all(isinstance(v, str) for v in value):
+        raise ValueError(f'Invalid value for {name}: expected list of strings')
+    return {'SS': sorted(set(value))}
+
+
+def _serialize_number_set(name, value):
+    if not isinstance(value, (list, set, tuple)):
+        raise ValueError(f'Invalid value for {name}: expected list of numbers')
+    return {'NS': sorted({_serialize_number(name, v)['N'] for v in value})}
+
+
+SERIALIZERS = {
+    'S': _serialize_string,
+    'N': _serialize_number,
+    'BOOL': _serialize_bool,
+    'B': _serialize_binary,
+    'SS': _serialize_string_set,
+    'NS': _serialize_number_set,
+}
+
+CREATED_AT = 'created_at'
+UPDATED_AT = 'updated_at'
+
+
+class UpdateTemplate:
+    __slots__ = ('fields', 'expression', 'names', 'placeholders')
+
+    def __init__(self, fields):
+        self.fields = fields
+        parts = ['#ua = :updated_at_val']
+        self.names = {'#ua': UPDATED_AT}
+        self.placeholders = []
+        for i, field in enumerate(fields):
+            parts.append(f'#f{i} = :v{i}')
+            self.names[f'#f{i}'] = field
+            self.placeholders.append((field, f':v{i}'))
+        self.expression = 'SET ' + ', '.join(parts)
+
+
+class Schema:
+    def __init__(self, field_types):
+        if not isinstance(field_types, dict):
+            raise ValueError('FIELD_TYPES must be a JSON object')
+        for name, field_type in field_types.items():
+            if field_type not in SERIALIZERS:
+                raise ValueError(f'Unsupported field type for {name}: {field_type}')
+        self.field_types = dict(field_types)
+        self.fields = frozenset(field_types)
+        self.serializers = {name: SERIALIZERS[field_type] for name, field_type in field_types.items()}
+        self.update_templates = {}
+        self.row_types = {}
+
+    @classmethod
+    def of(cls, field_types):
+        return field_types if isinstance(field_types, cls) else cls(field_types)
+
+    def unknown_fields(self, item):
+        return [name for name in item if name not in self.fields]
+
+    # 未定義のフィールドや型の合わない値があれば ValueError（ネットワーク呼び出し前に弾く）
+    # ignore に渡したフィールドは、スキーマに無くても型が違ってもエラーにしない（書き込まないもの）
+    def validate(self, item, ignore=()):
+        unknown = [name for name in self.unknown_fields(item) if name not in ignore]
+        if unknown:
+            raise ValueError(f'Unknown fields: {", ".join(sorted(unknown))}')
+        for name, value in item.items():
+            if name in self.serializers and name not in ignore:
+                self.serializers[name](name, value)
+
+    def serialize_value(self, name, value):
+        return self.serializers[name](name, value)
+
+    # スキーマに定義されたフィールドだけを DynamoDB 形式に変換する
+    def serialize_item(self, item):
+        serializers = self.serializers
+        return {name: serializers[name](name, value) for name, value in item.items() if name in serializers}
+
+    def update_template(self, field_names):
+        key = tuple(sorted(field_names))
+        template = self.update_templates.get(key)
+        if template is None:
+            template = UpdateTemplate(key)
+            self.update_templates[key] = template
+        return template
+
+    # キー列を先頭に、スキーマのフィールド、タイムスタンプの順に並べる（重複は除く）
+    def columns(self, key_fields=()):
+        columns = []
+        for name in [*key_fields, *self.field_types, CREATED_AT, UPDATED_AT]:
+            if name and name not in columns:
+                columns.append(name)
+        return columns
+
+    # クエリ結果用のコンパクトな行型。キー列の組み合わせごとに1回だけ作る
+    def row_type(self, key_fields=()):
+        key = tuple(key_fields)
+        row_type = self.row_types.get(key)
+        if row_type is None:
+            row_type = make_row_type(self.columns(key))
+            self.row_types[key] = row_type
+        return row_type
+
+    # updated_at は常にハンドラ側で設定するので入力に含まれていても無視する
+    # encode(field, attr) を渡すと、シリアライズした値をさらに変換する（圧縮など）
+    def build_update(self, item, timestamp, encode=None):
+        template = self.update_template(name for name in item if name != UPDATED_AT)
+        values = {':updated_at_val': {'S': timestamp}}
+        serializers = self.serializers
+        for field, placeholder in template.placeholders:
+            attr = serializers[field](field, item[field])
+            values[placeholder] = attr if encode is None else encode(field, attr)
+        return template.expression, template.names, values
+
+
+@functools.lru_cache(maxsize=None)
+def _parse_schema(raw):
+    try:
+        field_types = json.loads(raw)
+    except json.JSONDecodeError as e:
+        raise ValueError(f'Invalid FIELD_TYPES: {e}')
+    return Schema(field_types)
+
+
+# 同じ環境変数の値に対しては同じ Schema インスタンスを返す（コンテナ内で1回だけ構築）
+def load_schema(env_name='FIELD_TYPES'):
+    return _parse_schema(os.environ[env_name])
@@ -0,0 +1,89 @@
+import base64
+import json
+from decimal import Decimal
+
+# DynamoDB の型付き属性値 ({'S': 'abc'} など) を Python の値に変換する
+# boto3 の TypeDeserializer と同じ結果（N は Decimal）を返すが、
+# 型ごとの分岐を辞書引きにして、大半を占める S 型は関数呼び出しなしで処理する
+
+
+def _null(value):
+    return None
+
+
+def _identity(value):
+    return value
+
+
+def _binary(value):
+    return value if isinstance(value, bytes) else bytes(value)
+
+
+def _number_set(values):
+    return {Decimal(v) for v in values}
+
+
+def _binary_set(values):
+    return {_binary(v) for v in values}
+
+
+def _list(values):
+    return [deserialize_value(v) for v in values]
+
+
+def _map(value):
+    return deserialize_item(value)
+
+
+_DESERIALIZERS = {
+    'S': _identity,
+    'N': Decimal,
+    'BOOL': _identity,
+    'NULL': _null,
+    'B': _binary,
+    'SS': set,
+    'NS': _number_set,
+    'BS': _binary_set,
+    'L': _list,
+    'M': _map,
+}
+
+
+def deserialize_value(attr):
+    for attr_type, value in attr.items():
+        return _DESERIALIZERS[attr_type](value)
+    raise ValueError('Empty attribute value')
+
+
+def deserialize_item(item):
+    return {key: attr['S'] if 'S' in attr else deserialize_value(attr) for key, attr in item.items()}
+
+
+# DynamoDB 形式のアイテムを JSON の文字列にする（キャッシュ・スナップショット用）
+# B・BS の bytes は base64 の文字列にする（DynamoDB の JSON と同じ）
+def _encode_binary(value):
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _decode_binary(obj):
+    if len(obj) == 1:
+        if isinstance(obj.get('B'), str):
+            return {'B': base64.b64decode(obj['B'])}
+        if isinstance(obj.get('BS'), list):
+            return {'BS': [base64.b64decode(v) for v in obj['BS']]}
+    return obj
+
+
+def dumps_raw(value):
+    return json.dumps(value, separators=(',', ':'), default=_encode_binary)
+
+
+# バイナリ属性を含まないもの（ほとんど）は object_hook なしで読む
+def loads_raw(value):
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode()
+    if '"B":"' in value or '"BS":[' in value:
+        return json.loads(value, object_hook=_decode_binary)
+    return json.loads(value)
@@ -0,0 +1,116 @@
+import json
+import logging
+import os
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# 大きな organization のアイテムを複数のパーティションキーに分散させる（書き込みシャーディング）
+# シャード数が1のときは PK の値をそのまま使うので、既存データとの互換性を保てる
+# シャード数が2以上のときは PK を '<pk値>~<シャード番号>' にし、シャード番号は item_id から決める
+
+SHARD_SEPARATOR = '~'
+
+
+def shard_of(item_id, shard_count):
+    if shard_count <= 1:
+        return 0
+    return zlib.crc32(item_id.encode()) % shard_count
+
+
+def physical_pk(pk_val, shard, shard_count):
+    if shard_count <= 1:
+        return pk_val
+    return f'{pk_val}{SHARD_SEPARATOR}{shard}'
+
+
+def physical_pks(pk_val, shard_count):
+    return [physical_pk(pk_val, shard, shard_count) for shard in range(max(1, shard_count))]
+
+
+class ShardingPolicy:
+    def __init__(self, default_shard_count=1, overrides=None):
+        if default_shard_count < 1:
+            raise ValueError(f'Invalid shard count: {default_shard_count}')
+        self.default_shard_count = default_shard_count
+        self.overrides = dict(overrides or {})
+        for pk_val, shard_count in self.overrides.items():
+            if not isinstance(shard_count, int) or shard_count < 1:
+                raise ValueError(f'Invalid shard count for {pk_val}: {shard_count}')
+
+    # SHARD_COUNT: 全体のシャード数, SHARD_OVERRIDES: {"<organization_id>": シャード数, ...}
+    @classmethod
+    def from_env(cls, count_env_name='SHARD_COUNT', overrides_env_name='SHARD_OVERRIDES'):
+        default_shard_count = int(os.environ.get(count_env_name, '1'))
+        try:
+            overrides = json.loads(os.environ.get(overrides_env_name, '{}'))
+        except json.JSONDecodeError as e:
+            raise ValueError(f'Invalid {overrides_env_name}: {e}')
+        return cls(default_shard_count, overrides)
+
+    def shard_count(self, pk_val):
+        return self.overrides.get(pk_val, self.default_shard_count)
+
+    def is_sharded(self, pk_val):
+        return self.shard_count(pk_val) > 1
+
+    def shards_any(self):
+        return self.default_shard_count > 1 or any(count > 1 for count in self.overrides.values())
+
+
+NO_SHARDING = ShardingPolicy()
+
+
+# 既存の organization のアイテムを新しいシャード数のレイアウトに移し替える
+# 新しいキーへの書き込みが全て終わってから古いキーを削除するので、途中で失敗しても再実行できる
+# 移行中は書き込みを止め、完了後に SHARD_OVERRIDES を新しいシャード数に更新すること
+def reshard_organization(handler, pk_val, from_shard_count, to_shard_count):
+    if from_shard_count == to_shard_count:
+        return {'moved': 0, 'deleted': 0}
+    if handler.sk_name == '' or handler.sk_delimiter == '':
+        raise ValueError('Sharding requires a sort key with a delimiter')
+
+    moved = 0
+    old_keys = []
+    for source_pk in physical_pks(pk_val, from_shard_count):
+        query_params = {
+            'TableName': handler.table_name,
+            'KeyConditionExpression': '#pk = :pk_val',
+            'ExpressionAttributeNames': {'#pk': handler.pk_name},
+            'ExpressionAttributeValues': {':pk_val': {'S': source_pk}},
+        }
+        for page in handler.iter_query_pages(query_params):
+            put_requests = []
+            for item in page:
+                sk_val = item[handler.sk_name]['S']
+                _, item_id = handler.parse_sk_value(sk_val)
+                target_pk = physical_pk(pk_val, shard_of(item_id, to_shard_count), to_shard_count)
+                old_keys.append({handler.pk_name: {'S': source_pk}, handler.sk_name: {'S': sk_val}})
+                if target_pk == source_pk:
+                    continue
+                new_item = dict(item)
+                new_item[handler.pk_name] = {'S': target_pk}
+                put_requests.append({'PutRequest': {'Item': new_item}})
+            moved += _write_requests(handler, put_requests)
+
+    # 新しいレイアウトでも同じキーになるアイテムは削除しない
+    new_keys = set()
+    for key in old_keys:
+        _, item_id = handler.parse_sk_value(key[handler.sk_name]['S'])
+        new_keys.add((physical_pk(pk_val, shard_of(item_id, to_shard_count), to_shard_count), key[handler.sk_name]['S']))
+    delete_requests = [
+        {'DeleteRequest': {'Key': key}} for key in old_keys
+        if (key[handler.pk_name]['S'], key[handler.sk_name]['S']) not in new_keys
+    ]
+    deleted = _write_requests(handler, delete_requests)
+
+    logger.info(f'Resharded {pk_val}: {from_shard_count} -> {to_shard_count}, moved={moved}, deleted={deleted}')
+    return {'moved': moved, 'deleted': deleted}
+
+
+def _write_requests(handler, requests):
+    for i in range(0, len(requests), 25):
+        unprocessed_items = handler.batch_write_with_retry({handler.table_name: requests[i:i + 25]})
+        if unprocessed_items:
+            raise RuntimeError(f'Failed to reshard: unprocessed items remain: {unprocessed_items}')
+    return len(requests)
@@ -0,0 +1,322 @@
+import logging
+import os
+import threading
+import time
+import uuid
+import zlib
+
+import tracing
+from resilience import error_code, wrap_error
+from serialization import dumps_raw, loads_raw
+
+logger = logging.getLogger(__name__)
+
+# organization ごとの在庫全体のスナップショット（サインイン直後の一覧表示をパーティション全体のクエリなしで返す）
+#
+# 同じテーブルの PK 'snapshot#<organization_id>' に置く
+#   meta                          : version, build, chunk_count, item_count, cutoff（どの時点までの書き込みを含むか, epoch ミリ秒）
+#   chunk#<version>#<build>#<n>   : アイテム（DynamoDB 形式、論理 PK）の JSON を zlib で圧縮して分割したもの（B）
+#                                   build は作り直しごとの乱数。同時に作り直しても互いのチャンクを上書き・削除しない
+#   delta#<epoch ミリ秒>#<乱数>   : 書き込んだアイテムの SK（keys）。インポートなどで全体が変わったときは full
+# 読み取り: meta を GetItem → チャンクを BatchGetItem、cutoff 以降の delta を Query（並列）→ delta の SK を BatchGetItem で読み直してマージ
+# 書き込み: アイテムを書く前に delta を1件 PutItem する（カウンターなどの共有アイテムは更新しないのでホットにならない）
+#           delta を書けなければアイテムも書かない。アイテムの書き込みが失敗・中断しても余分な SK が残るだけ
+# 作り直し: 現在のスナップショット + delta（無ければパーティション全体のクエリ）から新しい version のチャンクを書き、
+#           meta を version の条件付きで切り替えてから古いチャンクを消す。delta は TTL（expires_at）で消える
+# cutoff は作り直しを始めた時刻から safety_seconds 引いた時刻にする。書き込みから delta が見えるまでの時間（関数のタイムアウト）
+# より長くしておけば、cutoff 以前の delta のアイテムはスナップショットに含まれている
+# 既定値は Lambda のタイムアウトの上限（900秒）。SNAPSHOT_SAFETY_SECONDS で変えられる（関数のタイムアウト未満にはしない）
+# delta が多い・全体が変わった・スナップショットが無い（古い）ときは stale として作り直しを依頼する（呼び出し元が非同期で実行する）
+
+ENV_NAME = 'SNAPSHOTS'
+SAFETY_ENV_NAME = 'SNAPSHOT_SAFETY_SECONDS'
+KEY_PREFIX = 'snapshot#'
+META_SK = 'meta'
+CHUNK_PREFIX = 'chunk#'
+DELTA_PREFIX = 'delta#'
+
+# 1アイテム 400KB の制限に収める（圧縮後）
+MAX_CHUNK_BYTES = 300 * 1024
+# 圧縮前にまとめる目安。圧縮しても MAX_CHUNK_BYTES を超えたら半分に分ける
+RAW_CHUNK_BYTES = 2 * 1024 * 1024
+# BatchGetItem の上限（100キー・16MB）
+BATCH_GET_KEYS = 100
+BATCH_GET_CHUNKS = 40
+
+SAFETY_SECONDS = 900
+DELTA_TTL_SECONDS = 7 * 24 * 3600
+COMPACT_AFTER_KEYS = 50
+MAX_DELTA_KEYS = 1000
+# 同じコンテナから同じ organization の作り直しを続けて依頼しない
+REBUILD_INTERVAL_SECONDS = 60
+
+
+def compress_chunk(raw_items):
+    return zlib.compress(dumps_raw(raw_items).encode(), 6)
+
+
+def decompress_chunk(data):
+    return loads_raw(zlib.decompress(data))
+
+
+# アイテムのリストを圧縮したチャンク（bytes）のリストにする
+def encode_chunks(raw_items, max_chunk_bytes=MAX_CHUNK_BYTES, raw_chunk_bytes=RAW_CHUNK_BYTES):
+    groups = []
+    group = []
+    group_bytes = 0
+    for item in raw_items:
+        size = len(dumps_raw(item))
+        if group and group_bytes + size > raw_chunk_bytes:
+            groups.append(group)
+            group, group_bytes = [], 0
+        group.append(item)
+        group_bytes += size
+    if group or not groups:
+        groups.append(group)
+
+    chunks = []
+    while groups:
+        group = groups.pop(0)
+        data = compress_chunk(group)
+        if len(data) > max_chunk_bytes and len(group) > 1:
+            middle = len(group) // 2
+            groups[:0] = [group[:middle], group[middle:]]
+            continue
+        if len(data) > max_chunk_bytes:
+            raise ValueError(f'Item is too large for a snapshot chunk: {len(data)} bytes')
+        chunks.append(data)
+    return chunks
+
+
+def batch_get(handler, keys, consistent=False, batch_size=BATCH_GET_KEYS):
+    found = []
+    for i in range(0, len(keys), batch_size):
+        request_items = {handler.table_name: {'Keys': keys[i:i + batch_size], 'ConsistentRead': consistent}}
+        attempt = 0
+        while request_items:
+            try:
+                with tracing.span('ddb.batch_get'):
+                    response = handler._call('batch_get_item', RequestItems=request_items)
+            except Exception as e:
+                raise wrap_error(e, 'Failed to batch get items')
+            found.extend(response.get('Responses', {}).get(handler.table_name, []))
+            request_items = response.get('UnprocessedKeys') or {}
+            if request_items and not handler.resilience.backoff(attempt):
+                raise RuntimeError('BatchGetItem left unprocessed keys')
+            attempt += 1
+    return found
+
+
+class InventorySnapshots:
+    def __init__(self, safety_seconds=SAFETY_SECONDS, delta_ttl_seconds=DELTA_TTL_SECONDS, compact_after_keys=COMPACT_AFTER_KEYS,
+                 max_delta_keys=MAX_DELTA_KEYS, rebuild_interval_seconds=REBUILD_INTERVAL_SECONDS, clock=time.time):
+        self.safety_seconds = safety_seconds
+        self.delta_ttl_seconds = delta_ttl_seconds
+        self.compact_after_keys = compact_after_keys
+        self.max_delta_keys = max_delta_keys
+        self.rebuild_interval_seconds = rebuild_interval_seconds
+        self.clock = clock
+        self.requested = {}
+        self.lock = threading.Lock()
+
+    def _key(self, handler, pk_val, sk_val):
+        return {handler.pk_name: {'S': f'{KEY_PREFIX}{pk_val}'}, handler.sk_name: {'S': sk_val}}
+
+    def _chunk_key(self, handler, pk_val, version, build, n):
+        return self._key(handler, pk_val, f'{CHUNK_PREFIX}{version:08d}#{build}#{n:04d}')
+
+    # これから書くアイテムの SK を delta に記録する。sk_vals が None ならパーティション全体が変わることを記録する
+    def record(self, handler, pk_val, sk_vals=None):
+        now = self.clock()
+        item = self._key(handler, pk_val, f'{DELTA_PREFIX}{int(now * 1000):013d}#{uuid.uuid4().hex[:12]}')
+        if sk_vals is not None:
+            sk_vals = sorted(set(sk_vals))
+            if not sk_vals:
+                return
+        if sk_vals is None or len(sk_vals) > self.max_delta_keys:
+            item['full'] = {'BOOL': True}
+        else:
+            item['keys'] = {'SS': sk_vals}
+        item['expires_at'] = {'N': str(int(now + self.delta_ttl_seconds))}
+        try:
+            with tracing.span('snapshot.record'):
+                handler._call('put_item', TableName=handler.table_name, Item=item)
+        except Exception as e:
+            raise wrap_error(e, 'Failed to record snapshot delta')
+
+    def get_meta(self, handler, pk_val):
+        with tracing.span('snapshot.meta'):
+            response = handler._call('get_item', TableName=handler.table_name, Key=self._key(handler, pk_val, META_SK),
+                                     ConsistentRead=True)
+        item = response.get('Item')
+        if item is None or 'version' not in item:
+            return None
+        meta = {name: int(item[name]['N']) for name in ('version', 'chunk_count', 'item_count', 'cutoff')}
+        meta['build'] = item.get('build', {}).get('S', '')
+        return meta
+
+    def read_chunks(self, handler, pk_val, meta):
+        keys = [self._chunk_key(handler, pk_val, meta['version'], meta['build'], n) for n in range(meta['chunk_count'])]
+        found = {item[handler.sk_name]['S']: item for item in batch_get(handler, keys, batch_size=BATCH_GET_CHUNKS)}
+        raw_items = {}
+        for key in keys:
+            chunk = found.get(key[handler.sk_name]['S'])
+            if chunk is None:
+                # 作り直しで消された（古い version を読んでいた）
+                return None
+            with tracing.span('snapshot.decompress'):
+                for item in decompress_chunk(chunk['data']['B']):
+                    raw_items[item[handler.sk_name]['S']] = item
+        return raw_items
+
+    # cutoff 以降の delta の SK を返す（全体が変わっていたら None）
+    def read_delta(self, handler, pk_val, cutoff):
+        query_params = {
+            'TableName': handler.table_name,
+            'KeyConditionExpression': '#pk = :pk_val AND #sk BETWEEN :start AND :end',
+            'ExpressionAttributeNames': {'#pk': handler.pk_name, '#sk': handler.sk_name},
+            'ExpressionAttributeValues': {
+                ':pk_val': {'S': f'{KEY_PREFIX}{pk_val}'},
+                ':start': {'S': f'{DELTA_PREFIX}{cutoff:013d}'},
+                ':end': {'S': f'{DELTA_PREFIX}~'},
+            },
+            'ConsistentRead': True,
+        }
+        sk_vals = set()
+        for items in handler.iter_query_pages(query_params):
+            for item in items:
+                if item.get('full', {}).get('BOOL'):
+                    return None
+                sk_vals.update(item.get('keys', {}).get('SS', []))
+        return sk_vals
+
+    # スナップショットに delta のアイテムの現在の値をマージする（消されたアイテムは除く）
+    def merge(self, handler, pk_val, raw_items, sk_vals):
+        keys = [{handler.pk_name: {'S': handler.physical_pk_for_sk(pk_val, sk_val)}, handler.sk_name: {'S': sk_val}}
+                for sk_val in sorted(sk_vals)]
+        for sk_val in sk_vals:
+            raw_items.pop(sk_val, None)
+        for item in batch_get(handler, keys, consistent=True):
+            item[handler.pk_name] = {'S': pk_val}
+            raw_items[item[handler.sk_name]['S']] = item
+        return [raw_items[sk_val] for sk_val in sorted(raw_items)]
+
+    # スナップショットと delta から現在のアイテム（DynamoDB 形式、SK 順）を組み立てる
+    # 戻り値: (meta, アイテムのリスト or None, delta の SK の数, 使えなかった理由)
+    def read(self, handler, pk_val):
+        meta = self.get_meta(handler, pk_val)
+        if meta is None:
+            return None, None, 0, 'missing'
+        if (self.clock() - self.delta_ttl_seconds + self.safety_seconds) * 1000 > meta['cutoff']:
+            # delta が TTL で消えているかもしれない
+            return meta, None, 0, 'expired'
+
+        from dynamodb_handler import get_shard_executor
+        chunks_future = get_shard_executor().submit(tracing.in_context(self.read_chunks), handler, pk_val, meta)
+        sk_vals = self.read_delta(handler, pk_val, meta['cutoff'])
+        raw_items = chunks_future.result()
+        if sk_vals is None:
+            return meta, None, 0, 'full'
+        if len(sk_vals) > self.max_delta_keys:
+            return meta, None, len(sk_vals), 'delta'
+        if raw_items is None:
+            return meta, None, len(sk_vals), 'replaced'
+        with tracing.span('snapshot.merge'):
+            return meta, self.merge(handler, pk_val, raw_items, sk_vals), len(sk_vals), ''
+
+    # クエリの代わりに使う。戻り値: (アイテムのリスト or None, 作り直しを依頼するか)
+    def load(self, handler, pk_val):
+        tracer = tracing.current()
+        with tracing.span('snapshot.load'):
+            meta, raw_items, delta_keys, reason = self.read(handler, pk_val)
+        if raw_items is None:
+            tracer.add_count('snapshot.misses')
+            logger.info(f'Snapshot of {pk_val} is not usable ({reason})')
+        else:
+            tracer.add_count('snapshot.hits')
+            tracer.add_count('snapshot.delta_keys', delta_keys)
+            tracer.set_property('snapshot_version', meta['version'])
+        stale = raw_items is None or delta_keys >= self.compact_after_keys
+        return raw_items, stale and self.should_request(pk_val)
+
+    def should_request(self, pk_val):
+        now = self.clock()
+        with self.lock:
+            if now - self.requested.get(pk_val, float('-inf')) < self.rebuild_interval_seconds:
+                return False
+            self.requested[pk_val] = now
+            return True
+
+    # スナップショットを作り直す。他の作り直しが先に切り替えていたら None を返す
+    def build(self, handler, pk_val):
+        started = self.clock()
+        cutoff = int((started - self.safety_seconds) * 1000)
+        meta, raw_items, _, reason = self.read(handler, pk_val)
+        if raw_items is None:
+            logger.info(f'Building snapshot of {pk_val} from a full query ({reason})')
+            query_params = {
+                'TableName': handler.table_name,
+                'KeyConditionExpression': '#pk = :pk_val',
+                'ExpressionAttributeNames': {'#pk': handler.pk_name},
+                'ExpressionAttributeValues': {':pk_val': {'S': pk_val}},
+            }
+            with tracing.span('snapshot.query'):
+                raw_items = handler.query_raw_items(pk_val, query_params)
+
+        version = (meta['version'] if meta is not None else 0) + 1
+        build = uuid.uuid4().hex[:12]
+        with tracing.span('snapshot.compress'):
+            chunks = encode_chunks(raw_items)
+        self.write_chunks(handler, pk_val, version, build, chunks)
+
+        new_meta = {'version': version, 'chunk_count': len(chunks), 'item_count': len(raw_items), 'cutoff': cutoff}
+        item = self._key(handler, pk_val, META_SK)
+        item.update({name: {'N': str(value)} for name, value in new_meta.items()})
+        item['build'] = {'S': build}
+        new_meta['build'] = build
+        item['built_at'] = {'S': handler.get_current_timestamp()}
+        item['bytes'] = {'N': str(sum(len(chunk) for chunk in chunks))}
+        params = {'ConditionExpression': 'attribute_not_exists(version)'}
+        if meta is not None:
+            params = {'ConditionExpression': 'version = :version', 'ExpressionAttributeValues': {':version': {'N': str(meta['version'])}}}
+        try:
+            with tracing.span('snapshot.switch'):
+                handler._call('put_item', TableName=handler.table_name, Item=item, **params)
+        except Exception as e:
+            if error_code(e) != 'ConditionalCheckFailedException':
+                raise wrap_error(e, 'Failed to switch snapshot')
+            logger.info(f'Snapshot of {pk_val} was rebuilt by another request')
+            # 自分のチャンクだけを消す（切り替えた側のチャンクは build が違う）
+            self.delete_chunks(handler, pk_val, version, build, len(chunks))
+            return None
+
+        if meta is not None:
+            self.delete_chunks(handler, pk_val, meta['version'], meta['build'], meta['chunk_count'])
+        logger.info(f'Built snapshot of {pk_val}: {new_meta}')
+        return new_meta
+
+    def write_chunks(self, handler, pk_val, version, build, chunks):
+        requests = []
+        for n, data in enumerate(chunks):
+            item = self._chunk_key(handler, pk_val, version, build, n)
+            item['data'] = {'B': data}
+            requests.append({'PutRequest': {'Item': item}})
+        self._batch_write(handler, requests, 'write')
+
+    def delete_chunks(self, handler, pk_val, version, build, chunk_count):
+        requests = [{'DeleteRequest': {'Key': self._chunk_key(handler, pk_val, version, build, n)}} for n in range(chunk_count)]
+        self._batch_write(handler, requests, 'delete')
+
+    def _batch_write(self, handler, requests, operation):
+        for i in range(0, len(requests), 25):
+            unprocessed_items = handler.batch_write_with_retry({handler.table_name: requests[i:i + 25]})
+            if unprocessed_items:
+                raise RuntimeError(f'Failed to {operation} snapshot chunks')
+
+
+# SNAPSHOTS=true でスナップショットを使う（未設定なら None）
+def from_env(env_name=ENV_NAME):
+    if os.environ.get(env_name, '').lower() not in ('1', 'true', 'yes'):
+        return None
+    safety_seconds = int(os.environ.get(SAFETY_ENV_NAME, SAFETY_SECONDS))
+    return InventorySnapshots(safety_seconds=safety_seconds)
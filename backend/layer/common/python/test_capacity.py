@@ -0,0 +1,81 @@
+import pytest
+import capacity
+from capacity import CapacityMeter
+from dynamodb_fake import FakeDynamoDBClient
+from dynamodb_handler import DynamoDBHandler
+
+
+@pytest.fixture
+def meter():
+    return CapacityMeter(organization_id='org1', action='query')
+
+
+@pytest.fixture
+def handler(meter):
+    client = FakeDynamoDBClient(page_size_bytes=300)
+    client.add_table('test_table', 'pk', 'sk')
+    return DynamoDBHandler(
+        region_name='ap-northeast-1',
+        table_name='test_table',
+        pk_name='pk',
+        sk_name='sk',
+        sk_prefix='category',
+        sk_suffix='id',
+        sk_delimiter='#',
+        field_types={'pk': 'S', 'sk': 'S', 'id': 'S', 'category': 'S', 'name': 'S'},
+        client=client,
+        capacity_meter=meter
+    )
+
+
+def test_is_enabled(monkeypatch):
+    monkeypatch.delenv(capacity.ENABLED_ENV_NAME, raising=False)
+    assert capacity.is_enabled() is False
+    monkeypatch.setenv(capacity.ENABLED_ENV_NAME, 'true')
+    assert capacity.is_enabled() is True
+
+
+def test_record_read_and_write_units(meter):
+    meter.record('query', {'Count': 3, 'ConsumedCapacity': {'CapacityUnits': 1.5}})
+    meter.record('put_item', {'ConsumedCapacity': {'CapacityUnits': 2.0}})
+    meter.record('batch_write_item', {'ConsumedCapacity': [
+        {'TableName': 't', 'CapacityUnits': 3.0, 'WriteCapacityUnits': 3.0},
+    ]})
+
+    summary = meter.summary()
+    assert summary['organization_id'] == 'org1'
+    assert summary['action'] == 'query'
+    assert summary['rcu'] == 1.5
+    assert summary['wcu'] == 5.0
+    assert summary['operations']['query'] == {'calls': 1, 'rcu': 1.5, 'wcu': 0.0, 'items': 3}
+    assert summary['query_page_items'] == [3]
+
+
+def test_record_without_consumed_capacity(meter):
+    meter.record('get_item', {'Item': {'pk': {'S': 'a'}}})
+    assert meter.summary()['operations']['get_item']['items'] == 1
+    assert meter.total_rcu() == 0.0
+
+
+def test_set_tags(meter):
+    meter.set_tags(organization_id='org2')
+    assert meter.summary()['organization_id'] == 'org2'
+
+
+def test_handler_collects_capacity_per_page(handler, meter):
+    for i in range(6):
+        handler.put_item({'pk': 'org1', 'category': 'ic', 'name': f'part{i}'})
+    items = handler.query_by_PK({'pk': 'org1'})
+
+    summary = meter.summary()
+    assert len(items) == 6
+    assert summary['operations']['put_item']['calls'] == 6
+    assert summary['operations']['put_item']['wcu'] == 6.0
+    assert summary['operations']['query']['calls'] == len(summary['query_page_items'])
+    assert sum(summary['query_page_items']) == 6
+    assert summary['rcu'] > 0
+
+
+def test_emit_returns_summary(meter):
+    meter.record('query', {'Count': 1, 'ConsumedCapacity': {'CapacityUnits': 0.5}})
+    assert meter.emit()['rcu'] == 0.5
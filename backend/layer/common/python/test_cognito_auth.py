@@ -40,3 +40,14 @@ def test_jwt_decode_expired_signature(mock_jwt_decode, mock_get_jwks, sample_eve
     assert result is False
     assert auth.get_claims() is None
 
+
+@pytest.mark.parametrize('error', [jwt.JWTClaimsError('bad audience'), jwt.JWTError('Signature verification failed.')])
+@patch('cognito_auth.CognitoAuthenticator.get_cognito_jwks')
+@patch('cognito_auth.jwt.decode')
+def test_jwt_decode_invalid_token(mock_jwt_decode, mock_get_jwks, sample_event, error):
+    mock_get_jwks.return_value = {'keys': []}
+    mock_jwt_decode.side_effect = error
+
+    auth = CognitoAuthenticator('ap-northeast-1', 'userpool123', 'test_app')
+    assert auth.jwt_decode(sample_event) is False
+    assert auth.get_claims() is None
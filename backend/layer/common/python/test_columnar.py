@@ -0,0 +1,50 @@
+import json
+from decimal import Decimal
+from columnar import ColumnarEncoder, decode_columnar, encode_columnar
+
+
+def make_items(count):
+    return [{
+        'organization_id': 'org1',
+        'category_item_id': f'ic#{i}',
+        'category': ['ic', 'cap', 'res'][i % 3],
+        'name': f'part{i}',
+        'qty': Decimal(i),
+    } for i in range(count)]
+
+
+def test_round_trip():
+    items = make_items(10)
+    document = json.loads(encode_columnar(items, ['organization_id', 'category_item_id', 'category', 'name', 'qty']))
+    assert document['count'] == 10
+    assert document['fields'] == ['organization_id', 'category_item_id', 'category', 'name', 'qty']
+    assert decode_columnar(document) == [{**item, 'qty': str(item['qty'])} for item in items]
+
+
+def test_low_cardinality_columns_are_dictionary_encoded():
+    document = json.loads(encode_columnar(make_items(10)))
+    assert document['columns']['category'] == {
+        'dictionary': ['ic', 'cap', 'res'],
+        'codes': [0, 1, 2, 0, 1, 2, 0, 1, 2, 0],
+    }
+    assert document['columns']['organization_id']['dictionary'] == ['org1']
+    assert isinstance(document['columns']['name'], list)
+    # 数値の列は辞書エンコードしない
+    assert document['columns']['qty'] == [str(i) for i in range(10)]
+
+
+def test_missing_values_and_late_fields():
+    encoder = ColumnarEncoder(['name', 'category'])
+    encoder.add([{'name': 'a', 'category': 'ic'}, {'name': 'b'}])
+    encoder.add([{'name': 'c', 'category': 'ic', 'note': 'new'}, {'name': 'd', 'category': 'ic'}])
+    document = json.loads(encoder.encode())
+    assert document['fields'] == ['name', 'category', 'note']
+    assert document['columns']['category']['codes'] == [0, -1, 0, 0]
+    assert document['columns']['note'] == {'dictionary': ['new'], 'codes': [-1, -1, 0, -1]}
+    assert decode_columnar(document)[1] == {'name': 'b'}
+
+
+def test_empty():
+    document = json.loads(encode_columnar([], ['name']))
+    assert document == {'format': 'columnar', 'count': 0, 'fields': ['name'], 'columns': {'name': {'dictionary': [], 'codes': []}}}
+    assert decode_columnar(document) == []
@@ -0,0 +1,90 @@
+import os
+import pytest
+from dynamodb_fake import FakeDynamoDBClient, item_size as fake_item_size
+from dynamodb_handler import DynamoDBHandler
+from query_cache import LRUCacheBackend, QueryCache
+import compression
+
+FIELD_TYPES = {'pk': 'S', 'sk': 'S', 'id': 'S', 'category': 'S', 'name': 'S', 'note': 'S', 'qty': 'N'}
+LONG_NOTE = 'Keep away from moisture. Store in the anti-static bag. ' * 100
+
+
+def make_handler(client, **kwargs):
+    compressor = compression.TextCompressor.for_schema(FIELD_TYPES, exclude=['pk', 'sk', 'id', 'category'], min_bytes=256)
+    return DynamoDBHandler('ap-northeast-1', 'components', 'pk', 'sk', 'category', 'id', '#', FIELD_TYPES,
+                           client=client, compressor=compressor, **kwargs)
+
+
+@pytest.fixture
+def client():
+    client = FakeDynamoDBClient()
+    client.add_table('components', 'pk', 'sk')
+    return client
+
+
+def stored(client, sk):
+    return client.get_item(TableName='components', Key={'pk': {'S': 'org1'}, 'sk': {'S': sk}})['Item']
+
+
+def test_large_text_is_stored_compressed_and_read_back(client):
+    handler = make_handler(client)
+    sk = handler.put_item({'pk': 'org1', 'category': 'ic', 'name': 'part', 'note': LONG_NOTE, 'qty': 1})[0]['sk']
+    raw = stored(client, sk)
+    assert 'B' in raw['note'] and len(raw['note']['B']) < len(LONG_NOTE) // 10
+    # 短い属性・キーは圧縮しない
+    assert raw['name'] == {'S': 'part'} and raw['category'] == {'S': 'ic'}
+
+    assert handler.query_by_PK({'pk': 'org1'})[0]['note'] == LONG_NOTE
+    assert handler.get_item({'pk': 'org1', 'sk': sk})['note'] == LONG_NOTE
+    assert make_handler(client, compact_rows=True).query_by_sk_prefix({'pk': 'org1', 'category': 'ic'})[0]['note'] == LONG_NOTE
+    # 射影しなかった属性は読まない
+    assert handler.get_item({'pk': 'org1', 'sk': sk}, ['name']) == {'name': 'part'}
+
+    # 短い値で更新すると S に戻る
+    assert handler.update_item({'pk': 'org1', 'sk': sk, 'note': 'short'})[0]['note'] == 'short'
+    assert stored(client, sk)['note'] == {'S': 'short'}
+    assert handler.update_item({'pk': 'org1', 'sk': sk, 'note': LONG_NOTE})[0]['note'] == LONG_NOTE
+    assert 'B' in stored(client, sk)['note']
+
+
+def test_compressed_items_survive_query_cache(client):
+    handler = make_handler(client, query_cache=QueryCache(LRUCacheBackend()))
+    handler.put_item({'pk': 'org1', 'category': 'ic', 'name': 'part', 'note': LONG_NOTE, 'qty': 1})
+    assert handler.query_by_PK({'pk': 'org1'})[0]['note'] == LONG_NOTE
+    client.reset_call_counts()
+    assert handler.query_by_PK({'pk': 'org1'})[0]['note'] == LONG_NOTE
+    assert client.call_counts == {}
+
+
+def test_expand_returns_same_item_without_compressed_attributes():
+    compressor = compression.TextCompressor(['note'], min_bytes=16)
+    item = {'note': {'S': 'plain'}, 'name': {'S': 'x'}}
+    assert compressor.expand(item) is item
+    compressed = compressor.compress_item({'note': {'S': LONG_NOTE}})
+    assert compressor.expand(compressed) == {'note': {'S': LONG_NOTE}}
+    assert 'B' in compressed['note']
+    # 圧縮しても小さくならないものはそのまま
+    assert compressor.compress_attribute('note', {'S': 'abcdefghijklmnopqrstuvwxyz'}) == {'S': 'abcdefghijklmnopqrstuvwxyz'}
+
+
+def test_oversized_items_are_rejected_before_the_call(client):
+    handler = make_handler(client, max_item_bytes=4 * 1024)
+    incompressible = os.urandom(8 * 1024).hex()
+    with pytest.raises(ValueError, match='Item too large'):
+        handler.put_item({'pk': 'org1', 'category': 'ic', 'name': incompressible})
+    sk = handler.put_item({'pk': 'org1', 'category': 'ic', 'name': 'part'})[0]['sk']
+    client.reset_call_counts()
+    with pytest.raises(ValueError, match='Item too large'):
+        handler.update_item({'pk': 'org1', 'sk': sk, 'name': incompressible})
+    assert client.call_counts == {}
+    # 圧縮して収まるものは書ける
+    handler.put_item({'pk': 'org1', 'category': 'ic', 'name': 'part', 'note': LONG_NOTE * 5})
+
+
+def test_item_size_is_not_smaller_than_dynamodb_size():
+    item = {
+        'pk': {'S': 'org1'}, 'name': {'S': '抵抗器'}, 'qty': {'N': '12345.678'}, 'note': {'B': b'\x00z1abc'},
+        'tags': {'SS': ['a', 'bc']}, 'flag': {'BOOL': True},
+        'extra': {'M': {'list': {'L': [{'S': 'x'}, {'N': '1'}]}}},
+    }
+    assert compression.item_size(item) >= fake_item_size(item)
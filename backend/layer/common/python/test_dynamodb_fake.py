@@ -0,0 +1,399 @@
+import pytest
+from botocore.exceptions import ClientError
+from dynamodb_fake import FakeDynamoDBClient
+from dynamodb_handler import DynamoDBHandler
+
+
+@pytest.fixture
+def client():
+    client = FakeDynamoDBClient()
+    client.add_table('test_table', 'pk', 'sk')
+    return client
+
+
+@pytest.fixture
+def handler(client):
+    return DynamoDBHandler(
+        region_name='ap-northeast-1',
+        table_name='test_table',
+        pk_name='pk',
+        sk_name='sk',
+        sk_prefix='category',
+        sk_suffix='id',
+        sk_delimiter='#',
+        field_types={'pk': 'S', 'sk': 'S', 'id': 'S', 'category': 'S', 'name': 'S', 'qty': 'N'},
+        client=client
+    )
+
+
+def put(client, pk, sk, **attrs):
+    item = {'pk': {'S': pk}, 'sk': {'S': sk}}
+    item.update(attrs)
+    client.put_item(TableName='test_table', Item=item)
+
+
+def error_code(excinfo):
+    return excinfo.value.response['Error']['Code']
+
+
+# ===== 単一アイテム操作 =====
+
+def test_put_and_get_item(client):
+    put(client, 'org1', 'a#1', name={'S': 'resistor'})
+    response = client.get_item(TableName='test_table', Key={'pk': {'S': 'org1'}, 'sk': {'S': 'a#1'}})
+    assert response['Item']['name'] == {'S': 'resistor'}
+
+
+def test_get_item_not_found(client):
+    response = client.get_item(TableName='test_table', Key={'pk': {'S': 'org1'}, 'sk': {'S': 'none'}})
+    assert 'Item' not in response
+
+
+def test_get_item_projection(client):
+    put(client, 'org1', 'a#1', name={'S': 'resistor'}, qty={'N': '3'})
+    response = client.get_item(
+        TableName='test_table',
+        Key={'pk': {'S': 'org1'}, 'sk': {'S': 'a#1'}},
+        ProjectionExpression='#n',
+        ExpressionAttributeNames={'#n': 'name'}
+    )
+    assert response['Item'] == {'name': {'S': 'resistor'}}
+
+
+def test_put_item_condition_failed(client):
+    put(client, 'org1', 'a#1')
+    with pytest.raises(ClientError) as excinfo:
+        client.put_item(
+            TableName='test_table',
+            Item={'pk': {'S': 'org1'}, 'sk': {'S': 'a#1'}},
+            ConditionExpression='attribute_not_exists(pk)'
+        )
+    assert error_code(excinfo) == 'ConditionalCheckFailedException'
+
+
+def test_put_item_missing_key(client):
+    with pytest.raises(ClientError) as excinfo:
+        client.put_item(TableName='test_table', Item={'pk': {'S': 'org1'}})
+    assert error_code(excinfo) == 'ValidationException'
+
+
+def test_unknown_table(client):
+    with pytest.raises(ClientError) as excinfo:
+        client.put_item(TableName='unknown', Item={'pk': {'S': 'org1'}})
+    assert error_code(excinfo) == 'ResourceNotFoundException'
+
+
+def test_update_item_set_and_add(client):
+    put(client, 'org1', 'a#1', qty={'N': '3'})
+    response = client.update_item(
+        TableName='test_table',
+        Key={'pk': {'S': 'org1'}, 'sk': {'S': 'a#1'}},
+        UpdateExpression='SET #n = :name ADD #q :delta',
+        ExpressionAttributeNames={'#n': 'name', '#q': 'qty'},
+        ExpressionAttributeValues={':name': {'S': 'capacitor'}, ':delta': {'N': '-2'}},
+        ReturnValues='ALL_NEW'
+    )
+    assert response['Attributes']['name'] == {'S': 'capacitor'}
+    assert response['Attributes']['qty'] == {'N': '1'}
+
+
+def test_update_item_updated_new_returns_only_updated(client):
+    put(client, 'org1', 'a#1', name={'S': 'resistor'}, qty={'N': '3'})
+    response = client.update_item(
+        TableName='test_table',
+        Key={'pk': {'S': 'org1'}, 'sk': {'S': 'a#1'}},
+        UpdateExpression='SET #n = :name',
+        ExpressionAttributeNames={'#n': 'name'},
+        ExpressionAttributeValues={':name': {'S': 'resistor'}},
+        ReturnValues='UPDATED_NEW'
+    )
+    assert response['Attributes'] == {'name': {'S': 'resistor'}}
+
+
+def test_update_item_creates_missing_item(client):
+    client.update_item(
+        TableName='test_table',
+        Key={'pk': {'S': 'org1'}, 'sk': {'S': 'a#1'}},
+        UpdateExpression='ADD #q :delta',
+        ExpressionAttributeNames={'#q': 'qty'},
+        ExpressionAttributeValues={':delta': {'N': '5'}}
+    )
+    response = client.get_item(TableName='test_table', Key={'pk': {'S': 'org1'}, 'sk': {'S': 'a#1'}})
+    assert response['Item']['qty'] == {'N': '5'}
+
+
+def test_update_item_condition_floor(client):
+    put(client, 'org1', 'a#1', qty={'N': '1'})
+    with pytest.raises(ClientError) as excinfo:
+        client.update_item(
+            TableName='test_table',
+            Key={'pk': {'S': 'org1'}, 'sk': {'S': 'a#1'}},
+            UpdateExpression='ADD #q :delta',
+            ConditionExpression='#q >= :need',
+            ExpressionAttributeNames={'#q': 'qty'},
+            ExpressionAttributeValues={':delta': {'N': '-2'}, ':need': {'N': '2'}}
+        )
+    assert error_code(excinfo) == 'ConditionalCheckFailedException'
+
+
+def test_update_item_add_to_string_is_validation_error(client):
+    put(client, 'org1', 'a#1', qty={'S': '1'})
+    with pytest.raises(ClientError) as excinfo:
+        client.update_item(
+            TableName='test_table',
+            Key={'pk': {'S': 'org1'}, 'sk': {'S': 'a#1'}},
+            UpdateExpression='ADD #q :delta',
+            ExpressionAttributeNames={'#q': 'qty'},
+            ExpressionAttributeValues={':delta': {'N': '1'}}
+        )
+    assert error_code(excinfo) == 'ValidationException'
+
+
+def test_update_item_key_attribute_is_validation_error(client):
+    put(client, 'org1', 'a#1')
+    with pytest.raises(ClientError) as excinfo:
+        client.update_item(
+            TableName='test_table',
+            Key={'pk': {'S': 'org1'}, 'sk': {'S': 'a#1'}},
+            UpdateExpression='SET #pk = :v',
+            ExpressionAttributeNames={'#pk': 'pk'},
+            ExpressionAttributeValues={':v': {'S': 'org2'}}
+        )
+    assert error_code(excinfo) == 'ValidationException'
+
+
+def test_delete_item(client):
+    put(client, 'org1', 'a#1')
+    client.delete_item(TableName='test_table', Key={'pk': {'S': 'org1'}, 'sk': {'S': 'a#1'}})
+    assert client.tables['test_table'].item_count() == 0
+
+
+# ===== クエリ =====
+
+def test_query_begins_with_sorted(client):
+    put(client, 'org1', 'b#1')
+    put(client, 'org1', 'a#2')
+    put(client, 'org1', 'a#1')
+    put(client, 'org2', 'a#3')
+    response = client.query(
+        TableName='test_table',
+        KeyConditionExpression='#pk = :pk_val AND begins_with(#sk, :sk_prefix_val)',
+        ExpressionAttributeNames={'#pk': 'pk', '#sk': 'sk'},
+        ExpressionAttributeValues={':pk_val': {'S': 'org1'}, ':sk_prefix_val': {'S': 'a#'}}
+    )
+    assert [item['sk']['S'] for item in response['Items']] == ['a#1', 'a#2']
+    assert 'LastEvaluatedKey' not in response
+
+
+def test_query_pagination_with_limit(client):
+    for i in range(5):
+        put(client, 'org1', f'a#{i}')
+    params = {
+        'TableName': 'test_table',
+        'KeyConditionExpression': '#pk = :pk_val',
+        'ExpressionAttributeNames': {'#pk': 'pk'},
+        'ExpressionAttributeValues': {':pk_val': {'S': 'org1'}},
+        'Limit': 2,
+    }
+    pages = []
+    while True:
+        response = client.query(**params)
+        pages.append([item['sk']['S'] for item in response['Items']])
+        if 'LastEvaluatedKey' not in response:
+            break
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    assert pages == [['a#0', 'a#1'], ['a#2', 'a#3'], ['a#4']]
+
+
+@pytest.mark.parametrize('forward, expected', [(True, ['a#2', 'a#3']), (False, ['a#2', 'a#1'])])
+def test_query_resumes_after_deleted_start_key(client, forward, expected):
+    for i in range(5):
+        put(client, 'org1', f'a#{i}')
+    params = {
+        'TableName': 'test_table',
+        'KeyConditionExpression': '#pk = :pk_val',
+        'ExpressionAttributeNames': {'#pk': 'pk'},
+        'ExpressionAttributeValues': {':pk_val': {'S': 'org1'}},
+        'Limit': 2,
+        'ScanIndexForward': forward,
+    }
+    first = client.query(**params)
+    client.delete_item(TableName='test_table', Key=first['LastEvaluatedKey'])
+    second = client.query(**dict(params, ExclusiveStartKey=first['LastEvaluatedKey']))
+    assert [item['sk']['S'] for item in second['Items']] == expected
+
+
+def test_index_query_resumes_after_deleted_start_key():
+    client = FakeDynamoDBClient()
+    client.create_table(
+        TableName='test_table',
+        KeySchema=[{'AttributeName': 'pk', 'KeyType': 'HASH'}, {'AttributeName': 'sk', 'KeyType': 'RANGE'}],
+        GlobalSecondaryIndexes=[{
+            'IndexName': 'by-group',
+            'KeySchema': [{'AttributeName': 'group', 'KeyType': 'HASH'}, {'AttributeName': 'sk', 'KeyType': 'RANGE'}],
+        }],
+    )
+    for i in range(4):
+        put(client, f'org{i % 2}', f'a#{i}', group={'S': 'g'})
+    params = {
+        'TableName': 'test_table',
+        'IndexName': 'by-group',
+        'KeyConditionExpression': '#group = :group',
+        'ExpressionAttributeNames': {'#group': 'group'},
+        'ExpressionAttributeValues': {':group': {'S': 'g'}},
+        'Limit': 2,
+    }
+    first = client.query(**params)
+    assert [item['sk']['S'] for item in first['Items']] == ['a#0', 'a#1']
+    client.delete_item(TableName='test_table', Key={'pk': {'S': 'org1'}, 'sk': {'S': 'a#1'}})
+    second = client.query(**dict(params, ExclusiveStartKey=first['LastEvaluatedKey']))
+    assert [item['sk']['S'] for item in second['Items']] == ['a#2', 'a#3']
+
+
+def test_scan_resumes_after_deleted_start_key(client):
+    for i in range(3):
+        put(client, 'org1', f'a#{i}')
+        put(client, 'org2', f'a#{i}')
+    first = client.scan(TableName='test_table', Limit=2)
+    assert first['LastEvaluatedKey'] == {'pk': {'S': 'org1'}, 'sk': {'S': 'a#1'}}
+    client.delete_item(TableName='test_table', Key=first['LastEvaluatedKey'])
+    second = client.scan(TableName='test_table', Limit=2, ExclusiveStartKey=first['LastEvaluatedKey'])
+    assert [(item['pk']['S'], item['sk']['S']) for item in second['Items']] == [('org1', 'a#2'), ('org2', 'a#0')]
+
+
+def test_query_page_size_bytes():
+    client = FakeDynamoDBClient(page_size_bytes=100)
+    client.add_table('test_table', 'pk', 'sk')
+    for i in range(4):
+        put(client, 'org1', f'a#{i}', note={'S': 'x' * 60})
+    response = client.query(
+        TableName='test_table',
+        KeyConditionExpression='#pk = :pk_val',
+        ExpressionAttributeNames={'#pk': 'pk'},
+        ExpressionAttributeValues={':pk_val': {'S': 'org1'}}
+    )
+    assert len(response['Items']) == 2
+    assert response['LastEvaluatedKey']['sk'] == {'S': 'a#1'}
+
+
+def test_query_without_partition_key_is_validation_error(client):
+    with pytest.raises(ClientError) as excinfo:
+        client.query(
+            TableName='test_table',
+            KeyConditionExpression='begins_with(#sk, :v)',
+            ExpressionAttributeNames={'#sk': 'sk'},
+            ExpressionAttributeValues={':v': {'S': 'a'}}
+        )
+    assert error_code(excinfo) == 'ValidationException'
+
+
+# ===== バッチ・トランザクション =====
+
+def test_batch_write_item_put_and_delete(client):
+    put(client, 'org1', 'a#1')
+    response = client.batch_write_item(RequestItems={'test_table': [
+        {'PutRequest': {'Item': {'pk': {'S': 'org1'}, 'sk': {'S': 'a#2'}}}},
+        {'DeleteRequest': {'Key': {'pk': {'S': 'org1'}, 'sk': {'S': 'a#1'}}}},
+    ]})
+    assert response['UnprocessedItems'] == {}
+    assert list(client.tables['test_table'].partitions['org1']) == ['a#2']
+
+
+def test_batch_write_item_too_many(client):
+    requests = [{'PutRequest': {'Item': {'pk': {'S': 'org1'}, 'sk': {'S': f'a#{i}'}}}} for i in range(26)]
+    with pytest.raises(ClientError) as excinfo:
+        client.batch_write_item(RequestItems={'test_table': requests})
+    assert error_code(excinfo) == 'ValidationException'
+
+
+def test_batch_write_item_unprocessed_items():
+    client = FakeDynamoDBClient(unprocessed_ratio=1.0)
+    client.add_table('test_table', 'pk', 'sk')
+    request = {'PutRequest': {'Item': {'pk': {'S': 'org1'}, 'sk': {'S': 'a#1'}}}}
+    response = client.batch_write_item(RequestItems={'test_table': [request]})
+    assert response['UnprocessedItems'] == {'test_table': [request]}
+    assert client.tables['test_table'].item_count() == 0
+
+
+def test_batch_write_item_throttle_every():
+    client = FakeDynamoDBClient(throttle_every=2)
+    client.add_table('test_table', 'pk', 'sk')
+    request = {'PutRequest': {'Item': {'pk': {'S': 'org1'}, 'sk': {'S': 'a#1'}}}}
+    client.batch_write_item(RequestItems={'test_table': [request]})
+    with pytest.raises(ClientError) as excinfo:
+        client.batch_write_item(RequestItems={'test_table': [request]})
+    assert error_code(excinfo) == 'ProvisionedThroughputExceededException'
+
+
+def test_inject_error(client):
+    client.inject_error('GetItem', times=1)
+    key = {'pk': {'S': 'org1'}, 'sk': {'S': 'a#1'}}
+    with pytest.raises(ClientError):
+        client.get_item(TableName='test_table', Key=key)
+    assert client.get_item(TableName='test_table', Key=key) == {}
+    assert client.call_counts['GetItem'] == 2
+
+
+def test_transact_write_items_all_or_nothing(client):
+    put(client, 'org1', 'a#1')
+    with pytest.raises(ClientError) as excinfo:
+        client.transact_write_items(TransactItems=[
+            {'Put': {'TableName': 'test_table', 'Item': {'pk': {'S': 'org1'}, 'sk': {'S': 'a#2'}}}},
+            {'Put': {
+                'TableName': 'test_table',
+                'Item': {'pk': {'S': 'org1'}, 'sk': {'S': 'a#1'}},
+                'ConditionExpression': 'attribute_not_exists(pk)',
+            }},
+        ])
+    assert error_code(excinfo) == 'TransactionCanceledException'
+    reasons = excinfo.value.response['CancellationReasons']
+    assert [r['Code'] for r in reasons] == ['None', 'ConditionalCheckFailed']
+    assert list(client.tables['test_table'].partitions['org1']) == ['a#1']
+
+
+def test_transact_write_items_success(client):
+    put(client, 'org1', 'a#1', qty={'N': '1'})
+    client.transact_write_items(TransactItems=[
+        {'ConditionCheck': {
+            'TableName': 'test_table',
+            'Key': {'pk': {'S': 'org1'}, 'sk': {'S': 'a#1'}},
+            'ConditionExpression': 'attribute_exists(pk)',
+        }},
+        {'Update': {
+            'TableName': 'test_table',
+            'Key': {'pk': {'S': 'org1'}, 'sk': {'S': 'a#2'}},
+            'UpdateExpression': 'SET #n = :n',
+            'ExpressionAttributeNames': {'#n': 'name'},
+            'ExpressionAttributeValues': {':n': {'S': 'new'}},
+        }},
+    ])
+    assert client.tables['test_table'].item_count() == 2
+
+
+# ===== DynamoDBHandler への注入 =====
+
+def test_handler_put_and_query_with_fake(handler):
+    handler.put_item({'pk': 'org1', 'category': 'ic', 'name': 'opamp'})
+    handler.put_item({'pk': 'org1', 'category': 'ic', 'name': 'timer'})
+    handler.put_item({'pk': 'org1', 'category': 'passive', 'name': 'resistor'})
+
+    assert len(handler.query_by_PK({'pk': 'org1'})) == 3
+    items = handler.query_by_sk_prefix({'pk': 'org1', 'category': 'ic'})
+    assert sorted(item['name'] for item in items) == ['opamp', 'timer']
+
+
+def test_handler_query_pagination_with_fake(client, handler):
+    client.page_size_bytes = 200
+    for i in range(20):
+        handler.put_item({'pk': 'org1', 'category': 'ic', 'name': f'part{i}'})
+    client.reset_call_counts()
+
+    items = handler.query_by_PK({'pk': 'org1'})
+    assert len(items) == 20
+    assert client.call_counts['Query'] > 1
+
+
+def test_handler_batch_delete_with_fake(handler):
+    created = handler.put_item({'pk': 'org1', 'category': 'ic', 'name': 'opamp'})[0]
+    assert handler.batch_delete_items([{'pk': 'org1', 'sk': created['sk']}]) is True
+    assert handler.query_by_PK({'pk': 'org1'}) == []
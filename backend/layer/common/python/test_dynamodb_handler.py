@@ -134,29 +134,32 @@ def handler_without_sk():
 
 def test_update_item_success_with_sk(handler_with_sk, monkeypatch):
     monkeypatch.setattr(handler_with_sk, "get_current_timestamp", lambda: "2025/08/12 12:00:00")
-    mock_update_item = MagicMock(return_value={'Attributes': {'name': {'S': 'test'}}})
+    mock_update_item = MagicMock(return_value={'Attributes': {
+        'pk': {'S': 'key1'}, 'sk': {'S': 'sk#id1'}, 'name': {'S': 'test'}, 'updated_at': {'S': '2025/08/12 12:00:00'}
+    }})
     handler_with_sk.dynamodb.update_item = mock_update_item
 
     item = {'pk': 'key1', 'sk': 'sk#id1', 'name': 'test'}
 
     result = handler_with_sk.update_item(item.copy())
-    assert result is True
+    assert result == [{'pk': 'key1', 'sk': 'sk#id1', 'name': 'test', 'updated_at': '2025/08/12 12:00:00'}]
     mock_update_item.assert_called_once()
     args, kwargs = mock_update_item.call_args
     assert kwargs['TableName'] == 'test_table'
+    assert kwargs['ReturnValues'] == 'ALL_NEW'
     assert '#ua' in kwargs['ExpressionAttributeNames']
     assert ':updated_at_val' in kwargs['ExpressionAttributeValues']
 
 
 def test_update_item_success_without_sk(handler_without_sk, monkeypatch):
     monkeypatch.setattr(handler_without_sk, "get_current_timestamp", lambda: "2025/08/12 12:00:00")
-    mock_update_item = MagicMock(return_value={'Attributes': {'name': {'S': 'test'}}})
+    mock_update_item = MagicMock(return_value={'Attributes': {'pk': {'S': 'key1'}, 'name': {'S': 'test'}}})
     handler_without_sk.dynamodb.update_item = mock_update_item
 
     item = {'pk': 'key1', 'name': 'test'}
 
     result = handler_without_sk.update_item(item.copy())
-    assert result is True
+    assert result == [{'pk': 'key1', 'name': 'test'}]
     mock_update_item.assert_called_once()
 
 
@@ -364,3 +367,131 @@ def test_query_by_pk_missing_pk(mock_handler2):
     with pytest.raises(KeyError) as exc_info:
         mock_handler2.query_by_PK(item)
     assert f"KeyError in query_by_PK: {mock_handler2.pk_name}" in str(exc_info.value)
+
+
+# ---------- adjust_quantity ----------
+
+@pytest.fixture
+def qty_handler():
+    from dynamodb_fake import FakeDynamoDBClient
+    client = FakeDynamoDBClient()
+    client.add_table('components', 'pk', 'sk')
+    handler = DynamoDBHandler('ap-northeast-1', 'components', 'pk', 'sk', 'category', 'id', '#',
+                              {'pk': 'S', 'sk': 'S', 'id': 'S', 'category': 'S', 'name': 'S', 'qty': 'N'}, client=client)
+    return handler
+
+
+def put_component(handler, qty):
+    return handler.put_item({'pk': 'org1', 'category': 'ic', 'name': 'opamp', 'qty': qty})[0]['sk']
+
+
+def test_adjust_quantity_concurrently(qty_handler):
+    import threading
+    sk = put_component(qty_handler, 100)
+    threads = [threading.Thread(target=qty_handler.adjust_quantity, args=({'pk': 'org1', 'sk': sk, 'delta': -1},))
+               for _ in range(50)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert qty_handler.query_by_PK({'pk': 'org1'})[0]['qty'] == 50
+
+
+def test_adjust_quantity_floor_and_missing_item(qty_handler):
+    sk = put_component(qty_handler, 3)
+    result = qty_handler.adjust_quantity({'pk': 'org1', 'sk': sk, 'delta': -2, 'floor': 0})
+    assert (result['status'], result['qty']) == ('ok', 1)
+    result = qty_handler.adjust_quantity({'pk': 'org1', 'sk': sk, 'delta': -2, 'floor': 0})
+    assert (result['status'], result['qty']) == ('insufficient', 1)
+    # floor を指定しなければ負の値にもできる
+    assert qty_handler.adjust_quantity({'pk': 'org1', 'sk': sk, 'delta': -2})['qty'] == -1
+    # 存在しないアイテムは作らない
+    assert qty_handler.adjust_quantity({'pk': 'org1', 'sk': 'ic#missing', 'delta': 1})['status'] == 'not_found'
+    assert len(qty_handler.query_by_PK({'pk': 'org1'})) == 1
+    with pytest.raises(ValueError):
+        qty_handler.adjust_quantity({'pk': 'org1', 'sk': sk, 'delta': 'abc'})
+
+
+def test_adjust_quantity_migrates_string_qty(qty_handler):
+    client = qty_handler.dynamodb
+    for sk, qty in (('ic#1', '7'), ('ic#2', ''), ('ic#3', 'many')):
+        client.put_item(TableName='components', Item={'pk': {'S': 'org1'}, 'sk': {'S': sk}, 'qty': {'S': qty}})
+
+    results = qty_handler.adjust_quantities([
+        {'pk': 'org1', 'sk': 'ic#1', 'delta': -2, 'floor': 0},
+        {'pk': 'org1', 'sk': 'ic#2', 'delta': 5},
+        {'pk': 'org1', 'sk': 'ic#3', 'delta': 1},
+    ])
+    assert [(r['status'], r['qty']) for r in results] == [('ok', 5), ('ok', 5), ('invalid_qty', 'many')]
+    item = client.get_item(TableName='components', Key={'pk': {'S': 'org1'}, 'sk': {'S': 'ic#1'}})['Item']
+    assert item['qty'] == {'N': '5'}
+
+
+# ---------- low stock ----------
+
+@pytest.fixture
+def low_stock_handler():
+    from dynamodb_fake import FakeDynamoDBClient
+    from low_stock import LowStockIndex
+    client = FakeDynamoDBClient()
+    client.create_table(
+        TableName='components',
+        KeySchema=[{'AttributeName': 'pk', 'KeyType': 'HASH'}, {'AttributeName': 'sk', 'KeyType': 'RANGE'}],
+        GlobalSecondaryIndexes=[{
+            'IndexName': 'low-stock-index',
+            'KeySchema': [{'AttributeName': 'low_stock_pk', 'KeyType': 'HASH'}, {'AttributeName': 'sk', 'KeyType': 'RANGE'}],
+        }],
+    )
+    return DynamoDBHandler('ap-northeast-1', 'components', 'pk', 'sk', 'category', 'id', '#',
+                           {'pk': 'S', 'sk': 'S', 'id': 'S', 'category': 'S', 'name': 'S', 'qty': 'N', 'reorder_threshold': 'N'},
+                           client=client, low_stock=LowStockIndex('low-stock-index'))
+
+
+def low_stock_names(handler):
+    return [item['name'] for item in handler.query_low_stock({'pk': 'org1'})]
+
+
+def test_low_stock_flag_follows_put_update_and_adjust(low_stock_handler):
+    handler = low_stock_handler
+    sk = handler.put_item({'pk': 'org1', 'category': 'ic', 'name': 'opamp', 'qty': 3, 'reorder_threshold': 5})[0]['sk']
+    handler.put_item({'pk': 'org1', 'category': 'ic', 'name': 'timer', 'qty': 10, 'reorder_threshold': 5})
+    handler.put_item({'pk': 'org1', 'category': 'ic', 'name': 'diode', 'qty': 0})
+    assert low_stock_names(handler) == ['opamp']
+
+    # 発注点を超えたら GSI から外れ、下回ったら載る
+    assert handler.adjust_quantity({'pk': 'org1', 'sk': sk, 'delta': 3})['qty'] == 6
+    assert low_stock_names(handler) == []
+    assert handler.adjust_quantity({'pk': 'org1', 'sk': sk, 'delta': -1})['qty'] == 5
+    assert low_stock_names(handler) == ['opamp']
+
+    updated = handler.update_item({'pk': 'org1', 'sk': sk, 'reorder_threshold': 2})[0]
+    assert 'low_stock_pk' not in updated
+    assert low_stock_names(handler) == []
+    updated = handler.update_item({'pk': 'org1', 'sk': sk, 'qty': 1})[0]
+    assert updated['low_stock_pk'] == 'org1'
+    assert low_stock_names(handler) == ['opamp']
+
+
+def test_low_stock_writes_only_when_state_changes(low_stock_handler):
+    handler = low_stock_handler
+    sk = handler.put_item({'pk': 'org1', 'category': 'ic', 'name': 'opamp', 'qty': 3, 'reorder_threshold': 5})[0]['sk']
+    client = handler.dynamodb
+    client.reset_call_counts()
+    handler.adjust_quantity({'pk': 'org1', 'sk': sk, 'delta': -1})
+    handler.update_item({'pk': 'org1', 'sk': sk, 'name': 'renamed'})
+    assert client.call_counts['UpdateItem'] == 2
+    handler.adjust_quantity({'pk': 'org1', 'sk': sk, 'delta': 10})
+    assert client.call_counts['UpdateItem'] == 4
+
+
+def test_low_stock_query_reads_only_low_items(low_stock_handler):
+    handler = low_stock_handler
+    for i in range(50):
+        handler.put_item({'pk': 'org1', 'category': 'ic', 'name': f'part{i:02}', 'qty': i, 'reorder_threshold': 2})
+    handler.put_item({'pk': 'org2', 'category': 'ic', 'name': 'other', 'qty': 0, 'reorder_threshold': 2})
+    handler.capacity_meter = MagicMock()
+    assert sorted(low_stock_names(handler)) == ['part00', 'part01', 'part02']
+    # 1回の Query で、読んだのは在庫の少ないアイテムだけ
+    handler.capacity_meter.record.assert_called_once()
+    response = handler.capacity_meter.record.call_args[0][1]
+    assert response['ScannedCount'] == 3
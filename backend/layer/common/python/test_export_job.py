@@ -0,0 +1,119 @@
+import csv
+import gzip
+import io
+import json
+import pytest
+from unittest.mock import MagicMock
+from dynamodb_fake import FakeDynamoDBClient
+from dynamodb_handler import DynamoDBHandler
+from schema import Schema
+from sharding import ShardingPolicy
+import clients
+from object_store import LocalObjectStore, MultipartWriter, S3MultipartWriter, S3ObjectStore
+from export_job import (
+    ExportJob, STATUS_FAILED, STATUS_PENDING, STATUS_SUCCEEDED,
+    export_columns, get_export_status, run_export,
+)
+
+SCHEMA = Schema({'pk': 'S', 'sk': 'S', 'id': 'S', 'category': 'S', 'name': 'S', 'qty': 'N'})
+COLUMNS = export_columns(SCHEMA, ['pk', 'sk'])
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalObjectStore(str(tmp_path))
+
+
+@pytest.fixture
+def handler():
+    client = FakeDynamoDBClient(page_size_bytes=2048)
+    client.add_table('test_table', 'pk', 'sk')
+    handler = DynamoDBHandler('ap-northeast-1', 'test_table', 'pk', 'sk', 'category', 'id', '#', SCHEMA,
+                              client=client, sharding_policy=ShardingPolicy(overrides={'big': 3}))
+    for i in range(50):
+        handler.put_item({'pk': 'org1', 'category': 'ic', 'name': f'part,"{i}"', 'qty': i})
+    for i in range(10):
+        handler.put_item({'pk': 'big', 'category': 'ic', 'name': f'part{i}'})
+    return handler
+
+
+def read_result(store, document):
+    return gzip.decompress(store.get_object(document['key'])).decode()
+
+
+def test_export_columns_order():
+    assert COLUMNS == ['pk', 'sk', 'id', 'category', 'name', 'qty', 'created_at', 'updated_at']
+
+
+def test_export_csv_in_multiple_parts(store, handler):
+    job = ExportJob.create(store, 'org1', 'csv')
+    assert get_export_status(store, 'org1', job.job_id)['status'] == STATUS_PENDING
+
+    document = run_export(job, handler, COLUMNS, part_size=256)
+    assert document['status'] == STATUS_SUCCEEDED
+    assert document['item_count'] == 50
+
+    rows = list(csv.DictReader(io.StringIO(read_result(store, document))))
+    assert len(rows) == 50
+    assert sorted(int(row['qty']) for row in rows) == list(range(50))
+    assert {row['name'] for row in rows} == {f'part,"{i}"' for i in range(50)}
+
+    status = get_export_status(store, 'org1', job.job_id)
+    assert status['url'].startswith('file://')
+
+
+def test_export_jsonl_of_sharded_organization(store, handler):
+    job = ExportJob.create(store, 'big', 'jsonl')
+    document = run_export(job, handler, COLUMNS)
+    items = [json.loads(line) for line in read_result(store, document).splitlines()]
+    assert len(items) == 10
+    assert all(item['pk'] == 'big' for item in items)
+
+
+def test_export_failure_is_recorded(store, handler):
+    handler.dynamodb.inject_error('Query', code='ValidationException')
+    job = ExportJob.create(store, 'org1', 'csv')
+    with pytest.raises(Exception):
+        run_export(job, handler, COLUMNS)
+    status = get_export_status(store, 'org1', job.job_id)
+    assert status['status'] == STATUS_FAILED
+    assert 'url' not in status
+
+
+def test_export_rejects_unknown_format_and_job(store):
+    with pytest.raises(ValueError):
+        ExportJob.create(store, 'org1', 'xlsx')
+    with pytest.raises(ValueError):
+        get_export_status(store, 'org1', 'missing')
+
+
+def test_local_store_rejects_path_traversal(store):
+    with pytest.raises(ValueError):
+        store.put_object('../outside', b'x')
+
+
+def test_s3_multipart_writer_uploads_parts():
+    client = MagicMock()
+    client.create_multipart_upload.return_value = {'UploadId': 'upload-1'}
+    client.upload_part.side_effect = lambda **kwargs: {'ETag': f'etag-{kwargs["PartNumber"]}'}
+
+    writer = S3MultipartWriter(client, 'bucket', 'key', 'application/gzip', part_size=4)
+    writer.write(b'abcdefghij')
+    writer.close()
+
+    bodies = [call.kwargs['Body'] for call in client.upload_part.call_args_list]
+    assert bodies == [b'abcd', b'efgh', b'ij']
+    parts = client.complete_multipart_upload.call_args.kwargs['MultipartUpload']['Parts']
+    assert [part['PartNumber'] for part in parts] == [1, 2, 3]
+
+
+def test_s3_store_uses_shared_client():
+    client = MagicMock()
+    clients.override_client('s3', client)
+    try:
+        assert S3ObjectStore('bucket', 'ap-northeast-1').client is client
+    finally:
+        clients.clear_overrides()
+    # 保存先ごとの処理を実装していない writer は作れない
+    with pytest.raises(TypeError):
+        MultipartWriter()
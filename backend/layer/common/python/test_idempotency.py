@@ -0,0 +1,145 @@
+import pytest
+from dynamodb_fake import FakeDynamoDBClient
+from idempotency import (
+    DynamoDBIdempotencyStore, Idempotency, IdempotencyInProgressError, IdempotencyKeyMismatchError,
+    from_env, get_idempotency_key, request_hash,
+)
+from query_cache import LRUCacheBackend
+from resilience import ResilientCaller, ThrottlingError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def client():
+    client = FakeDynamoDBClient()
+    client.add_table('idempotency', 'idempotency_key')
+    return client
+
+
+def make_idempotency(client, clock, **kwargs):
+    store = DynamoDBIdempotencyStore('idempotency', client=client)
+    return Idempotency(store, ttl_seconds=3600, front_cache=LRUCacheBackend(clock=clock), clock=clock, **kwargs)
+
+
+class Counter:
+    def __init__(self, response=None, error=None):
+        self.calls = 0
+        self.response = response or {'statusCode': 200, 'body': '{"result": "success"}'}
+        self.error = error
+
+    def __call__(self):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+
+def test_retry_returns_stored_response_without_executing_again(client):
+    clock = FakeClock()
+    idempotency = make_idempotency(client, clock)
+    execute = Counter()
+
+    first = idempotency.run('org1#put#key1', {'value': 1}, execute)
+    assert first == execute.response
+
+    # 同じコンテナでのリトライはメモリ上のキャッシュから返す（DynamoDB を呼ばない）
+    client.reset_call_counts()
+    second = idempotency.run('org1#put#key1', {'value': 1}, execute)
+    assert sum(client.call_counts.values()) == 0
+    assert execute.calls == 1
+    assert second['body'] == first['body']
+    assert second['headers']['Idempotency-Replayed'] == 'true'
+
+    # 別のコンテナ（キャッシュが空）では冪等性テーブルから返す
+    other = make_idempotency(client, clock)
+    third = other.run('org1#put#key1', {'value': 1}, execute)
+    assert execute.calls == 1
+    assert third['body'] == first['body']
+    assert client.call_counts['PutItem'] == 1
+
+
+def test_different_request_with_same_key_is_rejected(client):
+    clock = FakeClock()
+    idempotency = make_idempotency(client, clock)
+    idempotency.run('org1#put#key1', {'value': 1}, Counter())
+    with pytest.raises(IdempotencyKeyMismatchError):
+        idempotency.run('org1#put#key1', {'value': 2}, Counter())
+    with pytest.raises(IdempotencyKeyMismatchError):
+        make_idempotency(client, clock).run('org1#put#key1', {'value': 2}, Counter())
+
+
+def test_concurrent_request_is_in_progress_until_it_times_out(client):
+    clock = FakeClock()
+    idempotency = make_idempotency(client, clock, in_progress_seconds=60)
+    store = idempotency.store
+    # 別のコンテナが処理中
+    assert store.claim('org1#put#key1', request_hash({'value': 1}), clock.now, clock.now + 3600, clock.now + 60) is None
+
+    execute = Counter()
+    with pytest.raises(IdempotencyInProgressError):
+        idempotency.run('org1#put#key1', {'value': 1}, execute)
+    assert execute.calls == 0
+
+    # 処理中のまま残ったレコードは期限が過ぎたら取り直せる
+    clock.now += 61
+    idempotency.run('org1#put#key1', {'value': 1}, execute)
+    assert execute.calls == 1
+
+
+def test_failures_are_not_stored(client):
+    clock = FakeClock()
+    idempotency = make_idempotency(client, clock)
+    with pytest.raises(RuntimeError):
+        idempotency.run('org1#put#key1', {'value': 1}, Counter(error=RuntimeError('boom')))
+    failed = Counter(response={'statusCode': 503})
+    assert idempotency.run('org1#put#key1', {'value': 1}, failed)['statusCode'] == 503
+
+    execute = Counter()
+    assert idempotency.run('org1#put#key1', {'value': 1}, execute)['statusCode'] == 200
+    assert execute.calls == 1
+
+
+def test_expired_record_executes_again(client):
+    clock = FakeClock()
+    execute = Counter()
+    make_idempotency(client, clock).run('org1#put#key1', {'value': 1}, execute)
+    clock.now += 3601
+    make_idempotency(client, clock).run('org1#put#key1', {'value': 1}, execute)
+    assert execute.calls == 2
+
+
+def test_store_retries_throttled_calls(client):
+    store = DynamoDBIdempotencyStore('idempotency', client=client, resilience=ResilientCaller(sleep=lambda _: None))
+    client.inject_error('PutItem', times=2)
+    assert store.claim('key-1', 'digest', 1000, 2000, 1900) is None
+    assert client.call_counts['PutItem'] == 3
+
+    # リトライし尽くしたら ThrottlingError（lambda 側で 503）
+    client.inject_error('PutItem', times=5)
+    with pytest.raises(ThrottlingError):
+        store.claim('key-2', 'digest', 1000, 2000, 1900)
+
+
+def test_get_idempotency_key():
+    assert get_idempotency_key({'headers': {'idempotency-key': 'abc'}}, {}) == 'abc'
+    assert get_idempotency_key({'headers': {}}, {'idempotency_key': 'def'}) == 'def'
+    assert get_idempotency_key({}, {}) == ''
+    with pytest.raises(ValueError):
+        get_idempotency_key({'headers': {'idempotency-key': 'x' * 256}}, {})
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.delenv('IDEMPOTENCY_TABLE_NAME', raising=False)
+    assert from_env() is None
+    monkeypatch.setenv('IDEMPOTENCY_TABLE_NAME', 'idempotency')
+    monkeypatch.setenv('IDEMPOTENCY_TTL_SECONDS', '60')
+    idempotency = from_env('ap-northeast-1')
+    assert idempotency.store.table_name == 'idempotency'
+    assert idempotency.ttl_seconds == 60
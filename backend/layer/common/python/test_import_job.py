@@ -0,0 +1,105 @@
+import pytest
+from dynamodb_fake import FakeDynamoDBClient
+from dynamodb_handler import DynamoDBHandler
+from object_store import LocalObjectStore
+from resilience import Deadline
+from import_job import ImportJob, get_import_status, parse_row, row_item_id, run_import
+from background import STATUS_FAILED, STATUS_PENDING, STATUS_SUCCEEDED
+
+FIELD_TYPES = {'pk': 'S', 'sk': 'S', 'id': 'S', 'category': 'S', 'name': 'S', 'qty': 'N', 'active': 'BOOL'}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalObjectStore(str(tmp_path))
+
+
+@pytest.fixture
+def fake_client():
+    client = FakeDynamoDBClient()
+    client.add_table('test_table', 'pk', 'sk')
+    return client
+
+
+@pytest.fixture
+def handler(fake_client):
+    return DynamoDBHandler('ap-northeast-1', 'test_table', 'pk', 'sk', 'category', 'id', '#', FIELD_TYPES,
+                           client=fake_client)
+
+
+def make_csv(rows, header='category,name,qty,active'):
+    return '\ufeff' + header + '\n' + ''.join(f'{row}\n' for row in rows)
+
+
+def test_parse_row(handler):
+    item = parse_row({'category': 'ic', 'name': ' opamp ', 'qty': '3', 'active': 'TRUE', 'created_at': 'x'}, handler, 'org1')
+    assert item == {'pk': 'org1', 'category': 'ic', 'name': 'opamp', 'qty': '3', 'active': True}
+
+    with pytest.raises(ValueError):
+        parse_row({'category': 'ic', 'color': 'red'}, handler, 'org1')
+    with pytest.raises(ValueError):
+        parse_row({'name': 'opamp'}, handler, 'org1')
+
+
+def test_import_writes_valid_rows_and_records_errors(store, handler, fake_client):
+    rows = [f'ic,part{i},{i},true' for i in range(60)]
+    rows[10] = 'ic,bad,ten,true'
+    rows[20] = ',no category,1,false'
+    job = ImportJob.create(store, 'org1', make_csv(rows))
+
+    document = run_import(job, handler, chunk_rows=25)
+    assert document['status'] == STATUS_SUCCEEDED
+    assert document['rows_processed'] == 60
+    assert document['rows_written'] == 58
+    assert document['error_count'] == 2
+    assert [(e['row'], e['line']) for e in document['errors']] == [(11, 12), (21, 22)]
+    assert fake_client.tables['test_table'].item_count() == 58
+    assert fake_client.call_counts['BatchWriteItem'] == 3
+
+    assert get_import_status(store, 'org1', job.job_id)['rows_written'] == 58
+
+
+def test_import_pauses_at_deadline_and_resumes(store, handler, fake_client):
+    job = ImportJob.create(store, 'org1', make_csv([f'ic,part{i},{i},true' for i in range(100)]))
+
+    document = run_import(job, handler, deadline=Deadline(0.0), chunk_rows=30)
+    assert document['status'] == STATUS_PENDING
+    assert document['rows_processed'] == 30
+    assert fake_client.tables['test_table'].item_count() == 30
+
+    job = ImportJob.load(store, 'org1', job.job_id)
+    document = run_import(job, handler, chunk_rows=30)
+    assert document['status'] == STATUS_SUCCEEDED
+    assert document['rows_written'] == 100
+    assert fake_client.tables['test_table'].item_count() == 100
+
+
+def test_failed_import_resumes_without_duplicates(store, handler, fake_client):
+    job = ImportJob.create(store, 'org1', make_csv([f'ic,part{i},{i},true' for i in range(50)]))
+    original = fake_client.batch_write_item
+    calls = []
+
+    # 2チャンク目の書き込みの途中で失敗させる（一部の行は書き込み済み）
+    def fail_on_third_call(**kwargs):
+        calls.append(1)
+        if len(calls) == 3:
+            raise RuntimeError('connection reset')
+        return original(**kwargs)
+
+    fake_client.batch_write_item = fail_on_third_call
+    with pytest.raises(Exception):
+        run_import(job, handler, chunk_rows=30)
+    status = get_import_status(store, 'org1', job.job_id)
+    assert status['status'] == STATUS_FAILED
+    assert status['rows_processed'] == 30
+
+    fake_client.batch_write_item = original
+    document = run_import(ImportJob.load(store, 'org1', job.job_id), handler, chunk_rows=30)
+    assert document['status'] == STATUS_SUCCEEDED
+    assert 'error' not in document
+    assert fake_client.tables['test_table'].item_count() == 50
+
+
+def test_row_item_id_is_deterministic():
+    assert row_item_id('job1', 5) == row_item_id('job1', 5)
+    assert row_item_id('job1', 5) != row_item_id('job1', 6)
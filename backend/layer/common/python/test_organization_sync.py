@@ -0,0 +1,81 @@
+import pytest
+from dynamodb_fake import FakeDynamoDBClient
+from dynamodb_handler import DynamoDBHandler
+import organization_sync
+
+USER_FIELD_TYPES = {'user_id': 'S', 'organization_id': 'S', 'username': 'S',
+                    'organization_name': 'S', 'organization_version': 'N'}
+
+
+@pytest.fixture
+def client():
+    client = FakeDynamoDBClient()
+    client.create_table(
+        TableName='users',
+        KeySchema=[{'AttributeName': 'user_id', 'KeyType': 'HASH'}],
+        GlobalSecondaryIndexes=[{
+            'IndexName': 'users-by-organization',
+            'KeySchema': [{'AttributeName': 'organization_id', 'KeyType': 'HASH'}],
+        }],
+    )
+    client.add_table('organizations', 'organization_id')
+    return client
+
+
+@pytest.fixture
+def handlers(client):
+    users = DynamoDBHandler('ap-northeast-1', 'users', 'user_id', '', '', '', '', USER_FIELD_TYPES, client=client)
+    organizations = DynamoDBHandler('ap-northeast-1', 'organizations', 'organization_id', '', '', '', '',
+                                    {'organization_id': 'S', 'organization_name': 'S', 'version': 'N'}, client=client)
+    organizations.put_item({'organization_id': 'org1', 'organization_name': 'Old'})
+    organization = organizations.query_by_PK({'organization_id': 'org1'})[0]
+    for i in range(3):
+        users.put_item(dict({'user_id': f'user{i}', 'organization_id': 'org1', 'username': f'u{i}'},
+                            **organization_sync.copy_fields(organization)))
+    users.put_item({'user_id': 'other', 'organization_id': 'org2', 'username': 'x'})
+    return users, organizations
+
+
+def test_is_enabled():
+    assert organization_sync.is_enabled(USER_FIELD_TYPES)
+    assert not organization_sync.is_enabled({'user_id': 'S', 'organization_id': 'S'})
+
+
+def test_get_item_projects_attributes(handlers):
+    users, _ = handlers
+    user = users.get_item({'user_id': 'user0'}, ['user_id', 'organization_id', 'organization_name'])
+    assert user == {'user_id': 'user0', 'organization_id': 'org1', 'organization_name': 'Old'}
+    assert users.get_item({'user_id': 'missing'}) is None
+
+
+@pytest.mark.parametrize('index_name', [None, 'users-by-organization'])
+def test_rename_fans_out_to_members(handlers, client, index_name):
+    users, organizations = handlers
+    renamed = organization_sync.rename_organization(organizations, 'org1', 'New')
+    assert renamed['version'] == 1
+
+    client.reset_call_counts()
+    report = organization_sync.fan_out(users, 'organization_id', renamed, index_name)
+    assert report == {'updated': 3, 'skipped': 0}
+    assert ('Query' if index_name else 'Scan') in client.call_counts
+    copies = {user['user_id']: (user.get('organization_name'), user.get('organization_version'))
+              for user in [users.get_item({'user_id': f'user{i}'}) for i in range(3)] + [users.get_item({'user_id': 'other'})]}
+    assert copies == {'user0': ('New', 1), 'user1': ('New', 1), 'user2': ('New', 1), 'other': (None, None)}
+
+
+def test_stale_fan_out_does_not_overwrite_newer_copy(handlers):
+    users, organizations = handlers
+    first = organization_sync.rename_organization(organizations, 'org1', 'First')
+    second = organization_sync.rename_organization(organizations, 'org1', 'Second')
+    organization_sync.fan_out(users, 'organization_id', second)
+    # 遅れて届いた古い名前の fan_out は何も書かない
+    assert organization_sync.fan_out(users, 'organization_id', first) == {'updated': 0, 'skipped': 3}
+    # 同じバージョンを何度実行しても変わらない
+    assert organization_sync.fan_out(users, 'organization_id', second) == {'updated': 0, 'skipped': 3}
+    assert users.get_item({'user_id': 'user1'})['organization_name'] == 'Second'
+
+
+def test_rename_missing_organization(handlers):
+    _, organizations = handlers
+    with pytest.raises(ValueError):
+        organization_sync.rename_organization(organizations, 'missing', 'New')
@@ -0,0 +1,161 @@
+import pytest
+from unittest.mock import MagicMock
+from dynamodb_fake import FakeDynamoDBClient
+from dynamodb_handler import DynamoDBHandler
+from resilience import ConditionalCheckError, ResilientCaller
+import outbox
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def no_sleep(_):
+    pass
+
+
+def test_dispatch_retries_then_raises():
+    handler = MagicMock(side_effect=[Exception('temporary'), 'done'])
+    message = outbox.make_message('work', {'n': 1})
+    assert outbox.dispatch(message, {'work': handler}, sleep=no_sleep) == 'done'
+    assert handler.call_count == 2
+
+    handler = MagicMock(side_effect=Exception('down'))
+    with pytest.raises(Exception):
+        outbox.dispatch(message, {'work': handler}, sleep=no_sleep)
+    assert handler.call_count == 3
+
+    with pytest.raises(outbox.UnknownMessageTypeError):
+        outbox.dispatch(outbox.make_message('other', {}), {'work': handler})
+
+
+def make_table(clock, **kwargs):
+    client = FakeDynamoDBClient()
+    client.add_table('outbox', 'message_id')
+    return client, outbox.OutboxTable('outbox', client=client, clock=clock, **kwargs)
+
+
+def stream_record(put, event_name='INSERT'):
+    return {'eventName': event_name, 'dynamodb': {'NewImage': put['Put']['Item']}}
+
+
+def test_messages_are_written_in_the_transaction():
+    clock = FakeClock()
+    client, table = make_table(clock)
+    client.add_table('users', 'user_id')
+    users = DynamoDBHandler('ap-northeast-1', 'users', 'user_id', '', '', '', '', {'user_id': 'S'}, client=client)
+    message = outbox.make_message(outbox.ADD_USER_TO_GROUP, {'username': 'tester', 'group': 'admin'})
+
+    users.transact_write([users.put_request({'user_id': 'u1'}, must_not_exist=True), table.put_request(message)])
+    assert [m['payload'] for m in table.pending(min_age=0)] == [message['payload']]
+
+    # 書き込みが失敗したらメッセージも残らない
+    other = outbox.make_message(outbox.ADD_USER_TO_GROUP, {'username': 'other', 'group': 'admin'})
+    with pytest.raises(ConditionalCheckError):
+        users.transact_write([users.put_request({'user_id': 'u1'}, must_not_exist=True), table.put_request(other)])
+    assert [m['id'] for m in table.pending(min_age=0)] == [message['id']]
+
+
+def test_stream_records_are_processed_and_failures_kept():
+    clock = FakeClock()
+    client, table = make_table(clock)
+    ok = outbox.make_message('work', {'n': 1})
+    ng = outbox.make_message('work', {'n': 2})
+    unknown = outbox.make_message('other', {})
+    puts = [table.put_request(m) for m in (ok, ng, unknown)]
+    client.transact_write_items(TransactItems=puts)
+
+    def work(payload):
+        if payload['n'] == 2:
+            raise Exception('down')
+
+    records = [stream_record(put) for put in puts] + [stream_record(puts[0], 'REMOVE')]
+    assert outbox.process_records(records, {'work': work}, table, sleep=no_sleep) == [ng['id']]
+    # 失敗したものだけが attempts を増やして残る（種類が分からないものは消す）
+    assert [(m['id'], m['attempts']) for m in table.pending(min_age=0)] == [(ng['id'], 1)]
+
+
+def test_sweep_retries_until_max_attempts():
+    clock = FakeClock()
+    client, table = make_table(clock, max_attempts=2)
+    message = outbox.make_message('work', {'n': 1})
+    client.transact_write_items(TransactItems=[table.put_request(message)])
+    handler = MagicMock(side_effect=Exception('down'))
+
+    # 作られたばかりのものはストリームに任せる
+    assert outbox.sweep(table, {'work': handler}, sleep=no_sleep) == 0
+    handler.assert_not_called()
+
+    clock.now = outbox.SWEEP_AFTER_SECONDS
+    assert outbox.sweep(table, {'work': handler}, sleep=no_sleep) == 0
+    assert outbox.sweep(table, {'work': handler}, sleep=no_sleep) == 0
+    assert handler.call_count == 6
+    # 諦めたものは再実行しないが、TTL まで残す
+    assert outbox.sweep(table, {'work': handler}, sleep=no_sleep) == 0
+    assert handler.call_count == 6
+    assert len(client.scan(TableName='outbox')['Items']) == 1
+
+    client.put_item(TableName='outbox', Item=table.put_request(outbox.make_message('work', {'n': 2}))['Put']['Item'])
+    clock.now *= 2
+    assert outbox.sweep(table, {'work': MagicMock()}, sleep=no_sleep) == 1
+
+
+def test_table_calls_are_retried():
+    clock = FakeClock()
+    client, table = make_table(clock, resilience=ResilientCaller(sleep=no_sleep))
+    message = outbox.make_message('work', {'n': 1})
+    client.transact_write_items(TransactItems=[table.put_request(message)])
+    client.inject_error('Scan')
+    client.inject_error('DeleteItem', code='InternalServerError')
+    assert outbox.sweep(table, {'work': MagicMock()}, min_age=0, sleep=no_sleep) == 1
+    assert client.scan(TableName='outbox')['Items'] == []
+
+
+def test_record_failure_ignores_completed_messages():
+    _, table = make_table(FakeClock())
+    assert table.record_failure(outbox.make_message('work', {}), Exception('late')) is None
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.delenv('OUTBOX_TABLE_NAME', raising=False)
+    assert outbox.from_env() is None
+    monkeypatch.setenv('OUTBOX_TABLE_NAME', 'outbox')
+    assert outbox.from_env('ap-northeast-1').table_name == 'outbox'
+
+
+def test_transaction_is_all_or_nothing():
+    client = FakeDynamoDBClient()
+    client.add_table('users', 'user_id')
+    client.add_table('organizations', 'organization_id')
+    users = DynamoDBHandler('ap-northeast-1', 'users', 'user_id', '', '', '', '', {'user_id': 'S', 'organization_id': 'S'}, client=client)
+    organizations = DynamoDBHandler('ap-northeast-1', 'organizations', 'organization_id', '', '', '', '', {'organization_id': 'S'}, client=client)
+
+    users.transact_write([
+        organizations.put_request({'organization_id': 'org1'}, must_not_exist=True),
+        users.put_request({'user_id': 'u1', 'organization_id': 'org1'}, must_not_exist=True),
+    ])
+    assert len(client.scan(TableName='users')['Items']) == 1
+
+    # 既に存在する user があると organization も書き込まれない
+    with pytest.raises(ConditionalCheckError):
+        users.transact_write([
+            organizations.put_request({'organization_id': 'org2'}, must_not_exist=True),
+            users.put_request({'user_id': 'u1', 'organization_id': 'org2'}, must_not_exist=True),
+        ])
+    assert len(client.scan(TableName='organizations')['Items']) == 1
+
+    # 存在しない organization への参加は失敗する
+    with pytest.raises(ConditionalCheckError):
+        users.transact_write([
+            organizations.exists_check_request({'organization_id': 'missing'}),
+            users.put_request({'user_id': 'u2', 'organization_id': 'missing'}, must_not_exist=True),
+        ])
+    users.transact_write([
+        organizations.exists_check_request({'organization_id': 'org1'}),
+        users.put_request({'user_id': 'u2', 'organization_id': 'org1'}, must_not_exist=True),
+    ])
+    assert len(client.scan(TableName='users')['Items']) == 2
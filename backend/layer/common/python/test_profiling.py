@@ -0,0 +1,97 @@
+import json
+import os
+import tracemalloc
+import pytest
+
+import profiling
+from serialization import deserialize_item
+
+
+def workload():
+    items = [deserialize_item({'name': {'S': f'part{i}'}, 'qty': {'N': str(i)}}) for i in range(200)]
+    return json.dumps([dict(item, qty=str(item['qty'])) for item in items])
+
+
+@pytest.fixture(autouse=True)
+def no_profiling_env(monkeypatch):
+    for name in (profiling.MODE_ENV_NAME, profiling.DIR_ENV_NAME, profiling.TOP_N_ENV_NAME):
+        monkeypatch.delenv(name, raising=False)
+
+
+def test_disabled_handler_is_not_profiled(caplog):
+    handler = profiling.profiled('test')(lambda event, context: workload())
+    handler({}, None)
+    assert profiling.current() is None
+    assert not tracemalloc.is_tracing()
+    assert 'profile' not in caplog.text
+
+
+def test_env_mode_logs_cpu_and_memory_report(monkeypatch, caplog):
+    monkeypatch.setenv(profiling.MODE_ENV_NAME, 'all')
+    monkeypatch.setenv(profiling.TOP_N_ENV_NAME, '5')
+    handler = profiling.profiled('test')(lambda event, context: workload())
+    handler({}, None)
+
+    report = json.loads(caplog.records[-1].getMessage())
+    assert report['service'] == 'test'
+    assert len(report['cpu']['top']) == 5
+    assert report['cpu']['focus']['deserialize']['calls'] == 200
+    assert report['cpu']['focus']['encode']['calls'] >= 1
+    assert report['memory']['peak_bytes'] > 0
+    assert 0 < len(report['memory']['top']) <= 5
+    assert not tracemalloc.is_tracing()
+
+
+def test_started_from_request_and_written_to_directory(monkeypatch, tmp_path):
+    monkeypatch.setenv(profiling.DIR_ENV_NAME, str(tmp_path))
+
+    def handler(event, context):
+        profiling.start(profiling.requested_mode(event))
+        return workload()
+
+    profiling.profiled('test')(handler)({'headers': {'x-profile': 'cpu'}}, None)
+    names = sorted(os.listdir(tmp_path))
+    assert [os.path.splitext(name)[1] for name in names] == ['.json', '.prof']
+    with open(tmp_path / names[0]) as f:
+        report = json.load(f)
+    assert report['mode'] == 'cpu'
+    assert 'memory' not in report
+    assert profiling.current() is None
+
+
+def test_start_errors_do_not_fail_the_request(monkeypatch, caplog):
+    def handler(event, context):
+        profiling.try_start(profiling.requested_mode(event))
+        return 'ok'
+
+    assert profiling.profiled('test')(handler)({'headers': {'x-profile': 'everything'}}, None) == 'ok'
+    assert 'Invalid profiling mode' in caplog.text
+
+    # 別のスレッドで cProfile が動いているときなど
+    def busy(*args):
+        raise ValueError('Another profiling tool is already active')
+    monkeypatch.setattr(profiling, 'Session', busy)
+    assert profiling.profiled('test')(handler)({'headers': {'x-profile': 'cpu'}}, None) == 'ok'
+    assert 'Another profiling tool' in caplog.text
+    assert profiling.current() is None
+
+
+def test_failed_start_leaves_tracemalloc_off(monkeypatch):
+    class BusyProfile:
+        def enable(self):
+            raise ValueError('Another profiling tool is already active')
+    monkeypatch.setattr(profiling.cProfile, 'Profile', BusyProfile)
+
+    assert profiling.try_start('all', 'test') is None
+    assert profiling.current() is None
+    assert not tracemalloc.is_tracing()
+    assert profiling._memory_sessions == 0
+
+
+def test_parse_mode():
+    assert profiling.parse_mode(None) is None
+    assert profiling.parse_mode('off') is None
+    assert profiling.parse_mode('true') == 'all'
+    assert profiling.parse_mode(' Memory ') == 'memory'
+    with pytest.raises(ValueError):
+        profiling.parse_mode('everything')
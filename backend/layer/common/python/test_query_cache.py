@@ -0,0 +1,179 @@
+import socket
+import pytest
+from decimal import Decimal
+from dynamodb_fake import FakeDynamoDBClient
+from dynamodb_handler import DynamoDBHandler
+from query_cache import DEFAULT_TTL_SECONDS, MEMORY_TTL_SECONDS, LRUCacheBackend, QueryCache, RedisCacheBackend, from_env
+from redis_fake import FakeRedisServer
+from sharding import ShardingPolicy
+
+FIELD_TYPES = {'pk': 'S', 'sk': 'S', 'id': 'S', 'category': 'S', 'name': 'S', 'qty': 'N'}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def redis_server():
+    server = FakeRedisServer().start()
+    yield server
+    server.stop()
+
+
+def create_handler(cache, shard_count=1, compact_rows=False):
+    client = FakeDynamoDBClient()
+    client.add_table('test_table', 'pk', 'sk')
+    handler = DynamoDBHandler('ap-northeast-1', 'test_table', 'pk', 'sk', 'category', 'id', '#', FIELD_TYPES,
+                              client=client, query_cache=cache, compact_rows=compact_rows,
+                              sharding_policy=ShardingPolicy(overrides={'org1': shard_count}))
+    return handler, client
+
+
+def test_lru_backend_expires_and_evicts():
+    clock = FakeClock()
+    backend = LRUCacheBackend(max_entries=2, clock=clock)
+    backend.set('a', '1', ttl_seconds=10)
+    backend.set('b', '2')
+    assert backend.get('a') == '1'
+    backend.set('c', '3')
+    # 最近使っていない b が追い出される
+    assert backend.get('b') is None
+    clock.now = 11
+    assert backend.get('a') is None
+    assert backend.get('c') == '3'
+    assert backend.incr('v') == 1
+    assert backend.incr('v') == 2
+
+
+def test_redis_backend(redis_server):
+    backend = RedisCacheBackend(redis_server.host, redis_server.port)
+    assert backend.get('missing') is None
+    backend.set('key', '値', ttl_seconds=5)
+    assert backend.get('key') == '値'
+    assert backend.incr('version') == 1
+    assert backend.incr('version') == 2
+    assert redis_server.command_counts['INCR'] == 2
+
+
+def test_redis_backend_reconnects_after_connection_error(redis_server):
+    backend = RedisCacheBackend(redis_server.host, redis_server.port)
+    backend.set('key', 'value')
+    backend.sock.shutdown(socket.SHUT_RDWR)
+    with pytest.raises(OSError):
+        backend.get('key')
+    assert backend.get('key') == 'value'
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.delenv('QUERY_CACHE', raising=False)
+    monkeypatch.delenv('QUERY_CACHE_TTL', raising=False)
+    assert from_env() is None
+    # memory は他のコンテナで無効化されないので TTL を短くする
+    monkeypatch.setenv('QUERY_CACHE', 'memory')
+    assert from_env().ttl_seconds == MEMORY_TTL_SECONDS
+    monkeypatch.setenv('QUERY_CACHE', 'redis://cache.local:6380')
+    assert from_env().ttl_seconds == DEFAULT_TTL_SECONDS
+    monkeypatch.setenv('QUERY_CACHE', 'memory')
+    monkeypatch.setenv('QUERY_CACHE_TTL', '5')
+    cache = from_env()
+    assert isinstance(cache.backend, LRUCacheBackend)
+    assert cache.ttl_seconds == 5
+    monkeypatch.setenv('QUERY_CACHE', 'redis://cache.local:6380')
+    backend = from_env().backend
+    assert (backend.host, backend.port) == ('cache.local', 6380)
+    monkeypatch.setenv('QUERY_CACHE', 'memcached://cache.local')
+    with pytest.raises(ValueError):
+        from_env()
+
+
+@pytest.mark.parametrize('shard_count', [1, 3])
+@pytest.mark.parametrize('use_redis', [False, True])
+def test_handler_reads_through_and_invalidates_on_write(request, shard_count, use_redis):
+    if use_redis:
+        server = request.getfixturevalue('redis_server')
+        backend = RedisCacheBackend(server.host, server.port)
+    else:
+        backend = LRUCacheBackend()
+    handler, client = create_handler(QueryCache(backend), shard_count)
+    handler.put_item({'pk': 'org1', 'category': 'ic', 'name': 'opamp', 'qty': 3})
+
+    client.reset_call_counts()
+    first = handler.query_by_PK({'pk': 'org1'})
+    queries = client.call_counts['Query']
+    assert queries == shard_count
+    second = handler.query_by_PK({'pk': 'org1'})
+    assert client.call_counts['Query'] == queries
+    assert first == second
+    assert second[0]['pk'] == 'org1'
+    assert second[0]['qty'] == Decimal('3')
+
+    # 更新したら次のクエリは DynamoDB から読み直す
+    handler.update_item({'pk': 'org1', 'sk': first[0]['sk'], 'qty': 5})
+    assert handler.query_by_PK({'pk': 'org1'})[0]['qty'] == Decimal('5')
+    assert client.call_counts['Query'] == queries * 2
+
+    handler.put_item({'pk': 'org1', 'category': 'cap', 'name': '10uF', 'qty': 10})
+    assert len(handler.query_by_PK({'pk': 'org1'})) == 2
+
+    handler.batch_delete_items([{'pk': 'org1', 'sk': first[0]['sk']}])
+    assert [item['name'] for item in handler.query_by_PK({'pk': 'org1'})] == ['10uF']
+
+
+def test_cache_key_includes_sk_prefix_and_organization():
+    handler, client = create_handler(QueryCache(LRUCacheBackend()))
+    handler.put_item({'pk': 'org1', 'category': 'ic', 'name': 'opamp'})
+    handler.put_item({'pk': 'org1', 'category': 'cap', 'name': '10uF'})
+    handler.put_item({'pk': 'org2', 'category': 'ic', 'name': 'adc'})
+
+    assert [i['name'] for i in handler.query_by_sk_prefix({'pk': 'org1', 'category': 'ic'})] == ['opamp']
+    assert [i['name'] for i in handler.query_by_sk_prefix({'pk': 'org1', 'category': 'cap'})] == ['10uF']
+    assert len(handler.query_by_PK({'pk': 'org1'})) == 2
+    assert [i['name'] for i in handler.query_by_PK({'pk': 'org2'})] == ['adc']
+
+    # org2 への書き込みは org1 のキャッシュを無効化しない
+    client.reset_call_counts()
+    handler.put_item({'pk': 'org2', 'category': 'ic', 'name': 'dac'})
+    handler.query_by_PK({'pk': 'org1'})
+    assert client.call_counts['Query'] == 0
+    assert len(handler.query_by_PK({'pk': 'org2'})) == 2
+
+
+def test_cached_results_are_not_shared_between_callers():
+    handler, _ = create_handler(QueryCache(LRUCacheBackend()))
+    handler.put_item({'pk': 'org1', 'category': 'ic', 'name': 'opamp'})
+    handler.query_by_PK({'pk': 'org1'})[0]['name'] = 'changed'
+    assert handler.query_by_PK({'pk': 'org1'})[0]['name'] == 'opamp'
+
+
+def test_compact_rows_from_cache():
+    handler, client = create_handler(QueryCache(LRUCacheBackend()), compact_rows=True)
+    handler.put_item({'pk': 'org1', 'category': 'ic', 'name': 'opamp'})
+    handler.query_by_PK({'pk': 'org1'})
+    client.reset_call_counts()
+    rows = handler.query_by_PK({'pk': 'org1'})
+    assert client.call_counts['Query'] == 0
+    assert rows[0]['name'] == 'opamp'
+
+
+class BrokenBackend:
+    def get(self, key):
+        raise ConnectionError('cache is down')
+
+    def set(self, key, value, ttl_seconds=None):
+        raise ConnectionError('cache is down')
+
+    def incr(self, key):
+        raise ConnectionError('cache is down')
+
+
+def test_backend_failure_falls_back_to_query():
+    handler, client = create_handler(QueryCache(BrokenBackend()))
+    handler.put_item({'pk': 'org1', 'category': 'ic', 'name': 'opamp'})
+    assert [i['name'] for i in handler.query_by_PK({'pk': 'org1'})] == ['opamp']
+    assert [i['name'] for i in handler.query_by_PK({'pk': 'org1'})] == ['opamp']
+    assert client.call_counts['Query'] == 2
@@ -0,0 +1,142 @@
+import pytest
+from unittest.mock import MagicMock
+from dynamodb_fake import FakeDynamoDBClient
+from resilience import ResilientCaller
+from rate_limiter import (
+    DynamoDBBucketStore, RateLimiter, RateLimitExceeded, STATUS_CODE_TOO_MANY_REQUESTS, from_env, too_many_requests_response
+)
+
+
+class FakeClock:
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def client():
+    client = FakeDynamoDBClient()
+    client.add_table('components', 'organization_id', 'sk')
+    return client
+
+
+def create_limiter(client, clock, rate=10, burst=20, lease_size=10):
+    store = DynamoDBBucketStore('components', 'organization_id', 'sk', client=client)
+    return RateLimiter(store, rate, burst, lease_size=lease_size, clock=clock)
+
+
+def test_local_bucket_avoids_dynamodb_calls(client):
+    limiter = create_limiter(client, FakeClock())
+    for _ in range(10):
+        limiter.check('org1', 'query')
+    # 10トークンを1回でまとめて借りる
+    assert client.call_counts['UpdateItem'] == 1
+    limiter.check('org1', 'query')
+    assert client.call_counts['UpdateItem'] == 2
+
+
+def test_rejects_when_burst_is_used_up(client):
+    clock = FakeClock()
+    limiter = create_limiter(client, clock)
+    for _ in range(20):
+        limiter.check('org1', 'query')
+    with pytest.raises(RateLimitExceeded) as exc_info:
+        limiter.check('org1', 'query')
+    assert exc_info.value.retry_after == pytest.approx(0.1)
+
+    # 他の organization には影響しない
+    limiter.check('org2', 'query')
+
+    # 時間が経てば補充される
+    clock.now += 0.5
+    for _ in range(5):
+        limiter.check('org1', 'query')
+    with pytest.raises(RateLimitExceeded):
+        limiter.check('org1', 'query')
+
+
+def test_writes_cost_more_than_queries(client):
+    limiter = create_limiter(client, FakeClock())
+    for _ in range(4):
+        limiter.check('org1', 'put')
+    with pytest.raises(RateLimitExceeded):
+        limiter.check('org1', 'update')
+    # バーストより重い操作は何度待っても通らないので、作るときに設定の誤りにする
+    with pytest.raises(ValueError):
+        create_limiter(client, FakeClock(), burst=10)
+
+
+def test_bucket_is_shared_between_containers(client):
+    clock = FakeClock()
+    first = create_limiter(client, clock)
+    second = create_limiter(client, clock)
+    for _ in range(10):
+        first.check('org1', 'query')
+    for _ in range(10):
+        second.check('org1', 'query')
+    with pytest.raises(RateLimitExceeded):
+        first.check('org1', 'query')
+    with pytest.raises(RateLimitExceeded):
+        second.check('org1', 'query')
+
+    item = client.get_item(TableName='components', Key={'organization_id': {'S': 'ratelimit#org1'}, 'sk': {'S': 'bucket'}})['Item']
+    assert float(item['tat']['N']) == pytest.approx(clock.now + 2.0)
+    assert 'expires_at' in item
+
+
+def test_idle_bucket_is_refilled_with_single_update(client):
+    clock = FakeClock()
+    limiter = create_limiter(client, clock)
+    for _ in range(20):
+        limiter.check('org1', 'query')
+    clock.now += 60
+    client.reset_call_counts()
+    limiter.check('org1', 'query')
+    assert client.call_counts['UpdateItem'] == 1
+
+
+def test_dynamodb_errors_do_not_block_requests(client):
+    limiter = create_limiter(client, FakeClock())
+    limiter.store.resilience = ResilientCaller(sleep=lambda _: None)
+    # 一時的なエラーはリトライする
+    client.inject_error('UpdateItem', code='InternalServerError')
+    limiter.check('org1', 'query')
+    assert client.call_counts['UpdateItem'] == 2
+    # リトライし尽くしても制限はしない
+    client.inject_error('UpdateItem', code='InternalServerError', times=5)
+    limiter.check('org2', 'query')
+
+
+def test_too_many_requests_response():
+    response = too_many_requests_response(RateLimitExceeded('org1', 0.2))
+    assert response == {'statusCode': STATUS_CODE_TOO_MANY_REQUESTS, 'headers': {'Retry-After': '1'}}
+    assert too_many_requests_response(RateLimitExceeded('org1', 2.5))['headers']['Retry-After'] == '3'
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.delenv('RATE_LIMIT_PER_SECOND', raising=False)
+    assert from_env('components', 'organization_id', 'sk') is None
+    monkeypatch.setenv('RATE_LIMIT_PER_SECOND', '5')
+    monkeypatch.setattr('rate_limiter.clients.get_client', MagicMock())
+    limiter = from_env('components', 'organization_id', 'sk', 'ap-northeast-1')
+    assert (limiter.rate, limiter.burst) == (5.0, 50.0)
+
+    # rate が小さくてもジョブ1回分は使える
+    monkeypatch.setenv('RATE_LIMIT_PER_SECOND', '0.5')
+    limiter = from_env('components', 'organization_id', 'sk', 'ap-northeast-1')
+    assert limiter.burst == 20.0
+    monkeypatch.setenv('RATE_LIMIT_BURST', '10')
+    with pytest.raises(ValueError, match='burst must be at least 20'):
+        from_env('components', 'organization_id', 'sk', 'ap-northeast-1')
+
+
+def test_slow_rate_still_allows_jobs(client):
+    clock = FakeClock()
+    limiter = create_limiter(client, clock, rate=0.5, burst=20)
+    limiter.check('org1', 'export')
+    with pytest.raises(RateLimitExceeded):
+        limiter.check('org1', 'import')
+    clock.now += 40
+    limiter.check('org1', 'import')
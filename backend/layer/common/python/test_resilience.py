@@ -0,0 +1,329 @@
+import random
+import pytest
+from unittest.mock import MagicMock
+from botocore.exceptions import ConnectionClosedError, EndpointConnectionError, ReadTimeoutError
+from dynamodb_fake import FakeDynamoDBClient, make_client_error
+from dynamodb_handler import DynamoDBHandler
+from resilience import (
+    AdaptiveRateLimiter, CircuitBreaker, CircuitOpenError, ConditionalCheckError, Deadline,
+    DynamoDBError, DynamoDBValidationError, ResilientCaller, RetryPolicy, ThrottlingError,
+    classify_error, service_unavailable_response, wrap_error,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def make_caller(clock, deadline=None, max_attempts=5, failure_threshold=3):
+    return ResilientCaller(
+        limiter=AdaptiveRateLimiter(clock=clock),
+        breaker=CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=10.0, clock=clock),
+        policy=RetryPolicy(max_attempts=max_attempts),
+        deadline=deadline or Deadline(None, clock),
+        sleep=clock.sleep,
+        rng=random.Random(0),
+    )
+
+
+def throttle_error():
+    return make_client_error('ProvisionedThroughputExceededException', 'throttled', 'Query')
+
+
+# ===== 分類 =====
+
+@pytest.mark.parametrize('code, expected', [
+    ('ProvisionedThroughputExceededException', 'throttle'),
+    ('ThrottlingException', 'throttle'),
+    ('ConditionalCheckFailedException', 'conditional'),
+    ('ValidationException', 'validation'),
+    ('InternalServerError', 'transient'),
+    ('AccessDeniedException', 'unknown'),
+])
+def test_classify_error(code, expected):
+    assert classify_error(make_client_error(code, 'message', 'Query')) == expected
+
+
+def test_classify_transaction_cancelled_by_throttling():
+    error = make_client_error(
+        'TransactionCanceledException', 'cancelled', 'TransactWriteItems',
+        CancellationReasons=[{'Code': 'None'}, {'Code': 'ThrottlingError'}]
+    )
+    assert classify_error(error) == 'throttle'
+
+
+def test_wrap_error_keeps_message_and_class():
+    wrapped = wrap_error(make_client_error('ValidationException', 'bad', 'PutItem'), 'Failed to put item')
+    assert isinstance(wrapped, DynamoDBValidationError)
+    assert isinstance(wrapped, ValueError)
+    assert str(wrapped).startswith('Failed to put item: ')
+
+    wrapped = wrap_error(make_client_error('ConditionalCheckFailedException', 'failed', 'PutItem'), 'Failed to put item')
+    assert isinstance(wrapped, ConditionalCheckError)
+
+    wrapped = wrap_error(Exception('boom'), 'Failed to put item')
+    assert type(wrapped) is DynamoDBError
+    assert str(wrapped) == 'Failed to put item: boom'
+
+
+# ===== 期限 =====
+
+def test_deadline_from_context(clock):
+    context = MagicMock()
+    context.get_remaining_time_in_millis.return_value = 3000
+    deadline = Deadline.from_context(context, safety_margin_ms=1000, clock=clock)
+    assert deadline.remaining() == pytest.approx(2.0)
+    assert deadline.allows(1.5)
+    assert not deadline.allows(2.5)
+
+
+def test_deadline_without_context_is_unlimited():
+    assert Deadline.from_context(None).allows(10 ** 6)
+
+
+# ===== リトライ =====
+
+def test_retry_then_success(clock):
+    caller = make_caller(clock)
+    fn = MagicMock(side_effect=[throttle_error(), throttle_error(), {'Items': []}])
+    assert caller.call(fn, TableName='t') == {'Items': []}
+    assert fn.call_count == 3
+    assert caller.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_retry_gives_up_after_max_attempts(clock):
+    caller = make_caller(clock, max_attempts=2, failure_threshold=10)
+    fn = MagicMock(side_effect=throttle_error())
+    with pytest.raises(Exception):
+        caller.call(fn)
+    assert fn.call_count == 2
+
+
+def test_retry_stops_at_deadline(clock):
+    caller = make_caller(clock, deadline=Deadline(clock() + 0.0001, clock), failure_threshold=10)
+    fn = MagicMock(side_effect=throttle_error())
+    with pytest.raises(Exception):
+        caller.call(fn)
+    assert fn.call_count == 1
+
+
+@pytest.mark.parametrize('error', [
+    ReadTimeoutError(endpoint_url='https://dynamodb'),
+    EndpointConnectionError(endpoint_url='https://dynamodb'),
+    ConnectionClosedError(endpoint_url='https://dynamodb'),
+])
+def test_network_errors_are_retried(clock, error):
+    caller = make_caller(clock)
+    fn = MagicMock(side_effect=[error, {'Items': []}])
+    assert caller.call(fn) == {'Items': []}
+    assert fn.call_count == 2
+
+    fn = MagicMock(side_effect=error)
+    with pytest.raises(type(error)):
+        caller.call(fn)
+    assert fn.call_count == 5
+    assert classify_error(error) == 'transient'
+
+
+@pytest.mark.parametrize('error', [
+    make_client_error('RequestTimeout', 'timeout', 'Query'),
+    make_client_error('SomethingBroke', 'bad gateway', 'Query', ResponseMetadata={'HTTPStatusCode': 502}),
+])
+def test_server_errors_are_retried(clock, error):
+    caller = make_caller(clock)
+    fn = MagicMock(side_effect=[error, {'Items': []}])
+    assert caller.call(fn) == {'Items': []}
+    assert fn.call_count == 2
+    assert classify_error(error) == 'transient'
+
+
+def test_non_retryable_error_is_not_retried(clock):
+    caller = make_caller(clock)
+    fn = MagicMock(side_effect=make_client_error('ConditionalCheckFailedException', 'failed', 'PutItem'))
+    with pytest.raises(Exception):
+        caller.call(fn)
+    assert fn.call_count == 1
+
+
+# ===== レート制限 =====
+
+def test_rate_limiter_disabled_until_throttled(clock):
+    limiter = AdaptiveRateLimiter(clock=clock)
+    assert limiter.acquire() == 0.0
+    assert not limiter.is_enabled()
+
+
+def test_rate_limiter_decreases_and_recovers(clock):
+    limiter = AdaptiveRateLimiter(min_rate=1.0, max_rate=20.0, decrease_factor=0.5, increase_step=5.0, clock=clock)
+    for _ in range(10):
+        limiter.acquire()
+    limiter.on_throttle()
+    assert limiter.rate == 5.0
+
+    # トークンが無ければ待ち時間を返す
+    assert limiter.acquire() > 0
+
+    for _ in range(3):
+        limiter.on_success()
+    assert not limiter.is_enabled()
+
+
+def test_rate_limiter_raises_when_wait_exceeds_deadline(clock):
+    limiter = AdaptiveRateLimiter(min_rate=1.0, clock=clock)
+    limiter.on_throttle()
+    with pytest.raises(ThrottlingError):
+        limiter.acquire(Deadline(clock() + 0.01, clock))
+
+
+# ===== サーキットブレーカー =====
+
+def test_circuit_breaker_opens_and_fails_fast(clock):
+    caller = make_caller(clock, max_attempts=1, failure_threshold=2)
+    fn = MagicMock(side_effect=throttle_error())
+    for _ in range(2):
+        with pytest.raises(Exception):
+            caller.call(fn)
+    assert caller.breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(CircuitOpenError) as excinfo:
+        caller.call(fn)
+    assert fn.call_count == 2
+    assert service_unavailable_response(excinfo.value)['statusCode'] == 503
+
+
+def test_circuit_breaker_half_open_recovers(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10.0, clock=clock)
+    breaker.on_throttle()
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now += 11
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.on_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_circuit_breaker_counts_calls_not_attempts(clock):
+    caller = make_caller(clock, max_attempts=5, failure_threshold=5)
+    fn = MagicMock(side_effect=throttle_error())
+    with pytest.raises(Exception):
+        caller.call(fn)
+    assert fn.call_count == 5
+    assert caller.breaker.state == CircuitBreaker.CLOSED
+    assert caller.breaker.failures == 1
+
+    # 条件チェックの失敗はテーブルが応答しているので数え直す
+    fn.side_effect = make_client_error('ConditionalCheckFailedException', 'failed', 'PutItem')
+    with pytest.raises(Exception):
+        caller.call(fn)
+    assert caller.breaker.failures == 0
+
+
+def test_circuit_breaker_allows_single_probe(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10.0, clock=clock)
+    breaker.on_throttle()
+    clock.now += 11
+    breaker.before_call()
+    # 試している間は他の呼び出しを通さない
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.on_success()
+    breaker.before_call()
+
+    # 試した呼び出しがスロットリング以外で失敗したら OPEN に戻る
+    breaker.on_throttle()
+    clock.now += 11
+    caller = make_caller(clock, failure_threshold=1)
+    caller.breaker = breaker
+    with pytest.raises(ThrottlingError):
+        caller.call(MagicMock(side_effect=ThrottlingError('client side')))
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_circuit_breaker_half_open_reopens_on_throttle(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10.0, clock=clock)
+    breaker.on_throttle()
+    clock.now += 11
+    breaker.before_call()
+    breaker.on_throttle()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+# ===== DynamoDBHandler との結合 =====
+
+@pytest.fixture
+def fake_client():
+    client = FakeDynamoDBClient()
+    client.add_table('test_table', 'pk', 'sk')
+    return client
+
+
+def make_handler(fake_client, caller):
+    return DynamoDBHandler(
+        region_name='ap-northeast-1',
+        table_name='test_table',
+        pk_name='pk',
+        sk_name='sk',
+        sk_prefix='category',
+        sk_suffix='id',
+        sk_delimiter='#',
+        field_types={'pk': 'S', 'sk': 'S', 'id': 'S', 'category': 'S', 'name': 'S'},
+        client=fake_client,
+        resilience=caller
+    )
+
+
+def test_handler_retries_throttled_put(fake_client, clock):
+    handler = make_handler(fake_client, make_caller(clock))
+    fake_client.inject_error('PutItem', times=2)
+    handler.put_item({'pk': 'org1', 'category': 'ic', 'name': 'opamp'})
+    assert fake_client.call_counts['PutItem'] == 3
+    assert fake_client.tables['test_table'].item_count() == 1
+
+
+def test_handler_raises_throttling_error(fake_client, clock):
+    handler = make_handler(fake_client, make_caller(clock, max_attempts=2, failure_threshold=10))
+    fake_client.inject_error('Query', times=2)
+    with pytest.raises(ThrottlingError, match='Failed to query'):
+        handler.query_by_PK({'pk': 'org1'})
+
+
+def test_handler_batch_delete_retries_unprocessed(fake_client, clock):
+    handler = make_handler(fake_client, make_caller(clock))
+    created = handler.put_item({'pk': 'org1', 'category': 'ic', 'name': 'opamp'})[0]
+
+    fake_client.unprocessed_ratio = 1.0
+    original = fake_client.batch_write_item
+
+    def recover_after_first_call(**kwargs):
+        response = original(**kwargs)
+        fake_client.unprocessed_ratio = 0.0
+        return response
+
+    fake_client.batch_write_item = recover_after_first_call
+    assert handler.batch_delete_items([{'pk': 'org1', 'sk': created['sk']}]) is True
+    assert fake_client.call_counts['BatchWriteItem'] == 2
+    assert fake_client.tables['test_table'].item_count() == 0
+
+
+def test_handler_batch_delete_propagates_circuit_open(fake_client, clock):
+    caller = make_caller(clock, max_attempts=1, failure_threshold=1)
+    handler = make_handler(fake_client, caller)
+    fake_client.inject_error('BatchWriteItem', times=1)
+    with pytest.raises(ThrottlingError):
+        handler.batch_delete_items([{'pk': 'org1', 'sk': 'ic#1'}])
+    with pytest.raises(CircuitOpenError):
+        handler.batch_delete_items([{'pk': 'org1', 'sk': 'ic#1'}])
@@ -0,0 +1,78 @@
+import json
+import pytest
+from decimal import Decimal
+from columnar import decode_columnar, encode_columnar
+from dynamodb_fake import FakeDynamoDBClient
+from dynamodb_handler import DynamoDBHandler
+from rows import CompactRow, dumps_rows, make_row_type
+from schema import Schema
+from sharding import ShardingPolicy
+
+FIELD_TYPES = {'pk': 'S', 'sk': 'S', 'id': 'S', 'category': 'S', 'name': 'S', 'qty': 'N'}
+Row = make_row_type(['pk', 'sk', 'name', 'qty'])
+
+
+def test_row_from_dynamodb():
+    row = Row.from_dynamodb({'pk': {'S': 'org1'}, 'qty': {'N': '3'}, 'color': {'S': 'red'}})
+    assert isinstance(row, CompactRow)
+    assert row['pk'] == 'org1'
+    assert row.get('qty') == Decimal('3')
+    assert row.get('name') is None
+    assert row['color'] == 'red'
+    assert 'name' not in row
+    assert 'color' in row
+    with pytest.raises(KeyError):
+        row['name']
+    assert row.to_dict() == {'pk': 'org1', 'qty': Decimal('3'), 'color': 'red'}
+
+
+def test_row_is_read_only_and_replace_returns_new_row():
+    row = Row.from_dict({'pk': 'org1~2', 'name': 'opamp'})
+    with pytest.raises(TypeError):
+        row['pk'] = 'org1'
+    replaced = row.replace('pk', 'org1')
+    assert replaced['pk'] == 'org1'
+    assert row['pk'] == 'org1~2'
+    assert replaced.replace('note', 'x').to_dict() == {'pk': 'org1', 'name': 'opamp', 'note': 'x'}
+
+
+def test_row_has_no_instance_dict():
+    row = Row.from_dict({'pk': 'org1'})
+    assert not hasattr(row, '__dict__')
+
+
+def test_field_names_are_shared():
+    first = Row.from_dict({'pk': 'a'})
+    second = Row.from_dict({'pk': 'b'})
+    assert [k for k in first.keys()][0] is [k for k in second.keys()][0]
+
+
+def test_schema_row_type_is_cached():
+    schema = Schema(FIELD_TYPES)
+    assert schema.row_type(['pk', 'sk']) is schema.row_type(['pk', 'sk'])
+    assert schema.row_type(['pk', 'sk']).fields == ('pk', 'sk', 'id', 'category', 'name', 'qty', 'created_at', 'updated_at')
+
+
+def test_serializers_understand_rows():
+    rows = [Row.from_dict({'pk': 'org1', 'name': f'part{i}', 'qty': Decimal(i)}) for i in range(3)]
+    expected = [{'pk': 'org1', 'name': f'part{i}', 'qty': str(i)} for i in range(3)]
+    assert json.loads(dumps_rows(rows)) == expected
+    assert dumps_rows([]) == '[]'
+    assert decode_columnar(encode_columnar(rows, ['pk', 'name'])) == expected
+
+
+@pytest.mark.parametrize('shard_count', [1, 3])
+def test_handler_returns_compact_rows(shard_count):
+    client = FakeDynamoDBClient()
+    client.add_table('test_table', 'pk', 'sk')
+    handler = DynamoDBHandler('ap-northeast-1', 'test_table', 'pk', 'sk', 'category', 'id', '#', FIELD_TYPES,
+                              client=client, compact_rows=True,
+                              sharding_policy=ShardingPolicy(overrides={'org1': shard_count}))
+    for i in range(5):
+        handler.put_item({'pk': 'org1', 'category': 'ic', 'name': f'part{i}', 'qty': i})
+
+    rows = handler.query_by_PK({'pk': 'org1'})
+    assert len(rows) == 5
+    assert all(isinstance(row, CompactRow) for row in rows)
+    assert all(row['pk'] == 'org1' for row in rows)
+    assert sorted(row['name'] for row in rows) == [f'part{i}' for i in range(5)]
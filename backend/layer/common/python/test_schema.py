@@ -0,0 +1,108 @@
+import json
+import pytest
+from dynamodb_fake import FakeDynamoDBClient
+from dynamodb_handler import DynamoDBHandler
+from schema import Schema, load_schema
+
+
+@pytest.fixture
+def schema():
+    return Schema({'pk': 'S', 'sk': 'S', 'id': 'S', 'category': 'S', 'name': 'S', 'qty': 'N', 'active': 'BOOL'})
+
+
+def test_invalid_field_type():
+    with pytest.raises(ValueError, match='Unsupported field type'):
+        Schema({'name': 'X'})
+
+
+def test_validate_rejects_unknown_fields(schema):
+    with pytest.raises(ValueError, match='Unknown fields: color'):
+        schema.validate({'name': 'opamp', 'color': 'red'})
+
+
+@pytest.mark.parametrize('item', [
+    {'name': 1},
+    {'qty': 'abc'},
+    {'qty': 'NaN'},
+    {'qty': True},
+    {'active': 'yes'},
+])
+def test_validate_rejects_wrong_types(schema, item):
+    with pytest.raises(ValueError):
+        schema.validate(item)
+
+
+def test_serialize_item_skips_unknown_fields(schema):
+    assert schema.serialize_item({'name': 'opamp', 'qty': 3, 'active': False, 'other': 'x'}) == {
+        'name': {'S': 'opamp'},
+        'qty': {'N': '3'},
+        'active': {'BOOL': False},
+    }
+
+
+def test_empty_number_is_zero(schema):
+    assert schema.serialize_item({'qty': ''}) == {'qty': {'N': '0'}}
+    assert schema.serialize_item({'qty': ' 12 '}) == {'qty': {'N': '12'}}
+    schema.validate({'name': 'opamp', 'qty': ''})
+    expression, names, values = schema.build_update({'qty': ''}, '2025/08/12 12:00:00')
+    assert values[':v0'] == {'N': '0'}
+
+
+def test_update_template_is_cached_by_field_set(schema):
+    first = schema.update_template(['name', 'qty'])
+    second = schema.update_template(['qty', 'name'])
+    assert first is second
+    assert first.expression == 'SET #ua = :updated_at_val, #f0 = :v0, #f1 = :v1'
+    assert first.names == {'#ua': 'updated_at', '#f0': 'name', '#f1': 'qty'}
+
+
+def test_build_update_ignores_updated_at(schema):
+    expression, names, values = schema.build_update({'qty': '5', 'updated_at': 'x'}, '2025/08/12 12:00:00')
+    assert expression == 'SET #ua = :updated_at_val, #f0 = :v0'
+    assert values == {':updated_at_val': {'S': '2025/08/12 12:00:00'}, ':v0': {'N': '5'}}
+
+
+def test_load_schema_builds_once(monkeypatch):
+    monkeypatch.setenv('TEST_FIELD_TYPES', json.dumps({'name': 'S'}))
+    assert load_schema('TEST_FIELD_TYPES') is load_schema('TEST_FIELD_TYPES')
+
+
+def test_load_schema_invalid_json(monkeypatch):
+    monkeypatch.setenv('TEST_FIELD_TYPES', '{bad json}')
+    with pytest.raises(ValueError, match='Invalid FIELD_TYPES'):
+        load_schema('TEST_FIELD_TYPES')
+
+
+@pytest.fixture
+def client():
+    client = FakeDynamoDBClient()
+    client.add_table('test_table', 'pk', 'sk')
+    return client
+
+
+@pytest.fixture
+def handler(client, schema):
+    return DynamoDBHandler('ap-northeast-1', 'test_table', 'pk', 'sk', 'category', 'id', '#', schema, client=client)
+
+
+def test_handler_rejects_unknown_field_before_network_call(handler, client):
+    with pytest.raises(ValueError):
+        handler.put_item({'pk': 'org1', 'category': 'ic', 'color': 'red'})
+    with pytest.raises(ValueError):
+        handler.update_item({'pk': 'org1', 'sk': 'ic#1', 'color': 'red'})
+    assert sum(client.call_counts.values()) == 0
+
+
+def test_handler_update_with_schema(handler):
+    created = handler.put_item({'pk': 'org1', 'category': 'ic', 'name': 'opamp', 'qty': '3'})[0]
+    updated = handler.update_item({'pk': 'org1', 'sk': created['sk'], 'qty': '5', 'name': 'timer'})[0]
+    assert updated['qty'] == 5
+    assert updated['name'] == 'timer'
+    assert updated['created_at'] == created['created_at']
+
+
+def test_handler_update_ignores_client_updated_at(handler):
+    created = handler.put_item({'pk': 'org1', 'category': 'ic', 'name': 'opamp', 'qty': '3'})[0]
+    updated = handler.update_item({'pk': 'org1', 'sk': created['sk'], 'qty': '5', 'updated_at': 'stale'})[0]
+    assert updated['qty'] == 5
+    assert updated['updated_at'] != 'stale'
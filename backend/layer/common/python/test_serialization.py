@@ -0,0 +1,42 @@
+import pytest
+from decimal import Decimal
+from boto3.dynamodb.types import TypeDeserializer
+from serialization import deserialize_item, deserialize_value, dumps_raw, loads_raw
+
+
+def test_deserialize_item_matches_type_deserializer():
+    item = {
+        'name': {'S': 'resistor'},
+        'qty': {'N': '10'},
+        'price': {'N': '1.25'},
+        'active': {'BOOL': True},
+        'missing': {'NULL': True},
+        'tags': {'SS': ['a', 'b']},
+        'sizes': {'NS': ['1', '2']},
+        'history': {'L': [{'S': 'x'}, {'N': '1'}]},
+        'meta': {'M': {'owner': {'S': 'me'}, 'count': {'N': '3'}}},
+    }
+    deserializer = TypeDeserializer()
+    expected = {k: deserializer.deserialize(v) for k, v in item.items()}
+    assert deserialize_item(item) == expected
+    assert isinstance(deserialize_item(item)['qty'], Decimal)
+
+
+def test_deserialize_binary():
+    assert deserialize_value({'B': b'abc'}) == b'abc'
+    assert deserialize_value({'BS': [b'a']}) == {b'a'}
+
+
+def test_deserialize_empty_attribute():
+    with pytest.raises(ValueError):
+        deserialize_value({})
+
+
+def test_raw_json_round_trips_binary():
+    items = [
+        {'pk': {'S': 'org1'}, 'note': {'B': b'\x00z1\xff'}, 'files': {'BS': [b'a', b'\x00']}},
+        {'pk': {'S': 'org1'}, 'B': {'S': 'attribute named B'}},
+    ]
+    assert loads_raw(dumps_raw(items)) == items
+    assert loads_raw(dumps_raw(items).encode()) == items
+    assert loads_raw(dumps_raw([{'pk': {'S': 'org1'}}])) == [{'pk': {'S': 'org1'}}]
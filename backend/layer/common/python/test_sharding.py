@@ -0,0 +1,126 @@
+import pytest
+from dynamodb_fake import FakeDynamoDBClient
+from dynamodb_handler import DynamoDBHandler
+from sharding import ShardingPolicy, physical_pk, physical_pks, reshard_organization, shard_of
+
+FIELD_TYPES = {'pk': 'S', 'sk': 'S', 'id': 'S', 'category': 'S', 'name': 'S'}
+
+
+@pytest.fixture
+def fake_client():
+    client = FakeDynamoDBClient()
+    client.add_table('test_table', 'pk', 'sk')
+    return client
+
+
+def make_handler(fake_client, sharding_policy=None):
+    return DynamoDBHandler(
+        region_name='ap-northeast-1',
+        table_name='test_table',
+        pk_name='pk',
+        sk_name='sk',
+        sk_prefix='category',
+        sk_suffix='id',
+        sk_delimiter='#',
+        field_types=FIELD_TYPES,
+        client=fake_client,
+        sharding_policy=sharding_policy
+    )
+
+
+def partition_keys(fake_client):
+    return set(fake_client.tables['test_table'].partitions)
+
+
+def test_shard_of_is_stable_and_in_range():
+    assert shard_of('item-1', 1) == 0
+    shards = {shard_of(f'item-{i}', 4) for i in range(100)}
+    assert shards == {0, 1, 2, 3}
+    assert shard_of('item-1', 4) == shard_of('item-1', 4)
+
+
+def test_physical_pk_unchanged_without_sharding():
+    assert physical_pk('org1', 0, 1) == 'org1'
+    assert physical_pks('org1', 1) == ['org1']
+    assert physical_pks('org1', 3) == ['org1~0', 'org1~1', 'org1~2']
+
+
+def test_policy_from_env(monkeypatch):
+    monkeypatch.setenv('SHARD_OVERRIDES', '{"big-org": 8}')
+    policy = ShardingPolicy.from_env()
+    assert policy.shard_count('big-org') == 8
+    assert policy.shard_count('small-org') == 1
+    assert policy.shards_any()
+
+
+def test_policy_rejects_invalid_count():
+    with pytest.raises(ValueError):
+        ShardingPolicy(overrides={'org1': 0})
+
+
+def test_sharding_requires_delimited_sort_key(fake_client):
+    with pytest.raises(ValueError):
+        DynamoDBHandler('ap-northeast-1', 'test_table', 'pk', '', '', '', '', FIELD_TYPES,
+                        client=fake_client, sharding_policy=ShardingPolicy(4))
+
+
+def test_put_and_query_across_shards(fake_client):
+    handler = make_handler(fake_client, ShardingPolicy(overrides={'org1': 4}))
+    # item_id を固定して、20件が4つのシャードすべてに分かれるようにする
+    created = [handler.put_item({'pk': 'org1', 'category': 'ic', 'name': f'part{i}'}, f'item{i:02d}')[0] for i in range(20)]
+    handler.put_item({'pk': 'org2', 'category': 'ic', 'name': 'other'})
+
+    # 返り値の PK は論理的な値のまま
+    assert all(item['pk'] == 'org1' for item in created)
+    assert partition_keys(fake_client) == {'org1~0', 'org1~1', 'org1~2', 'org1~3', 'org2'}
+
+    items = handler.query_by_PK({'pk': 'org1'})
+    assert len(items) == 20
+    assert all(item['pk'] == 'org1' for item in items)
+    assert [item['sk'] for item in items] == sorted(item['sk'] for item in created)
+    assert fake_client.call_counts['Query'] == 4
+
+    handler.put_item({'pk': 'org1', 'category': 'cap', 'name': 'cap'})
+    assert [item['name'] for item in handler.query_by_sk_prefix({'pk': 'org1', 'category': 'cap'})] == ['cap']
+
+
+def test_update_and_delete_sharded_items(fake_client):
+    handler = make_handler(fake_client, ShardingPolicy(overrides={'org1': 4}))
+    created = handler.put_item({'pk': 'org1', 'category': 'ic', 'name': 'opamp'})[0]
+
+    updated = handler.update_item({'pk': 'org1', 'sk': created['sk'], 'name': 'comparator'})[0]
+    assert updated['pk'] == 'org1'
+    assert updated['name'] == 'comparator'
+    assert fake_client.tables['test_table'].item_count() == 1
+
+    assert handler.batch_delete_items([{'pk': 'org1', 'sk': created['sk']}]) is True
+    assert fake_client.tables['test_table'].item_count() == 0
+
+
+def test_reshard_organization_moves_items(fake_client):
+    handler = make_handler(fake_client)
+    for i in range(30):
+        handler.put_item({'pk': 'org1', 'category': 'ic', 'name': f'part{i}'})
+    before = handler.query_by_PK({'pk': 'org1'})
+
+    result = reshard_organization(handler, 'org1', 1, 4)
+    assert result == {'moved': 30, 'deleted': 30}
+    assert partition_keys(fake_client) == {'org1~0', 'org1~1', 'org1~2', 'org1~3'}
+
+    sharded_handler = make_handler(fake_client, ShardingPolicy(overrides={'org1': 4}))
+    assert sharded_handler.query_by_PK({'pk': 'org1'}) == before
+
+    # 2 -> 4 のように一部のアイテムが同じキーに残る場合は移動しない
+    reshard_organization(sharded_handler, 'org1', 4, 2)
+    result = reshard_organization(make_handler(fake_client, ShardingPolicy(overrides={'org1': 2})), 'org1', 2, 4)
+    assert result['moved'] == result['deleted'] < 30
+    assert sharded_handler.query_by_PK({'pk': 'org1'}) == before
+
+
+def test_reshard_back_to_single_partition(fake_client):
+    handler = make_handler(fake_client, ShardingPolicy(overrides={'org1': 3}))
+    for i in range(10):
+        handler.put_item({'pk': 'org1', 'category': 'ic', 'name': f'part{i}'})
+    reshard_organization(handler, 'org1', 3, 1)
+    assert partition_keys(fake_client) == {'org1'}
+    assert len(make_handler(fake_client).query_by_PK({'pk': 'org1'})) == 10
@@ -0,0 +1,183 @@
+import pytest
+from dynamodb_fake import FakeDynamoDBClient
+from dynamodb_handler import DynamoDBHandler
+from snapshot import SAFETY_SECONDS, InventorySnapshots, decompress_chunk, encode_chunks, from_env
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1700000000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def handler(clock):
+    client = FakeDynamoDBClient()
+    client.add_table('components', 'pk', 'sk')
+    snapshots = InventorySnapshots(compact_after_keys=5, max_delta_keys=20, clock=clock)
+    return DynamoDBHandler('ap-northeast-1', 'components', 'pk', 'sk', 'category', 'id', '#',
+                           {'pk': 'S', 'sk': 'S', 'id': 'S', 'category': 'S', 'name': 'S', 'qty': 'N'},
+                           client=client, snapshots=snapshots)
+
+
+def put_parts(handler, count, organization_id='org1'):
+    return [handler.put_item({'pk': organization_id, 'category': 'ic', 'name': f'part{i:03}', 'qty': i})[0]['sk']
+            for i in range(count)]
+
+
+def full_query(handler, organization_id='org1'):
+    return handler.query_raw_items(organization_id, {
+        'TableName': 'components',
+        'KeyConditionExpression': '#pk = :pk_val',
+        'ExpressionAttributeNames': {'#pk': 'pk'},
+        'ExpressionAttributeValues': {':pk_val': {'S': organization_id}},
+    })
+
+
+def test_encode_chunks_splits_large_inventories():
+    raw_items = [{'pk': {'S': 'org1'}, 'sk': {'S': f'ic#{i:04}'}, 'note': {'S': f'{i}' * 200}} for i in range(500)]
+    chunks = encode_chunks(raw_items, max_chunk_bytes=4096, raw_chunk_bytes=64 * 1024)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 4096 for chunk in chunks)
+    assert [item for chunk in chunks for item in decompress_chunk(chunk)] == raw_items
+    assert encode_chunks([]) and decompress_chunk(encode_chunks([])[0]) == []
+
+
+def test_query_is_served_from_snapshot_and_delta(handler, clock):
+    sks = put_parts(handler, 30)
+    clock.now += SAFETY_SECONDS * 2
+    client = handler.dynamodb
+
+    # スナップショットが無ければ通常のクエリで返し、作り直しを依頼する
+    assert len(handler.query_by_PK({'pk': 'org1'})) == 30
+    assert handler.stale_snapshots == {'org1'}
+    assert handler.snapshots.build(handler, 'org1')['item_count'] == 30
+
+    handler.update_item({'pk': 'org1', 'sk': sks[0], 'name': 'renamed'})
+    handler.batch_delete_items([{'pk': 'org1', 'sk': sks[1]}])
+    added = handler.put_item({'pk': 'org1', 'category': 'ic', 'name': 'added', 'qty': 1})[0]['sk']
+
+    client.reset_call_counts()
+    handler.stale_snapshots.clear()
+    items = handler.query_by_PK({'pk': 'org1'})
+    # meta の GetItem、チャンクと差分のアイテムの BatchGetItem、差分の Query だけ
+    assert client.call_counts == {'GetItem': 1, 'BatchGetItem': 2, 'Query': 1}
+    assert handler.stale_snapshots == set()
+    assert [item['sk'] for item in items] == sorted(set(sks[:1] + sks[2:] + [added]))
+    assert items == [dict(item, pk='org1') for item in handler.query_by_sk_prefix({'pk': 'org1', 'category': 'ic'})]
+    assert {item['sk']: item['name'] for item in items}[sks[0]] == 'renamed'
+
+
+def test_rebuild_merges_delta_without_full_query(handler, clock):
+    sks = put_parts(handler, 10)
+    handler.snapshots.build(handler, 'org1')
+    for sk in sks[:6]:
+        handler.adjust_quantities([{'pk': 'org1', 'sk': sk, 'delta': 100}])
+    clock.now += SAFETY_SECONDS * 2
+
+    # 差分が多くなったら作り直しを依頼する（同じコンテナからは続けて依頼しない）
+    handler.query_by_PK({'pk': 'org1'})
+    assert handler.stale_snapshots == {'org1'}
+    assert handler.snapshots.load(handler, 'org1')[1] is False
+
+    client = handler.dynamodb
+    client.reset_call_counts()
+    meta = handler.snapshots.build(handler, 'org1')
+    assert meta['version'] == 2
+    # 差分の Query だけでパーティション全体は読まない
+    assert client.call_counts['Query'] == 1
+    # 古いチャンクは消える
+    chunk_sks = [item['sk']['S'] for item in client.scan(TableName='components')['Items'] if item['sk']['S'].startswith('chunk#')]
+    assert chunk_sks == [f"chunk#00000002#{meta['build']}#0000"]
+
+    raw_items, stale = handler.snapshots.load(handler, 'org1')
+    assert raw_items == full_query(handler)
+    assert stale is False
+
+
+def test_falls_back_to_query_when_snapshot_is_unusable(handler, clock):
+    handler.snapshots.build(handler, 'org1')
+    put_parts(handler, 25)
+    # 差分が多すぎる
+    assert handler.snapshots.load(handler, 'org1')[0] is None
+    assert len(handler.query_by_PK({'pk': 'org1'})) == 25
+
+    # 作り直しの cutoff は safety_seconds 前なので、それより前の書き込みは差分として読まない
+    clock.now += SAFETY_SECONDS * 2
+    handler.snapshots.build(handler, 'org1')
+    assert handler.snapshots.load(handler, 'org1')[0] == full_query(handler)
+    # インポートなどで全体が変わった
+    handler.record_changes('org1')
+    assert handler.snapshots.load(handler, 'org1')[0] is None
+
+    clock.now += SAFETY_SECONDS * 2
+    handler.snapshots.build(handler, 'org1')
+    assert handler.snapshots.load(handler, 'org1')[0] is not None
+    # 差分が TTL で消えているかもしれないほど古い
+    clock.now += handler.snapshots.delta_ttl_seconds
+    assert handler.snapshots.load(handler, 'org1')[0] is None
+
+
+def test_concurrent_rebuild_keeps_winner_chunks(handler, clock):
+    put_parts(handler, 10)
+    clock.now += SAFETY_SECONDS * 2
+    snapshots = handler.snapshots
+    handler.snapshots.build(handler, 'org1')
+
+    # 2つの作り直しが同じ version を読んだ状態で、先に片方が切り替える
+    read = snapshots.read
+    winner = {}
+
+    def read_then_rebuild(handler, pk_val):
+        result = read(handler, pk_val)
+        if not winner:
+            snapshots.read = read
+            winner.update(snapshots.build(handler, pk_val))
+        return result
+
+    snapshots.read = read_then_rebuild
+    assert snapshots.build(handler, 'org1') is None
+    snapshots.read = read
+
+    meta, raw_items, _, reason = snapshots.read(handler, 'org1')
+    assert meta == winner
+    assert reason == '' and len(raw_items) == 10
+
+
+def test_delta_is_recorded_before_the_write(handler, clock):
+    handler.snapshots.build(handler, 'org1')
+    client = handler.dynamodb
+    # delta を書けなければアイテムも書かない（書いたのに 500 を返すことはない）
+    client.inject_error('PutItem', 'InternalServerError', times=10)
+    with pytest.raises(Exception):
+        handler.put_item({'pk': 'org1', 'category': 'ic', 'name': 'lost', 'qty': 1})
+    client.injected_errors.clear()
+    assert full_query(handler) == []
+
+    # アイテムの書き込みが失敗しても、余分な delta はマージで読み直すだけ
+    sk = put_parts(handler, 1)[0]
+    client.inject_error('UpdateItem', 'InternalServerError', times=10)
+    with pytest.raises(Exception):
+        handler.update_item({'pk': 'org1', 'sk': sk, 'name': 'not written'})
+    client.injected_errors.clear()
+    raw_items, _ = handler.snapshots.load(handler, 'org1')
+    assert raw_items == full_query(handler)
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.delenv('SNAPSHOTS', raising=False)
+    assert from_env() is None
+    monkeypatch.setenv('SNAPSHOTS', 'true')
+    monkeypatch.delenv('SNAPSHOT_SAFETY_SECONDS', raising=False)
+    snapshots = from_env()
+    assert isinstance(snapshots, InventorySnapshots)
+    assert snapshots.safety_seconds == 900
+    monkeypatch.setenv('SNAPSHOT_SAFETY_SECONDS', '1200')
+    assert from_env().safety_seconds == 1200
@@ -0,0 +1,101 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import tracing
+
+
+@pytest.fixture(autouse=True)
+def reset_tracing(monkeypatch):
+    monkeypatch.setattr(tracing, '_cold_start', True)
+    tracing._current.set(tracing.NULL_TRACER)
+
+
+def test_disabled_returns_null_tracer(monkeypatch):
+    monkeypatch.delenv(tracing.ENABLED_ENV_NAME, raising=False)
+    tracer = tracing.start_invocation('svc')
+    assert tracer is tracing.NULL_TRACER
+    with tracing.span('auth.jwks'):
+        pass
+    assert tracing.finish_invocation() is None
+
+
+def test_enabled_records_spans_counts_and_bytes(monkeypatch):
+    monkeypatch.setenv(tracing.ENABLED_ENV_NAME, 'true')
+    lines = []
+    tracer = tracing.start_invocation('svc', emit=lines.append)
+    with tracing.span('ddb.query.page'):
+        pass
+    with tracing.span('ddb.query.page'):
+        pass
+    tracer.add_count('ddb.query.items', 10)
+    tracer.add_count('ddb.query.items', 5)
+    tracer.add_bytes('response.bytes', 1234)
+    tracer.set_property('action', 'query')
+
+    document = tracing.finish_invocation()
+    assert json.loads(lines[0]) == json.loads(json.dumps(document))
+    assert document['Service'] == 'svc'
+    assert document['StartType'] == 'cold'
+    assert document['ddb.query.page.calls'] == 2
+    assert document['ddb.query.items'] == 15
+    assert document['response.bytes'] == 1234
+    assert document['action'] == 'query'
+    metric_units = {m['Name']: m['Unit'] for m in document['_aws']['CloudWatchMetrics'][0]['Metrics']}
+    assert metric_units['ddb.query.page'] == 'Milliseconds'
+    assert metric_units['ddb.query.items'] == 'Count'
+    assert metric_units['response.bytes'] == 'Bytes'
+    assert 'duration' in metric_units
+    assert tracing.current() is tracing.NULL_TRACER
+
+
+def test_second_invocation_is_warm(monkeypatch):
+    monkeypatch.setenv(tracing.ENABLED_ENV_NAME, '1')
+    tracing.start_invocation('svc', emit=lambda line: None)
+    assert tracing.finish_invocation()['StartType'] == 'cold'
+    tracing.start_invocation('svc', emit=lambda line: None)
+    assert tracing.finish_invocation()['StartType'] == 'warm'
+
+
+def test_traced_decorator_sets_status_code(monkeypatch, capsys):
+    monkeypatch.setenv(tracing.ENABLED_ENV_NAME, '1')
+
+    @tracing.traced('svc')
+    def handler(event, context):
+        with tracing.span('serialize'):
+            return {'statusCode': 200}
+
+    assert handler({}, None) == {'statusCode': 200}
+    document = json.loads(capsys.readouterr().out.strip())
+    assert document['status_code'] == 200
+    assert 'serialize' in document
+
+
+def test_concurrent_invocations_do_not_share_tracer(monkeypatch):
+    monkeypatch.setenv(tracing.ENABLED_ENV_NAME, '1')
+    started = threading.Barrier(2)
+    documents = {}
+
+    def invoke(name):
+        tracing.start_invocation(name, emit=lambda line: None)
+        started.wait()
+        tracing.current().add_count(f'{name}.items')
+        started.wait()
+        documents[name] = tracing.finish_invocation()
+
+    threads = [threading.Thread(target=invoke, args=(name,)) for name in ('a', 'b')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert documents['a']['a.items'] == 1 and 'b.items' not in documents['a']
+    assert documents['b']['b.items'] == 1 and 'a.items' not in documents['b']
+    assert tracing.current() is tracing.NULL_TRACER
+
+
+def test_in_context_records_to_caller_tracer(monkeypatch):
+    monkeypatch.setenv(tracing.ENABLED_ENV_NAME, '1')
+    tracing.start_invocation('svc', emit=lambda line: None)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        list(executor.map(tracing.in_context(lambda n: tracing.current().add_count('shard.items', n)), [1, 2, 3]))
+    assert tracing.finish_invocation()['shard.items'] == 6
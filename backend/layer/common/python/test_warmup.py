@@ -0,0 +1,134 @@
+import io
+import json
+import sys
+import types
+import pytest
+from unittest.mock import MagicMock, patch
+from dynamodb_fake import FakeDynamoDBClient
+import clients
+import cognito_auth
+import warmup
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(autouse=True)
+def reset_caches():
+    clients.reset_clients()
+    cognito_auth.clear_jwks_cache()
+    yield
+    clients.reset_clients()
+    cognito_auth.clear_jwks_cache()
+
+
+def jwks_response(*kids):
+    return io.BytesIO(json.dumps({'keys': [{'kid': kid} for kid in kids]}).encode())
+
+
+def test_is_warmup_event():
+    assert warmup.is_warmup_event({'warmup': True})
+    assert warmup.is_warmup_event({'source': 'aws.events', 'detail-type': 'Scheduled Event'})
+    assert not warmup.is_warmup_event({'body': '{}', 'headers': {}})
+    assert not warmup.is_warmup_event({'source': 'aws.events', 'detail-type': 'Object Created'})
+    assert not warmup.is_warmup_event(None)
+
+
+@patch('clients.boto3.client')
+def test_clients_are_reused(mock_boto_client):
+    mock_boto_client.side_effect = lambda *args, **kwargs: MagicMock()
+    first = clients.get_client('dynamodb', 'ap-northeast-1')
+    assert clients.get_client('dynamodb', 'ap-northeast-1') is first
+    assert clients.get_client('dynamodb', 'us-east-1') is not first
+    assert mock_boto_client.call_count == 2
+    clients.reset_clients()
+    assert clients.get_client('dynamodb', 'ap-northeast-1') is not first
+
+
+@patch('cognito_auth.urllib.request.urlopen')
+def test_jwks_is_cached_until_unknown_kid_or_expiry(mock_urlopen):
+    clock = FakeClock()
+    mock_urlopen.side_effect = lambda url: jwks_response('key1')
+    url = cognito_auth.jwks_url('ap-northeast-1', 'pool')
+
+    assert cognito_auth.fetch_jwks(url, 'key1', clock=clock) == {'keys': [{'kid': 'key1'}]}
+    cognito_auth.fetch_jwks(url, 'key1', clock=clock)
+    assert mock_urlopen.call_count == 1
+    # 未知の kid でも、前回の取得から間もなければ取り直さない（キャッシュの JWKS で検証して拒否する）
+    assert cognito_auth.fetch_jwks(url, 'key2', clock=clock) == {'keys': [{'kid': 'key1'}]}
+    assert mock_urlopen.call_count == 1
+    # 鍵がローテーションされたら取り直す
+    clock.now = cognito_auth.JWKS_MIN_REFETCH_SECONDS
+    cognito_auth.fetch_jwks(url, 'key2', clock=clock)
+    assert mock_urlopen.call_count == 2
+    cognito_auth.fetch_jwks(url, 'key3', clock=clock)
+    assert mock_urlopen.call_count == 2
+    clock.now += cognito_auth.JWKS_TTL_SECONDS
+    cognito_auth.fetch_jwks(url, clock=clock)
+    assert mock_urlopen.call_count == 3
+
+
+@patch('cognito_auth.urllib.request.urlopen')
+def test_warmer_primes_clients_jwks_and_connections(mock_urlopen):
+    mock_urlopen.side_effect = lambda url: jwks_response('key1')
+    fake_client = FakeDynamoDBClient()
+    fake_client.add_table('components', 'pk', 'sk')
+    warmer = warmup.Warmer().jwks('ap-northeast-1', 'pool').describe_tables('ap-northeast-1', ['components'])
+
+    with patch('clients.boto3.client', return_value=fake_client):
+        report = warmer.prime()
+
+    assert report['warmed'] is True
+    assert set(report['steps']) == {'jwks', 'dynamodb.connect'}
+    assert fake_client.call_counts['DescribeTable'] == 1
+    # 最初のリクエストでは JWKS を取得しない
+    cognito_auth.prefetch_jwks('ap-northeast-1', 'pool')
+    assert mock_urlopen.call_count == 1
+    response = warmup.warmup_response(report)
+    assert response['statusCode'] == 200
+    assert json.loads(response['body'])['warmed'] is True
+
+
+def test_failed_step_does_not_stop_others():
+    calls = []
+
+    def fail():
+        raise RuntimeError('network down')
+
+    report = warmup.Warmer().step('first', fail).step('second', lambda: calls.append('second')).prime()
+    assert report['warmed'] is False
+    assert report['steps']['first']['ok'] is False
+    assert report['steps']['second']['ok'] is True
+    assert calls == ['second']
+
+
+def test_init_hook_registers_snapshot_hooks(monkeypatch):
+    registered = {}
+    module = types.ModuleType('snapshot_restore_py')
+    module.register_before_snapshot = lambda fn: registered.setdefault('before', fn)
+    module.register_after_restore = lambda fn: registered.setdefault('after', fn)
+    monkeypatch.setitem(sys.modules, 'snapshot_restore_py', module)
+    monkeypatch.delenv('AWS_LAMBDA_INITIALIZATION_TYPE', raising=False)
+
+    calls = []
+    warmer = warmup.Warmer().step('step', lambda: calls.append('primed'))
+    assert warmer.init_hook() is True
+    assert calls == []
+    registered['before']()
+    with patch('clients.reset_clients') as mock_reset:
+        registered['after']()
+    mock_reset.assert_called_once()
+    assert calls == ['primed', 'primed']
+
+
+def test_init_hook_primes_provisioned_concurrency(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'snapshot_restore_py', None)
+    monkeypatch.setenv('AWS_LAMBDA_INITIALIZATION_TYPE', 'provisioned-concurrency')
+    calls = []
+    assert warmup.Warmer().step('step', lambda: calls.append('primed')).init_hook() is False
+    assert calls == ['primed']
@@ -0,0 +1,205 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+
+# 1回の呼び出しで発生した処理時間（スパン）・件数・サイズを集計し、
+# CloudWatch Embedded Metric Format (EMF) の JSON 1行として出力する
+# TRACING_ENABLED が未設定の場合は何もしない NullTracer を使う
+# 現在のトレーサーは呼び出し（スレッド）ごとに持つので、ローカルサーバーなどで同時に処理しても混ざらない
+# スレッドプールで処理するときは in_context() で呼び出し元のトレーサーを引き継ぐ
+
+NAMESPACE = 'InventoryManager'
+ENABLED_ENV_NAME = 'TRACING_ENABLED'
+
+UNIT_MILLISECONDS = 'Milliseconds'
+UNIT_COUNT = 'Count'
+UNIT_BYTES = 'Bytes'
+
+_cold_start = True
+
+
+def is_enabled():
+    return os.environ.get(ENABLED_ENV_NAME, '').lower() in ('1', 'true', 'yes')
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class NullTracer:
+    enabled = False
+
+    def span(self, name):
+        return _NULL_SPAN
+
+    def add_count(self, name, value=1):
+        pass
+
+    def add_bytes(self, name, size):
+        pass
+
+    def set_property(self, key, value):
+        pass
+
+    def flush(self):
+        return None
+
+
+NULL_TRACER = NullTracer()
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'started')
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.record(self.name, (time.perf_counter() - self.started) * 1000)
+        return False
+
+
+class Tracer:
+    enabled = True
+
+    def __init__(self, service, cold_start=False, namespace=NAMESPACE, emit=print):
+        self.service = service
+        self.cold_start = cold_start
+        self.namespace = namespace
+        self.emit = emit
+        self.started = time.perf_counter()
+        # name -> (unit, value)
+        self.metrics = {}
+        self.span_counts = {}
+        self.properties = {}
+        self.lock = threading.Lock()
+
+    def span(self, name):
+        return _Span(self, name)
+
+    def record(self, name, elapsed_ms):
+        with self.lock:
+            _, total = self.metrics.get(name, (UNIT_MILLISECONDS, 0.0))
+            self.metrics[name] = (UNIT_MILLISECONDS, total + elapsed_ms)
+            self.span_counts[name] = self.span_counts.get(name, 0) + 1
+
+    def _add(self, name, unit, value):
+        with self.lock:
+            _, total = self.metrics.get(name, (unit, 0))
+            self.metrics[name] = (unit, total + value)
+
+    def add_count(self, name, value=1):
+        self._add(name, UNIT_COUNT, value)
+
+    def add_bytes(self, name, size):
+        self._add(name, UNIT_BYTES, size)
+
+    def set_property(self, key, value):
+        with self.lock:
+            self.properties[key] = value
+
+    def to_emf(self):
+        with self.lock:
+            metrics = dict(self.metrics)
+            span_counts = dict(self.span_counts)
+            properties = dict(self.properties)
+        metrics['duration'] = (UNIT_MILLISECONDS, (time.perf_counter() - self.started) * 1000)
+
+        document = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['Service', 'StartType']],
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, (unit, _) in metrics.items()],
+                }],
+            },
+            'Service': self.service,
+            'StartType': 'cold' if self.cold_start else 'warm',
+        }
+        for name, (unit, value) in metrics.items():
+            document[name] = round(value, 3) if unit == UNIT_MILLISECONDS else value
+        # スパンの呼び出し回数はメトリクスではなくプロパティとして残す
+        for name, count in span_counts.items():
+            document[f'{name}.calls'] = count
+        document.update(properties)
+        return document
+
+    def flush(self):
+        document = self.to_emf()
+        self.emit(json.dumps(document, default=str))
+        return document
+
+
+_current = contextvars.ContextVar('tracer', default=NULL_TRACER)
+
+
+def current():
+    return _current.get()
+
+
+def start_invocation(service, emit=print):
+    global _cold_start
+    cold_start = _cold_start
+    _cold_start = False
+    tracer = Tracer(service, cold_start=cold_start, emit=emit) if is_enabled() else NULL_TRACER
+    _current.set(tracer)
+    return tracer
+
+
+def finish_invocation():
+    tracer = _current.get()
+    _current.set(NULL_TRACER)
+    return tracer.flush()
+
+
+def span(name):
+    return _current.get().span(name)
+
+
+# fn を別のスレッドで実行しても、呼び出し元（今）のトレーサーに記録されるようにする
+def in_context(fn):
+    tracer = _current.get()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        token = _current.set(tracer)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return run
+
+
+# lambda_handler をラップして呼び出しごとに計測を開始・出力する
+def traced(service):
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            tracer = start_invocation(service)
+            try:
+                response = handler(event, context)
+                if isinstance(response, dict) and 'statusCode' in response:
+                    tracer.set_property('status_code', response['statusCode'])
+                return response
+            finally:
+                finish_invocation()
+        return wrapper
+    return decorator
@@ -0,0 +1,111 @@
+import json
+import logging
+import os
+import time
+
+import clients
+import cognito_auth
+import tracing
+from dynamodb_handler import CLIENT_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# ウォームアップ（スケジュールされたウォーマー・プロビジョニングされた同時実行・SnapStart）用の処理
+# 認証などの通常の処理は通さず、最初のリクエストで払っていたコストを先に払っておく
+#   - boto3 クライアントの作成（clients.get_client でコンテナ内に保持）
+#   - JWKS の取得（cognito_auth のキャッシュに保持）
+#   - DescribeTable による DynamoDB への TLS 接続（接続プールに残る）
+#
+#   WARMER = warmup.Warmer().jwks(REGION_NAME, COGNITO_USER_POOL_ID).describe_tables(REGION_NAME, [TABLE_NAME])
+#   if warmup.is_warmup_event(event):
+#       return warmup.warmup_response(WARMER.prime())
+
+WARMUP_KEY = 'warmup'
+INITIALIZATION_TYPE_ENV = 'AWS_LAMBDA_INITIALIZATION_TYPE'
+
+
+# {"warmup": true} か EventBridge のスケジュールイベント
+# Function URL のイベントにはどちらも含まれないので、通常のリクエストと取り違えることはない
+def is_warmup_event(event):
+    if not isinstance(event, dict):
+        return False
+    if event.get(WARMUP_KEY):
+        return True
+    return event.get('source') == 'aws.events' and event.get('detail-type') == 'Scheduled Event'
+
+
+class Warmer:
+    # ステップは (名前, 関数) の順に実行する。失敗したステップがあっても残りは続ける
+    def __init__(self, clock=time.perf_counter):
+        self.steps = []
+        self.clock = clock
+        self.last_report = None
+
+    def step(self, name, fn):
+        self.steps.append((name, fn))
+        return self
+
+    def client(self, service_name, region_name=None):
+        return self.step(f'client.{service_name}', lambda: clients.get_client(service_name, region_name))
+
+    def jwks(self, region, user_pool_id):
+        return self.step('jwks', lambda: cognito_auth.prefetch_jwks(region, user_pool_id))
+
+    # DynamoDBHandler と同じクライアントを作り、DescribeTable で接続を張る（読み込みキャパシティを消費しない）
+    def describe_tables(self, region_name, table_names):
+        def describe():
+            client = clients.get_client('dynamodb', region_name, config=CLIENT_CONFIG)
+            for table_name in table_names:
+                client.describe_table(TableName=table_name)
+        return self.step('dynamodb.connect', describe)
+
+    def prime(self):
+        tracer = tracing.current()
+        started = self.clock()
+        report = {'warmed': True, 'steps': {}}
+        for name, fn in self.steps:
+            step_started = self.clock()
+            try:
+                with tracer.span(f'warmup.{name}'):
+                    fn()
+                ok = True
+            except Exception as e:
+                logger.warning(f'Warm-up step {name} failed: {e}')
+                ok = False
+                report['warmed'] = False
+            report['steps'][name] = {'ok': ok, 'duration_ms': round((self.clock() - step_started) * 1000, 2)}
+        report['duration_ms'] = round((self.clock() - started) * 1000, 2)
+        logger.info(f'Warm-up finished: {json.dumps(report)}')
+        self.last_report = report
+        return report
+
+    # SnapStart のスナップショット前に準備し、復元後はクライアント（接続プール）を作り直す
+    # 復元前の接続は使えないので、スナップショットに含めたままにしない
+    # プロビジョニングされた同時実行の初期化中ならその場で準備する
+    def init_hook(self):
+        registered = register_snapshot_hooks(self.prime, self.restore)
+        if os.environ.get(INITIALIZATION_TYPE_ENV) == 'provisioned-concurrency':
+            self.prime()
+        return registered
+
+    def restore(self):
+        clients.reset_clients()
+        return self.prime()
+
+
+# snapshot_restore_py は SnapStart が有効なランタイムにだけある
+def register_snapshot_hooks(before_snapshot, after_restore):
+    try:
+        from snapshot_restore_py import register_after_restore, register_before_snapshot
+    except ImportError:
+        return False
+    register_before_snapshot(before_snapshot)
+    register_after_restore(after_restore)
+    return True
+
+
+def warmup_response(report):
+    return {
+        'statusCode': 200,
+        'body': json.dumps(report),
+    }
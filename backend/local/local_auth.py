@@ -0,0 +1,45 @@
+import time
+import uuid
+
+import rsa
+from jose import jwk, jwt
+
+# Cognito の代わりにトークンを発行するローカルの署名者
+# 起動ごとに RSA 鍵を作り、公開鍵を JWKS として返す（COGNITO_JWKS_URL にその URL を設定して検証させる）
+# クレームは Cognito の ID トークンに合わせる（aud = アプリクライアント ID、cognito:groups）
+# ローカル専用の鍵なので、起動を速くするため既定の鍵長は 1024 ビットにする（rsa パッケージの鍵生成は pure Python で遅い）
+
+
+class LocalSigner:
+    def __init__(self, audience, issuer='http://localhost/local-user-pool', key_bits=1024, lifetime_seconds=3600):
+        self.audience = audience
+        self.issuer = issuer
+        self.lifetime_seconds = lifetime_seconds
+        self.kid = str(uuid.uuid4())
+        _, private_key = rsa.newkeys(key_bits)
+        self.private_pem = private_key.save_pkcs1().decode()
+        public_jwk = jwk.construct(self.private_pem, 'RS256').public_key().to_dict()
+        self.public_jwk = dict(public_jwk, kid=self.kid, use='sig')
+
+    def jwks(self):
+        return {'keys': [self.public_jwk]}
+
+    def issue_token(self, sub, username=None, groups=None, lifetime_seconds=None):
+        now = int(time.time())
+        claims = {
+            'sub': sub,
+            'aud': self.audience,
+            'iss': self.issuer,
+            'token_use': 'id',
+            'cognito:username': username or sub,
+            'iat': now,
+            'exp': now + (lifetime_seconds if lifetime_seconds is not None else self.lifetime_seconds),
+        }
+        if groups:
+            claims['cognito:groups'] = list(groups)
+        return jwt.encode(claims, self.private_pem, algorithm='RS256', headers={'kid': self.kid})
+
+
+# Authorization ヘッダーの値（ハンドラーは "Bearer <token>" の2つ目を取り出す）
+def bearer(token):
+    return f'Bearer {token}'
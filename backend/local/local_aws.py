@@ -0,0 +1,90 @@
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# ローカル実行用の AWS クライアントの代わり（clients.override_client で差し替える）
+#   LocalCognitoClient : グループへの追加を記録するだけ。記録したグループは発行するトークンの cognito:groups に入れる
+#   LocalLambdaClient  : 非同期呼び出し（エクスポート・インポートのジョブ）を別スレッドで同じランタイムに渡す
+#   LatencyInjector    : DynamoDB などの呼び出しに一定の待ち時間を足す
+
+
+class LocalCognitoClient:
+    def __init__(self):
+        self.groups = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def admin_add_user_to_group(self, UserPoolId, Username, GroupName):
+        with self.lock:
+            self.groups[Username].add(GroupName)
+        return {}
+
+    def groups_of(self, username):
+        with self.lock:
+            return sorted(self.groups.get(username, ()))
+
+
+def function_name_of(function_name):
+    # ARN（arn:aws:lambda:region:account:function:name[:qualifier]）でも名前でも受け付ける
+    if function_name.startswith('arn:'):
+        return function_name.split(':')[6]
+    return function_name
+
+
+class LocalLambdaClient:
+    # invoke_function(name, event) でイベントを処理するランタイムを受け取る
+    def __init__(self, invoke_function):
+        self.invoke_function = invoke_function
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def invoke(self, FunctionName, InvocationType='RequestResponse', Payload=b'{}'):
+        name = function_name_of(FunctionName)
+        event = json.loads(Payload)
+        if InvocationType != 'Event':
+            result = self.invoke_function(name, event)
+            return {'StatusCode': 200, 'Payload': json.dumps(result).encode()}
+
+        def run():
+            try:
+                self.invoke_function(name, event)
+            except Exception:
+                logger.error(f'Asynchronous invocation of {name} failed', exc_info=True)
+
+        thread = threading.Thread(target=run, name=f'invoke-{name}', daemon=True)
+        thread.start()
+        with self.lock:
+            self.threads = [t for t in self.threads if t.is_alive()]
+            self.threads.append(thread)
+        return {'StatusCode': 202}
+
+    # 非同期呼び出しがすべて終わるまで待つ（続きを呼び出すジョブもあるので、新しいスレッドが無くなるまで繰り返す）
+    def wait(self):
+        while True:
+            with self.lock:
+                running = [t for t in self.threads if t.is_alive()]
+            if not running:
+                return
+            for thread in running:
+                thread.join()
+
+
+class LatencyInjector:
+    # メモリ上の DynamoDB は一瞬で返るので、API 呼び出しごとに latency_ms 待ってネットワーク越しの呼び出しに近づける
+    def __init__(self, client, latency_ms):
+        self.client = client
+        self.latency_seconds = latency_ms / 1000
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            time.sleep(self.latency_seconds)
+            return attr(*args, **kwargs)
+
+        return call
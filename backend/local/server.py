@@ -0,0 +1,405 @@
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+LAYER_DIR = os.path.join(BACKEND_DIR, 'layer', 'common', 'python')
+if LAYER_DIR not in sys.path:
+    sys.path.insert(0, LAYER_DIR)
+
+import clients
+import low_stock
+from dynamodb_fake import FakeDynamoDBClient
+from local_auth import LocalSigner
+from local_aws import LatencyInjector, LocalCognitoClient, LocalLambdaClient
+
+logger = logging.getLogger(__name__)
+
+# components-crud / user-register / organization-id-get を HTTP で動かすローカルランタイム
+# リクエストを Lambda Function URL と同じ形（ペイロード 2.0）のイベントにして、各関数の lambda_handler を呼ぶ
+#   - 振り分けは router 関数と同じ（/components, /register, /organization や body の中身）
+#   - 関数のモジュールは最初のリクエストで読み込み、以降は同じモジュール（ウォームな状態）を使い続ける
+#   - 認証: local   … ローカルの署名者がトークンを発行し、/.well-known/jwks.json の JWKS で検証させる
+#           cognito … 本物の Cognito のトークンで検証する（COGNITO_* の環境変数が必要）
+#   - DynamoDB: 既定はメモリ上の FakeDynamoDBClient（--dynamodb-endpoint で DynamoDB Local なども使える）
+#   - エクスポート・インポートの非同期呼び出しは別スレッドで処理し、ファイルは OBJECT_STORE_DIR に置く
+#   - --record で受けたイベントを JSON Lines で保存する（benchmarks/load_harness.py --replay で再生できる）
+#   - GET /local/stats でメモリ上の DynamoDB の API 呼び出し回数を返す（負荷試験で1リクエストあたりの回数を出すため）
+#   - --profile / --profile-dir で components-crud の呼び出しをプロファイルする（admin は x-profile ヘッダーでも指定できる）
+#
+# 使い方: python backend/local/server.py --port 8080
+#   curl -X POST localhost:8080/local/token -d '{"sub": "user1", "username": "user1"}'
+#   curl -X POST localhost:8080/register -H "Authorization: Bearer <id_token>" \
+#        -d '{"value": {"mode": "create", "organization_input": "org", "user_id": "user1", "username": "user1"}}'
+# フロントエンドは REACT_APP_*_LAMBDA_URL を http://localhost:8080/components などに向ける
+
+JWKS_PATH = '/.well-known/jwks.json'
+TOKEN_PATH = '/local/token'
+STATS_PATH = '/local/stats'
+
+DEFAULT_ENV = {
+    'REGION_NAME': 'ap-northeast-1',
+    'COGNITO_USER_POOL_ID': 'local_user_pool',
+    'COGNITO_APP_CLIENT_ID': 'local_app_client',
+    'TABLE_NAME': 'components',
+    'PK_NAME': 'organization_id',
+    'SK_NAME': 'category_item_id',
+    'SK_PREFIX': 'category',
+    'SK_SUFFIX': 'item_id',
+    'SK_DELIMITER': '#',
+    'FIELD_TYPES': json.dumps({
+        'organization_id': 'S', 'category_item_id': 'S', 'item_id': 'S', 'category': 'S',
+        'manufacturer': 'S', 'name': 'S', 'type': 'S', 'model_number': 'S', 'year': 'S', 'qty': 'N',
+        'reorder_threshold': 'N', 'storage_area': 'S', 'assign': 'S', 'note': 'S', 'created_at': 'S', 'updated_at': 'S',
+    }),
+    'TABLE1_NAME': 'users',
+    'TABLE1_PK_NAME': 'user_id',
+    'TABLE1_FIELD_TYPES': json.dumps({
+        'user_id': 'S', 'organization_id': 'S', 'username': 'S', 'organization_name': 'S', 'organization_version': 'N',
+    }),
+    'TABLE2_NAME': 'organizations',
+    'TABLE2_PK_NAME': 'organization_id',
+    'TABLE2_FIELD_TYPES': json.dumps({'organization_id': 'S', 'organization_name': 'S'}),
+    'IDEMPOTENCY_TABLE_NAME': 'idempotency',
+    'LOW_STOCK_INDEX_NAME': 'low-stock-index',
+    'COMPRESS_MIN_BYTES': '1024',
+    'USERS_BY_ORGANIZATION_INDEX': 'users-by-organization',
+    'AWS_DEFAULT_REGION': 'ap-northeast-1',
+}
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'authorization, content-type, idempotency-key, x-profile',
+    'Access-Control-Expose-Headers': 'retry-after, idempotency-replayed, x-local-function, x-local-duration-ms',
+}
+
+
+def load_router():
+    path = os.path.join(BACKEND_DIR, 'router', 'lambda_function.py')
+    spec = importlib.util.spec_from_file_location('router_lambda_function', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class LocalContext:
+    # Lambda のコンテキストのうちハンドラーが使う属性だけを持つ
+    def __init__(self, function_name, timeout_seconds=900):
+        self.function_name = function_name
+        self.invoked_function_arn = f'arn:aws:lambda:local:000000000000:function:{function_name}'
+        self.aws_request_id = str(uuid.uuid4())
+        self.expires_at = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.expires_at - time.monotonic()) * 1000))
+
+
+def make_event(method, raw_path, headers, body, source_ip='127.0.0.1'):
+    path, _, query = raw_path.partition('?')
+    headers = {name.lower(): value for name, value in headers.items()}
+    now = time.time()
+    event = {
+        'version': '2.0',
+        'routeKey': '$default',
+        'rawPath': path,
+        'rawQueryString': query,
+        'headers': headers,
+        'requestContext': {
+            'accountId': 'anonymous',
+            'domainName': headers.get('host', 'localhost'),
+            'http': {
+                'method': method,
+                'path': path,
+                'protocol': 'HTTP/1.1',
+                'sourceIp': source_ip,
+                'userAgent': headers.get('user-agent', ''),
+            },
+            'requestId': str(uuid.uuid4()),
+            'routeKey': '$default',
+            'stage': '$default',
+            'time': time.strftime('%d/%b/%Y:%H:%M:%S +0000', time.gmtime(now)),
+            'timeEpoch': int(now * 1000),
+        },
+        'body': body,
+        'isBase64Encoded': False,
+    }
+    if query:
+        event['queryStringParameters'] = dict(parse_qsl(query))
+    return event
+
+
+class LocalRuntime:
+    # concurrency: 同時に処理するリクエスト数の上限（1 で Lambda のコンテナ1つと同じく直列に処理する）
+    # dynamodb_latency_ms: メモリ上の DynamoDB の呼び出しごとに足す待ち時間
+    def __init__(self, auth='local', dynamodb_endpoint=None, concurrency=None, log_level=logging.INFO,
+                 dynamodb_latency_ms=0, record_path=None):
+        if auth not in ('local', 'cognito'):
+            raise ValueError(f'Unknown auth mode: {auth}')
+        for name, value in DEFAULT_ENV.items():
+            os.environ.setdefault(name, value)
+        os.environ.setdefault('OBJECT_STORE_DIR', tempfile.mkdtemp(prefix='inventory-local-'))
+
+        self.auth = auth
+        self.log_level = log_level
+        self.slots = threading.BoundedSemaphore(concurrency) if concurrency else None
+        self.record_file = open(record_path, 'a') if record_path else None
+        self.record_lock = threading.Lock()
+        self.router = load_router()
+        self.lambda_client = LocalLambdaClient(self.invoke)
+        clients.override_client('lambda', self.lambda_client)
+
+        self.signer = None
+        self.cognito = None
+        if auth == 'local':
+            self.signer = LocalSigner(os.environ['COGNITO_APP_CLIENT_ID'])
+            self.cognito = LocalCognitoClient()
+            clients.override_client('cognito-idp', self.cognito)
+
+        self.dynamodb = None
+        if dynamodb_endpoint:
+            os.environ['AWS_ENDPOINT_URL_DYNAMODB'] = dynamodb_endpoint
+        else:
+            self.dynamodb = FakeDynamoDBClient()
+            self.create_tables(self.dynamodb)
+            if dynamodb_latency_ms > 0:
+                clients.override_client('dynamodb', LatencyInjector(self.dynamodb, dynamodb_latency_ms))
+            else:
+                clients.override_client('dynamodb', self.dynamodb)
+
+    @staticmethod
+    def create_tables(dynamodb):
+        indexes = []
+        if os.environ.get('LOW_STOCK_INDEX_NAME'):
+            indexes.append({
+                'IndexName': os.environ['LOW_STOCK_INDEX_NAME'],
+                'KeySchema': [{'AttributeName': low_stock.FLAG_NAME, 'KeyType': 'HASH'},
+                              {'AttributeName': os.environ['SK_NAME'], 'KeyType': 'RANGE'}],
+            })
+        dynamodb.create_table(
+            TableName=os.environ['TABLE_NAME'],
+            KeySchema=[{'AttributeName': os.environ['PK_NAME'], 'KeyType': 'HASH'},
+                       {'AttributeName': os.environ['SK_NAME'], 'KeyType': 'RANGE'}],
+            GlobalSecondaryIndexes=indexes,
+        )
+        user_indexes = []
+        if os.environ.get('USERS_BY_ORGANIZATION_INDEX'):
+            user_indexes.append({
+                'IndexName': os.environ['USERS_BY_ORGANIZATION_INDEX'],
+                'KeySchema': [{'AttributeName': os.environ['TABLE2_PK_NAME'], 'KeyType': 'HASH'}],
+            })
+        dynamodb.create_table(
+            TableName=os.environ['TABLE1_NAME'],
+            KeySchema=[{'AttributeName': os.environ['TABLE1_PK_NAME'], 'KeyType': 'HASH'}],
+            GlobalSecondaryIndexes=user_indexes,
+        )
+        dynamodb.add_table(os.environ['TABLE2_NAME'], os.environ['TABLE2_PK_NAME'])
+        if os.environ.get('IDEMPOTENCY_TABLE_NAME'):
+            dynamodb.add_table(os.environ['IDEMPOTENCY_TABLE_NAME'], 'idempotency_key')
+
+    def close(self):
+        self.lambda_client.wait()
+        clients.clear_overrides()
+        if self.record_file is not None:
+            self.record_file.close()
+
+    def record(self, event):
+        if self.record_file is None:
+            return
+        with self.record_lock:
+            self.record_file.write(json.dumps(event) + '\n')
+            self.record_file.flush()
+
+    def stats(self):
+        if self.dynamodb is None:
+            return {'dynamodb_calls': None}
+        with self.dynamodb.lock:
+            return {'dynamodb_calls': dict(self.dynamodb.call_counts)}
+
+    def load_function(self, name):
+        module = self.router.load_function(name)
+        # 各関数はルートロガーを INFO にするので、読み込んだ後に指定のレベルに戻す
+        logging.getLogger().setLevel(self.log_level)
+        return module
+
+    def invoke(self, name, event):
+        module = self.load_function(name)
+        if self.slots is None:
+            return module.lambda_handler(event, LocalContext(name))
+        with self.slots:
+            return module.lambda_handler(event, LocalContext(name))
+
+    def warm(self):
+        results = {}
+        for name in self.router.FUNCTION_NAMES:
+            response = self.invoke(name, {'warmup': True})
+            results[name] = json.loads(response['body'])
+        return results
+
+    def issue_token(self, request):
+        if self.signer is None:
+            raise ValueError('Tokens are issued only in local auth mode')
+        sub = request.get('sub') or str(uuid.uuid4())
+        username = request.get('username') or sub
+        # グループを指定しなければ、登録時に追加されたグループを入れる
+        groups = request.get('groups')
+        if groups is None:
+            groups = self.cognito.groups_of(username)
+        token = self.signer.issue_token(sub, username, groups)
+        return {
+            'id_token': token,
+            'token_type': 'Bearer',
+            'expires_in': self.signer.lifetime_seconds,
+            'sub': sub,
+            'username': username,
+            'groups': groups,
+        }
+
+    # (ステータスコード, ヘッダー, body のバイト列) を返す
+    def handle(self, method, raw_path, headers, body):
+        path = raw_path.partition('?')[0]
+        if method == 'OPTIONS':
+            return 204, dict(CORS_HEADERS), b''
+        if path == JWKS_PATH and self.signer is not None:
+            return self.json_response(200, self.signer.jwks())
+        if path == STATS_PATH and method == 'GET':
+            return self.json_response(200, self.stats())
+        if path == TOKEN_PATH and method == 'POST':
+            try:
+                return self.json_response(200, self.issue_token(json.loads(body or '{}')))
+            except ValueError as ve:
+                return self.json_response(400, {'message': str(ve)})
+
+        event = make_event(method, raw_path, headers, body)
+        name = self.router.route(event)
+        if name is None:
+            return self.json_response(404, {'message': f'No function for {path}'})
+        self.record(event)
+
+        started = time.perf_counter()
+        result = self.invoke(name, event)
+        duration_ms = (time.perf_counter() - started) * 1000
+        status, response_headers, response_body = self.function_url_response(result)
+        response_headers.update(CORS_HEADERS)
+        response_headers['X-Local-Function'] = name
+        response_headers['X-Local-Duration-Ms'] = f'{duration_ms:.2f}'
+        return status, response_headers, response_body
+
+    # Function URL と同じく、statusCode の無い戻り値はそのまま JSON の body として返す
+    @staticmethod
+    def function_url_response(result):
+        if not isinstance(result, dict) or 'statusCode' not in result:
+            return 200, {'Content-Type': 'application/json'}, json.dumps(result).encode()
+        headers = {'Content-Type': 'application/json'}
+        headers.update(result.get('headers') or {})
+        body = result.get('body') or ''
+        return result['statusCode'], headers, body.encode() if isinstance(body, str) else body
+
+    @staticmethod
+    def json_response(status, body):
+        headers = dict(CORS_HEADERS, **{'Content-Type': 'application/json'})
+        return status, headers, json.dumps(body).encode()
+
+
+class LocalRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode() if length > 0 else None
+        try:
+            status, headers, response_body = self.server.runtime.handle(
+                self.command, self.path, dict(self.headers.items()), body
+            )
+        except Exception as e:
+            logger.error(f'Local runtime failed: {e}', exc_info=True)
+            status, headers, response_body = 502, dict(CORS_HEADERS), b''
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(response_body)))
+        self.end_headers()
+        self.wfile.write(response_body)
+
+    do_GET = _handle
+    do_POST = _handle
+    do_OPTIONS = _handle
+
+    def log_message(self, format, *args):
+        logger.debug(f'{self.address_string()} {format % args}')
+
+
+class LocalServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, runtime, host='127.0.0.1', port=8080):
+        super().__init__((host, port), LocalRequestHandler)
+        self.runtime = runtime
+        self.thread = None
+        if runtime.auth == 'local':
+            os.environ['COGNITO_JWKS_URL'] = f'{self.url}{JWKS_PATH}'
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    # テストや負荷ツールから使うときはバックグラウンドのスレッドで動かす
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name='local-server', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.thread is not None:
+            self.thread.join()
+        self.runtime.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the Lambda handlers over HTTP for local development.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--auth', choices=['local', 'cognito'], default='local')
+    parser.add_argument('--dynamodb-endpoint', default=None, help='use DynamoDB Local etc. instead of the in-memory table')
+    parser.add_argument('--concurrency', type=int, default=None, help='max concurrent requests (1 behaves like a single container)')
+    parser.add_argument('--dynamodb-latency-ms', type=float, default=0, help='latency added to each in-memory DynamoDB call')
+    parser.add_argument('--record', default=None, help='append received events to this JSON Lines file')
+    parser.add_argument('--warm', action='store_true', help='load and warm every function before serving')
+    parser.add_argument('--profile', choices=['cpu', 'memory', 'all'], default=None, help='profile every request (PROFILING)')
+    parser.add_argument('--profile-dir', default=None, help='write profile reports here instead of the log (PROFILING_DIR)')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args(argv)
+    if args.profile is not None:
+        os.environ['PROFILING'] = args.profile
+    if args.profile_dir is not None:
+        os.environ['PROFILING_DIR'] = args.profile_dir
+
+    logging.basicConfig(level=args.log_level)
+    runtime = LocalRuntime(args.auth, args.dynamodb_endpoint, args.concurrency, logging.getLevelName(args.log_level),
+                           args.dynamodb_latency_ms, args.record)
+    server = LocalServer(runtime, args.host, args.port).start()
+    if args.warm:
+        print(json.dumps(runtime.warm(), indent=2))
+    print(f'Serving {", ".join(runtime.router.FUNCTION_NAMES)} on {server.url} (auth={args.auth})')
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
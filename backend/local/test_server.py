@@ -0,0 +1,111 @@
+import json
+import urllib.error
+import urllib.request
+import pytest
+
+from local_auth import LocalSigner, bearer
+from local_aws import LocalLambdaClient
+from server import LocalRuntime, LocalServer, make_event
+
+
+@pytest.fixture(scope='module')
+def server():
+    server = LocalServer(LocalRuntime(concurrency=4), port=0).start()
+    yield server
+    server.stop()
+
+
+def request(server, path, body=None, token=None, method='POST'):
+    headers = {'Content-Type': 'application/json'}
+    if token is not None:
+        headers['Authorization'] = bearer(token)
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(f'{server.url}{path}', data=data, headers=headers, method=method)
+    try:
+        with urllib.request.urlopen(req) as response:
+            raw = response.read()
+            return response.status, dict(response.headers), json.loads(raw) if raw else None
+    except urllib.error.HTTPError as e:
+        raw = e.read()
+        return e.code, dict(e.headers), json.loads(raw) if raw else None
+
+
+def issue_token(server, sub, groups=None):
+    body = {'sub': sub, 'username': sub}
+    if groups is not None:
+        body['groups'] = groups
+    return request(server, '/local/token', body)[2]['id_token']
+
+
+def test_make_event_is_function_url_shaped():
+    event = make_event('POST', '/components?debug=1', {'Authorization': 'Bearer x'}, '{}')
+    assert event['rawPath'] == '/components'
+    assert event['rawQueryString'] == 'debug=1'
+    assert event['queryStringParameters'] == {'debug': '1'}
+    assert event['headers'] == {'authorization': 'Bearer x'}
+    assert event['requestContext']['http']['method'] == 'POST'
+
+
+def test_register_then_use_components(server):
+    token = issue_token(server, 'user1')
+    status, headers, body = request(server, '/register', {'value': {
+        'mode': 'create', 'organization_input': 'Lab', 'user_id': 'user1', 'username': 'user1',
+    }}, token)
+    assert status == 200
+    assert headers['X-Local-Function'] == 'user-register'
+    organization_id = body['user']['organization_id']
+
+    status, _, body = request(server, '/organization', {'value': {'user_id': 'user1'}}, token)
+    assert body['organization']['organization_name'] == 'Lab'
+
+    # 登録で admin グループに追加されたので、新しいトークンでは編集できる
+    token = issue_token(server, 'user1')
+    item = {'organization_id': organization_id, 'category': 'ic', 'name': 'opamp', 'qty': '3'}
+    status, _, body = request(server, '/components', {'action': 'put', 'value': item}, token)
+    assert status == 200
+    status, _, body = request(server, '/components', {'action': 'query', 'value': {'organization_id': organization_id}}, token)
+    assert [c['name'] for c in body['components']] == ['opamp']
+
+
+def test_routes_by_body_on_root_path(server):
+    token = issue_token(server, 'user2', groups=['viewer'])
+    status, headers, body = request(server, '/', {'value': {'user_id': 'user2'}}, token)
+    assert status == 200
+    assert headers['X-Local-Function'] == 'organization-id-get'
+    assert body['result'] == 'failure'
+
+
+def test_rejects_tokens_from_another_signer(server):
+    other = LocalSigner('local_app_client')
+    status, _, _ = request(server, '/organization', {'value': {'user_id': 'user1'}}, other.issue_token('user1'))
+    assert status == 401
+
+
+def test_cors_and_unknown_routes(server):
+    status, headers, _ = request(server, '/components', method='OPTIONS')
+    assert status == 204
+    assert headers['Access-Control-Allow-Origin'] == '*'
+    assert request(server, '/unknown', {})[0] == 404
+
+
+def test_lambda_client_waits_for_chained_invocations():
+    calls = []
+
+    def invoke_function(name, event):
+        calls.append((name, event['n']))
+        if event['n'] < 3:
+            client.invoke(FunctionName=f'arn:aws:lambda:local:0:function:{name}', InvocationType='Event',
+                          Payload=json.dumps({'n': event['n'] + 1}).encode())
+
+    client = LocalLambdaClient(invoke_function)
+    assert client.invoke(FunctionName='components-crud', InvocationType='Event', Payload=b'{"n": 1}')['StatusCode'] == 202
+    client.wait()
+    assert calls == [('components-crud', 1), ('components-crud', 2), ('components-crud', 3)]
+
+
+def test_stats_count_dynamodb_calls(server):
+    before = request(server, '/local/stats', method='GET')[2]['dynamodb_calls']
+    token = issue_token(server, 'user3', groups=['viewer'])
+    request(server, '/components', {'action': 'query', 'value': {'organization_id': 'org-stats'}}, token)
+    after = request(server, '/local/stats', method='GET')[2]['dynamodb_calls']
+    assert after['Query'] == before.get('Query', 0) + 1
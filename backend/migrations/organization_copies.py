@@ -0,0 +1,107 @@
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'layer', 'common', 'python'))
+
+from dynamodb_handler import DynamoDBHandler  # noqa: E402
+from schema import load_schema  # noqa: E402
+import organization_sync  # noqa: E402
+
+# users に持たせている organization の名前のコピー（organization_sync）を管理する
+#   rename  : organization の名前を変えて、所属する users のコピーを書き換える
+#   sync    : organization の今の名前・バージョンを所属する users に書く（rename が途中で止まったときのやり直し）
+#   backfill: コピーを持っていない users（有効にする前に登録した users）にコピーを書く
+# コピーはバージョンが新しいときだけ書くので、どれも何度実行してもよい
+# 環境変数は user-register と同じもの（REGION_NAME, TABLE1_*, TABLE2_*）と USERS_BY_ORGANIZATION_INDEX（任意）を使う
+# 使い方: python backend/migrations/organization_copies.py rename --organization-id ORG --name NAME
+#        python backend/migrations/organization_copies.py sync --organization-id ORG
+#        python backend/migrations/organization_copies.py backfill [--dry-run]
+
+
+def get_organization(organization_handler, organization_id):
+    organization = organization_handler.get_item({organization_handler.pk_name: organization_id})
+    if organization is None:
+        raise ValueError(f'Organization not found: {organization_id}')
+    return organization
+
+
+def rename(user_handler, organization_handler, organization_id, organization_name, index_name=None):
+    organization = organization_sync.rename_organization(organization_handler, organization_id, organization_name)
+    return organization_sync.fan_out(user_handler, organization_handler.pk_name, organization, index_name)
+
+
+def sync(user_handler, organization_handler, organization_id, index_name=None):
+    organization = get_organization(organization_handler, organization_id)
+    return organization_sync.fan_out(user_handler, organization_handler.pk_name, organization, index_name)
+
+
+def scan_users_without_copy(user_handler, organization_field):
+    params = {
+        'TableName': user_handler.table_name,
+        'FilterExpression': 'attribute_exists(#organization_id) AND attribute_not_exists(#version)',
+        'ExpressionAttributeNames': {
+            '#pk': user_handler.pk_name,
+            '#organization_id': organization_field,
+            '#version': organization_sync.VERSION_FIELD,
+        },
+        'ProjectionExpression': '#pk, #organization_id',
+    }
+    for items in organization_sync.iter_scan_pages(user_handler, params):
+        for item in items:
+            yield item[user_handler.pk_name]['S'], item[organization_field]['S']
+
+
+def backfill(user_handler, organization_handler, dry_run=False):
+    report = {'found': 0, 'updated': 0, 'missing_organization': []}
+    organizations = {}
+    for user_id, organization_id in scan_users_without_copy(user_handler, organization_handler.pk_name):
+        report['found'] += 1
+        if dry_run:
+            continue
+        if organization_id not in organizations:
+            organizations[organization_id] = organization_handler.get_item({organization_handler.pk_name: organization_id})
+        organization = organizations[organization_id]
+        if organization is None:
+            report['missing_organization'].append(user_id)
+        elif organization_sync.write_copy(user_handler, user_id, organization):
+            report['updated'] += 1
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Manage organization copies on user records.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    rename_parser = subparsers.add_parser('rename')
+    rename_parser.add_argument('--organization-id', required=True)
+    rename_parser.add_argument('--name', required=True)
+    sync_parser = subparsers.add_parser('sync')
+    sync_parser.add_argument('--organization-id', required=True)
+    backfill_parser = subparsers.add_parser('backfill')
+    backfill_parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args(argv)
+
+    user_field_types = load_schema('TABLE1_FIELD_TYPES')
+    if not organization_sync.is_enabled(user_field_types):
+        parser.error(f'TABLE1_FIELD_TYPES must include {organization_sync.NAME_FIELD} and {organization_sync.VERSION_FIELD}')
+    user_handler = DynamoDBHandler(
+        os.environ['REGION_NAME'], os.environ['TABLE1_NAME'], os.environ['TABLE1_PK_NAME'], '', '', '', '', user_field_types,
+    )
+    organization_handler = DynamoDBHandler(
+        os.environ['REGION_NAME'], os.environ['TABLE2_NAME'], os.environ['TABLE2_PK_NAME'], '', '', '', '',
+        load_schema('TABLE2_FIELD_TYPES'),
+    )
+    index_name = organization_sync.users_index_from_env()
+
+    if args.command == 'rename':
+        report = rename(user_handler, organization_handler, args.organization_id, args.name, index_name)
+    elif args.command == 'sync':
+        report = sync(user_handler, organization_handler, args.organization_id, index_name)
+    else:
+        report = backfill(user_handler, organization_handler, args.dry_run)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
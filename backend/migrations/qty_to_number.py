@@ -0,0 +1,65 @@
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'layer', 'common', 'python'))
+
+from dynamodb_handler import DynamoDBHandler  # noqa: E402
+from schema import load_schema  # noqa: E402
+
+# components テーブルの qty を文字列（S）から数値（N）に変換する
+#   1. FIELD_TYPES の qty を "N" にしてデプロイする（以降の put / update は数値で書く。フロントエンドからの文字列も数値に変換される）
+#   2. このスクリプトで残っている文字列の qty を変換する（adjust_qty も変換前のアイテムをその場で変換するので、途中で止めてもよい）
+# 変換は「読んだ時と同じ文字列なら」の条件付きで書くので、実行中の更新とは競合しない。何度実行してもよい
+# 環境変数は components-crud と同じもの（REGION_NAME, TABLE_NAME, PK_NAME, SK_NAME, ...）を使う
+# 使い方: python backend/migrations/qty_to_number.py [--dry-run] [--qty-name qty]
+
+
+def scan_string_quantities(handler, qty_name):
+    params = {
+        'TableName': handler.table_name,
+        'FilterExpression': 'attribute_type(#qty, :string)',
+        'ExpressionAttributeNames': {'#qty': qty_name},
+        'ExpressionAttributeValues': {':string': {'S': 'S'}},
+    }
+    while True:
+        response = handler._call('scan', **params)
+        for item in response.get('Items', []):
+            yield item
+        if 'LastEvaluatedKey' not in response:
+            return
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def migrate(handler, qty_name='qty', dry_run=False):
+    report = {'found': 0, 'migrated': 0, 'invalid': []}
+    for item in scan_string_quantities(handler, qty_name):
+        report['found'] += 1
+        key_item = {handler.pk_name: item[handler.pk_name]}
+        if handler.sk_name != '':
+            key_item[handler.sk_name] = item[handler.sk_name]
+        if dry_run:
+            continue
+        if handler.migrate_quantity(key_item, item[qty_name]['S'], qty_name):
+            report['migrated'] += 1
+        else:
+            report['invalid'].append({name: value['S'] for name, value in key_item.items()})
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert string quantities to numbers.')
+    parser.add_argument('--qty-name', default=os.environ.get('QTY_NAME', 'qty'))
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args(argv)
+
+    handler = DynamoDBHandler(
+        os.environ['REGION_NAME'], os.environ['TABLE_NAME'], os.environ['PK_NAME'], os.environ['SK_NAME'],
+        os.environ['SK_PREFIX'], os.environ['SK_SUFFIX'], os.environ['SK_DELIMITER'], load_schema('FIELD_TYPES'),
+    )
+    print(json.dumps(migrate(handler, args.qty_name, args.dry_run), indent=2))
+
+
+if __name__ == '__main__':
+    main()
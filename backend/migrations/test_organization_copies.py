@@ -0,0 +1,39 @@
+from dynamodb_fake import FakeDynamoDBClient
+from dynamodb_handler import DynamoDBHandler
+from organization_copies import backfill, rename, sync
+
+
+def make_handlers():
+    client = FakeDynamoDBClient()
+    client.add_table('users', 'user_id')
+    client.add_table('organizations', 'organization_id')
+    users = DynamoDBHandler('ap-northeast-1', 'users', 'user_id', '', '', '', '',
+                            {'user_id': 'S', 'organization_id': 'S', 'organization_name': 'S', 'organization_version': 'N'},
+                            client=client)
+    organizations = DynamoDBHandler('ap-northeast-1', 'organizations', 'organization_id', '', '', '', '',
+                                    {'organization_id': 'S', 'organization_name': 'S', 'version': 'N'}, client=client)
+    organizations.put_item({'organization_id': 'org1', 'organization_name': 'Org One'})
+    users.put_item({'user_id': 'user1', 'organization_id': 'org1'})
+    users.put_item({'user_id': 'user2', 'organization_id': 'org1'})
+    users.put_item({'user_id': 'user3', 'organization_id': 'gone'})
+    return users, organizations
+
+
+def copies(users):
+    return {user_id: users.get_item({'user_id': user_id}).get('organization_name') for user_id in ('user1', 'user2', 'user3')}
+
+
+def test_backfill_writes_missing_copies():
+    users, organizations = make_handlers()
+    assert backfill(users, organizations, dry_run=True) == {'found': 3, 'updated': 0, 'missing_organization': []}
+    assert backfill(users, organizations) == {'found': 3, 'updated': 2, 'missing_organization': ['user3']}
+    assert copies(users) == {'user1': 'Org One', 'user2': 'Org One', 'user3': None}
+    # 2回目はコピーを書けなかったものだけが残る
+    assert backfill(users, organizations)['found'] == 1
+
+
+def test_rename_and_sync():
+    users, organizations = make_handlers()
+    assert rename(users, organizations, 'org1', 'Renamed') == {'updated': 2, 'skipped': 0}
+    assert copies(users) == {'user1': 'Renamed', 'user2': 'Renamed', 'user3': None}
+    assert sync(users, organizations, 'org1') == {'updated': 0, 'skipped': 2}
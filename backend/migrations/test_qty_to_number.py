@@ -0,0 +1,34 @@
+from dynamodb_fake import FakeDynamoDBClient
+from dynamodb_handler import DynamoDBHandler
+from qty_to_number import migrate
+
+
+def make_handler():
+    client = FakeDynamoDBClient()
+    client.add_table('components', 'pk', 'sk')
+    items = [('ic#1', {'S': '7'}), ('ic#2', {'S': ' 3 '}), ('ic#3', {'S': 'many'}), ('ic#4', {'N': '2'})]
+    for sk, qty in items:
+        client.put_item(TableName='components', Item={'pk': {'S': 'org1'}, 'sk': {'S': sk}, 'qty': qty})
+    handler = DynamoDBHandler('ap-northeast-1', 'components', 'pk', 'sk', 'category', 'id', '#',
+                              {'pk': 'S', 'sk': 'S', 'qty': 'N'}, client=client)
+    return handler, client
+
+
+def quantities(client):
+    items = client.scan(TableName='components')['Items']
+    return {item['sk']['S']: item['qty'] for item in items}
+
+
+def test_dry_run_does_not_write():
+    handler, client = make_handler()
+    assert migrate(handler, dry_run=True) == {'found': 3, 'migrated': 0, 'invalid': []}
+    assert quantities(client)['ic#1'] == {'S': '7'}
+
+
+def test_migrate_converts_strings_and_reports_invalid_values():
+    handler, client = make_handler()
+    report = migrate(handler)
+    assert report == {'found': 3, 'migrated': 2, 'invalid': [{'pk': 'org1', 'sk': 'ic#3'}]}
+    assert quantities(client) == {'ic#1': {'N': '7'}, 'ic#2': {'N': '3'}, 'ic#3': {'S': 'many'}, 'ic#4': {'N': '2'}}
+    # 2回目は変換できなかったものだけが残る
+    assert migrate(handler)['found'] == 1
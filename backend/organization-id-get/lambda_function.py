@@ -1,5 +1,10 @@
 from dynamodb_handler import DynamoDBHandler
+from schema import load_schema
 from cognito_auth import CognitoAuthenticator, STATUS_CODE_UNAUTHORIZED
+import tracing
+from resilience import ResilientCaller, Deadline, ThrottlingError, service_unavailable_response
+import warmup
+import organization_sync
 import json
 import os
 import logging
@@ -10,15 +15,41 @@ COGNITO_USER_POOL_ID = os.environ['COGNITO_USER_POOL_ID']
 COGNITO_APP_CLIENT_ID = os.environ['COGNITO_APP_CLIENT_ID']
 TABLE1_NAME = os.environ['TABLE1_NAME']
 TABLE1_PK_NAME = os.environ['TABLE1_PK_NAME']
-TABLE1_FIELD_TYPES = json.loads(os.environ['TABLE1_FIELD_TYPES'])
+TABLE1_FIELD_TYPES = load_schema('TABLE1_FIELD_TYPES')
 TABLE2_NAME = os.environ['TABLE2_NAME']
 TABLE2_PK_NAME = os.environ['TABLE2_PK_NAME']
-TABLE2_FIELD_TYPES = json.loads(os.environ['TABLE2_FIELD_TYPES'])
+TABLE2_FIELD_TYPES = load_schema('TABLE2_FIELD_TYPES')
+# users に organization の名前のコピーがあれば（organization_sync）、users の GetItem 1回で返す
+DENORMALIZE_ORGANIZATION = organization_sync.is_enabled(TABLE1_FIELD_TYPES)
+USER_ATTRIBUTES = [TABLE1_PK_NAME, TABLE2_PK_NAME, organization_sync.NAME_FIELD, organization_sync.VERSION_FIELD]
+# ウォームアップイベントとプロビジョニングされた同時実行・SnapStart の初期化で、クライアント・JWKS・接続を準備する
+WARMER = warmup.Warmer().jwks(REGION_NAME, COGNITO_USER_POOL_ID).describe_tables(REGION_NAME, [TABLE1_NAME, TABLE2_NAME])
+WARMER.init_hook()
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
+# user のコピーから organization を返す。コピーが無ければ organizations を読み、次回から1回で済むようにコピーを書く
+def get_organization_from_user(dynamodb_handler1, dynamodb_handler2, value):
+    user = dynamodb_handler1.get_item(value, USER_ATTRIBUTES)
+    if user is None:
+        logger.info(f'User not found: {value}')
+        return []
+    if organization_sync.has_copy(user):
+        tracing.current().add_count('organization.copy_hits')
+        return [{TABLE2_PK_NAME: user[TABLE2_PK_NAME], 'organization_name': user[organization_sync.NAME_FIELD]}]
+
+    response_item = dynamodb_handler2.query_by_PK(user)
+    if len(response_item) == 0:
+        raise ValueError(f'organization not found: {value}')
+    try:
+        organization_sync.write_copy(dynamodb_handler1, user[TABLE1_PK_NAME], response_item[0])
+    except Exception as e:
+        logger.warning(f'Failed to copy organization to user {user[TABLE1_PK_NAME]}: {e}')
+    return [{TABLE2_PK_NAME: response_item[0][TABLE2_PK_NAME], 'organization_name': response_item[0]['organization_name']}]
+
+
 class StringDecimalEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, Decimal):
@@ -26,9 +57,13 @@ class StringDecimalEncoder(json.JSONEncoder):
         return super().default(obj)
 
 
+@tracing.traced('organization-id-get')
 def lambda_handler(event, context):
     logger.info('Lambda function invoked from Lambda Function URLs.')
 
+    if warmup.is_warmup_event(event):
+        return warmup.warmup_response(WARMER.prime())
+
     logger.info(f'Received raw event: {json.dumps(event, indent=2)}')
     if ('httpMethod' in event) and (event['httpMethod'] == 'OPTIONS'):
         logger.info('OPTIONS request received for CORS preflight check.')
@@ -48,12 +83,21 @@ def lambda_handler(event, context):
         request_body = json.loads(event['body'])
         value = request_body['value']
 
-        dynamodb_handler1 = DynamoDBHandler(REGION_NAME, TABLE1_NAME, TABLE1_PK_NAME, '', '', '', '', TABLE1_FIELD_TYPES)
-        dynamodb_handler2 = DynamoDBHandler(REGION_NAME, TABLE2_NAME, TABLE2_PK_NAME, '', '', '', '', TABLE2_FIELD_TYPES)
+        deadline = Deadline.from_context(context)
+        dynamodb_handler1 = DynamoDBHandler(
+            REGION_NAME, TABLE1_NAME, TABLE1_PK_NAME, '', '', '', '', TABLE1_FIELD_TYPES,
+            resilience=ResilientCaller.for_table(TABLE1_NAME, deadline=deadline)
+        )
+        dynamodb_handler2 = DynamoDBHandler(
+            REGION_NAME, TABLE2_NAME, TABLE2_PK_NAME, '', '', '', '', TABLE2_FIELD_TYPES,
+            resilience=ResilientCaller.for_table(TABLE2_NAME, deadline=deadline)
+        )
 
         response_item = []
+        if value[TABLE1_PK_NAME] != '' and DENORMALIZE_ORGANIZATION:
+            response_item = get_organization_from_user(dynamodb_handler1, dynamodb_handler2, value)
         # usersテーブルからuser_idが一致するレコードを取得する
-        if value[TABLE1_PK_NAME] != '':
+        elif value[TABLE1_PK_NAME] != '':
             item = dynamodb_handler1.query_by_PK(value)
             if len(item) == 0:
                 logger.info(f'User not found: {value}')
@@ -79,13 +123,18 @@ def lambda_handler(event, context):
                 'organization': response_item[0]
             }
 
-        logger.info(f'Returning response: {json.dumps(response_body, cls=StringDecimalEncoder)}')
+        with tracing.span('serialize'):
+            dumped_response_body = json.dumps(response_body, cls=StringDecimalEncoder)
+        logger.info(f'Returning response: {dumped_response_body}')
         
         return {
             'statusCode': 200,
-            'body': json.dumps(response_body, cls=StringDecimalEncoder)
+            'body': dumped_response_body
         }
 
+    except ThrottlingError as te:
+        logger.error(f'DynamoDB is throttling: {te}')
+        return service_unavailable_response(te)
     except ValueError as ve:
         logger.error(ve)
         return {
@@ -106,3 +106,69 @@ def test_lambda_handler_organization_not_found(mock_dynamodb_cls, mock_cognito_c
     response = lambda_module.lambda_handler(base_event, None)
     assert response['statusCode'] == 400
 
+
+
+@patch('lambda_function.CognitoAuthenticator')
+@patch('lambda_function.DynamoDBHandler')
+def test_warmup_event_skips_auth(mock_dynamodb_cls, mock_cognito_cls):
+    with patch.object(lambda_module.WARMER, 'steps', [('dynamodb.connect', MagicMock())]):
+        response = lambda_module.lambda_handler({'warmup': True}, None)
+
+    assert response['statusCode'] == 200
+    body = json.loads(response['body'])
+    assert body['warmed'] is True
+    assert body['steps']['dynamodb.connect']['ok'] is True
+    mock_cognito_cls.assert_not_called()
+    mock_dynamodb_cls.assert_not_called()
+
+
+@patch('lambda_function.CognitoAuthenticator')
+@patch('lambda_function.DynamoDBHandler')
+def test_organization_copy_is_read_with_single_get(mock_dynamodb_cls, mock_cognito_cls, base_event, monkeypatch):
+    monkeypatch.setattr(lambda_module, 'DENORMALIZE_ORGANIZATION', True)
+    mock_cognito = MagicMock()
+    mock_cognito.jwt_decode.return_value = True
+    mock_cognito.get_claims.return_value = {}
+    mock_cognito_cls.return_value = mock_cognito
+
+    mock_dynamodb1 = MagicMock()
+    mock_dynamodb2 = MagicMock()
+    mock_dynamodb_cls.side_effect = [mock_dynamodb1, mock_dynamodb2]
+    mock_dynamodb1.get_item.return_value = {
+        'user_id': 'user123', 'organization_id': 'org456', 'organization_name': 'Test Org', 'organization_version': 0,
+    }
+
+    response = lambda_module.lambda_handler(base_event, None)
+
+    body = json.loads(response['body'])
+    assert body['organization'] == {'organization_id': 'org456', 'organization_name': 'Test Org'}
+    # organizations は読まない
+    mock_dynamodb1.query_by_PK.assert_not_called()
+    mock_dynamodb2.query_by_PK.assert_not_called()
+
+
+@patch('lambda_function.organization_sync.write_copy')
+@patch('lambda_function.CognitoAuthenticator')
+@patch('lambda_function.DynamoDBHandler')
+def test_missing_organization_copy_is_backfilled(mock_dynamodb_cls, mock_cognito_cls, mock_write_copy, base_event, monkeypatch):
+    monkeypatch.setattr(lambda_module, 'DENORMALIZE_ORGANIZATION', True)
+    mock_cognito = MagicMock()
+    mock_cognito.jwt_decode.return_value = True
+    mock_cognito.get_claims.return_value = {}
+    mock_cognito_cls.return_value = mock_cognito
+
+    mock_dynamodb1 = MagicMock()
+    mock_dynamodb2 = MagicMock()
+    mock_dynamodb_cls.side_effect = [mock_dynamodb1, mock_dynamodb2]
+    mock_dynamodb1.get_item.return_value = {'user_id': 'user123', 'organization_id': 'org456'}
+    organization = {'organization_id': 'org456', 'organization_name': 'Test Org'}
+    mock_dynamodb2.query_by_PK.return_value = [organization]
+    # コピーを書けなくてもレスポンスは返す
+    mock_write_copy.side_effect = Exception('throttled')
+
+    response = lambda_module.lambda_handler(base_event, None)
+
+    body = json.loads(response['body'])
+    assert body['result'] == 'success'
+    assert body['organization'] == organization
+    mock_write_copy.assert_called_once_with(mock_dynamodb1, 'user123', organization)
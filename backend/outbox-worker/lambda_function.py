@@ -0,0 +1,49 @@
+import tracing
+import outbox
+import clients
+import json
+import os
+import logging
+
+REGION_NAME = os.environ['REGION_NAME']
+COGNITO_USER_POOL_ID = os.environ['COGNITO_USER_POOL_ID']
+OUTBOX_TABLE_NAME = os.environ['OUTBOX_TABLE_NAME']
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+_handlers = None
+_table = None
+
+
+# 副作用のハンドラーとアウトボックステーブルはコンテナ内で使い回す
+def get_handlers():
+    global _handlers
+    if _handlers is None:
+        _handlers = outbox.cognito_handlers(COGNITO_USER_POOL_ID, clients.get_client('cognito-idp', REGION_NAME))
+    return _handlers
+
+
+def get_table():
+    global _table
+    if _table is None:
+        _table = outbox.OutboxTable(OUTBOX_TABLE_NAME, region_name=REGION_NAME)
+    return _table
+
+
+# アウトボックステーブルの DynamoDB Streams（INSERT）と、スケジュール（{"outbox_sweep": true}）から呼ばれる
+# 失敗したメッセージはテーブルに残り、次の sweep で再実行する（ストリームのシャードは止めない）
+@tracing.traced('outbox-worker')
+def lambda_handler(event, context):
+    if event.get('outbox_sweep'):
+        processed = outbox.sweep(get_table(), get_handlers())
+        logger.info(f'Swept {processed} outbox messages')
+        return {'processed': processed}
+
+    records = event.get('Records', [])
+    logger.info(f'Received {len(records)} outbox records')
+
+    failed = outbox.process_records(records, get_handlers(), get_table())
+    if failed:
+        logger.error(f'Failed outbox messages: {json.dumps(failed)}')
+    return {'batchItemFailures': []}
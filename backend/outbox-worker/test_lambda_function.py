@@ -0,0 +1,72 @@
+import pytest
+import os
+from unittest.mock import patch, MagicMock
+
+os.environ['REGION_NAME'] = 'ap-northeast-1'
+os.environ['COGNITO_USER_POOL_ID'] = 'dummy_pool_id'
+os.environ['OUTBOX_TABLE_NAME'] = 'outbox'
+
+import lambda_function as lambda_module
+import outbox
+from dynamodb_fake import FakeDynamoDBClient
+
+
+@pytest.fixture
+def table():
+    client = FakeDynamoDBClient()
+    client.add_table('outbox', 'message_id')
+    table = outbox.OutboxTable('outbox', client=client)
+    with patch('lambda_function._table', table):
+        yield table
+
+
+@pytest.fixture
+def mock_cognito_client():
+    client = MagicMock()
+    with patch('lambda_function._handlers', None), patch('lambda_function.clients.get_client', return_value=client):
+        yield client
+
+
+# 登録のトランザクションで書かれたメッセージと、そのストリームのレコード
+def insert(table, message):
+    put = table.put_request(message)
+    table.dynamodb.transact_write_items(TransactItems=[put])
+    return {'eventName': 'INSERT', 'dynamodb': {'NewImage': put['Put']['Item']}}
+
+
+def test_processes_messages(table, mock_cognito_client):
+    message = outbox.make_message(outbox.ADD_USER_TO_GROUP, {'username': 'tester', 'group': 'admin'})
+
+    response = lambda_module.lambda_handler({'Records': [insert(table, message)]}, None)
+
+    assert response == {'batchItemFailures': []}
+    mock_cognito_client.admin_add_user_to_group.assert_called_once_with(
+        UserPoolId='dummy_pool_id',
+        Username='tester',
+        GroupName='admin'
+    )
+    assert list(table.pending(min_age=0)) == []
+
+
+@patch('outbox.time.sleep')
+def test_failed_messages_are_retried_by_sweep(mock_sleep, table, mock_cognito_client):
+    ok = outbox.make_message(outbox.ADD_USER_TO_GROUP, {'username': 'ok', 'group': 'viewer'})
+    ng = outbox.make_message(outbox.ADD_USER_TO_GROUP, {'username': 'ng', 'group': 'viewer'})
+    unknown = outbox.make_message('send_mail', {})
+
+    def add_user_to_group(UserPoolId, Username, GroupName):
+        if Username == 'ng':
+            raise Exception('Cognito error')
+    mock_cognito_client.admin_add_user_to_group.side_effect = add_user_to_group
+
+    records = [insert(table, m) for m in (ok, ng, unknown)]
+    response = lambda_module.lambda_handler({'Records': records}, None)
+
+    # 失敗してもストリームは止めず、テーブルに残す
+    assert response == {'batchItemFailures': []}
+    assert [m['id'] for m in table.pending(min_age=0)] == [ng['id']]
+
+    mock_cognito_client.admin_add_user_to_group.side_effect = None
+    table.clock = lambda: 10 ** 10
+    assert lambda_module.lambda_handler({'outbox_sweep': True}, None) == {'processed': 1}
+    assert list(table.pending(min_age=0)) == []
@@ -0,0 +1,117 @@
+import importlib.util
+import json
+import logging
+import os
+import threading
+
+import warmup
+
+# components-crud / user-register / organization-id-get を1つの関数として動かすためのエントリーポイント
+# 各関数の lambda_function.py をそのまま読み込んで振り分けるので、関数ごとのデプロイもこれまでどおりできる
+# 1つのコンテナでクライアント・JWKS・クエリキャッシュなどを共有し、呼び出しの少ない関数もウォームなまま使える
+#
+# 環境変数は3つの関数の分をすべて設定する（変数名は重ならない）
+# 振り分け:
+#   1. パスの最初の要素（/components, /user-register, /organization-id-get など）
+#   2. パスが無い場合はイベントの中身（export_job / import_job / snapshot_job / action は components-crud、value.mode は user-register）
+# 各関数のモジュールは最初に使うときに読み込む（ウォームアップイベントではすべて読み込む）
+
+FUNCTION_NAMES = ['components-crud', 'user-register', 'organization-id-get']
+PATH_ALIASES = {
+    'components': 'components-crud',
+    'register': 'user-register',
+    'users': 'user-register',
+    'organization': 'organization-id-get',
+    'organizations': 'organization-id-get',
+}
+
+COMPONENTS_JOB_EVENTS = ('export_job', 'import_job', 'snapshot_job')
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+_modules = {}
+_modules_lock = threading.Lock()
+
+
+# デプロイパッケージでは router/functions/<name>/、リポジトリでは backend/<name>/ にある
+def functions_dir():
+    configured = os.environ.get('ROUTER_FUNCTIONS_DIR', '')
+    if configured:
+        return configured
+    here = os.path.dirname(os.path.abspath(__file__))
+    bundled = os.path.join(here, 'functions')
+    return bundled if os.path.isdir(bundled) else os.path.dirname(here)
+
+
+def load_function(name):
+    module = _modules.get(name)
+    if module is not None:
+        return module
+    with _modules_lock:
+        if name not in _modules:
+            path = os.path.join(functions_dir(), name, 'lambda_function.py')
+            spec = importlib.util.spec_from_file_location(f"{name.replace('-', '_')}_lambda_function", path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            _modules[name] = module
+            logger.info(f'Loaded {name} from {path}')
+        return _modules[name]
+
+
+def route(event):
+    path = event.get('rawPath') or event.get('path') or ''
+    segment = path.strip('/').split('/')[0]
+    if segment in FUNCTION_NAMES:
+        return segment
+    if segment in PATH_ALIASES:
+        return PATH_ALIASES[segment]
+    if segment != '':
+        return None
+
+    # components-crud が自分（context.invoked_function_arn = ルーター）に非同期で送るジョブ
+    if any(name in event for name in COMPONENTS_JOB_EVENTS):
+        return 'components-crud'
+    try:
+        body = json.loads(event.get('body') or '{}')
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(body, dict):
+        return None
+    if 'action' in body:
+        return 'components-crud'
+    value = body.get('value')
+    if isinstance(value, dict) and 'mode' in value:
+        return 'user-register'
+    if isinstance(value, dict):
+        return 'organization-id-get'
+    return None
+
+
+def warm_all(event, context):
+    report = {'warmed': True, 'functions': {}}
+    for name in FUNCTION_NAMES:
+        response = load_function(name).lambda_handler(event, context)
+        function_report = json.loads(response['body'])
+        report['functions'][name] = function_report
+        report['warmed'] = report['warmed'] and function_report['warmed']
+    return warmup.warmup_response(report)
+
+
+def lambda_handler(event, context):
+    if warmup.is_warmup_event(event):
+        return warm_all(event, context)
+
+    # CORS のプリフライトは関数を読み込まずに返す
+    if event.get('httpMethod') == 'OPTIONS' or event.get('requestContext', {}).get('http', {}).get('method') == 'OPTIONS':
+        return {
+            'statusCode': 204,
+        }
+
+    name = route(event)
+    if name is None:
+        logger.info(f"No route for path: {event.get('rawPath', '')}")
+        return {
+            'statusCode': 404,
+        }
+    return load_function(name).lambda_handler(event, context)
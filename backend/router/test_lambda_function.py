@@ -0,0 +1,90 @@
+import json
+import os
+import pytest
+from unittest.mock import MagicMock, patch
+
+os.environ['REGION_NAME'] = 'ap-northeast-1'
+os.environ['COGNITO_USER_POOL_ID'] = 'dummy_pool_id'
+os.environ['COGNITO_APP_CLIENT_ID'] = 'dummy_app_client_id'
+# components-crud
+os.environ['TABLE_NAME'] = 'components'
+os.environ['PK_NAME'] = 'pk'
+os.environ['SK_NAME'] = 'sk'
+os.environ['SK_PREFIX'] = 'category'
+os.environ['SK_SUFFIX'] = 'id'
+os.environ['SK_DELIMITER'] = '#'
+os.environ['FIELD_TYPES'] = json.dumps({'pk': 'S', 'sk': 'S', 'category': 'S', 'name': 'S', 'id': 'S'})
+# user-register / organization-id-get
+os.environ['TABLE1_NAME'] = 'users'
+os.environ['TABLE1_PK_NAME'] = 'user_id'
+os.environ['TABLE1_FIELD_TYPES'] = json.dumps({'user_id': 'S', 'organization_id': 'S', 'username': 'S'})
+os.environ['TABLE2_NAME'] = 'organizations'
+os.environ['TABLE2_PK_NAME'] = 'organization_id'
+os.environ['TABLE2_FIELD_TYPES'] = json.dumps({'organization_id': 'S', 'organization_name': 'S'})
+
+import lambda_function as router
+
+
+def http_event(path, body):
+    return {
+        'rawPath': path,
+        'headers': {'authorization': 'Bearer dummy_token'},
+        'body': json.dumps(body),
+    }
+
+
+@pytest.mark.parametrize('event, expected', [
+    (http_event('/components', {}), 'components-crud'),
+    (http_event('/components-crud/', {}), 'components-crud'),
+    (http_event('/register', {}), 'user-register'),
+    (http_event('/organization', {}), 'organization-id-get'),
+    (http_event('/unknown', {}), None),
+    (http_event('/', {'action': 'query', 'value': {'pk': 'org1'}}), 'components-crud'),
+    (http_event('/', {'value': {'mode': 'join', 'user_id': 'u1'}}), 'user-register'),
+    (http_event('/', {'value': {'user_id': 'u1'}}), 'organization-id-get'),
+    ({'export_job': {'organization_id': 'org1', 'job_id': 'j1'}}, 'components-crud'),
+    ({'import_job': {'organization_id': 'org1', 'job_id': 'j1'}}, 'components-crud'),
+    ({'snapshot_job': {'organization_id': 'org1'}}, 'components-crud'),
+    (http_event('', 'not an object'), None),
+])
+def test_route(event, expected):
+    assert router.route(event) == expected
+
+
+def test_routes_to_existing_handler():
+    components = router.load_function('components-crud')
+    assert router.load_function('components-crud') is components
+
+    mock_cognito = MagicMock()
+    mock_cognito.jwt_decode.return_value = True
+    mock_cognito.get_claims.return_value = {'cognito:groups': ['admin']}
+    mock_dynamodb = MagicMock()
+    mock_dynamodb.query_by_PK.return_value = [{'pk': 'org1', 'name': 'opamp'}]
+
+    with patch.object(components, 'CognitoAuthenticator', return_value=mock_cognito), \
+            patch.object(components, 'DynamoDBHandler', return_value=mock_dynamodb):
+        response = router.lambda_handler(http_event('/components', {'action': 'query', 'value': {'pk': 'org1'}}), None)
+
+    assert response['statusCode'] == 200
+    assert json.loads(response['body'])['components'] == [{'pk': 'org1', 'name': 'opamp'}]
+
+
+def test_options_and_unknown_paths():
+    assert router.lambda_handler({'requestContext': {'http': {'method': 'OPTIONS'}}, 'rawPath': '/register'}, None) == {'statusCode': 204}
+    assert router.lambda_handler(http_event('/unknown', {}), None) == {'statusCode': 404}
+
+
+def test_warmup_primes_every_function():
+    modules = [router.load_function(name) for name in router.FUNCTION_NAMES]
+    patches = [patch.object(module.WARMER, 'steps', [('step', MagicMock())]) for module in modules]
+    for p in patches:
+        p.start()
+    try:
+        response = router.lambda_handler({'warmup': True}, None)
+    finally:
+        for p in patches:
+            p.stop()
+
+    body = json.loads(response['body'])
+    assert body['warmed'] is True
+    assert set(body['functions']) == set(router.FUNCTION_NAMES)
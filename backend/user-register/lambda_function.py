@@ -1,21 +1,39 @@
 from dynamodb_handler import DynamoDBHandler
+from schema import load_schema
 from cognito_auth import CognitoAuthenticator, STATUS_CODE_UNAUTHORIZED
+import tracing
+from resilience import ResilientCaller, Deadline, ThrottlingError, ConditionalCheckError, service_unavailable_response
+import outbox
+import organization_sync
+import warmup
+import clients
 import json
 import os
 import logging
 from decimal import Decimal
 import uuid
-import boto3
 
 REGION_NAME = os.environ['REGION_NAME']
 COGNITO_USER_POOL_ID = os.environ['COGNITO_USER_POOL_ID']
 COGNITO_APP_CLIENT_ID = os.environ['COGNITO_APP_CLIENT_ID']
 TABLE1_NAME = os.environ['TABLE1_NAME']
 TABLE1_PK_NAME = os.environ['TABLE1_PK_NAME']
-TABLE1_FIELD_TYPES = json.loads(os.environ['TABLE1_FIELD_TYPES'])
+TABLE1_FIELD_TYPES = load_schema('TABLE1_FIELD_TYPES')
 TABLE2_NAME = os.environ['TABLE2_NAME']
 TABLE2_PK_NAME = os.environ['TABLE2_PK_NAME']
-TABLE2_FIELD_TYPES = json.loads(os.environ['TABLE2_FIELD_TYPES'])
+TABLE2_FIELD_TYPES = load_schema('TABLE2_FIELD_TYPES')
+# users のスキーマに organization_name / organization_version があれば、organization の名前を user にもコピーする
+DENORMALIZE_ORGANIZATION = organization_sync.is_enabled(TABLE1_FIELD_TYPES)
+# Cognito グループへの追加などの副作用を登録と同じトランザクションで書くアウトボックス（未設定ならリクエスト内で実行する）
+OUTBOX = outbox.from_env(REGION_NAME)
+SIDE_EFFECT_TABLES = [OUTBOX.table_name] if OUTBOX is not None else []
+# ウォームアップイベントとプロビジョニングされた同時実行・SnapStart の初期化で、クライアント・JWKS・接続を準備する
+WARMER = (warmup.Warmer()
+          .jwks(REGION_NAME, COGNITO_USER_POOL_ID)
+          .describe_tables(REGION_NAME, [TABLE1_NAME, TABLE2_NAME] + SIDE_EFFECT_TABLES))
+if OUTBOX is None:
+    WARMER.client('cognito-idp', REGION_NAME)
+WARMER.init_hook()
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -28,9 +46,74 @@ class StringDecimalEncoder(json.JSONEncoder):
         return super().default(obj)
 
 
+# organization と user の書き込みを1つのトランザクションで行う
+# create: organization を新規作成 / join: organization が存在することを条件にする
+# どちらも user が既に登録されていれば何も書き込まない
+# アウトボックスがあれば副作用のメッセージも同じトランザクションで書く（登録が確定したときだけ残る）
+def register(dynamodb_handler1, dynamodb_handler2, value, messages=()):
+    if value['mode'] == 'create':
+        organization_item = {
+            TABLE2_PK_NAME: str(uuid.uuid4()),
+            'organization_name': value['organization_input'],
+        }
+        transact_items = [dynamodb_handler2.put_request(organization_item, must_not_exist=True)]
+
+    elif value['mode'] == 'join':
+        item = {
+            TABLE2_PK_NAME: value['organization_input']
+        }
+        organization_response_item = dynamodb_handler2.query_by_PK(item)
+        if len(organization_response_item) == 0:
+            raise ValueError(f"Organization not found: {value['organization_input']}")
+        organization_item = organization_response_item[0]
+        if DENORMALIZE_ORGANIZATION:
+            # コピーする名前が古くならないよう、読んだ後に名前が変わっていないことも確認する
+            transact_items = [organization_sync.version_check_request(dynamodb_handler2, organization_item)]
+        else:
+            transact_items = [dynamodb_handler2.exists_check_request(organization_item)]
+
+    else:
+        raise ValueError(f"Invalid mode: {value['mode']}")
+
+    logger.info(f'organization_item: {organization_item}')
+
+    user_item = {
+        TABLE1_PK_NAME: value[TABLE1_PK_NAME],
+        TABLE2_PK_NAME: organization_item[TABLE2_PK_NAME],
+        'username': value['username'],
+    }
+    if DENORMALIZE_ORGANIZATION:
+        user_item.update(organization_sync.copy_fields(organization_item))
+    transact_items.append(dynamodb_handler1.put_request(user_item, must_not_exist=True))
+    if OUTBOX is not None:
+        transact_items.extend(OUTBOX.put_request(message) for message in messages)
+
+    try:
+        dynamodb_handler1.transact_write(transact_items)
+    except ConditionalCheckError as ce:
+        raise ValueError(f'User already registered or organization removed or renamed: {ce}')
+    return organization_item, user_item
+
+
+# アウトボックスが無いときは登録の確定後にその場で実行する
+# 登録は確定しているので、失敗してもログに残すだけでリクエストは失敗にしない
+def run_side_effects_inline(messages):
+    handlers = outbox.cognito_handlers(COGNITO_USER_POOL_ID, clients.get_client("cognito-idp", REGION_NAME))
+    for message in messages:
+        try:
+            outbox.dispatch(message, handlers)
+        except Exception as e:
+            logger.error(f"Side effect {message['type']} ({message['id']}) failed after registration: {e}", exc_info=True)
+            tracing.current().add_count('outbox.failed')
+
+
+@tracing.traced('user-register')
 def lambda_handler(event, context):
     logger.info('Lambda function invoked from Lambda Function URLs.')
 
+    if warmup.is_warmup_event(event):
+        return warmup.warmup_response(WARMER.prime())
+
     logger.info(f'Received raw event: {json.dumps(event, indent=2)}')
     if ('httpMethod' in event) and (event['httpMethod'] == 'OPTIONS'):
         logger.info('OPTIONS request received for CORS preflight check.')
@@ -49,45 +132,31 @@ def lambda_handler(event, context):
         request_body = json.loads(event['body'])
         value = request_body['value']
         # リクエストvalidation
-        if 'mode' not in value and 'organization_input' not in value and TABLE1_PK_NAME not in value and 'username' not in value:
+        if any(key not in value for key in ('mode', 'organization_input', TABLE1_PK_NAME, 'username')):
             raise ValueError(f'Invalid request: {value}')
 
-        dynamodb_handler1 = DynamoDBHandler(REGION_NAME, TABLE1_NAME, TABLE1_PK_NAME, '', '', '', '', TABLE1_FIELD_TYPES)
-        dynamodb_handler2 = DynamoDBHandler(REGION_NAME, TABLE2_NAME, TABLE2_PK_NAME, '', '', '', '', TABLE2_FIELD_TYPES)
-        
-        if value['mode'] == 'create':
-            item = {
-                TABLE2_PK_NAME: str(uuid.uuid4()),
-                'organization_name': value['organization_input'],
-            }
-            organization_response_item = dynamodb_handler2.put_item(item)
-            if len(organization_response_item) == 0:
-                raise ValueError(f"Organization put error: {value['organization_input']}")
-            
-        elif value['mode'] == 'join':
-            item = {
-                TABLE2_PK_NAME: value['organization_input']
-            }
-            organization_response_item = dynamodb_handler2.query_by_PK(item)
-            if len(organization_response_item) == 0:
-                raise ValueError(f"Organization not found: {value['organization_input']}")
-        
-        logger.info(f'organization_response_item: {organization_response_item}')
-        
-        item = {
-            TABLE1_PK_NAME: value[TABLE1_PK_NAME],
-            TABLE2_PK_NAME: organization_response_item[0][TABLE2_PK_NAME],
-            'username': value['username'],
-        }
-        user_response_item = dynamodb_handler1.put_item(item)
-        if len(user_response_item) == 0:
-            raise ValueError(f'User put error: {value}')
+        deadline = Deadline.from_context(context)
+        dynamodb_handler1 = DynamoDBHandler(
+            REGION_NAME, TABLE1_NAME, TABLE1_PK_NAME, '', '', '', '', TABLE1_FIELD_TYPES,
+            resilience=ResilientCaller.for_table(TABLE1_NAME, deadline=deadline)
+        )
+        dynamodb_handler2 = DynamoDBHandler(
+            REGION_NAME, TABLE2_NAME, TABLE2_PK_NAME, '', '', '', '', TABLE2_FIELD_TYPES,
+            resilience=ResilientCaller.for_table(TABLE2_NAME, deadline=deadline)
+        )
+
+        # cognito userをcognito groupに追加（アウトボックス経由で、登録の確定後に実行する）
+        groupName = 'admin' if value['mode'] == 'create' else 'viewer'
+        messages = [
+            outbox.make_message(outbox.ADD_USER_TO_GROUP, {'username': value['username'], 'group': groupName})
+        ]
+        organization_item, user_item = register(dynamodb_handler1, dynamodb_handler2, value, messages)
 
         response_item = {
-            TABLE1_PK_NAME: user_response_item[0][TABLE1_PK_NAME],
-            TABLE2_PK_NAME: organization_response_item[0][TABLE2_PK_NAME],
-            'organization_name': organization_response_item[0]['organization_name'],
-            'username': user_response_item[0]['username'],
+            TABLE1_PK_NAME: user_item[TABLE1_PK_NAME],
+            TABLE2_PK_NAME: organization_item[TABLE2_PK_NAME],
+            'organization_name': organization_item['organization_name'],
+            'username': user_item['username'],
         }
         
         response_body = {
@@ -95,24 +164,21 @@ def lambda_handler(event, context):
             'message': '',
             'user': response_item
         }
-        dumped_response_body = json.dumps(response_body, cls=StringDecimalEncoder)
+        with tracing.span('serialize'):
+            dumped_response_body = json.dumps(response_body, cls=StringDecimalEncoder)
         logger.info(f'Returning response: {dumped_response_body}')
 
-        # cognito userをcognito groupに追加
-        groupName = 'admin' if value['mode'] == 'create' else 'viewer'
-        cognito_client = boto3.client("cognito-idp")
-        cognito_client.admin_add_user_to_group(
-            UserPoolId=COGNITO_USER_POOL_ID,
-            Username=value['username'],
-            GroupName=groupName
-        )
-        logger.info(f'Added user to group: username={value["username"]}, group={groupName}')
+        if OUTBOX is None:
+            run_side_effects_inline(messages)
         
         return {
             'statusCode': 200,
             'body': dumped_response_body
         }
 
+    except ThrottlingError as te:
+        logger.error(f'DynamoDB is throttling: {te}')
+        return service_unavailable_response(te)
     except ValueError as ve:
         logger.error(ve)
         return {
@@ -31,18 +31,44 @@ os.environ["TABLE2_FIELD_TYPES"] = '{"organization_id":"S","organization_name":"
 
 
 import lambda_function as lambda_module
+import outbox
+from dynamodb_fake import FakeDynamoDBClient
+from dynamodb_handler import DynamoDBHandler
+
+
+@pytest.fixture
+def fake_client():
+    client = FakeDynamoDBClient()
+    client.add_table("users", "user_id")
+    client.add_table("organizations", "organization_id")
+    return client
+
+
+# lambda の DynamoDBHandler をフェイクの DynamoDB を使うものに差し替える
+def handler_factory(client):
+    def create(*args, **kwargs):
+        return DynamoDBHandler(*args, client=client, **kwargs)
+    return create
+
+
+def put_organization(client, organization_id="org123", organization_name="Test Org"):
+    client.put_item(TableName="organizations", Item={
+        "organization_id": {"S": organization_id},
+        "organization_name": {"S": organization_name},
+    })
+
 
 @patch("lambda_function.CognitoAuthenticator.jwt_decode", return_value=True)
 @patch("lambda_function.CognitoAuthenticator", autospec=True)
 @patch("lambda_function.DynamoDBHandler")
-@patch("lambda_function.boto3.client")
+@patch("lambda_function.clients.get_client")
 def test_options_request(mock_boto_client, mock_dynamodb_cls, mock_cognito_cls, mock_jwt_decode, base_event):
     event = base_event.copy()
     event["httpMethod"] = "OPTIONS"
     response = lambda_module.lambda_handler(event, None)
     assert response["statusCode"] == 204
 
-@patch("lambda_function.boto3.client")
+@patch("lambda_function.clients.get_client")
 @patch("lambda_function.DynamoDBHandler")
 @patch("lambda_function.CognitoAuthenticator")
 def test_unauthorized(mock_cognito_cls, mock_dynamodb_cls, mock_boto_client, base_event):
@@ -57,16 +83,9 @@ def test_unauthorized(mock_cognito_cls, mock_dynamodb_cls, mock_boto_client, bas
 @patch("lambda_function.CognitoAuthenticator.jwt_decode", return_value=True)
 @patch("lambda_function.CognitoAuthenticator", autospec=True)
 @patch("lambda_function.DynamoDBHandler")
-@patch("lambda_function.boto3.client")
-def test_create_mode_success(mock_boto_client, mock_dynamodb_cls, mock_cognito_cls, mock_jwt_decode, base_event):
-    # DynamoDBHandlerのインスタンスモック
-    mock_dynamodb_instance1 = MagicMock()
-    mock_dynamodb_instance2 = MagicMock()
-    mock_dynamodb_cls.side_effect = [mock_dynamodb_instance1, mock_dynamodb_instance2]
-
-    # put_item成功の戻り値をセット（リストに辞書を入れる想定）
-    mock_dynamodb_instance2.put_item.return_value = [{"organization_id": "org123", "organization_name": "Test Org"}]
-    mock_dynamodb_instance1.put_item.return_value = [{"user_id": "user123", "organization_id": "org123", "username": "tester"}]
+@patch("lambda_function.clients.get_client")
+def test_create_mode_success(mock_boto_client, mock_dynamodb_cls, mock_cognito_cls, mock_jwt_decode, base_event, fake_client):
+    mock_dynamodb_cls.side_effect = handler_factory(fake_client)
 
     # boto3クライアントのモック（admin_add_user_to_group）
     mock_cognito_client = MagicMock()
@@ -79,6 +98,12 @@ def test_create_mode_success(mock_boto_client, mock_dynamodb_cls, mock_cognito_c
     assert body["result"] == "success"
     assert body["user"]["username"] == "tester"
     assert body["user"]["organization_name"] == "Test Org"
+    # organization と user が同じトランザクションで書き込まれていることを確認
+    assert fake_client.call_counts["TransactWriteItems"] == 1
+    user = fake_client.get_item(TableName="users", Key={"user_id": {"S": "user123"}})["Item"]
+    assert user["organization_id"]["S"] == body["user"]["organization_id"]
+    organization = fake_client.get_item(TableName="organizations", Key={"organization_id": {"S": body["user"]["organization_id"]}})["Item"]
+    assert organization["organization_name"]["S"] == "Test Org"
     # Cognitoのadmin_add_user_to_groupが呼ばれていることを確認
     mock_cognito_client.admin_add_user_to_group.assert_called_once_with(
         UserPoolId="dummy_pool_id",
@@ -89,19 +114,16 @@ def test_create_mode_success(mock_boto_client, mock_dynamodb_cls, mock_cognito_c
 @patch("lambda_function.CognitoAuthenticator.jwt_decode", return_value=True)
 @patch("lambda_function.CognitoAuthenticator", autospec=True)
 @patch("lambda_function.DynamoDBHandler")
-@patch("lambda_function.boto3.client")
-def test_join_mode_success(mock_boto_client, mock_dynamodb_cls, mock_cognito_cls, mock_jwt_decode, base_event):
+@patch("lambda_function.clients.get_client")
+def test_join_mode_success(mock_boto_client, mock_dynamodb_cls, mock_cognito_cls, mock_jwt_decode, base_event, fake_client):
     event = base_event.copy()
     body = json.loads(event["body"])
     body["value"]["mode"] = "join"
+    body["value"]["organization_input"] = "org123"
     event["body"] = json.dumps(body)
 
-    mock_dynamodb_instance1 = MagicMock()
-    mock_dynamodb_instance2 = MagicMock()
-    mock_dynamodb_cls.side_effect = [mock_dynamodb_instance1, mock_dynamodb_instance2]
-
-    mock_dynamodb_instance2.query_by_PK.return_value = [{"organization_id": "org123", "organization_name": "Test Org"}]
-    mock_dynamodb_instance1.put_item.return_value = [{"user_id": "user123", "organization_id": "org123", "username": "tester"}]
+    put_organization(fake_client)
+    mock_dynamodb_cls.side_effect = handler_factory(fake_client)
 
     mock_cognito_client = MagicMock()
     mock_boto_client.return_value = mock_cognito_client
@@ -113,6 +135,7 @@ def test_join_mode_success(mock_boto_client, mock_dynamodb_cls, mock_cognito_cls
     assert body["result"] == "success"
     assert body["user"]["username"] == "tester"
     assert body["user"]["organization_name"] == "Test Org"
+    assert body["user"]["organization_id"] == "org123"
     mock_cognito_client.admin_add_user_to_group.assert_called_once_with(
         UserPoolId="dummy_pool_id",
         Username="tester",
@@ -122,7 +145,7 @@ def test_join_mode_success(mock_boto_client, mock_dynamodb_cls, mock_cognito_cls
 @patch("lambda_function.CognitoAuthenticator.jwt_decode", return_value=True)
 @patch("lambda_function.CognitoAuthenticator", autospec=True)
 @patch("lambda_function.DynamoDBHandler")
-@patch("lambda_function.boto3.client")
+@patch("lambda_function.clients.get_client")
 def test_missing_required_keys(mock_boto_client, mock_dynamodb_cls, mock_cognito_cls, mock_jwt_decode, base_event):
     event = base_event.copy()
     body = json.loads(event["body"])
@@ -137,73 +160,126 @@ def test_missing_required_keys(mock_boto_client, mock_dynamodb_cls, mock_cognito
 @patch("lambda_function.CognitoAuthenticator.jwt_decode", return_value=True)
 @patch("lambda_function.CognitoAuthenticator", autospec=True)
 @patch("lambda_function.DynamoDBHandler")
-@patch("lambda_function.boto3.client")
-def test_organization_put_failure(mock_boto_client, mock_dynamodb_cls, mock_cognito_cls, mock_jwt_decode, base_event):
-    mock_dynamodb_instance1 = MagicMock()
-    mock_dynamodb_instance2 = MagicMock()
-    mock_dynamodb_cls.side_effect = [mock_dynamodb_instance1, mock_dynamodb_instance2]
-
-    # 組織登録失敗（空リスト返す）
-    mock_dynamodb_instance2.put_item.return_value = []
+@patch("lambda_function.clients.get_client")
+def test_organization_put_failure(mock_boto_client, mock_dynamodb_cls, mock_cognito_cls, mock_jwt_decode, base_event, fake_client):
+    mock_dynamodb_cls.side_effect = handler_factory(fake_client)
+    # トランザクションが検証エラーで失敗する
+    fake_client.inject_error("TransactWriteItems", code="ValidationException")
 
     response = lambda_module.lambda_handler(base_event, None)
 
     assert response["statusCode"] == 400
+    assert fake_client.scan(TableName="organizations")["Items"] == []
+    mock_boto_client.return_value.admin_add_user_to_group.assert_not_called()
 
 @patch("lambda_function.CognitoAuthenticator.jwt_decode", return_value=True)
 @patch("lambda_function.CognitoAuthenticator", autospec=True)
 @patch("lambda_function.DynamoDBHandler")
-@patch("lambda_function.boto3.client")
-def test_organization_not_found(mock_boto_client, mock_dynamodb_cls, mock_cognito_cls, mock_jwt_decode, base_event):
+@patch("lambda_function.clients.get_client")
+def test_organization_not_found(mock_boto_client, mock_dynamodb_cls, mock_cognito_cls, mock_jwt_decode, base_event, fake_client):
     event = base_event.copy()
     body = json.loads(event["body"])
     body["value"]["mode"] = "join"
     event["body"] = json.dumps(body)
 
-    mock_dynamodb_instance1 = MagicMock()
-    mock_dynamodb_instance2 = MagicMock()
-    mock_dynamodb_cls.side_effect = [mock_dynamodb_instance1, mock_dynamodb_instance2]
-
-    # 組織取得失敗（空リスト返す）
-    mock_dynamodb_instance2.query_by_PK.return_value = []
+    # 組織が存在しない
+    mock_dynamodb_cls.side_effect = handler_factory(fake_client)
 
     response = lambda_module.lambda_handler(event, None)
 
     assert response["statusCode"] == 400
+    assert fake_client.scan(TableName="users")["Items"] == []
 
 @patch("lambda_function.CognitoAuthenticator.jwt_decode", return_value=True)
 @patch("lambda_function.CognitoAuthenticator", autospec=True)
 @patch("lambda_function.DynamoDBHandler")
-@patch("lambda_function.boto3.client")
-def test_user_put_failure(mock_boto_client, mock_dynamodb_cls, mock_cognito_cls, mock_jwt_decode, base_event):
-    mock_dynamodb_instance1 = MagicMock()
-    mock_dynamodb_instance2 = MagicMock()
-    mock_dynamodb_cls.side_effect = [mock_dynamodb_instance1, mock_dynamodb_instance2]
-
-    mock_dynamodb_instance2.put_item.return_value = [{"organization_id": "org123", "organization_name": "Test Org"}]
-    # ユーザー登録失敗（空リスト返す）
-    mock_dynamodb_instance1.put_item.return_value = []
+@patch("lambda_function.clients.get_client")
+def test_user_put_failure(mock_boto_client, mock_dynamodb_cls, mock_cognito_cls, mock_jwt_decode, base_event, fake_client):
+    mock_dynamodb_cls.side_effect = handler_factory(fake_client)
+    # 既に登録済みのユーザーは条件チェックで失敗し、組織も作られない
+    fake_client.put_item(TableName="users", Item={"user_id": {"S": "user123"}, "organization_id": {"S": "other"}})
 
     response = lambda_module.lambda_handler(base_event, None)
 
     assert response["statusCode"] == 400
+    assert fake_client.scan(TableName="organizations")["Items"] == []
+    user = fake_client.get_item(TableName="users", Key={"user_id": {"S": "user123"}})["Item"]
+    assert user["organization_id"]["S"] == "other"
 
 @patch("lambda_function.CognitoAuthenticator.jwt_decode", return_value=True)
 @patch("lambda_function.CognitoAuthenticator", autospec=True)
 @patch("lambda_function.DynamoDBHandler")
-@patch("lambda_function.boto3.client")
-def test_cognito_add_user_group_fail(mock_boto_client, mock_dynamodb_cls, mock_cognito_cls, mock_jwt_decode, base_event):
-    mock_dynamodb_instance1 = MagicMock()
-    mock_dynamodb_instance2 = MagicMock()
-    mock_dynamodb_cls.side_effect = [mock_dynamodb_instance1, mock_dynamodb_instance2]
-
-    mock_dynamodb_instance2.put_item.return_value = [{"organization_id": "org123", "organization_name": "Test Org"}]
-    mock_dynamodb_instance1.put_item.return_value = [{"user_id": "user123", "organization_id": "org123", "username": "tester"}]
+@patch("lambda_function.clients.get_client")
+def test_cognito_add_user_group_fail(mock_boto_client, mock_dynamodb_cls, mock_cognito_cls, mock_jwt_decode, base_event, fake_client):
+    mock_dynamodb_cls.side_effect = handler_factory(fake_client)
 
     mock_cognito_client = MagicMock()
     mock_cognito_client.admin_add_user_to_group.side_effect = Exception("Cognito error")
     mock_boto_client.return_value = mock_cognito_client
 
-    response = lambda_module.lambda_handler(base_event, None)
+    # アウトボックスが無いときはリクエスト内でリトライする。登録は確定しているので失敗にはしない
+    with patch("outbox.time.sleep"):
+        response = lambda_module.lambda_handler(base_event, None)
+
+    assert response["statusCode"] == 200
+    assert mock_cognito_client.admin_add_user_to_group.call_count == 3
+    assert fake_client.get_item(TableName="users", Key={"user_id": {"S": "user123"}})["Item"]["username"] == {"S": "tester"}
+
+@patch("lambda_function.CognitoAuthenticator.jwt_decode", return_value=True)
+@patch("lambda_function.CognitoAuthenticator", autospec=True)
+@patch("lambda_function.DynamoDBHandler")
+@patch("lambda_function.clients.get_client")
+def test_side_effects_are_written_to_outbox(mock_boto_client, mock_dynamodb_cls, mock_cognito_cls, mock_jwt_decode, base_event, fake_client):
+    mock_dynamodb_cls.side_effect = handler_factory(fake_client)
+    mock_cognito_client = MagicMock()
+    # 最初は失敗し、ワーカーの sweep で成功する
+    mock_cognito_client.admin_add_user_to_group.side_effect = [Exception("Cognito error")] * 3 + [None]
+    fake_client.add_table("outbox", "message_id")
+    table = outbox.OutboxTable("outbox", client=fake_client)
+
+    with patch("lambda_function.OUTBOX", table):
+        response = lambda_module.lambda_handler(base_event, None)
+        # 既に登録済みなら何も書き込まず、メッセージも残らない
+        assert lambda_module.lambda_handler(base_event, None)["statusCode"] == 400
 
-    assert response["statusCode"] == 500
+    assert response["statusCode"] == 200
+    mock_cognito_client.admin_add_user_to_group.assert_not_called()
+    assert len(fake_client.scan(TableName="outbox")["Items"]) == 1
+
+    handlers = outbox.cognito_handlers("dummy_pool_id", mock_cognito_client)
+    assert outbox.sweep(table, handlers, min_age=0, sleep=lambda _: None) == 0
+    assert outbox.sweep(table, handlers, min_age=0, sleep=lambda _: None) == 1
+    assert fake_client.scan(TableName="outbox")["Items"] == []
+    mock_cognito_client.admin_add_user_to_group.assert_called_with(
+        UserPoolId="dummy_pool_id",
+        Username="tester",
+        GroupName="admin"
+    )
+
+
+@patch("lambda_function.CognitoAuthenticator.jwt_decode", return_value=True)
+@patch("lambda_function.CognitoAuthenticator", autospec=True)
+@patch("lambda_function.DynamoDBHandler")
+@patch("lambda_function.clients.get_client")
+def test_join_stores_organization_copy(mock_boto_client, mock_dynamodb_cls, mock_cognito_cls, mock_jwt_decode, base_event, fake_client, monkeypatch):
+    monkeypatch.setattr(lambda_module, "DENORMALIZE_ORGANIZATION", True)
+    monkeypatch.setattr(lambda_module, "TABLE1_FIELD_TYPES", {
+        "user_id": "S", "organization_id": "S", "username": "S", "organization_name": "S", "organization_version": "N",
+    })
+    event = base_event.copy()
+    body = json.loads(event["body"])
+    body["value"]["mode"] = "join"
+    body["value"]["organization_input"] = "org123"
+    event["body"] = json.dumps(body)
+
+    put_organization(fake_client)
+    fake_client.update_item(TableName="organizations", Key={"organization_id": {"S": "org123"}},
+                            UpdateExpression="SET version = :version", ExpressionAttributeValues={":version": {"N": "2"}})
+    mock_dynamodb_cls.side_effect = handler_factory(fake_client)
+
+    response = lambda_module.lambda_handler(event, None)
+
+    assert response["statusCode"] == 200
+    user = fake_client.get_item(TableName="users", Key={"user_id": {"S": "user123"}})["Item"]
+    assert user["organization_name"] == {"S": "Test Org"}
+    assert user["organization_version"] == {"N": "2"}
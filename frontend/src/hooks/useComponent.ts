@@ -1,9 +1,14 @@
 import { useEffect, useState } from 'react';
 import { callLambda } from '../api/lambdaApi';
-import { LambdaPayload, ComponentsCRUDResponse } from '../types/lambda';
+import {
+  LambdaPayload,
+  ComponentsCRUDResponse,
+  ComponentsColumnarResponse,
+} from '../types/lambda';
 import { Component, ComponentForm } from '../types/component';
 import { useOrganization } from '../context/OrganizationContext';
 import { devLog } from '../utils/logger';
+import { decodeColumnar } from '../utils/columnar';
 
 export const componentKeys: (keyof Component)[] = [
   'organization_id',
@@ -83,7 +88,12 @@ export function useComponent() {
     const response = await callLambda(lambdaUrl, payload);
 
     if ('components' in response && response.result === 'success') {
-      const updated = allItems.filter((item) => !category_item_ids.includes(item.category_item_id));
+      // レスポンスに含まれる削除済みキーでローカルの状態を更新する
+      const deletedKeys = (response as ComponentsCRUDResponse).components.map(
+        (component) => component.category_item_id,
+      );
+      const removedIds = deletedKeys.length > 0 ? deletedKeys : category_item_ids;
+      const updated = allItems.filter((item) => !removedIds.includes(item.category_item_id));
       setAllItems(updated);
       filterByCategoryManufacturerName(category, manufacturer, name, updated);
     } else {
@@ -106,8 +116,11 @@ export function useComponent() {
     const response = await callLambda(lambdaUrl, payload);
 
     if ('components' in response && response.result === 'success') {
-      const fieldName = field as keyof Component;
-      const updated = getUpdatedItems(allItems, rowId, fieldName, updatedValue);
+      // 更新後のアイテム全体（updated_atを含む）が返るのでそのまま差し替える
+      const updatedComponent = (response as ComponentsCRUDResponse).components[0];
+      const updated = updatedComponent
+        ? replaceItem(allItems, fillNullFields(updatedComponent))
+        : getUpdatedItems(allItems, rowId, field as keyof Component, updatedValue);
       setAllItems(updated);
       filterByCategoryManufacturerName(category, manufacturer, name, updated);
     } else {
@@ -115,6 +128,12 @@ export function useComponent() {
     }
   };
 
+  const replaceItem = (items: Component[], component: Component): Component[] => {
+    return items.map((item) =>
+      item.category_item_id === component.category_item_id ? component : item,
+    );
+  };
+
   const getUpdatedItems = (
     items: Component[],
     id: string,
@@ -150,16 +169,20 @@ export function useComponent() {
       setLoading(true);
       try {
         devLog('fetchItems');
+        // 件数が多いとフィールド名の繰り返しが大きいので列形式で受け取る
         const payload: LambdaPayload = {
           action: 'query',
+          format: 'columnar',
           value: { organization_id: orgId },
         };
         const response = await callLambda(lambdaUrl, payload);
-        const componentsCRUDResponse = response as ComponentsCRUDResponse;
+        const componentsCRUDResponse = response as ComponentsColumnarResponse;
         if (componentsCRUDResponse.result === 'success') {
-          componentsCRUDResponse.components.map(fillNullFields);
-          setAllItems(componentsCRUDResponse.components);
-          setFilteredItems(componentsCRUDResponse.components);
+          const components = decodeColumnar<Component>(componentsCRUDResponse.components).map(
+            fillNullFields,
+          );
+          setAllItems(components);
+          setFilteredItems(components);
         } else {
           setError(componentsCRUDResponse.message);
         }
@@ -1,6 +1,7 @@
 import { Component } from "./component";
 import { Organization } from "./organization";
 import { User } from "./user";
+import { ColumnarDocument } from "../utils/columnar";
 
 export type LambdaAction = 'query' | 'put' | 'update' | 'delete';
 
@@ -15,6 +16,11 @@ export interface ComponentsCRUDResponse extends LambdaResponse {
   components: Component[];
 }
 
+// query で format: 'columnar' を指定したときのレスポンス
+export interface ComponentsColumnarResponse extends LambdaResponse {
+  components: ColumnarDocument | Component[];
+}
+
 export interface OrganizationIdGetResponse extends LambdaResponse {
   organization: Organization;
 }
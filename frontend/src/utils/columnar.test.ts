@@ -0,0 +1,27 @@
+import { decodeColumnar, ColumnarDocument } from './columnar';
+
+describe('decodeColumnar', () => {
+  it('列形式のレスポンスをアイテムの配列に戻す', () => {
+    const document: ColumnarDocument = {
+      format: 'columnar',
+      count: 3,
+      fields: ['category', 'name', 'note'],
+      columns: {
+        category: { dictionary: ['ic', 'cap'], codes: [0, 1, -1] },
+        name: ['opamp', '10uF', 'unknown'],
+        note: [null, 'ceramic', null],
+      },
+    };
+
+    expect(decodeColumnar(document)).toEqual([
+      { category: 'ic', name: 'opamp' },
+      { category: 'cap', name: '10uF', note: 'ceramic' },
+      { name: 'unknown' },
+    ]);
+  });
+
+  it('配列の場合はそのまま返す', () => {
+    const items = [{ name: 'opamp' }];
+    expect(decodeColumnar(items)).toBe(items);
+  });
+});
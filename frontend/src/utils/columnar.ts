@@ -0,0 +1,42 @@
+// components-crud の format: 'columnar' レスポンスをアイテムの配列に戻す
+// 辞書エンコードされた列は { dictionary, codes } の形で、値が無いセルは null（codes では -1）
+
+export type ColumnValues = (string | number | boolean | null)[];
+
+export interface DictionaryColumn {
+  dictionary: string[];
+  codes: number[];
+}
+
+export interface ColumnarDocument {
+  format: 'columnar';
+  count: number;
+  fields: string[];
+  columns: Record<string, ColumnValues | DictionaryColumn>;
+}
+
+export const isColumnarDocument = (value: unknown): value is ColumnarDocument =>
+  typeof value === 'object' &&
+  value !== null &&
+  !Array.isArray(value) &&
+  (value as ColumnarDocument).format === 'columnar';
+
+export function decodeColumnar<T>(document: ColumnarDocument | T[]): T[] {
+  if (!isColumnarDocument(document)) {
+    return document;
+  }
+
+  const items: Record<string, unknown>[] = Array.from({ length: document.count }, () => ({}));
+  document.fields.forEach((field) => {
+    const column = document.columns[field];
+    const values: ColumnValues = Array.isArray(column)
+      ? column
+      : column.codes.map((code) => (code < 0 ? null : column.dictionary[code]));
+    values.forEach((value, i) => {
+      if (value !== null && value !== undefined) {
+        items[i][field] = value;
+      }
+    });
+  });
+  return items as T[];
+}